@@ -2,9 +2,19 @@ from src.models.user import db, User
 from src.models.account import Account
 from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
 from src.models.risk_type import RiskType, StrategyTag, TradeStrategyTag
+from src.models.change_log import ChangeLog
+from src.models.snapshot import AccountSnapshot
+from src.models.archive import TradeSummary, TradeArchive
+from src.models.job import Job
+from src.models.lot import TradeLot
+from src.models.shard import UserShard
+from src.models.price import PriceBar
+from src.models.alert import AccountAlert, AccountAlertState
 
 __all__ = [
     'db', 'User', 'Account', 'Trade', 'TradeEntry', 'TradeExit', 
-    'TradeCost', 'RiskType', 'StrategyTag', 'TradeStrategyTag'
+    'TradeCost', 'RiskType', 'StrategyTag', 'TradeStrategyTag', 'ChangeLog',
+    'AccountSnapshot', 'TradeSummary', 'TradeArchive', 'Job', 'TradeLot', 'UserShard',
+    'PriceBar', 'AccountAlert', 'AccountAlertState'
 ]
 
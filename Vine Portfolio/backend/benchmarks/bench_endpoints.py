@@ -0,0 +1,194 @@
+"""Time every API endpoint at several data sizes, with SQL query counts and peak memory.
+
+Run from the directory containing the backend package (imported as ``src``):
+
+    python -m src.benchmarks.bench_endpoints --sizes 100,1000 --compare src/benchmarks/results/previous.json
+
+Results are written as JSON (by default to benchmarks/results/<commit>.json) so
+runs from different commits can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+from sqlalchemy import event
+from src.models.user import db
+from src.models.account import Account
+from src.models.trade import Trade
+from src.benchmarks.common import create_app, time_call
+from src.benchmarks.datagen import generate, PASSWORD
+from src.services.search_index import ensure_search_index
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def endpoint_cases(ids):
+    """(name, method, path, json body) for every blueprint endpoint; writes come last"""
+    account, trade, open_trade = ids['account_id'], ids['trade_id'], ids['open_trade_id']
+    calculator = {'account_balance': 10000, 'risk_percentage': 1, 'entry_price': 100, 'stop_loss_price': 98, 'take_profit_price': 106}
+    return [
+        ('auth.login', 'POST', '/api/auth/login', {'email': ids['email'], 'password': PASSWORD}),
+        ('auth.profile', 'GET', '/api/auth/profile', None),
+        ('accounts.list', 'GET', '/api/accounts/', None),
+        ('accounts.get', 'GET', f'/api/accounts/{account}', None),
+        ('accounts.dashboard', 'GET', f'/api/accounts/{account}/dashboard', None),
+        ('trades.list', 'GET', f'/api/accounts/{account}/trades', None),
+        ('trades.list_columns', 'GET', f'/api/accounts/{account}/trades?format=columns', None),
+        ('trades.get', 'GET', f'/api/trades/{trade}', None),
+        ('analytics.portfolio_dashboard', 'GET', '/api/analytics/portfolio/dashboard', None),
+        ('analytics.account', 'GET', f'/api/analytics/accounts/{account}/analytics', None),
+        ('analytics.account_tags', 'GET', f'/api/analytics/accounts/{account}/performance-by-tag', None),
+        ('analytics.portfolio_tags', 'GET', '/api/analytics/portfolio/performance-by-tag', None),
+        ('analytics.query', 'POST', '/api/analytics/query', {'instruments': ['EURUSD', 'AAPL'], 'trade_type': 'long'}),
+        ('analytics.equity_curve', 'GET', f'/api/analytics/accounts/{account}/equity-curve', None),
+        ('analytics.portfolio_equity_curve', 'GET', '/api/analytics/portfolio/equity-curve', None),
+        ('analytics.export', 'GET', f'/api/analytics/accounts/{account}/export', None),
+        ('risk.risk_types', 'GET', '/api/risk/risk-types', None),
+        ('risk.strategy_tags', 'GET', '/api/risk/strategy-tags', None),
+        ('risk.position_size', 'POST', '/api/risk/calculators/position-size', calculator),
+        ('risk.stock_shares', 'POST', '/api/risk/calculators/stock-shares', calculator),
+        ('risk.forex_lot_size', 'POST', '/api/risk/calculators/forex-lot-size',
+         {'account_balance': 10000, 'risk_percentage': 1, 'stop_loss_pips': 20, 'currency_pair': 'EURUSD'}),
+        ('risk.suggestions', 'GET', f'/api/risk/accounts/{account}/risk-suggestions', None),
+        ('search.trades', 'GET', '/api/search/trades?q=setup', None),
+        ('changes.since', 'GET', '/api/changes?since=0', None),
+        ('jobs.list', 'GET', '/api/jobs/', None),
+        ('trades.create', 'POST', f'/api/accounts/{account}/trades',
+         {'instrument': 'EURUSD', 'trade_type': 'Long', 'entry_price': 1.1, 'quantity': 1000, 'stop_loss_price': 1.09}),
+        ('trades.add_entry', 'POST', f'/api/trades/{open_trade}/entries', {'entry_price': 1.1, 'quantity': 1}),
+        ('trades.add_exit', 'POST', f'/api/trades/{open_trade}/exits', {'exit_price': 1.12, 'quantity': 1}),
+        ('trades.add_cost', 'POST', f'/api/trades/{trade}/costs', {'cost_type': 'Swap', 'amount': 0.5}),
+    ]
+
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def run_size(trades_per_account, repeat, users, accounts_per_user):
+    from src.routes.auth import generate_token
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        app = create_app(f'sqlite:///{path}', with_routes=True)
+        client = app.test_client()
+        with app.app_context():
+            user_id = generate(users, accounts_per_user, trades_per_account)[0]
+            ensure_search_index(db.engine)
+            counter = QueryCounter(db.engine)
+            account = Account.query.filter_by(user_id=user_id).first()
+            ids = {
+                'email': f'user{user_id}@bench.local',
+                'account_id': account.id,
+                'trade_id': Trade.query.filter_by(account_id=account.id).first().id,
+                'open_trade_id': Trade.query.filter_by(account_id=account.id, status='Open').first().id
+            }
+            headers = {'Authorization': f'Bearer {generate_token(user_id)}'}
+
+        results = {}
+        for name, method, url, body in endpoint_cases(ids):
+            def call():
+                return client.open(url, method=method, json=body, headers=headers)
+
+            # One measured call for queries, memory and size, then the timed repeats
+            counter.count = 0
+            tracemalloc.start()
+            response = call()
+            queries = counter.count
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            timing = time_call(call, repeat)
+            timing.update({
+                'status': response.status_code,
+                'queries': queries,
+                'peak_memory_kb': round(peak / 1024, 1),
+                'response_bytes': len(response.get_data())
+            })
+            results[name] = timing
+        return results
+    finally:
+        os.remove(path)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path, threshold):
+    """Print cases whose median latency or query count regressed against a previous run"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f'\nCompared with {previous.get("commit") or previous_path}:')
+    regressions = 0
+    for size, cases in current['sizes'].items():
+        for name, timing in cases.items():
+            before = previous.get('sizes', {}).get(size, {}).get(name)
+            if not before:
+                continue
+            ratio = timing['median_ms'] / before['median_ms'] if before['median_ms'] else 1
+            if ratio > 1 + threshold or timing['queries'] > before['queries'] or timing['status'] != before.get('status', timing['status']):
+                regressions += 1
+                print(f"  REGRESSION {size:>6} {name:32} {before['median_ms']:>9.2f} -> {timing['median_ms']:>9.2f} ms"
+                      f"  queries {before['queries']} -> {timing['queries']}")
+    if not regressions:
+        print('  no regressions')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000', help='Comma-separated trades per account')
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--accounts-per-user', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='Previous result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'users': args.users,
+        'accounts_per_user': args.accounts_per_user,
+        'sizes': {}
+    }
+    for size in [int(value) for value in args.sizes.split(',')]:
+        print(f'\n{size} trades per account')
+        print(f"  {'endpoint':32} {'median ms':>10} {'queries':>8} {'peak KB':>9} {'bytes':>10}")
+        cases = run_size(size, args.repeat, args.users, args.accounts_per_user)
+        for name, timing in cases.items():
+            failed = f"  HTTP {timing['status']}" if timing['status'] >= 400 else ''
+            print(f"  {name:32} {timing['median_ms']:>10.2f} {timing['queries']:>8} {timing['peak_memory_kb']:>9.1f} {timing['response_bytes']:>10}{failed}")
+        report['sizes'][str(size)] = cases
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "latest"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        compare(report, args.compare, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare Trade/Account.to_dict + jsonify with the DTO serialization layer.
+
+Run from the directory containing the backend package (imported as ``src``):
+
+    python -m src.benchmarks.bench_serialization --trades 5000
+"""
+import argparse
+import json
+from src.models.user import db
+from src.models.account import Account
+from src.models.trade import Trade
+from src.services.serialization import (
+    AccountDTO, TradeDTO, serialize_trades, serialize_trades_columnar, encode_json, msgpack
+)
+from src.benchmarks.common import create_app, time_call
+from src.benchmarks.datagen import generate
+
+
+def run(trade_count, repeat):
+    app = create_app()
+    results = {'trades': trade_count, 'cases': {}}
+    with app.app_context():
+        user_id = generate(users=1, accounts_per_user=1, trades_per_account=trade_count)[0]
+        account_id = Account.query.filter_by(user_id=user_id).first().id
+
+        def to_dict_path():
+            db.session.expunge_all()
+            trades = Trade.query.filter_by(account_id=account_id).order_by(Trade.created_at.desc()).all()
+            return json.dumps({'trades': [trade.to_dict() for trade in trades]}, separators=(',', ':'))
+
+        def dto_rows_path():
+            trades = TradeDTO.load(Trade.account_id == account_id, order_by=Trade.created_at.desc())
+            return encode_json({'trades': serialize_trades(trades)})
+
+        def dto_columns_path():
+            trades = TradeDTO.load(Trade.account_id == account_id, order_by=Trade.created_at.desc())
+            return encode_json(serialize_trades_columnar(trades))
+
+        def accounts_to_dict_path():
+            db.session.expunge_all()
+            return json.dumps({'accounts': [account.to_dict() for account in Account.query.all()]}, separators=(',', ':'))
+
+        def accounts_dto_path():
+            return encode_json({'accounts': [account.as_dict() for account in AccountDTO.load()]})
+
+        cases = {
+            'trades.to_dict+json': to_dict_path,
+            'trades.dto_rows': dto_rows_path,
+            'trades.dto_columns': dto_columns_path,
+            'accounts.to_dict+json': accounts_to_dict_path,
+            'accounts.dto_rows': accounts_dto_path
+        }
+        if msgpack is not None:
+            def dto_msgpack_path():
+                trades = TradeDTO.load(Trade.account_id == account_id, order_by=Trade.created_at.desc())
+                return msgpack.packb(serialize_trades_columnar(trades), use_bin_type=True)
+            cases['trades.dto_columns_msgpack'] = dto_msgpack_path
+
+        for name, fn in cases.items():
+            timing = time_call(fn, repeat)
+            timing['bytes'] = len(fn())
+            results['cases'][name] = timing
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trades', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = run(args.trades, args.repeat)
+    baseline = results['cases']['trades.to_dict+json']['median_ms']
+    print(f"{'case':32} {'median ms':>10} {'bytes':>10} {'speedup':>8}")
+    for name, timing in results['cases'].items():
+        speedup = baseline / timing['median_ms'] if name.startswith('trades.') and timing['median_ms'] else None
+        print(f"{name:32} {timing['median_ms']:>10.2f} {timing['bytes']:>10} {f'{speedup:.1f}x' if speedup else '':>8}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import statistics
+import time
+from flask import Flask
+from src.models.user import db
+
+# Same blueprints and prefixes as main.py
+BLUEPRINTS = (
+    ('src.routes.auth', 'auth_bp', '/api/auth'),
+    ('src.routes.accounts', 'accounts_bp', '/api/accounts'),
+    ('src.routes.trades', 'trades_bp', '/api'),
+    ('src.routes.analytics', 'analytics_bp', '/api/analytics'),
+    ('src.routes.risk_management', 'risk_bp', '/api/risk'),
+    ('src.routes.search', 'search_bp', '/api/search'),
+    ('src.routes.events', 'events_bp', '/api/events'),
+    ('src.routes.changes', 'changes_bp', '/api'),
+    ('src.routes.jobs', 'jobs_bp', '/api/jobs'),
+    ('src.routes.batch', 'batch_bp', '/api'),
+)
+
+
+def create_app(database_uri='sqlite://', with_routes=False):
+    """Minimal app bound to a throwaway database for benchmarking, optionally with the API blueprints"""
+    import importlib
+    from src.services.search_index import ensure_search_index
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if with_routes:
+        for module_name, blueprint_name, url_prefix in BLUEPRINTS:
+            blueprint = getattr(importlib.import_module(module_name), blueprint_name)
+            app.register_blueprint(blueprint, url_prefix=url_prefix)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        ensure_search_index(db.engine)
+    return app
+
+
+def time_call(fn, repeat=5):
+    """Run fn repeatedly and return timing statistics in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'max_ms': round(max(samples), 3)
+    }
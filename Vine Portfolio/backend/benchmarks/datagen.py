@@ -0,0 +1,198 @@
+"""Deterministic synthetic data generator for benchmarks and load tests.
+
+    python -m src.benchmarks.datagen --database /tmp/bench.db --users 20 --trades-per-account 500
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from src.models.user import db, User
+from src.models.account import Account
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.risk_type import RiskType, StrategyTag, TradeStrategyTag
+from src.services.money import QUANTITY_SCALE
+from src.services.search_index import ensure_search_index, reindex_trades
+
+PASSWORD = 'bench-password'
+INSTRUMENTS = {
+    'EURUSD': 1.1, 'GBPUSD': 1.27, 'USDJPY': 148.0, 'XAUUSD': 1950.0,
+    'AAPL': 185.0, 'MSFT': 410.0, 'TSLA': 240.0, 'ES': 4800.0, 'BTCUSD': 42000.0
+}
+TRADING_MODELS = ['Risk-Free', 'Medium Risk', 'High Risk']
+RISK_TYPES = ['T1', 'T2', 'T3']
+STRATEGY_TAGS = ['Breakout', 'Pullback', 'Reversal', 'Trend', 'News']
+COST_TYPES = ['Commission', 'Spread', 'Swap', 'Slippage']
+EXIT_REASONS = ['Target hit', 'Stop loss', 'Trailing stop', 'Manual close', 'Time exit']
+BATCH_SIZE = 5000
+
+
+# Parents before children, so batches also load into databases that enforce foreign keys
+INSERT_ORDER = (User, RiskType, StrategyTag, Account, Trade, TradeEntry, TradeExit, TradeCost, TradeStrategyTag)
+
+
+class _Batcher:
+    """Collects rows per model and bulk-inserts them in batches, parents first"""
+
+    def __init__(self):
+        self.rows = {model: [] for model in INSERT_ORDER}
+        self.pending = 0
+
+    def add(self, model, row):
+        self.rows[model].append(row)
+        self.pending += 1
+        if self.pending >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for model in INSERT_ORDER:
+            if self.rows[model]:
+                db.session.execute(insert(model), self.rows[model])
+                self.rows[model] = []
+        self.pending = 0
+
+
+def _weighted(rng, choices):
+    """Pick a value from (value, weight) pairs"""
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def generate(users=1, accounts_per_user=3, trades_per_account=100, seed=42, closed_ratio=0.85):
+    """Insert users, accounts and trades with partial entries/exits, costs and tags; return the user ids"""
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(PASSWORD)
+    now = datetime(2025, 1, 1)
+    batcher = _Batcher()
+
+    # Continue after existing ids so the generator can top up a database
+    next_id = {model: (db.session.query(db.func.max(model.id)).scalar() or 0) + 1 for model in INSERT_ORDER}
+
+    def new_id(model):
+        value = next_id[model]
+        next_id[model] += 1
+        return value
+
+    first_trade_id = next_id[Trade]
+    user_ids = []
+    for _ in range(users):
+        user_id = new_id(User)
+        user_ids.append(user_id)
+        batcher.add(User, {'id': user_id, 'email': f'user{user_id}@bench.local', 'password_hash': password_hash,
+                           'primary_currency': 'USD', 'created_at': now, 'updated_at': now})
+
+        risk_type_ids = []
+        for name in RISK_TYPES:
+            risk_type_ids.append(new_id(RiskType))
+            batcher.add(RiskType, {'id': risk_type_ids[-1], 'user_id': user_id, 'name': name,
+                                   'default_risk_percentage': 0.5 * len(risk_type_ids), 'created_at': now, 'updated_at': now})
+        tag_ids = []
+        for name in STRATEGY_TAGS:
+            tag_ids.append(new_id(StrategyTag))
+            batcher.add(StrategyTag, {'id': tag_ids[-1], 'user_id': user_id, 'name': name, 'created_at': now, 'updated_at': now})
+
+        for a in range(accounts_per_user):
+            account_id = new_id(Account)
+            capital = rng.choice([10000, 25000, 50000, 100000])
+            batcher.add(Account, {
+                'id': account_id, 'user_id': user_id, 'name': f'Account {a + 1}', 'broker': rng.choice(['IBKR', 'OANDA', 'FTMO']),
+                'base_currency': rng.choice(['USD', 'USD', 'EUR', 'GBP']), 'initial_capital': capital, 'current_balance': capital,
+                'profit_target': rng.choice([None, 8, 10]), 'max_drawdown': rng.choice([None, 5, 10]),
+                'trading_model': rng.choice(TRADING_MODELS), 'created_at': now, 'updated_at': now
+            })
+
+            opened = now - timedelta(days=730)
+            for _ in range(trades_per_account):
+                opened += timedelta(minutes=rng.randint(30, max(60, 1440 * 730 // max(trades_per_account, 1))))
+                _generate_trade(rng, batcher, new_id, account_id, opened, risk_type_ids, tag_ids, closed_ratio)
+
+    batcher.flush()
+    db.session.commit()
+
+    # Bulk inserts skip the session's index sync, so index the new trades here (a new index is filled whole)
+    ensure_search_index(db.engine)
+    new_trade_ids = list(range(first_trade_id, next_id[Trade]))
+    with db.engine.begin() as connection:
+        for start in range(0, len(new_trade_ids), 500):
+            reindex_trades(connection, new_trade_ids[start:start + 500])
+    return user_ids
+
+
+def _generate_trade(rng, batcher, new_id, account_id, opened, risk_type_ids, tag_ids, closed_ratio):
+    """One trade with 1-3 entries, exits matching its status, costs and tags"""
+    trade_id = new_id(Trade)
+    instrument = rng.choice(list(INSTRUMENTS))
+    base = INSTRUMENTS[instrument] * rng.uniform(0.9, 1.1)
+    is_long = rng.random() < 0.55
+    stop_distance = base * rng.uniform(0.002, 0.02)
+    status = 'Closed' if rng.random() < closed_ratio else 'Open'
+    children = []
+
+    entry_count = _weighted(rng, [(1, 70), (2, 20), (3, 10)])
+    quantities = [rng.choice([1, 5, 10, 50, 100, 1000]) for _ in range(entry_count)]
+    for i, quantity in enumerate(quantities):
+        children.append((TradeEntry, {
+            'id': new_id(TradeEntry), 'trade_id': trade_id, 'entry_date': opened + timedelta(minutes=15 * i),
+            'entry_price': round(base + rng.uniform(-0.3, 0.3) * stop_distance, 8), 'quantity': quantity,
+            'commission': round(rng.uniform(0, 5), 2), 'created_at': opened
+        }))
+
+    # Closed trades exit everything; about a third of open trades have scaled out partially
+    total = sum(quantities)
+    exited = total if status == 'Closed' else (total // 2 if rng.random() < 0.33 else 0)
+    exit_count = min(_weighted(rng, [(1, 60), (2, 30), (3, 10)]), exited) if exited else 0
+    remaining = exited
+    closed_at = opened
+    for i in range(exit_count):
+        quantity = remaining if i == exit_count - 1 else max(1, remaining // (exit_count - i))
+        remaining -= quantity
+        r_multiple = rng.gauss(0.3, 1.4)
+        move = r_multiple * stop_distance * (1 if is_long else -1)
+        closed_at = closed_at + timedelta(minutes=rng.randint(5, 4320))
+        children.append((TradeExit, {
+            'id': new_id(TradeExit), 'trade_id': trade_id, 'exit_date': closed_at,
+            'exit_price': round(max(base + move, base * 0.01), 8), 'quantity': quantity,
+            'commission': round(rng.uniform(0, 5), 2), 'exit_reason': rng.choice(EXIT_REASONS), 'created_at': closed_at
+        }))
+
+    for _ in range(_weighted(rng, [(0, 10), (1, 60), (2, 30)])):
+        children.append((TradeCost, {
+            'id': new_id(TradeCost), 'trade_id': trade_id, 'cost_type': rng.choice(COST_TYPES),
+            'amount': round(rng.uniform(0.5, 25), 2), 'created_at': opened
+        }))
+
+    for tag_id in rng.sample(tag_ids, _weighted(rng, [(0, 20), (1, 55), (2, 25)])):
+        children.append((TradeStrategyTag, {'id': new_id(TradeStrategyTag), 'trade_id': trade_id, 'strategy_tag_id': tag_id, 'created_at': opened}))
+
+    batcher.add(Trade, {
+        'id': trade_id, 'account_id': account_id, 'trade_name': f'{instrument} {opened:%Y-%m-%d}', 'instrument': instrument,
+        'trade_type': 'Long' if is_long else 'Short', 'status': status, 'open_quantity_units': (total - exited) * QUANTITY_SCALE,
+        'stop_loss_price': round(base - stop_distance if is_long else base + stop_distance, 8),
+        'take_profit_price': round(base + 2 * stop_distance if is_long else base - 2 * stop_distance, 8),
+        'risk_type_id': rng.choice(risk_type_ids + [None]),
+        'notes': rng.choice(['Clean setup at support', 'Chased the move', 'News spike entry', 'Followed the plan', None]),
+        'created_at': opened, 'updated_at': closed_at
+    })
+    for model, row in children:
+        batcher.add(model, row)
+
+
+def main():
+    from src.benchmarks.common import create_app
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='SQLite file to fill')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--accounts-per-user', type=int, default=3)
+    parser.add_argument('--trades-per-account', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_app(f'sqlite:///{args.database}')
+    with app.app_context():
+        user_ids = generate(args.users, args.accounts_per_user, args.trades_per_account, args.seed)
+    print(f'Generated {len(user_ids)} users; password for all of them: {PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Drive the API with many concurrent synthetic traders and report throughput, latency percentiles and errors.
+
+Run from the directory containing the backend package (imported as ``src``),
+against a running server or one started in this process with --serve:
+
+    python -m src.benchmarks.loadtest --base-url http://localhost:5000 --users 200 --duration 60
+    python -m src.benchmarks.loadtest --serve /tmp/load.db --users 50 --mix trades.add_exit=5,analytics.portfolio_dashboard=1
+
+Every virtual user registers (or logs in) as load<N>@load.local, gets an
+account with a few seeded trades and then loops over weighted actions until the
+duration is up. Results are written as JSON (by default to
+benchmarks/results/load-<commit>.json) so setups can be compared with --compare.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+from src.benchmarks.bench_endpoints import git_commit, RESULTS_DIR
+
+PASSWORD = 'load-password'
+INSTRUMENTS = {'EURUSD': 1.1, 'GBPUSD': 1.27, 'XAUUSD': 1950.0, 'AAPL': 185.0, 'ES': 4800.0}
+
+# Action name -> weight; roughly a trading day where dashboards are opened far more often than trades change
+DEFAULT_MIX = {
+    'trades.create': 3,
+    'trades.add_exit': 4,
+    'trades.list': 3,
+    'accounts.dashboard': 4,
+    'analytics.portfolio_dashboard': 5,
+    'analytics.account': 3,
+    'risk.suggestions': 2,
+}
+
+
+def percentile(sorted_samples, q):
+    """Nearest-rank percentile of already sorted samples"""
+    if not sorted_samples:
+        return None
+    rank = max(int(-(-q * len(sorted_samples) // 100)), 1)
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def parse_mix(value):
+    """'name=weight,...' on top of the default mix; a weight of 0 drops an action"""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown action {name}; choose from {", ".join(DEFAULT_MIX)}')
+        mix[name] = float(weight or 1)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise argparse.ArgumentTypeError('The mix has no actions left')
+    return mix
+
+
+class Recorder:
+    """Latency samples and outcomes per action, shared by all virtual users"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, outcome):
+        with self._lock:
+            self.samples[name].append(seconds * 1000)
+            if outcome is not None:
+                self.errors[name][outcome] += 1
+
+    def report(self, elapsed):
+        def summary(samples, errors):
+            samples = sorted(samples)
+            failed = sum(errors.values())
+            return {
+                'requests': len(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+                'error_rate': round(failed / len(samples), 4) if samples else 0,
+                'errors': dict(errors),
+                'p50_ms': round(percentile(samples, 50), 2) if samples else None,
+                'p95_ms': round(percentile(samples, 95), 2) if samples else None,
+                'p99_ms': round(percentile(samples, 99), 2) if samples else None,
+                'max_ms': round(samples[-1], 2) if samples else None
+            }
+
+        with self._lock:
+            actions = {name: summary(self.samples[name], self.errors[name]) for name in sorted(self.samples)}
+            all_errors = defaultdict(int)
+            for errors in self.errors.values():
+                for outcome, count in errors.items():
+                    all_errors[outcome] += count
+            total = summary([value for samples in self.samples.values() for value in samples], all_errors)
+        return {'total': total, 'actions': actions}
+
+
+class VirtualUser:
+    """One synthetic trader with its own keep-alive connection, token and open trades"""
+
+    def __init__(self, number, base_url, recorder, rng, timeout):
+        self.email = f'load{number}@load.local'
+        self.url = urlsplit(base_url)
+        self.recorder = recorder
+        self.rng = rng
+        self.timeout = timeout
+        self.connection = None
+        self.headers = {'Content-Type': 'application/json'}
+        self.account_id = None
+        self.open_trades = {}  # trade id -> [quantity not yet exited, entry price]
+
+    def _connect(self):
+        factory = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = factory(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def request(self, name, method, path, body=None, record=True):
+        """Send one request; returns (status, parsed JSON or None), status 0 on connection errors"""
+        if self.connection is None:
+            self._connect()
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, self.url.path.rstrip('/') + path,
+                                    body=json.dumps(body) if body is not None else None, headers=self.headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            # Drop the connection so the next request reconnects
+            self.connection.close()
+            self.connection = None
+            if record:
+                self.recorder.record(name, time.perf_counter() - started, type(e).__name__)
+            return 0, None
+        if record:
+            self.recorder.record(name, time.perf_counter() - started, f'HTTP {status}' if status >= 400 else None)
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+    def setup(self, seed_trades):
+        """Log in (registering on first use) and make sure the user has an account with open and closed trades"""
+        credentials = {'email': self.email, 'password': PASSWORD}
+        # Not recorded: the first run's 401s for users that do not exist yet are expected
+        status, payload = self.request('auth.login', 'POST', '/api/auth/login', credentials, record=False)
+        if status == 401:
+            status, payload = self.request('auth.register', 'POST', '/api/auth/register', credentials)
+        if status not in (200, 201):
+            raise RuntimeError(f'{self.email}: could not log in (HTTP {status})')
+        self.headers['Authorization'] = f"Bearer {payload['token']}"
+
+        status, payload = self.request('accounts.list', 'GET', '/api/accounts/')
+        accounts = (payload or {}).get('accounts') or []
+        if accounts:
+            self.account_id = accounts[0]['id']
+        else:
+            status, payload = self.request('accounts.create', 'POST', '/api/accounts/', {
+                'name': 'Load test', 'initial_capital': 100000, 'max_drawdown': 10, 'profit_target': 10
+            })
+            if status != 201:
+                raise RuntimeError(f'{self.email}: could not create an account (HTTP {status})')
+            self.account_id = payload['account']['id']
+
+        for _ in range(seed_trades):
+            trade_id = self.create_trade()
+            if trade_id is not None and self.rng.random() < 0.7:
+                self.add_exit(trade_id, self.open_trades[trade_id][0])
+
+    def create_trade(self):
+        instrument = self.rng.choice(list(INSTRUMENTS))
+        price = round(INSTRUMENTS[instrument] * self.rng.uniform(0.95, 1.05), 5)
+        is_long = self.rng.random() < 0.55
+        quantity = self.rng.choice([10, 20, 50, 100])
+        status, payload = self.request('trades.create', 'POST', f'/api/accounts/{self.account_id}/trades', {
+            'instrument': instrument,
+            'trade_type': 'Long' if is_long else 'Short',
+            'entry_price': price,
+            'quantity': quantity,
+            'stop_loss_price': round(price * (0.99 if is_long else 1.01), 5),
+            'costs': [{'cost_type': 'Commission', 'amount': 1.5}]
+        })
+        if status != 201:
+            return None
+        trade_id = payload['trade']['id']
+        self.open_trades[trade_id] = [quantity, price]
+        return trade_id
+
+    def add_exit(self, trade_id, quantity):
+        remaining, price = self.open_trades[trade_id]
+        status, _ = self.request('trades.add_exit', 'POST', f'/api/trades/{trade_id}/exits', {
+            'exit_price': round(price * self.rng.uniform(0.98, 1.03), 5),
+            'quantity': quantity,
+            'exit_reason': 'Load test'
+        })
+        if status != 201 or remaining <= quantity:
+            del self.open_trades[trade_id]
+        else:
+            self.open_trades[trade_id][0] = remaining - quantity
+
+    def act(self, name):
+        account = self.account_id
+        if name == 'trades.create':
+            self.create_trade()
+        elif name == 'trades.add_exit':
+            if not self.open_trades:
+                self.create_trade()
+                return
+            trade_id = self.rng.choice(list(self.open_trades))
+            remaining = self.open_trades[trade_id][0]
+            # Mostly partial exits, sometimes the rest of the position
+            self.add_exit(trade_id, remaining if remaining <= 5 or self.rng.random() < 0.3 else remaining // 2)
+        elif name == 'trades.list':
+            self.request(name, 'GET', f'/api/accounts/{account}/trades')
+        elif name == 'accounts.dashboard':
+            self.request(name, 'GET', f'/api/accounts/{account}/dashboard')
+        elif name == 'analytics.portfolio_dashboard':
+            self.request(name, 'GET', '/api/analytics/portfolio/dashboard')
+        elif name == 'analytics.account':
+            self.request(name, 'GET', f'/api/analytics/accounts/{account}/analytics')
+        elif name == 'risk.suggestions':
+            self.request(name, 'GET', f'/api/risk/accounts/{account}/risk-suggestions')
+
+    def run(self, mix, deadline, think_seconds):
+        names, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            self.act(self.rng.choices(names, weights)[0])
+            if think_seconds:
+                time.sleep(self.rng.uniform(0, 2 * think_seconds))
+        if self.connection is not None:
+            self.connection.close()
+
+
+def serve(database, port):
+    """Start the API on a local port in a background thread, bound to a SQLite file"""
+    from werkzeug.serving import make_server
+    from src.benchmarks.common import create_app
+
+    # One access-log line per request would swamp the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app = create_app(f'sqlite:///{os.path.abspath(database)}', with_routes=True)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run_load(base_url, users, duration, mix, seed_trades=5, think_ms=0, ramp_up=0, seed=42, timeout=30):
+    """Set up the virtual users, run the mix for duration seconds and return the report"""
+    recorder = Recorder()
+    virtual_users = [VirtualUser(number, base_url, recorder, random.Random(seed + number), timeout)
+                     for number in range(1, users + 1)]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(users, 64)) as pool:
+        list(pool.map(lambda user: user.setup(seed_trades), virtual_users))
+    setup_seconds = time.monotonic() - started
+    setup_report = recorder.report(setup_seconds)
+
+    recorder = Recorder()
+    for user in virtual_users:
+        user.recorder = recorder
+    started = time.monotonic()
+    deadline = started + duration
+    threads = []
+    for index, user in enumerate(virtual_users):
+        thread = threading.Thread(target=user.run, args=(mix, deadline, think_ms / 1000), daemon=True)
+        threads.append(thread)
+        thread.start()
+        if ramp_up:
+            time.sleep(ramp_up / users)
+    for thread in threads:
+        thread.join()
+    report = recorder.report(time.monotonic() - started)
+    report['setup'] = {'seconds': round(setup_seconds, 2), **setup_report['total']}
+    return report
+
+
+def compare(current, previous_path, threshold):
+    """Print actions whose p95 latency, throughput or error rate got worse than in a previous run"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f'\nCompared with {previous.get("label") or previous.get("commit") or previous_path}:')
+    regressions = 0
+    for name, stats in current['actions'].items():
+        before = previous.get('actions', {}).get(name)
+        if not before or not before['p95_ms']:
+            continue
+        slower = stats['p95_ms'] / before['p95_ms'] > 1 + threshold
+        fewer = before['throughput_rps'] and stats['throughput_rps'] / before['throughput_rps'] < 1 - threshold
+        failing = stats['error_rate'] > before['error_rate']
+        if slower or fewer or failing:
+            regressions += 1
+            print(f"  REGRESSION {name:32} p95 {before['p95_ms']:>9.2f} -> {stats['p95_ms']:>9.2f} ms"
+                  f"  rps {before['throughput_rps']:>8.1f} -> {stats['throughput_rps']:>8.1f}"
+                  f"  errors {before['error_rate']:.2%} -> {stats['error_rate']:.2%}")
+    if not regressions:
+        print('  no regressions')
+    return regressions
+
+
+def print_report(report):
+    print(f"  {'action':32} {'requests':>9} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    rows = list(report['actions'].items()) + [('total', report['total'])]
+    for name, stats in rows:
+        if not stats['requests']:
+            continue
+        print(f"  {name:32} {stats['requests']:>9} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.2f}"
+              f" {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['error_rate']:>8.2%}")
+    for name, stats in rows:
+        if stats['errors']:
+            print(f"  {name} errors: {', '.join(f'{outcome} x{count}' for outcome, count in stats['errors'].items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--base-url', help='Server to load, e.g. http://localhost:5000')
+    target.add_argument('--serve', metavar='DATABASE', help='Start the API in this process on a SQLite file and load it')
+    parser.add_argument('--port', type=int, default=0, help='Port for --serve (default: any free port)')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load after setup')
+    parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which the users start')
+    parser.add_argument('--think-ms', type=float, default=0, help='Mean pause between a user\'s requests')
+    parser.add_argument('--seed-trades', type=int, default=5, help='Trades each user creates during setup')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help=f'Action weights as name=weight,... over the default {",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items())}')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+    parser.add_argument('--label', help='Name for this setup in the results, e.g. sqlite-single-process')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--compare', help='Previous result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change reported as a regression')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if args.serve:
+        server, base_url = serve(args.serve, args.port)
+
+    try:
+        print(f'{args.users} users against {base_url} for {args.duration:g}s')
+        report = run_load(base_url, args.users, args.duration, args.mix, args.seed_trades,
+                          args.think_ms, args.ramp_up, args.seed, args.timeout)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    commit = git_commit()
+    report.update({
+        'label': args.label,
+        'commit': commit,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'base_url': base_url,
+        'users': args.users,
+        'duration': args.duration,
+        'think_ms': args.think_ms,
+        'mix': args.mix
+    })
+    setup = report['setup']
+    print(f"  setup: {setup['requests']} requests in {setup['seconds']}s, {setup['error_rate']:.2%} errors")
+    print_report(report)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'load-{commit or "latest"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        compare(report, args.compare, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,21 @@ from routes.accounts import accounts_bp
 from routes.trades import trades_bp
 from routes.analytics import analytics_bp
 from routes.risk_management import risk_bp
+from routes.search import search_bp
+from routes.events import events_bp
+from routes.changes import changes_bp
+from routes.jobs import jobs_bp
+from routes.batch import batch_bp
+from services.search_index import ensure_search_index
+from services.position_ledger import ensure_position_ledger
+from services.lot_matching import ensure_lot_matching
+from services.instrumentation import init_instrumentation
+from services.tracing import init_tracing
+from services.snapshots import init_snapshots, start_snapshot_scheduler
+from services.archive import init_archival
+from services.jobs import init_jobs
+from services.sharding import init_sharding, prepare_shards
+from services.price_store import init_price_store
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -24,12 +39,48 @@ app.register_blueprint(accounts_bp, url_prefix='/api/accounts')
 app.register_blueprint(trades_bp, url_prefix='/api')
 app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
 app.register_blueprint(risk_bp, url_prefix='/api/risk')
+app.register_blueprint(search_bp, url_prefix='/api/search')
+app.register_blueprint(events_bp, url_prefix='/api/events')
+app.register_blueprint(changes_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+app.register_blueprint(batch_bp, url_prefix='/api')
+
+# Per-route latency/SQL metrics, Server-Timing headers and the /metrics endpoint (METRICS_TOKEN for remote scrapers)
+init_instrumentation(app)
+
+# Sampled request/analytics/SQL spans (TRACE_SAMPLE_RATE, TRACE_EXPORTER)
+init_tracing(app)
 
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(os.path.abspath(os.path.dirname(__file__)), 'database', 'app.db')}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+# app.db stays the directory of users and jobs; DATABASE_SHARDS > 1 spreads user data over shard_N.db files
+init_sharding(app)
 db.init_app(app)
 with app.app_context():
     db.create_all()
+    # create_all skips existing tables, so add any indexes they are still missing
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    ensure_search_index(db.engine)
+    ensure_position_ledger(db.engine)
+    ensure_lot_matching(db.engine)
+    prepare_shards()
+
+# Background workers for queued exports and rebuilds (JOBS_THREADS, JOBS_PROCESSES).
+# Started first: the process workers are forked here, before any other background thread exists
+init_jobs(app)
+
+# End-of-day account snapshots; the first run backfills them from trade history. The scheduler
+# starts below for the development server; behind a WSGI server run `flask snapshot-scheduler` once
+init_snapshots(app)
+
+# Closed trades older than ARCHIVE_HORIZON_DAYS move to the archive tables in the same daily run
+init_archival(app)
+
+# Market prices for marking open trades, loaded with `flask import-prices`
+init_price_store(app)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -49,4 +100,7 @@ def serve(path):
 
 
 if __name__ == '__main__':
+    # The debug reloader runs this module in a watcher process too; only the child it starts serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_snapshot_scheduler(app)
     app.run(host='0.0.0.0', port=5000, debug=True)
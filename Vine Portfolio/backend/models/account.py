@@ -1,4 +1,6 @@
 from src.models.user import db
+from src.models.snapshot import AccountSnapshot
+from src.services.money import to_cents, from_cents
 from datetime import datetime
 
 class Account(db.Model):
@@ -12,11 +14,15 @@ class Account(db.Model):
     profit_target = db.Column(db.Numeric(5, 2), nullable=True)  # Percentage
     max_drawdown = db.Column(db.Numeric(5, 2), nullable=True)   # Percentage
     trading_model = db.Column(db.String(50), nullable=False, default='Medium Risk')
+    lot_method = db.Column(db.String(10), nullable=False, default='fifo', server_default='fifo')  # fifo, lifo, average
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     trades = db.relationship('Trade', backref='account', lazy=True, cascade='all, delete-orphan')
+    snapshots = db.relationship('AccountSnapshot', backref='account', lazy='dynamic', cascade='all, delete-orphan')
+    alerts = db.relationship('AccountAlert', backref='account', lazy='dynamic', cascade='all, delete-orphan')
+    alert_state = db.relationship('AccountAlertState', uselist=False, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Account {self.name}>'
@@ -33,26 +39,38 @@ class Account(db.Model):
             'profit_target': float(self.profit_target) if self.profit_target else None,
             'max_drawdown': float(self.max_drawdown) if self.max_drawdown else None,
             'trading_model': self.trading_model,
+            'lot_method': self.lot_method,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
     def calculate_pnl(self):
         """Calculate account P&L"""
-        return float(self.current_balance - self.initial_capital)
+        return from_cents(to_cents(self.current_balance) - to_cents(self.initial_capital))
 
-    def calculate_pnl_percentage(self):
-        """Calculate account P&L percentage"""
-        if self.initial_capital == 0:
+    def calculate_pnl_percentage(self, balance=None):
+        """Calculate account P&L percentage; balance in cents defaults to the stored current balance"""
+        initial_capital = to_cents(self.initial_capital)
+        if initial_capital == 0:
             return 0
-        return float((self.current_balance - self.initial_capital) / self.initial_capital * 100)
+        if balance is None:
+            balance = to_cents(self.current_balance)
+        return (balance - initial_capital) / initial_capital * 100
 
-    def calculate_current_drawdown(self):
-        """Calculate current drawdown from peak"""
-        # This would need to be calculated based on trade history
-        # For now, return a simple calculation
-        peak_balance = max(float(self.current_balance), float(self.initial_capital))
+    def calculate_current_drawdown(self, snapshot_peak=None, balance=None):
+        """Calculate current drawdown from peak
+
+        snapshot_peak is the peak balance of the account's snapshots (0 if it has none) when the
+        caller already loaded it for several accounts; otherwise it is read here. balance in cents
+        defaults to the stored current balance.
+        """
+        if snapshot_peak is None:
+            # The latest end-of-day snapshot carries the running peak of the balance history
+            latest = self.snapshots.order_by(AccountSnapshot.snapshot_date.desc()).first()
+            snapshot_peak = latest.peak_balance if latest else 0
+        if balance is None:
+            balance = to_cents(self.current_balance)
+        peak_balance = max(balance, to_cents(self.initial_capital), to_cents(snapshot_peak))
         if peak_balance == 0:
             return 0
-        return float((peak_balance - self.current_balance) / peak_balance * 100)
-
+        return (peak_balance - balance) / peak_balance * 100
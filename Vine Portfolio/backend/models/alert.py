@@ -0,0 +1,60 @@
+from src.models.user import db
+from datetime import datetime
+
+class AccountAlertState(db.Model):
+    """Running balance and peak of an account, kept up to date by each realized change
+
+    Amounts are in cents so exits and costs can be added with a single UPDATE.
+    The flags remember which rules are already breached, so each crossing alerts once.
+    """
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    balance_cents = db.Column(db.BigInteger, nullable=False)
+    peak_cents = db.Column(db.BigInteger, nullable=False)
+    drawdown_alerted = db.Column(db.Boolean, nullable=False, default=False)
+    target_alerted = db.Column(db.Boolean, nullable=False, default=False)
+    stale = db.Column(db.Boolean, nullable=False, default=False)  # Set by edits the running state cannot follow
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AccountAlertState {self.account_id}>'
+
+
+class AccountAlert(db.Model):
+    """An account crossing its max drawdown or profit target, with the figures at that moment
+
+    trade_id is a plain reference to the trade whose exit or cost caused it; the
+    alert outlives the trade.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    alert_type = db.Column(db.String(30), nullable=False)  # max_drawdown_breached, profit_target_reached
+    threshold = db.Column(db.Numeric(5, 2), nullable=False)  # Percentage of the rule when it fired
+    balance = db.Column(db.Numeric(15, 2), nullable=False)
+    peak_balance = db.Column(db.Numeric(15, 2), nullable=False)
+    drawdown = db.Column(db.Numeric(7, 2), nullable=False)  # Percentage below peak_balance
+    pnl_percentage = db.Column(db.Numeric(9, 2), nullable=False)  # Of the initial capital
+    trade_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    acknowledged_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_account_alert_account_created', 'account_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<AccountAlert {self.account_id} {self.alert_type}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'alert_type': self.alert_type,
+            'threshold': float(self.threshold),
+            'balance': float(self.balance),
+            'peak_balance': float(self.peak_balance),
+            'drawdown': float(self.drawdown),
+            'pnl_percentage': float(self.pnl_percentage),
+            'trade_id': self.trade_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'acknowledged_at': self.acknowledged_at.isoformat() if self.acknowledged_at else None
+        }
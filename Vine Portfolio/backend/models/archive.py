@@ -0,0 +1,73 @@
+from src.models.user import db
+from datetime import datetime
+import json
+import zlib
+
+class TradeSummary(db.Model):
+    """Frozen metrics of an archived trade, kept next to its trade row so analytics stay complete"""
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    opened_at = db.Column(db.DateTime, nullable=True)
+    closed_at = db.Column(db.DateTime, nullable=True)
+    entry_qty = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    avg_entry = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    exit_qty = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    avg_exit = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    total_costs = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    gross_pnl = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    net_pnl = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    risk_amount = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    r_multiple = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_trade_summary_account_closed', 'account_id', 'closed_at'),
+    )
+
+    def __repr__(self):
+        return f'<TradeSummary {self.trade_id}>'
+
+    def to_dict(self):
+        return {
+            'trade_id': self.trade_id,
+            'account_id': self.account_id,
+            'opened_at': self.opened_at.isoformat() if self.opened_at else None,
+            'closed_at': self.closed_at.isoformat() if self.closed_at else None,
+            'entry_qty': float(self.entry_qty),
+            'avg_entry': float(self.avg_entry),
+            'exit_qty': float(self.exit_qty),
+            'avg_exit': float(self.avg_exit),
+            'total_costs': float(self.total_costs),
+            'gross_pnl': float(self.gross_pnl),
+            'net_pnl': float(self.net_pnl),
+            'risk_amount': float(self.risk_amount),
+            'r_multiple': float(self.r_multiple),
+            'archived_at': self.archived_at.isoformat() if self.archived_at else None
+        }
+
+
+class TradeArchive(db.Model):
+    """Entries, exits and costs of an archived trade, stored as one compressed JSON document"""
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, index=True)
+    closed_at = db.Column(db.DateTime, nullable=True)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TradeArchive {self.trade_id}>'
+
+    @staticmethod
+    def pack(entries, exits, costs):
+        """Compress child rows already in their to_dict form"""
+        document = {'entries': entries, 'exits': exits, 'costs': costs}
+        return zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def unpack(payload):
+        """Child rows of a packed payload in their to_dict form, keyed by 'entries', 'exits' and 'costs'"""
+        return json.loads(zlib.decompress(payload))
+
+    def load(self):
+        """Child rows in their to_dict form, keyed by 'entries', 'exits' and 'costs'"""
+        return self.unpack(self.payload)
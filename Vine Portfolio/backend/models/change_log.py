@@ -0,0 +1,26 @@
+from src.models.user import db
+from datetime import datetime
+
+class ChangeLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # Doubles as the sync cursor
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entity = db.Column(db.String(30), nullable=False)  # account, trade, risk_type, strategy_tag
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # upsert or delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_change_log_user_cursor', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<ChangeLog {self.id} {self.operation} {self.entity} {self.entity_id}>'
+
+    def to_dict(self):
+        return {
+            'cursor': self.id,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.operation,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -0,0 +1,55 @@
+from src.models.user import db
+from datetime import datetime
+import json
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # None for system jobs
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    params = db.Column(db.Text, nullable=True)  # JSON
+    result = db.Column(db.Text, nullable=True)  # JSON
+    error = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Float, nullable=False, default=0)  # Percentage
+    progress_message = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_by = db.Column(db.String(32), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)  # Refreshed by progress updates while running
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+        db.Index('ix_job_user_created', 'user_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.job_type} {self.status}>'
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'params': self.get_params(),
+            'error': self.error,
+            'progress': round(self.progress or 0, 2),
+            'progress_message': self.progress_message,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'has_result': self.result is not None,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,47 @@
+from src.models.user import db
+from datetime import datetime
+
+class TradeLot(db.Model):
+    """A slice of an exit matched against an entry lot, with its realized P&L and holding time
+
+    Entry and exit ids are plain references: archiving a trade keeps its lots while
+    its fills move into the archive row, and restoring it rebuilds them.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    method = db.Column(db.String(10), nullable=False)  # fifo, lifo, average
+    entry_id = db.Column(db.Integer, nullable=True)  # None for average cost, which pools the entries
+    exit_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    entry_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    exit_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    realized_pnl = db.Column(db.Numeric(15, 2, asdecimal=False), nullable=False)
+    opened_at = db.Column(db.DateTime, nullable=False)
+    closed_at = db.Column(db.DateTime, nullable=False)
+    holding_seconds = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_trade_lot_trade', 'trade_id', 'closed_at'),
+        db.Index('ix_trade_lot_account_closed', 'account_id', 'closed_at'),
+    )
+
+    def __repr__(self):
+        return f'<TradeLot {self.trade_id} {self.method} {self.quantity}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trade_id': self.trade_id,
+            'method': self.method,
+            'entry_id': self.entry_id,
+            'exit_id': self.exit_id,
+            'quantity': round(self.quantity, 8),
+            'entry_price': round(self.entry_price, 8),
+            'exit_price': round(self.exit_price, 8),
+            'realized_pnl': round(self.realized_pnl, 2),
+            'opened_at': self.opened_at.isoformat() if self.opened_at else None,
+            'closed_at': self.closed_at.isoformat() if self.closed_at else None,
+            'holding_seconds': self.holding_seconds
+        }
@@ -0,0 +1,35 @@
+from src.models.user import db
+
+class PriceBar(db.Model):
+    """One bar of market prices for an instrument; imported ticks are stored as bars with a single price
+
+    Market data is shared by every user, so it lives in the directory database.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    instrument = db.Column(db.String(50), nullable=False)
+    bar_time = db.Column(db.DateTime, nullable=False)  # Close time of the bar, UTC
+    open_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    high_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    low_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    close_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    volume = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        # Serves "latest bar at or before a time" per instrument without touching the table
+        db.Index('ix_price_bar_instrument_time', 'instrument', 'bar_time', 'close_price'),
+        db.UniqueConstraint('instrument', 'bar_time', name='uq_price_bar_instrument_time'),
+    )
+
+    def __repr__(self):
+        return f'<PriceBar {self.instrument} {self.bar_time}>'
+
+    def to_dict(self):
+        return {
+            'instrument': self.instrument,
+            'bar_time': self.bar_time.isoformat() if self.bar_time else None,
+            'open': round(self.open_price, 8),
+            'high': round(self.high_price, 8),
+            'low': round(self.low_price, 8),
+            'close': round(self.close_price, 8),
+            'volume': self.volume
+        }
@@ -55,8 +55,8 @@ class StrategyTag(db.Model):
 
 class TradeStrategyTag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
-    strategy_tag_id = db.Column(db.Integer, db.ForeignKey('strategy_tag.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False, index=True)
+    strategy_tag_id = db.Column(db.Integer, db.ForeignKey('strategy_tag.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -0,0 +1,25 @@
+from src.models.user import db
+from datetime import datetime
+
+class UserShard(db.Model):
+    """Directory entry saying which shard database holds a user's data
+
+    Users without an entry (and entries with no shard) keep their data in the
+    directory database itself, which is where everything lived before sharding.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=True)  # Index into the shard databases
+    moving = db.Column(db.Boolean, nullable=False, default=False)  # Requests wait while the rebalancer copies the data
+    moved_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UserShard {self.user_id} {self.shard}>'
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'shard': self.shard,
+            'moving': self.moving,
+            'moved_at': self.moved_at.isoformat() if self.moved_at else None
+        }
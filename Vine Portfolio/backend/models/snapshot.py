@@ -0,0 +1,35 @@
+from src.models.user import db
+from datetime import datetime
+
+class AccountSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)  # End of this (UTC) day
+    balance = db.Column(db.Numeric(15, 2), nullable=False)
+    realized_pnl = db.Column(db.Numeric(15, 2), nullable=False, default=0)  # Realized during the day
+    open_risk = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    peak_balance = db.Column(db.Numeric(15, 2), nullable=False)
+    drawdown = db.Column(db.Numeric(7, 2), nullable=False, default=0)  # Percentage below peak_balance
+    open_trades = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_account_snapshot_account_date', 'account_id', 'snapshot_date', unique=True),
+    )
+
+    def __repr__(self):
+        return f'<AccountSnapshot {self.account_id} {self.snapshot_date}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'snapshot_date': self.snapshot_date.isoformat() if self.snapshot_date else None,
+            'balance': float(self.balance),
+            'realized_pnl': float(self.realized_pnl),
+            'open_risk': float(self.open_risk),
+            'peak_balance': float(self.peak_balance),
+            'drawdown': float(self.drawdown),
+            'open_trades': self.open_trades,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
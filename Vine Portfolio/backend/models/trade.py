@@ -1,31 +1,58 @@
 from src.models.user import db
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import func, event
+from sqlalchemy.orm import object_session
+from src.services.reference_cache import strategy_tag_names
+from src.services.money import PRICE_DIGITS, QUANTITY_DIGITS, CASH_DIGITS, to_fixed, from_fixed, to_cents, from_cents, trade_figures
 
+# Numeric columns load as plain floats, skipping a Decimal per value; calculations turn
+# them into exact fixed-point units (see services/money.py) before doing any arithmetic,
+# and to_dict rounds them to the column scale
 class Trade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, index=True)
     trade_name = db.Column(db.String(100), nullable=True)
     instrument = db.Column(db.String(50), nullable=False)
     trade_type = db.Column(db.String(10), nullable=False)  # 'Long' or 'Short'
     status = db.Column(db.String(20), nullable=False, default='Open')  # Open, Closed, Pending, Canceled
-    stop_loss_price = db.Column(db.Numeric(15, 8), nullable=True)
-    take_profit_price = db.Column(db.Numeric(15, 8), nullable=True)
+    stop_loss_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=True)
+    take_profit_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=True)
     risk_type_id = db.Column(db.Integer, db.ForeignKey('risk_type.id'), nullable=True)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Entered minus exited quantity in 1e-8 units, kept by services/position_ledger.py
+    open_quantity_units = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    # Bumped by every write to the row; a flush against a stale version raises StaleDataError
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     
     # Relationships
     entries = db.relationship('TradeEntry', backref='trade', lazy=True, cascade='all, delete-orphan')
     exits = db.relationship('TradeExit', backref='trade', lazy=True, cascade='all, delete-orphan')
     costs = db.relationship('TradeCost', backref='trade', lazy=True, cascade='all, delete-orphan')
     trade_tags = db.relationship('TradeStrategyTag', backref='trade', lazy=True, cascade='all, delete-orphan')
+    # Set once the trade is archived: entries, exits and costs then live in the archive row
+    summary = db.relationship('TradeSummary', backref='trade', lazy='joined', uselist=False, cascade='all, delete-orphan')
+    archive = db.relationship('TradeArchive', lazy=True, uselist=False, cascade='all, delete-orphan')
+    # Exits matched to entry lots under the account's lot_method; see services/lot_matching.py
+    lots = db.relationship('TradeLot', lazy=True, cascade='all, delete-orphan')
+
+    _figures = None  # Cached result of _fixed_figures
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Trade {self.instrument} {self.trade_type}>'
 
     def to_dict(self):
+        if self.summary:
+            children = self.archive.load()
+        else:
+            children = {
+                'entries': [entry.to_dict() for entry in self.entries],
+                'exits': [exit.to_dict() for exit in self.exits],
+                'costs': [cost.to_dict() for cost in self.costs]
+            }
         return {
             'id': self.id,
             'account_id': self.account_id,
@@ -33,96 +60,121 @@ class Trade(db.Model):
             'instrument': self.instrument,
             'trade_type': self.trade_type,
             'status': self.status,
-            'stop_loss_price': float(self.stop_loss_price) if self.stop_loss_price else None,
-            'take_profit_price': float(self.take_profit_price) if self.take_profit_price else None,
+            'stop_loss_price': round(self.stop_loss_price, PRICE_DIGITS) if self.stop_loss_price else None,
+            'take_profit_price': round(self.take_profit_price, PRICE_DIGITS) if self.take_profit_price else None,
             'risk_type_id': self.risk_type_id,
             'notes': self.notes,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'entries': [entry.to_dict() for entry in self.entries],
-            'exits': [exit.to_dict() for exit in self.exits],
-            'costs': [cost.to_dict() for cost in self.costs],
-            'strategy_tags': [tag.strategy_tag.name for tag in self.trade_tags]
+            'version': self.version,
+            'entries': children['entries'],
+            'exits': children['exits'],
+            'costs': children['costs'],
+            'strategy_tags': self.strategy_tag_names()
         }
 
+    def strategy_tag_names(self):
+        """Names of the trade's strategy tags, resolved through the owner's reference-data cache"""
+        if not self.trade_tags:
+            return []
+        return strategy_tag_names(self.account.user_id, [tag.strategy_tag_id for tag in self.trade_tags])
+
+    def _fixed_figures(self):
+        """Quantities, average prices, P&L and risk of the trade as exact fixed-point integers
+
+        Computed in one pass over the children and cached on the instance; the events at
+        the end of this module drop the cache whenever anything it depends on changes.
+        """
+        if self._figures is None:
+            self._figures = self._compute_figures()
+        return self._figures
+
+    def _compute_figures(self):
+        if self.summary:
+            summary = self.summary
+            return {
+                'entry_qty': to_fixed(summary.entry_qty, QUANTITY_DIGITS),
+                'avg_entry': to_fixed(summary.avg_entry, PRICE_DIGITS),
+                'exit_qty': to_fixed(summary.exit_qty, QUANTITY_DIGITS),
+                'avg_exit': to_fixed(summary.avg_exit, PRICE_DIGITS),
+                'total_costs': to_cents(summary.total_costs),
+                'gross_pnl': to_cents(summary.gross_pnl),
+                'net_pnl': to_cents(summary.net_pnl),
+                'risk_amount': to_cents(summary.risk_amount),
+                'r_multiple': float(summary.r_multiple)
+            }
+        return trade_figures(
+            self.trade_type.lower() == 'long', self.stop_loss_price,
+            [entry.entry_price for entry in self.entries], [entry.quantity for entry in self.entries],
+            [exit.exit_price for exit in self.exits], [exit.quantity for exit in self.exits],
+            [cost.amount for cost in self.costs]
+        )
+
     def calculate_weighted_avg_entry(self):
         """Calculate weighted average entry price"""
-        if not self.entries:
-            return 0
-        total_value = sum(float(entry.entry_price) * float(entry.quantity) for entry in self.entries)
-        total_quantity = sum(float(entry.quantity) for entry in self.entries)
-        return total_value / total_quantity if total_quantity > 0 else 0
+        return from_fixed(self._fixed_figures()['avg_entry'], PRICE_DIGITS)
 
     def calculate_weighted_avg_exit(self):
         """Calculate weighted average exit price"""
-        if not self.exits:
-            return 0
-        total_value = sum(float(exit.exit_price) * float(exit.quantity) for exit in self.exits)
-        total_quantity = sum(float(exit.quantity) for exit in self.exits)
-        return total_value / total_quantity if total_quantity > 0 else 0
+        return from_fixed(self._fixed_figures()['avg_exit'], PRICE_DIGITS)
 
     def calculate_total_quantity_entered(self):
         """Calculate total quantity entered"""
-        return sum(float(entry.quantity) for entry in self.entries)
+        return from_fixed(self._fixed_figures()['entry_qty'], QUANTITY_DIGITS)
 
     def calculate_total_quantity_exited(self):
         """Calculate total quantity exited"""
-        return sum(float(exit.quantity) for exit in self.exits)
+        return from_fixed(self._fixed_figures()['exit_qty'], QUANTITY_DIGITS)
 
     def calculate_open_quantity(self):
         """Calculate remaining open quantity"""
-        return self.calculate_total_quantity_entered() - self.calculate_total_quantity_exited()
+        figures = self._fixed_figures()
+        return from_fixed(figures['entry_qty'] - figures['exit_qty'], QUANTITY_DIGITS)
+
+    def calculate_total_costs_cents(self):
+        """Calculate total costs for this trade in cents"""
+        return self._fixed_figures()['total_costs']
 
     def calculate_total_costs(self):
         """Calculate total costs for this trade"""
-        return sum(float(cost.amount) for cost in self.costs)
+        return from_cents(self.calculate_total_costs_cents())
+
+    def calculate_gross_pnl_cents(self):
+        """Calculate gross P&L (before costs) in cents"""
+        return self._fixed_figures()['gross_pnl']
 
     def calculate_gross_pnl(self):
         """Calculate gross P&L (before costs)"""
-        if not self.exits:
-            return 0
-        
-        avg_entry = self.calculate_weighted_avg_entry()
-        avg_exit = self.calculate_weighted_avg_exit()
-        exited_quantity = self.calculate_total_quantity_exited()
-        
-        if self.trade_type.lower() == 'long':
-            return (avg_exit - avg_entry) * exited_quantity
-        else:  # Short
-            return (avg_entry - avg_exit) * exited_quantity
+        return from_cents(self.calculate_gross_pnl_cents())
+
+    def calculate_net_pnl_cents(self):
+        """Calculate net P&L (after costs) in cents"""
+        return self._fixed_figures()['net_pnl']
 
     def calculate_net_pnl(self):
         """Calculate net P&L (after costs)"""
-        return self.calculate_gross_pnl() - self.calculate_total_costs()
+        return from_cents(self.calculate_net_pnl_cents())
+
+    def calculate_risk_amount_cents(self):
+        """Calculate risk amount based on stop loss, in cents"""
+        return self._fixed_figures()['risk_amount']
 
     def calculate_risk_amount(self):
         """Calculate risk amount based on stop loss"""
-        if not self.stop_loss_price or not self.entries:
-            return 0
-        
-        avg_entry = self.calculate_weighted_avg_entry()
-        total_quantity = self.calculate_total_quantity_entered()
-        
-        if self.trade_type.lower() == 'long':
-            return (avg_entry - float(self.stop_loss_price)) * total_quantity
-        else:  # Short
-            return (float(self.stop_loss_price) - avg_entry) * total_quantity
+        return from_cents(self.calculate_risk_amount_cents())
 
     def calculate_r_multiple(self):
         """Calculate R-multiple for closed trades"""
-        risk_amount = self.calculate_risk_amount()
-        if risk_amount <= 0:
-            return 0
-        return self.calculate_net_pnl() / risk_amount
+        return self._fixed_figures()['r_multiple']
 
 
 class TradeEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False, index=True)
     entry_date = db.Column(db.DateTime, nullable=False)
-    entry_price = db.Column(db.Numeric(15, 8), nullable=False)
-    quantity = db.Column(db.Numeric(15, 8), nullable=False)
-    commission = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    entry_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    quantity = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    commission = db.Column(db.Numeric(10, 2, asdecimal=False), nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -130,20 +182,20 @@ class TradeEntry(db.Model):
             'id': self.id,
             'trade_id': self.trade_id,
             'entry_date': self.entry_date.isoformat() if self.entry_date else None,
-            'entry_price': float(self.entry_price),
-            'quantity': float(self.quantity),
-            'commission': float(self.commission),
+            'entry_price': round(self.entry_price, PRICE_DIGITS),
+            'quantity': round(self.quantity, QUANTITY_DIGITS),
+            'commission': round(self.commission, CASH_DIGITS),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
 class TradeExit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False, index=True)
     exit_date = db.Column(db.DateTime, nullable=False)
-    exit_price = db.Column(db.Numeric(15, 8), nullable=False)
-    quantity = db.Column(db.Numeric(15, 8), nullable=False)
-    commission = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    exit_price = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    quantity = db.Column(db.Numeric(15, 8, asdecimal=False), nullable=False)
+    commission = db.Column(db.Numeric(10, 2, asdecimal=False), nullable=False, default=0)
     exit_reason = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -152,9 +204,9 @@ class TradeExit(db.Model):
             'id': self.id,
             'trade_id': self.trade_id,
             'exit_date': self.exit_date.isoformat() if self.exit_date else None,
-            'exit_price': float(self.exit_price),
-            'quantity': float(self.quantity),
-            'commission': float(self.commission),
+            'exit_price': round(self.exit_price, PRICE_DIGITS),
+            'quantity': round(self.quantity, QUANTITY_DIGITS),
+            'commission': round(self.commission, CASH_DIGITS),
             'exit_reason': self.exit_reason,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -162,9 +214,9 @@ class TradeExit(db.Model):
 
 class TradeCost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False, index=True)
     cost_type = db.Column(db.String(50), nullable=False)  # Commission, Spread, Swap, Slippage
-    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    amount = db.Column(db.Numeric(10, 2, asdecimal=False), nullable=False)
     description = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -173,8 +225,74 @@ class TradeCost(db.Model):
             'id': self.id,
             'trade_id': self.trade_id,
             'cost_type': self.cost_type,
-            'amount': float(self.amount),
+            'amount': round(self.amount, CASH_DIGITS),
             'description': self.description,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+def _invalidate_figures(trade):
+    if trade is not None:
+        trade._figures = None
+
+
+def _owning_trade(child, trade_id=None):
+    """The child's trade (or the trade with trade_id) if it is loaded; a trade that is not loaded has nothing cached"""
+    if trade_id is None:
+        trade = child.__dict__.get('trade')
+        if trade is not None:
+            return trade
+        trade_id = child.__dict__.get('trade_id')
+    session = object_session(child)
+    if session is None or trade_id is None:
+        return None
+    return session.identity_map.get(session.identity_key(Trade, trade_id))
+
+
+@event.listens_for(Trade, 'expire')
+def _trade_expired(trade, attrs):
+    _invalidate_figures(trade)
+
+
+@event.listens_for(Trade, 'refresh')
+def _trade_refreshed(trade, context, attrs):
+    _invalidate_figures(trade)
+
+
+def _trade_attribute_set(trade, value, oldvalue, initiator):
+    _invalidate_figures(trade)
+
+
+def _trade_collection_changed(trade, value, initiator):
+    _invalidate_figures(trade)
+
+
+for attribute in (Trade.trade_type, Trade.stop_loss_price, Trade.summary):
+    event.listen(attribute, 'set', _trade_attribute_set)
+for collection in (Trade.entries, Trade.exits, Trade.costs):
+    for identifier in ('append', 'remove', 'bulk_replace'):
+        event.listen(collection, identifier, _trade_collection_changed)
+
+
+def _child_value_set(child, value, oldvalue, initiator):
+    _invalidate_figures(_owning_trade(child))
+
+
+def _child_trade_id_set(child, value, oldvalue, initiator):
+    # Moving a child changes the figures of both trades
+    for trade_id in (oldvalue, value):
+        if isinstance(trade_id, int):
+            _invalidate_figures(_owning_trade(child, trade_id))
+
+
+def _child_refreshed(child, context, attrs):
+    _invalidate_figures(_owning_trade(child))
+
+
+for model, attributes in ((TradeEntry, ('entry_price', 'quantity')),
+                          (TradeExit, ('exit_price', 'quantity')),
+                          (TradeCost, ('amount',))):
+    for name in attributes:
+        event.listen(getattr(model, name), 'set', _child_value_set)
+    event.listen(model.trade_id, 'set', _child_trade_id_set)
+    event.listen(model, 'refresh', _child_refreshed)
@@ -1,8 +1,39 @@
+from contextvars import ContextVar
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect, Table
+from sqlalchemy.sql.util import find_tables
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
-db = SQLAlchemy()
+# Bind key of the shard holding the current user's data; None means the directory database
+current_shard = ContextVar('current_shard', default=None)
+
+# Tables that only ever live in the directory database; price bars are market data shared by all users
+DIRECTORY_TABLES = frozenset({'user', 'user_shard', 'job', 'price_bar'})
+
+
+class ShardedSession(Session):
+    """Session that sends user data to the current shard and directory tables to the default database"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = current_shard.get()
+        if bind is not None or shard is None:
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if mapper is not None:
+            tables = [inspect(mapper).local_table]
+        elif isinstance(clause, Table):
+            tables = [clause]
+        elif clause is not None:
+            tables = find_tables(clause, include_crud=True)
+        else:
+            tables = []
+        if any(table.name in DIRECTORY_TABLES for table in tables):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        return self._db.engines[shard]
+
+
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
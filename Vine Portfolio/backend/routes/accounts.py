@@ -1,18 +1,28 @@
 from flask import Blueprint, request, jsonify
 from src.models import db, Account, Trade
-from src.routes.auth import require_auth
+from src.routes.auth import require_auth, read_only
+from src.services.change_feed import record_change, record_account_deleted
+from src.services.serialization import AccountDTO, to_columns, wants_columns, render
+from src.services.money import to_cents, from_cents
+from src.services.lot_matching import METHODS as LOT_METHODS, rebuild_account_lots
+from src.services.alerts import refresh_alerts, publish_alerts
 from datetime import datetime
 
 accounts_bp = Blueprint('accounts', __name__)
 
 @accounts_bp.route('/', methods=['GET'])
+@read_only
 @require_auth
 def get_accounts():
     """Get all accounts for the authenticated user"""
     try:
-        accounts = Account.query.filter_by(user_id=request.user_id).all()
-        return jsonify({
-            'accounts': [account.to_dict() for account in accounts]
+        accounts = AccountDTO.load(Account.user_id == request.user_id, order_by=Account.id)
+        
+        if wants_columns():
+            return render({'accounts': to_columns(accounts, AccountDTO)}), 200
+        
+        return render({
+            'accounts': [account.as_dict() for account in accounts]
         }), 200
         
     except Exception as e:
@@ -28,6 +38,9 @@ def create_account():
         if not data or not data.get('name') or not data.get('initial_capital'):
             return jsonify({'error': 'Name and initial capital are required'}), 400
         
+        if data.get('lot_method', 'fifo') not in LOT_METHODS:
+            return jsonify({'error': f'lot_method must be one of: {", ".join(LOT_METHODS)}'}), 400
+        
         account = Account(
             user_id=request.user_id,
             name=data['name'],
@@ -37,10 +50,15 @@ def create_account():
             current_balance=float(data['initial_capital']),  # Start with initial capital
             profit_target=float(data['profit_target']) if data.get('profit_target') else None,
             max_drawdown=float(data['max_drawdown']) if data.get('max_drawdown') else None,
-            trading_model=data.get('trading_model', 'Medium Risk')
+            trading_model=data.get('trading_model', 'Medium Risk'),
+            lot_method=data.get('lot_method', 'fifo')
         )
         
         db.session.add(account)
+        db.session.flush()  # Get the account ID
+        # Seed the running alert state, so reads never have to
+        refresh_alerts(account.id)
+        record_change(request.user_id, 'account', account.id)
         db.session.commit()
         
         return jsonify({
@@ -53,6 +71,7 @@ def create_account():
         return jsonify({'error': str(e)}), 500
 
 @accounts_bp.route('/<int:account_id>', methods=['GET'])
+@read_only
 @require_auth
 def get_account(account_id):
     """Get specific account details"""
@@ -92,9 +111,19 @@ def update_account(account_id):
             account.max_drawdown = float(data['max_drawdown']) if data['max_drawdown'] else None
         if 'trading_model' in data:
             account.trading_model = data['trading_model']
+        if 'lot_method' in data and data['lot_method'] != account.lot_method:
+            if data['lot_method'] not in LOT_METHODS:
+                return jsonify({'error': f'lot_method must be one of: {", ".join(LOT_METHODS)}'}), 400
+            account.lot_method = data['lot_method']
+            # Stored lots follow the account's method
+            rebuild_account_lots([account.id])
         
         account.updated_at = datetime.utcnow()
+        record_change(request.user_id, 'account', account.id)
+        # New limits may already be crossed; this also seeds accounts that predate the alert state
+        alerts = refresh_alerts(account.id)
         db.session.commit()
+        publish_alerts(request.user_id, alerts)
         
         return jsonify({
             'message': 'Account updated successfully',
@@ -114,6 +143,7 @@ def delete_account(account_id):
         if not account:
             return jsonify({'error': 'Account not found'}), 404
         
+        record_account_deleted(request.user_id, account)
         db.session.delete(account)
         db.session.commit()
         
@@ -124,6 +154,7 @@ def delete_account(account_id):
         return jsonify({'error': str(e)}), 500
 
 @accounts_bp.route('/<int:account_id>/dashboard', methods=['GET'])
+@read_only
 @require_auth
 def get_account_dashboard(account_id):
     """Get account dashboard with analytics"""
@@ -140,44 +171,43 @@ def get_account_dashboard(account_id):
         closed_trades = [t for t in trades if t.status == 'Closed']
         open_trades = [t for t in trades if t.status == 'Open']
         
-        # P&L calculations
-        total_pnl = sum(t.calculate_net_pnl() for t in closed_trades)
-        total_gross_pnl = sum(t.calculate_gross_pnl() for t in closed_trades)
-        total_costs = sum(t.calculate_total_costs() for t in trades)
+        # P&L calculations (in cents, so totals are exact)
+        total_pnl = sum(t.calculate_net_pnl_cents() for t in closed_trades)
+        total_gross_pnl = sum(t.calculate_gross_pnl_cents() for t in closed_trades)
+        total_costs = sum(t.calculate_total_costs_cents() for t in trades)
         
         # Win rate
-        winning_trades = [t for t in closed_trades if t.calculate_net_pnl() > 0]
+        winning_trades = [t for t in closed_trades if t.calculate_net_pnl_cents() > 0]
         win_rate = (len(winning_trades) / len(closed_trades) * 100) if closed_trades else 0
         
         # Average win/loss
-        avg_win = sum(t.calculate_net_pnl() for t in winning_trades) / len(winning_trades) if winning_trades else 0
-        losing_trades = [t for t in closed_trades if t.calculate_net_pnl() <= 0]
-        avg_loss = sum(t.calculate_net_pnl() for t in losing_trades) / len(losing_trades) if losing_trades else 0
+        total_wins = from_cents(sum(t.calculate_net_pnl_cents() for t in winning_trades))
+        avg_win = total_wins / len(winning_trades) if winning_trades else 0
+        losing_trades = [t for t in closed_trades if t.calculate_net_pnl_cents() <= 0]
+        total_losses = from_cents(sum(t.calculate_net_pnl_cents() for t in losing_trades))
+        avg_loss = total_losses / len(losing_trades) if losing_trades else 0
         
         # R-multiples
         r_multiples = [t.calculate_r_multiple() for t in closed_trades if t.calculate_r_multiple() != 0]
         avg_r_multiple = sum(r_multiples) / len(r_multiples) if r_multiples else 0
         
         # Profit factor
-        total_wins = sum(t.calculate_net_pnl() for t in winning_trades)
-        total_losses = abs(sum(t.calculate_net_pnl() for t in losing_trades))
-        profit_factor = total_wins / total_losses if total_losses > 0 else 0
+        profit_factor = total_wins / abs(total_losses) if total_losses < 0 else 0
         
-        # Update account balance based on trades
-        account.current_balance = float(account.initial_capital) + total_pnl
-        db.session.commit()
+        # Balance implied by the closed trades; reads leave the stored one to the writes that move it
+        balance = to_cents(account.initial_capital) + total_pnl
         
         dashboard_data = {
-            'account': account.to_dict(),
+            'account': dict(account.to_dict(), current_balance=from_cents(balance)),
             'analytics': {
                 'total_trades': total_trades,
                 'closed_trades': len(closed_trades),
                 'open_trades': len(open_trades),
-                'total_pnl': round(total_pnl, 2),
-                'total_gross_pnl': round(total_gross_pnl, 2),
-                'total_costs': round(total_costs, 2),
-                'pnl_percentage': account.calculate_pnl_percentage(),
-                'current_drawdown': account.calculate_current_drawdown(),
+                'total_pnl': from_cents(total_pnl),
+                'total_gross_pnl': from_cents(total_gross_pnl),
+                'total_costs': from_cents(total_costs),
+                'pnl_percentage': account.calculate_pnl_percentage(balance),
+                'current_drawdown': account.calculate_current_drawdown(balance=balance),
                 'win_rate': round(win_rate, 2),
                 'avg_win': round(avg_win, 2),
                 'avg_loss': round(avg_loss, 2),
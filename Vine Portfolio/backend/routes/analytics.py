@@ -1,11 +1,30 @@
 from flask import Blueprint, request, jsonify
 from src.models import db, Account, Trade, User
-from src.routes.auth import require_auth
+from src.routes.auth import require_auth, read_only
+from src.services.trade_metrics import user_trade_scope
+from src.services.tag_analytics import performance_by_strategy_tag, performance_by_tag_combination
+from src.services.analytics_query import parse_filters, run_query, summarize
+from src.services.tracing import trace_span
+from src.services.exports import account_export
+from src.services.columnar_export import FORMATS, columnar_available, columnar_export_response
+from src.services.jobs import enqueue
+from src.services.money import to_cents, from_cents
+from src.services.lot_matching import account_lot_summary
+from src.services.reference_cache import reference_data, risk_type_name, owns_accounts
+from src.services.mark_to_market import mark_to_market
+from src.services.risk_exposure import risk_exposure
+from src.services.what_if import what_if
+from src.services.serialization import AccountSnapshotDTO, to_columns, wants_columns, render
+from src.services.snapshots import (
+    parse_date_range, pending_snapshots, account_equity_curve, portfolio_equity_curve, drawdown_by_account
+)
 from sqlalchemy import func
+from datetime import datetime
 
 analytics_bp = Blueprint('analytics', __name__)
 
 @analytics_bp.route('/portfolio/dashboard', methods=['GET'])
+@read_only
 @require_auth
 def get_portfolio_dashboard():
     """Get main portfolio dashboard with aggregated data"""
@@ -15,7 +34,8 @@ def get_portfolio_dashboard():
             return jsonify({'error': 'User not found'}), 404
         
         # Get all user accounts
-        accounts = Account.query.filter_by(user_id=request.user_id).all()
+        with trace_span('portfolio.load_accounts'):
+            accounts = Account.query.filter_by(user_id=request.user_id).all()
         
         if not accounts:
             return jsonify({
@@ -34,65 +54,84 @@ def get_portfolio_dashboard():
                 'bottom_performers': []
             }), 200
         
-        # Calculate portfolio metrics
+        # Calculate portfolio metrics (cash totals in cents)
         total_balance = 0
         total_initial_capital = 0
         total_open_trades = 0
         total_closed_trades = 0
         account_performances = []
         
+        # Read every account's drawdown at once, counting days the scheduler has not snapshotted yet
+        account_ids = [account.id for account in accounts]
+        drawdowns = drawdown_by_account(account_ids, pending_snapshots(account_ids))
+        
         for account in accounts:
+            span = trace_span('portfolio.account', account_id=account.id)
             # Get account trades
             trades = Trade.query.filter_by(account_id=account.id).all()
             closed_trades = [t for t in trades if t.status == 'Closed']
             open_trades = [t for t in trades if t.status == 'Open']
             
             # Calculate account P&L
-            account_pnl = sum(t.calculate_net_pnl() for t in closed_trades)
-            account.current_balance = float(account.initial_capital) + account_pnl
+            account_pnl = sum(t.calculate_net_pnl_cents() for t in closed_trades)
+            balance = to_cents(account.initial_capital) + account_pnl
             
             # Convert to primary currency (simplified - assuming 1:1 for now)
             # In a real implementation, you'd use exchange rates here
-            total_balance += account.current_balance
-            total_initial_capital += float(account.initial_capital)
+            total_balance += balance
+            total_initial_capital += to_cents(account.initial_capital)
             total_open_trades += len(open_trades)
             total_closed_trades += len(closed_trades)
             
             # Store account performance for ranking
-            account_pnl_percentage = account.calculate_pnl_percentage()
+            account_pnl_percentage = account.calculate_pnl_percentage(balance)
             account_performances.append({
-                'account': account.to_dict(),
-                'pnl': account_pnl,
+                'account': dict(account.to_dict(), current_balance=from_cents(balance)),
+                'pnl': from_cents(account_pnl),
                 'pnl_percentage': account_pnl_percentage,
+                'current_drawdown': account.calculate_current_drawdown(
+                    drawdowns[account.id].peak_balance if account.id in drawdowns else 0, balance
+                ),
                 'open_trades': len(open_trades),
                 'closed_trades': len(closed_trades)
             })
-        
-        # Update account balances
-        db.session.commit()
+            span.end()
         
         # Calculate portfolio totals
         total_pnl = total_balance - total_initial_capital
         total_pnl_percentage = (total_pnl / total_initial_capital * 100) if total_initial_capital > 0 else 0
         
-        # Calculate max drawdown (simplified)
-        max_drawdown = max((acc['account']['max_drawdown'] or 0) for acc in account_performances) if account_performances else 0
+        # Deepest end-of-day drawdown recorded in the account snapshots
+        max_drawdown = max((row.max_drawdown for row in drawdowns.values()), default=0)
+        
+        # Open trades marked at the latest stored prices
+        with trace_span('portfolio.mark_to_market'):
+            marked = mark_to_market(request.user_id)
+            unrealized_by_account = {totals['account_id']: totals['unrealized_pnl'] for totals in marked['accounts']}
+            for performance in account_performances:
+                performance['unrealized_pnl'] = unrealized_by_account.get(performance['account']['id'], 0)
         
         # Sort accounts by performance
+        span = trace_span('portfolio.rank_accounts')
         account_performances.sort(key=lambda x: x['pnl_percentage'], reverse=True)
         top_performers = account_performances[:3]
         bottom_performers = account_performances[-3:] if len(account_performances) > 3 else []
+        span.end()
         
         portfolio_data = {
             'portfolio': {
                 'total_accounts': len(accounts),
-                'total_balance': round(total_balance, 2),
-                'total_initial_capital': round(total_initial_capital, 2),
-                'total_pnl': round(total_pnl, 2),
+                'total_balance': from_cents(total_balance),
+                'total_initial_capital': from_cents(total_initial_capital),
+                'total_pnl': from_cents(total_pnl),
                 'total_pnl_percentage': round(total_pnl_percentage, 2),
                 'max_drawdown': round(max_drawdown, 2),
                 'total_open_trades': total_open_trades,
                 'total_closed_trades': total_closed_trades,
+                'unrealized_pnl': marked['portfolio']['unrealized_pnl'],
+                'open_market_value': marked['portfolio']['market_value'],
+                'open_risk_to_stop': marked['portfolio']['risk_to_stop'],
+                'unpriced_instruments': marked['portfolio']['unpriced_instruments'],
                 'primary_currency': user.primary_currency
             },
             'accounts': account_performances,
@@ -106,6 +145,7 @@ def get_portfolio_dashboard():
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/accounts/<int:account_id>/analytics', methods=['GET'])
+@read_only
 @require_auth
 def get_account_analytics(account_id):
     """Get detailed analytics for a specific account"""
@@ -115,8 +155,10 @@ def get_account_analytics(account_id):
             return jsonify({'error': 'Account not found'}), 404
         
         # Get all trades for this account
+        span = trace_span('analytics.load_trades')
         trades = Trade.query.filter_by(account_id=account_id).all()
         closed_trades = [t for t in trades if t.status == 'Closed']
+        span.end()
         
         if not closed_trades:
             return jsonify({
@@ -139,13 +181,14 @@ def get_account_analytics(account_id):
             }), 200
         
         # Calculate basic metrics
-        winning_trades = [t for t in closed_trades if t.calculate_net_pnl() > 0]
-        losing_trades = [t for t in closed_trades if t.calculate_net_pnl() <= 0]
+        span = trace_span('analytics.core_metrics')
+        winning_trades = [t for t in closed_trades if t.calculate_net_pnl_cents() > 0]
+        losing_trades = [t for t in closed_trades if t.calculate_net_pnl_cents() <= 0]
         
         win_rate = (len(winning_trades) / len(closed_trades) * 100) if closed_trades else 0
         
-        total_wins = sum(t.calculate_net_pnl() for t in winning_trades)
-        total_losses = abs(sum(t.calculate_net_pnl() for t in losing_trades))
+        total_wins = from_cents(sum(t.calculate_net_pnl_cents() for t in winning_trades))
+        total_losses = abs(from_cents(sum(t.calculate_net_pnl_cents() for t in losing_trades)))
         profit_factor = total_wins / total_losses if total_losses > 0 else 0
         
         # R-multiples
@@ -156,15 +199,17 @@ def get_account_analytics(account_id):
         avg_win = total_wins / len(winning_trades) if winning_trades else 0
         avg_loss = total_losses / len(losing_trades) if losing_trades else 0
         expectancy = (win_rate / 100 * avg_win) - ((100 - win_rate) / 100 * avg_loss)
+        span.end()
         
         # Consecutive wins/losses
+        span = trace_span('analytics.streaks_and_extremes')
         max_consecutive_wins = 0
         max_consecutive_losses = 0
         current_wins = 0
         current_losses = 0
         
         for trade in closed_trades:
-            if trade.calculate_net_pnl() > 0:
+            if trade.calculate_net_pnl_cents() > 0:
                 current_wins += 1
                 current_losses = 0
                 max_consecutive_wins = max(max_consecutive_wins, current_wins)
@@ -174,10 +219,12 @@ def get_account_analytics(account_id):
                 max_consecutive_losses = max(max_consecutive_losses, current_losses)
         
         # Best and worst trades
-        best_trade = max(closed_trades, key=lambda t: t.calculate_net_pnl()) if closed_trades else None
-        worst_trade = min(closed_trades, key=lambda t: t.calculate_net_pnl()) if closed_trades else None
+        best_trade = max(closed_trades, key=lambda t: t.calculate_net_pnl_cents()) if closed_trades else None
+        worst_trade = min(closed_trades, key=lambda t: t.calculate_net_pnl_cents()) if closed_trades else None
+        span.end()
         
         # Performance by instrument
+        span = trace_span('analytics.by_instrument')
         instrument_performance = {}
         for trade in closed_trades:
             instrument = trade.instrument
@@ -188,8 +235,8 @@ def get_account_analytics(account_id):
                     'wins': 0
                 }
             instrument_performance[instrument]['trades'] += 1
-            instrument_performance[instrument]['pnl'] += trade.calculate_net_pnl()
-            if trade.calculate_net_pnl() > 0:
+            instrument_performance[instrument]['pnl'] += trade.calculate_net_pnl_cents()
+            if trade.calculate_net_pnl_cents() > 0:
                 instrument_performance[instrument]['wins'] += 1
         
         performance_by_instrument = []
@@ -198,14 +245,16 @@ def get_account_analytics(account_id):
             performance_by_instrument.append({
                 'instrument': instrument,
                 'trades': data['trades'],
-                'pnl': round(data['pnl'], 2),
+                'pnl': from_cents(data['pnl']),
                 'win_rate': round(win_rate_instrument, 2)
             })
+        span.end()
         
         # Performance by risk type
+        span = trace_span('analytics.by_risk_type')
         risk_type_performance = {}
         for trade in closed_trades:
-            risk_type = trade.risk_type.name if trade.risk_type else 'Unassigned'
+            risk_type = risk_type_name(request.user_id, trade.risk_type_id) or 'Unassigned'
             if risk_type not in risk_type_performance:
                 risk_type_performance[risk_type] = {
                     'trades': 0,
@@ -213,8 +262,8 @@ def get_account_analytics(account_id):
                     'wins': 0
                 }
             risk_type_performance[risk_type]['trades'] += 1
-            risk_type_performance[risk_type]['pnl'] += trade.calculate_net_pnl()
-            if trade.calculate_net_pnl() > 0:
+            risk_type_performance[risk_type]['pnl'] += trade.calculate_net_pnl_cents()
+            if trade.calculate_net_pnl_cents() > 0:
                 risk_type_performance[risk_type]['wins'] += 1
         
         performance_by_risk_type = []
@@ -223,10 +272,12 @@ def get_account_analytics(account_id):
             performance_by_risk_type.append({
                 'risk_type': risk_type,
                 'trades': data['trades'],
-                'pnl': round(data['pnl'], 2),
+                'pnl': from_cents(data['pnl']),
                 'win_rate': round(win_rate_risk, 2)
             })
+        span.end()
         
+        span = trace_span('analytics.serialize')
         analytics_data = {
             'account': account.to_dict(),
             'analytics': {
@@ -244,12 +295,213 @@ def get_account_analytics(account_id):
             'performance_by_instrument': performance_by_instrument,
             'performance_by_risk_type': performance_by_risk_type
         }
+        span.end()
         
         return jsonify(analytics_data), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@analytics_bp.route('/portfolio/performance-by-tag', methods=['GET'])
+@read_only
+@require_auth
+def get_portfolio_tag_performance():
+    """Get strategy tag performance across all accounts of the user"""
+    try:
+        scope = user_trade_scope(request.user_id)
+        
+        return jsonify({
+            'performance_by_strategy_tag': performance_by_strategy_tag(scope),
+            'performance_by_tag_combination': performance_by_tag_combination(scope)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/accounts/<int:account_id>/performance-by-tag', methods=['GET'])
+@read_only
+@require_auth
+def get_account_tag_performance(account_id):
+    """Get strategy tag performance for a specific account"""
+    try:
+        account = Account.query.filter_by(id=account_id, user_id=request.user_id).first()
+        if not account:
+            return jsonify({'error': 'Account not found'}), 404
+        
+        scope = user_trade_scope(request.user_id, [account_id])
+        
+        return jsonify({
+            'account': account.to_dict(),
+            'performance_by_strategy_tag': performance_by_strategy_tag(scope),
+            'performance_by_tag_combination': performance_by_tag_combination(scope)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/accounts/<int:account_id>/equity-curve', methods=['GET'])
+@read_only
+@require_auth
+def get_account_equity_curve(account_id):
+    """Get daily balance, realized P&L, open risk and drawdown snapshots for an account"""
+    try:
+        account = Account.query.filter_by(id=account_id, user_id=request.user_id).first()
+        if not account:
+            return jsonify({'error': 'Account not found'}), 404
+        
+        try:
+            start, end = parse_date_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Days the scheduler has not snapshotted yet are computed here but left for it to store
+        pending = pending_snapshots([account.id])
+        snapshots = account_equity_curve(account.id, start, end, pending)
+        
+        return render({
+            'account': account.to_dict(),
+            'snapshots': to_columns(snapshots, AccountSnapshotDTO) if wants_columns() else [snapshot.as_dict() for snapshot in snapshots],
+            'max_drawdown': max((snapshot.drawdown for snapshot in snapshots), default=0),
+            'current_drawdown': round(account.calculate_current_drawdown(pending[-1]['peak_balance'] if pending else None), 2)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/accounts/<int:account_id>/lots', methods=['GET'])
+@read_only
+@require_auth
+def get_account_lots(account_id):
+    """Get realized P&L and holding time of matched lots per instrument"""
+    try:
+        account = Account.query.filter_by(id=account_id, user_id=request.user_id).first()
+        if not account:
+            return jsonify({'error': 'Account not found'}), 404
+        
+        return jsonify(account_lot_summary(account)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/portfolio/equity-curve', methods=['GET'])
+@read_only
+@require_auth
+def get_portfolio_equity_curve():
+    """Get daily snapshots summed across all accounts of the user"""
+    try:
+        try:
+            start, end = parse_date_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        account_ids = list(reference_data(request.user_id).accounts)
+        snapshots = portfolio_equity_curve(account_ids, start, end, pending_snapshots(account_ids))
+        
+        return render({
+            'snapshots': snapshots,
+            'max_drawdown': max((snapshot['drawdown'] for snapshot in snapshots), default=0)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/portfolio/mark-to-market', methods=['GET'])
+@read_only
+@require_auth
+def get_portfolio_mark_to_market():
+    """Get unrealized P&L and distance to stop of open trades at the latest stored prices"""
+    try:
+        account_ids = None
+        if request.args.get('account_ids'):
+            try:
+                account_ids = sorted({int(value) for value in request.args['account_ids'].split(',') if value})
+            except ValueError:
+                return jsonify({'error': 'account_ids must contain integer ids'}), 400
+            if not owns_accounts(request.user_id, account_ids):
+                return jsonify({'error': 'Account not found'}), 404
+        try:
+            as_of = datetime.fromisoformat(request.args['as_of']) if request.args.get('as_of') else None
+        except ValueError:
+            return jsonify({'error': 'as_of must be an ISO date or time'}), 400
+        
+        return jsonify(mark_to_market(request.user_id, account_ids, as_of)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/portfolio/risk-exposure', methods=['GET'])
+@read_only
+@require_auth
+def get_portfolio_risk_exposure():
+    """Get open risk-to-stop by account, instrument, currency and risk type"""
+    try:
+        account_ids = None
+        if request.args.get('account_ids'):
+            try:
+                account_ids = sorted({int(value) for value in request.args['account_ids'].split(',') if value})
+            except ValueError:
+                return jsonify({'error': 'account_ids must contain integer ids'}), 400
+            if not owns_accounts(request.user_id, account_ids):
+                return jsonify({'error': 'Account not found'}), 404
+        
+        return jsonify(risk_exposure(request.user_id, account_ids)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/accounts/<int:account_id>/what-if', methods=['POST'])
+@require_auth
+def replay_account_what_if(account_id):
+    """Replay the account's closed trades under alternative risk, stop and drawdown rules"""
+    try:
+        account = Account.query.filter_by(id=account_id, user_id=request.user_id).first()
+        if not account:
+            return jsonify({'error': 'Account not found'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        try:
+            start, end = parse_date_range(data)
+            result = what_if(
+                account,
+                scenarios=data.get('scenarios'),
+                sweep=data.get('sweep'),
+                include_curves=bool(data.get('include_curves')),
+                start=start,
+                end=end,
+                starting_balance=data.get('starting_balance')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/query', methods=['POST'])
+@require_auth
+def query_analytics():
+    """Get analytics for trades matching account, date, instrument, tag, risk type and direction filters"""
+    try:
+        try:
+            filters = parse_filters(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        rows = run_query(request.user_id, filters)
+        result = summarize(rows)
+        result['filters'] = {
+            key: value.isoformat() if hasattr(value, 'isoformat') else value
+            for key, value in filters.items()
+        }
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @analytics_bp.route('/accounts/<int:account_id>/export', methods=['GET'])
 @require_auth
 def export_account_data(account_id):
@@ -259,47 +511,52 @@ def export_account_data(account_id):
         if not account:
             return jsonify({'error': 'Account not found'}), 404
         
-        trades = Trade.query.filter_by(account_id=account_id).all()
+        # Parquet or Arrow files for dataframe tools, instead of CSV rows in JSON
+        file_format = request.args.get('format')
+        if file_format in FORMATS:
+            if not columnar_available():
+                return jsonify({'error': 'Columnar export requires pyarrow'}), 501
+            return columnar_export_response([account], file_format)
         
-        # Prepare CSV data
-        csv_data = []
-        csv_data.append([
-            'Trade ID', 'Trade Name', 'Instrument', 'Type', 'Status',
-            'Entry Date', 'Entry Price', 'Exit Date', 'Exit Price',
-            'Quantity', 'Stop Loss', 'Take Profit', 'Gross P&L',
-            'Net P&L', 'Total Costs', 'R-Multiple', 'Notes'
-        ])
-        
-        for trade in trades:
-            # Get first entry and exit for simplicity
-            first_entry = trade.entries[0] if trade.entries else None
-            first_exit = trade.exits[0] if trade.exits else None
-            
-            csv_data.append([
-                trade.id,
-                trade.trade_name or '',
-                trade.instrument,
-                trade.trade_type,
-                trade.status,
-                first_entry.entry_date.isoformat() if first_entry else '',
-                float(first_entry.entry_price) if first_entry else '',
-                first_exit.exit_date.isoformat() if first_exit else '',
-                float(first_exit.exit_price) if first_exit else '',
-                float(first_entry.quantity) if first_entry else '',
-                float(trade.stop_loss_price) if trade.stop_loss_price else '',
-                float(trade.take_profit_price) if trade.take_profit_price else '',
-                round(trade.calculate_gross_pnl(), 2),
-                round(trade.calculate_net_pnl(), 2),
-                round(trade.calculate_total_costs(), 2),
-                round(trade.calculate_r_multiple(), 2),
-                trade.notes or ''
-            ])
+        # Large accounts can be exported in the background instead
+        if request.args.get('async') in ('1', 'true'):
+            job = enqueue('export_account_data', request.user_id, {'account_id': account_id})
+            db.session.commit()
+            response = jsonify({'job': job.to_dict()})
+            response.headers['Location'] = f'/api/jobs/{job.id}'
+            return response, 202
         
-        return jsonify({
-            'csv_data': csv_data,
-            'filename': f'{account.name}_trades_export.csv'
-        }), 200
+        return jsonify(account_export(account)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@analytics_bp.route('/export/columnar', methods=['GET'])
+@read_only
+@require_auth
+def export_columnar():
+    """Export trades, entries, exits and costs of several accounts (default: all) as Parquet or Arrow files"""
+    try:
+        file_format = request.args.get('format', 'parquet')
+        if file_format not in FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}), 400
+        if not columnar_available():
+            return jsonify({'error': 'Columnar export requires pyarrow'}), 501
+        
+        query = Account.query.filter_by(user_id=request.user_id)
+        account_ids = None
+        if request.args.get('account_ids'):
+            try:
+                account_ids = {int(value) for value in request.args['account_ids'].split(',') if value}
+            except ValueError:
+                return jsonify({'error': 'account_ids must contain integer ids'}), 400
+            query = query.filter(Account.id.in_(account_ids))
+        accounts = query.order_by(Account.id).all()
+        if not accounts or (account_ids and len(accounts) != len(account_ids)):
+            return jsonify({'error': 'Account not found'}), 404
+        
+        return columnar_export_response(accounts, file_format)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from models import db, User
+from src.services.sharding import assign_shard, locate_user, use_shard
 import jwt
 from datetime import datetime, timedelta
 import os
@@ -8,6 +9,14 @@ auth_bp = Blueprint('auth', __name__)
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
 
+# WSGI environ key carrying the user a batch request already authenticated to its sub-requests
+BATCH_USER_KEY = 'vine.batch_user_id'
+
+def read_only(f):
+    """Mark a view that never writes, so a batch can run it inside a shared read snapshot"""
+    f.read_only = True
+    return f
+
 def generate_token(user_id):
     """Generate JWT token for user"""
     payload = {
@@ -48,6 +57,8 @@ def register():
         user.set_password(data['password'])
         
         db.session.add(user)
+        db.session.flush()
+        assign_shard(user.id)
         db.session.commit()
         
         # Generate token
@@ -90,6 +101,7 @@ def login():
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/profile', methods=['GET'])
+@read_only
 def get_profile():
     """Get user profile"""
     try:
@@ -160,6 +172,12 @@ def update_profile():
 def require_auth(f):
     """Decorator to require authentication"""
     def decorated_function(*args, **kwargs):
+        # Sub-requests of a batch already run as its user, inside its shard
+        batch_user_id = request.environ.get(BATCH_USER_KEY)
+        if batch_user_id is not None:
+            request.user_id = batch_user_id
+            return f(*args, **kwargs)
+        
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
             return jsonify({'error': 'Token required'}), 401
@@ -172,7 +190,13 @@ def require_auth(f):
         
         # Add user_id to request context
         request.user_id = user_id
-        return f(*args, **kwargs)
+        
+        # Run the view against the database holding this user's data
+        shard, moving = locate_user(user_id)
+        if moving:
+            return jsonify({'error': 'Your data is being moved; try again in a few seconds'}), 503
+        with use_shard(shard):
+            return f(*args, **kwargs)
     
     decorated_function.__name__ = f.__name__
     return decorated_function
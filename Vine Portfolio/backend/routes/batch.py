@@ -0,0 +1,121 @@
+from contextlib import contextmanager, nullcontext
+from itertools import groupby
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+from src.models import db
+from src.routes.auth import require_auth, BATCH_USER_KEY
+
+batch_bp = Blueprint('batch', __name__)
+
+MAX_BATCH_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+@contextmanager
+def read_snapshot():
+    """Run a run of read sub-requests in one transaction per database, so they all see the same data
+
+    Only views marked read_only go in it: a write inside would need the lock that the open read transaction keeps
+    concurrent writers from committing with, and SQLite answers either side with "database is locked".
+    """
+    session = db.session()
+
+    def begin_read(session, transaction, connection):
+        # pysqlite only opens a transaction before writes; without one each SELECT sees the latest commit
+        if connection.dialect.name == 'sqlite' and not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN')
+
+    # Start from a fresh transaction so the connection authentication used is covered too
+    session.rollback()
+    event.listen(session, 'after_begin', begin_read)
+    try:
+        yield
+    finally:
+        event.remove(session, 'after_begin', begin_read)
+        session.rollback()
+
+def parse_sub_requests(data):
+    """Validated (id, method, path, body) of each sub-request; raises ValueError"""
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list) or not data['requests']:
+        raise ValueError('requests must be a non-empty list')
+    if len(data['requests']) > MAX_BATCH_REQUESTS:
+        raise ValueError(f'A batch can hold at most {MAX_BATCH_REQUESTS} requests')
+
+    sub_requests = []
+    for index, sub in enumerate(data['requests']):
+        if not isinstance(sub, dict):
+            raise ValueError(f'Request {index}: must be an object')
+        method = str(sub.get('method', 'GET')).upper()
+        path = sub.get('path')
+        if method not in BATCH_METHODS:
+            raise ValueError(f'Request {index}: method must be one of {", ".join(BATCH_METHODS)}')
+        if not isinstance(path, str) or not path.startswith('/api/'):
+            raise ValueError(f'Request {index}: path must start with /api/')
+        if path.split('?')[0].rstrip('/') == request.path.rstrip('/'):
+            raise ValueError(f'Request {index}: batches cannot be nested')
+        sub_requests.append((sub.get('id', index), method, path, sub.get('body')))
+    return sub_requests
+
+def is_read_only(method, path):
+    """Whether a sub-request reaches a view marked read_only, so it can share a read snapshot"""
+    if method != 'GET':
+        return False
+    adapter = current_app.create_url_adapter(request)
+    try:
+        endpoint, _ = adapter.match(path.split('?')[0], method=method)
+    except HTTPException:
+        # Unknown paths and redirects run on their own
+        return False
+    return getattr(current_app.view_functions.get(endpoint), 'read_only', False)
+
+def run_sub_request(method, path, body):
+    """Dispatch one sub-request to its view in this app and session; returns (status, body)"""
+    builder = EnvironBuilder(path=path, method=method, json=body, base_url=request.host_url,
+                             headers={'Authorization': request.headers.get('Authorization', '')})
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    environ[BATCH_USER_KEY] = request.user_id
+
+    # dispatch_request skips the before/after hooks, so metrics and the trace span stay the batch's own
+    with current_app.request_context(environ):
+        try:
+            response = current_app.make_response(current_app.dispatch_request())
+        except HTTPException as e:
+            return e.code, {'error': e.description}
+        except Exception as e:
+            db.session.rollback()
+            return 500, {'error': str(e)}
+
+        if response.is_streamed:
+            response.close()
+            return 400, {'error': 'Streamed responses cannot be batched'}
+        if response.is_json:
+            return response.status_code, response.get_json(silent=True)
+        return response.status_code, response.get_data(as_text=True)
+
+@batch_bp.route('/batch', methods=['POST'])
+@require_auth
+def run_batch():
+    """Run several API requests in one round-trip and return their responses in order"""
+    try:
+        try:
+            sub_requests = parse_sub_requests(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        responses = []
+        # Consecutive reads share a snapshot; anything else commits on its own, seen by the reads after it
+        for reads, run in groupby(sub_requests, key=lambda sub: is_read_only(sub[1], sub[2])):
+            with read_snapshot() if reads else nullcontext():
+                for sub_id, method, path, body in run:
+                    status, payload = run_sub_request(method, path, body)
+                    responses.append({'id': sub_id, 'status': status, 'body': payload})
+        
+        return jsonify({'responses': responses}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
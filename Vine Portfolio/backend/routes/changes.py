@@ -0,0 +1,22 @@
+from flask import Blueprint, request, jsonify
+from src.routes.auth import require_auth, read_only
+from src.services.change_feed import changes_since
+from src.services.serialization import render
+
+changes_bp = Blueprint('changes', __name__)
+
+MAX_CHANGES = 1000
+
+@changes_bp.route('/changes', methods=['GET'])
+@read_only
+@require_auth
+def get_changes():
+    """Get compacted upserts and tombstones since a sync cursor"""
+    try:
+        since = request.args.get('since', 0, type=int)
+        limit = min(max(request.args.get('limit', 500, type=int), 1), MAX_CHANGES)
+        
+        return render(changes_since(request.user_id, since, limit)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
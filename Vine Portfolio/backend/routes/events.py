@@ -0,0 +1,49 @@
+import json
+from flask import Blueprint, request, jsonify, Response
+from src.routes.auth import verify_token
+from src.services.event_bus import get_event_bus, user_channel
+
+events_bp = Blueprint('events', __name__)
+
+HEARTBEAT_SECONDS = 15
+
+def format_sse(event):
+    """Encode an event in the text/event-stream wire format"""
+    return f'id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n'
+
+@events_bp.route('/stream', methods=['GET'])
+def stream_events():
+    """Stream dashboard delta events for the authenticated user as server-sent events"""
+    # EventSource cannot send headers, so the token may also come as a query parameter
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+    else:
+        token = request.args.get('token')
+    
+    if not token:
+        return jsonify({'error': 'Token required'}), 401
+    
+    user_id = verify_token(token)
+    if not user_id:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = get_event_bus().subscribe(user_channel(user_id), last_event_id=last_event_id)
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            subscription.close()
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
@@ -0,0 +1,85 @@
+from flask import Blueprint, request, jsonify
+from src.models import db, Job
+from src.routes.auth import require_auth, read_only
+from src.services.jobs import JOB_TYPES, enqueue
+from src.services.serialization import render
+from src.services import exports, rebuild  # Register their job types
+
+jobs_bp = Blueprint('jobs', __name__)
+
+MAX_JOBS = 100
+
+@jobs_bp.route('/', methods=['GET'])
+@read_only
+@require_auth
+def get_jobs():
+    """Get the user's most recent jobs"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_JOBS)
+        query = Job.query.filter_by(user_id=request.user_id)
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        jobs = query.order_by(Job.id.desc()).limit(limit).all()
+        
+        return render({'jobs': [job.to_dict() for job in jobs]}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/', methods=['POST'])
+@require_auth
+def create_job():
+    """Queue a background job"""
+    try:
+        data = request.get_json()
+        if not data or data.get('job_type') not in JOB_TYPES:
+            return jsonify({'error': f'job_type must be one of {", ".join(sorted(JOB_TYPES))}'}), 400
+        
+        try:
+            job = enqueue(data['job_type'], request.user_id, data.get('params') or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        
+        response = jsonify({
+            'message': 'Job queued successfully',
+            'job': job.to_dict()
+        })
+        response.headers['Location'] = f'/api/jobs/{job.id}'
+        return response, 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+@read_only
+@require_auth
+def get_job(job_id):
+    """Get job status and progress"""
+    try:
+        job = Job.query.filter_by(id=job_id, user_id=request.user_id).first()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/<int:job_id>/result', methods=['GET'])
+@read_only
+@require_auth
+def get_job_result(job_id):
+    """Get the result of a finished job"""
+    try:
+        job = Job.query.filter_by(id=job_id, user_id=request.user_id).first()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        if job.status != 'succeeded':
+            return jsonify({'error': f'Job is {job.status}', 'job': job.to_dict()}), 409
+        
+        return jsonify(job.get_result()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,19 +1,27 @@
 from flask import Blueprint, request, jsonify
-from src.models import db, RiskType, StrategyTag, Account
-from src.routes.auth import require_auth
+from src.models import db, RiskType, StrategyTag, Account, AccountAlert
+from src.routes.auth import require_auth, read_only
+from src.services.change_feed import record_change
+from src.services.reference_cache import reference_data, owns_accounts
+from src.services.serialization import render
+from src.services.alerts import account_alert_state
+from src.services.money import (
+    PRICE_DIGITS, QUANTITY_DIGITS, QUANTITY_SCALE, to_fixed, from_fixed, to_cents, from_cents,
+    percent_of, position_size, whole_units_for_risk, value_to_cents
+)
 from datetime import datetime
-import math
 
 risk_bp = Blueprint('risk', __name__)
 
 @risk_bp.route('/risk-types', methods=['GET'])
+@read_only
 @require_auth
 def get_risk_types():
     """Get all risk types for the user"""
     try:
-        risk_types = RiskType.query.filter_by(user_id=request.user_id).all()
-        return jsonify({
-            'risk_types': [rt.to_dict() for rt in risk_types]
+        risk_types = reference_data(request.user_id).risk_types
+        return render({
+            'risk_types': list(risk_types.values())
         }), 200
         
     except Exception as e:
@@ -37,6 +45,8 @@ def create_risk_type():
         )
         
         db.session.add(risk_type)
+        db.session.flush()  # Get the risk type ID
+        record_change(request.user_id, 'risk_type', risk_type.id)
         db.session.commit()
         
         return jsonify({
@@ -49,13 +59,14 @@ def create_risk_type():
         return jsonify({'error': str(e)}), 500
 
 @risk_bp.route('/strategy-tags', methods=['GET'])
+@read_only
 @require_auth
 def get_strategy_tags():
     """Get all strategy tags for the user"""
     try:
-        tags = StrategyTag.query.filter_by(user_id=request.user_id).all()
-        return jsonify({
-            'strategy_tags': [tag.to_dict() for tag in tags]
+        tags = reference_data(request.user_id).strategy_tags
+        return render({
+            'strategy_tags': list(tags.values())
         }), 200
         
     except Exception as e:
@@ -78,6 +89,8 @@ def create_strategy_tag():
         )
         
         db.session.add(tag)
+        db.session.flush()  # Get the tag ID
+        record_change(request.user_id, 'strategy_tag', tag.id)
         db.session.commit()
         
         return jsonify({
@@ -100,13 +113,13 @@ def calculate_position_size():
         if not data or not all(field in data for field in required_fields):
             return jsonify({'error': 'Account balance, risk percentage, entry price, and stop loss price are required'}), 400
         
-        account_balance = float(data['account_balance'])
-        risk_percentage = float(data['risk_percentage'])
-        entry_price = float(data['entry_price'])
-        stop_loss_price = float(data['stop_loss_price'])
+        # Cash in cents, prices in fixed 1e-8 units
+        account_balance = to_cents(data['account_balance'])
+        entry_price = to_fixed(data['entry_price'], PRICE_DIGITS)
+        stop_loss_price = to_fixed(data['stop_loss_price'], PRICE_DIGITS)
         
         # Calculate risk amount
-        risk_amount = account_balance * (risk_percentage / 100)
+        risk_amount = percent_of(account_balance, data['risk_percentage'])
         
         # Calculate price difference
         price_diff = abs(entry_price - stop_loss_price)
@@ -115,19 +128,19 @@ def calculate_position_size():
             return jsonify({'error': 'Entry price and stop loss price cannot be the same'}), 400
         
         # Calculate position size
-        position_size = risk_amount / price_diff
+        quantity = position_size(risk_amount, price_diff)
         
         # Calculate R-multiple if take profit is provided
         r_multiple = None
         if data.get('take_profit_price'):
-            take_profit_price = float(data['take_profit_price'])
+            take_profit_price = to_fixed(data['take_profit_price'], PRICE_DIGITS)
             profit_diff = abs(take_profit_price - entry_price)
             r_multiple = profit_diff / price_diff
         
         result = {
-            'risk_amount': round(risk_amount, 2),
-            'position_size': round(position_size, 2),
-            'price_difference': round(price_diff, 4),
+            'risk_amount': from_cents(risk_amount),
+            'position_size': round(from_fixed(quantity, QUANTITY_DIGITS), 2),
+            'price_difference': round(from_fixed(price_diff, PRICE_DIGITS), 4),
             'r_multiple': round(r_multiple, 2) if r_multiple else None
         }
         
@@ -147,14 +160,13 @@ def calculate_forex_lot_size():
         if not data or not all(field in data for field in required_fields):
             return jsonify({'error': 'Account balance, risk percentage, stop loss pips, and currency pair are required'}), 400
         
-        account_balance = float(data['account_balance'])
-        risk_percentage = float(data['risk_percentage'])
+        account_balance = to_cents(data['account_balance'])
         stop_loss_pips = float(data['stop_loss_pips'])
         currency_pair = data['currency_pair'].upper()
         account_currency = data.get('account_currency', 'USD').upper()
         
         # Calculate risk amount
-        risk_amount = account_balance * (risk_percentage / 100)
+        risk_amount = from_cents(percent_of(account_balance, data['risk_percentage']))
         
         # Pip values for major pairs (simplified)
         pip_values = {
@@ -210,13 +222,13 @@ def calculate_stock_shares():
         if not data or not all(field in data for field in required_fields):
             return jsonify({'error': 'Account balance, risk percentage, entry price, and stop loss price are required'}), 400
         
-        account_balance = float(data['account_balance'])
-        risk_percentage = float(data['risk_percentage'])
-        entry_price = float(data['entry_price'])
-        stop_loss_price = float(data['stop_loss_price'])
+        # Cash in cents, prices in fixed 1e-8 units
+        account_balance = to_cents(data['account_balance'])
+        entry_price = to_fixed(data['entry_price'], PRICE_DIGITS)
+        stop_loss_price = to_fixed(data['stop_loss_price'], PRICE_DIGITS)
         
         # Calculate risk amount
-        risk_amount = account_balance * (risk_percentage / 100)
+        risk_amount = percent_of(account_balance, data['risk_percentage'])
         
         # Calculate price difference
         price_diff = abs(entry_price - stop_loss_price)
@@ -225,22 +237,22 @@ def calculate_stock_shares():
             return jsonify({'error': 'Entry price and stop loss price cannot be the same'}), 400
         
         # Calculate number of shares
-        shares = math.floor(risk_amount / price_diff)
+        shares = whole_units_for_risk(risk_amount, price_diff)
         
         # Calculate actual risk amount with whole shares
-        actual_risk = shares * price_diff
+        actual_risk = value_to_cents(shares * QUANTITY_SCALE * price_diff)
         actual_risk_percentage = (actual_risk / account_balance) * 100
         
         # Calculate total investment
-        total_investment = shares * entry_price
+        total_investment = value_to_cents(shares * QUANTITY_SCALE * entry_price)
         
         result = {
             'shares': shares,
-            'risk_amount': round(risk_amount, 2),
-            'actual_risk': round(actual_risk, 2),
+            'risk_amount': from_cents(risk_amount),
+            'actual_risk': from_cents(actual_risk),
             'actual_risk_percentage': round(actual_risk_percentage, 2),
-            'total_investment': round(total_investment, 2),
-            'price_difference': round(price_diff, 2)
+            'total_investment': from_cents(total_investment),
+            'price_difference': round(from_fixed(price_diff, PRICE_DIGITS), 2)
         }
         
         return jsonify(result), 200
@@ -249,6 +261,7 @@ def calculate_stock_shares():
         return jsonify({'error': str(e)}), 500
 
 @risk_bp.route('/accounts/<int:account_id>/risk-suggestions', methods=['GET'])
+@read_only
 @require_auth
 def get_risk_suggestions(account_id):
     """Get intelligent risk suggestions for an account"""
@@ -262,6 +275,7 @@ def get_risk_suggestions(account_id):
         recent_trades = Trade.query.filter_by(account_id=account_id).filter_by(status='Closed').order_by(Trade.updated_at.desc()).limit(10).all()
         
         suggestions = []
+        current_drawdown = account.calculate_current_drawdown()
         
         if not recent_trades:
             suggestions.append({
@@ -271,13 +285,10 @@ def get_risk_suggestions(account_id):
             })
         else:
             # Calculate recent performance
-            recent_pnl = sum(t.calculate_net_pnl() for t in recent_trades)
-            winning_trades = [t for t in recent_trades if t.calculate_net_pnl() > 0]
+            recent_pnl = sum(t.calculate_net_pnl_cents() for t in recent_trades)
+            winning_trades = [t for t in recent_trades if t.calculate_net_pnl_cents() > 0]
             win_rate = len(winning_trades) / len(recent_trades) * 100
             
-            # Current drawdown
-            current_drawdown = account.calculate_current_drawdown()
-            
             # Generate suggestions based on performance
             if current_drawdown > 5:
                 suggestions.append({
@@ -321,14 +332,69 @@ def get_risk_suggestions(account_id):
         return jsonify({
             'account': account.to_dict(),
             'suggestions': suggestions,
-            'current_drawdown': account.calculate_current_drawdown(),
+            'alert_state': account_alert_state(account_id),
+            'unacknowledged_alerts': [alert.to_dict() for alert in account.alerts.filter(
+                AccountAlert.acknowledged_at.is_(None)
+            ).order_by(AccountAlert.created_at.desc())],
+            'current_drawdown': current_drawdown,
             'recent_performance': {
                 'trades_analyzed': len(recent_trades),
                 'win_rate': round(win_rate, 1) if recent_trades else 0,
-                'total_pnl': round(sum(t.calculate_net_pnl() for t in recent_trades), 2) if recent_trades else 0
+                'total_pnl': from_cents(sum(t.calculate_net_pnl_cents() for t in recent_trades)) if recent_trades else 0
             }
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@risk_bp.route('/alerts', methods=['GET'])
+@read_only
+@require_auth
+def get_alerts():
+    """Get drawdown and profit target alerts, newest first"""
+    try:
+        query = AccountAlert.query.join(Account).filter(Account.user_id == request.user_id)
+        
+        account_id = request.args.get('account_id', type=int)
+        if account_id is not None:
+            if not owns_accounts(request.user_id, [account_id]):
+                return jsonify({'error': 'Account not found'}), 404
+            query = query.filter(AccountAlert.account_id == account_id)
+        if request.args.get('unacknowledged') in ('1', 'true'):
+            query = query.filter(AccountAlert.acknowledged_at.is_(None))
+        
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        alerts = query.order_by(AccountAlert.created_at.desc(), AccountAlert.id.desc()).limit(limit).all()
+        
+        return render({
+            'alerts': [alert.to_dict() for alert in alerts]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@risk_bp.route('/alerts/<int:alert_id>/acknowledge', methods=['POST'])
+@require_auth
+def acknowledge_alert(alert_id):
+    """Mark an alert as seen"""
+    try:
+        alert = AccountAlert.query.join(Account).filter(
+            AccountAlert.id == alert_id,
+            Account.user_id == request.user_id
+        ).first()
+        
+        if not alert:
+            return jsonify({'error': 'Alert not found'}), 404
+        
+        if alert.acknowledged_at is None:
+            alert.acknowledged_at = datetime.utcnow()
+            db.session.commit()
+        
+        return jsonify({
+            'message': 'Alert acknowledged',
+            'alert': alert.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,60 @@
+from flask import Blueprint, request, jsonify
+from src.models import db, Trade
+from src.routes.auth import require_auth, read_only
+from src.services.search_index import search_trades
+
+search_bp = Blueprint('search', __name__)
+
+@search_bp.route('/trades', methods=['GET'])
+@read_only
+@require_auth
+def search_trade_journal():
+    """Full-text search over trade names, instruments, notes and exit reasons"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Search query is required'}), 400
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        account_id = request.args.get('account_id', type=int)
+        
+        total, matches = search_trades(
+            db.session.connection(), request.user_id, query,
+            account_id=account_id, limit=per_page, offset=(page - 1) * per_page
+        )
+        
+        # Fetch the matched trades in one query and keep the ranking order
+        trades = {}
+        if matches:
+            trades = {
+                trade.id: trade
+                for trade in Trade.query.filter(Trade.id.in_([m.trade_id for m in matches])).all()
+            }
+        
+        results = []
+        for match in matches:
+            trade = trades.get(match.trade_id)
+            if not trade:
+                continue
+            results.append({
+                'trade_id': trade.id,
+                'account_id': trade.account_id,
+                'trade_name': trade.trade_name,
+                'instrument': trade.instrument,
+                'trade_type': trade.trade_type,
+                'status': trade.status,
+                'created_at': trade.created_at.isoformat() if trade.created_at else None,
+                'score': round(-match.score, 4),
+                'snippet': match.snippet
+            })
+        
+        return jsonify({
+            'results': results,
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
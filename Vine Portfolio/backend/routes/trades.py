@@ -1,11 +1,30 @@
 from flask import Blueprint, request, jsonify
 from src.models import db, Trade, TradeEntry, TradeExit, TradeCost, Account, StrategyTag, TradeStrategyTag
-from src.routes.auth import require_auth
+from src.routes.auth import require_auth, read_only
+from src.services.dashboard_events import publish_trade_change
+from src.services.alerts import realized_pnl_cents, record_realized_change, refresh_alerts, publish_alerts
+from src.services.change_feed import record_change
+from src.services.serialization import TradeDTO, serialize_trades, serialize_trades_columnar, wants_columns, render
+from src.services.archive import restore_trade, SUMMARY_FIELDS
+from src.services.position_ledger import record_entry, apply_exit, check_close, LedgerConflict, OpenPosition
+from src.services.lot_matching import METHODS, match_entry, match_exit, rebuild_lots, trade_lot_report
+from src.services.reference_cache import risk_type_name, strategy_tag_names
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
 
 trades_bp = Blueprint('trades', __name__)
 
+def unknown_reference(user_id, data):
+    """Error message if data names a risk type or strategy tag the user does not have, else None"""
+    if data.get('risk_type_id') is not None and risk_type_name(user_id, data['risk_type_id']) is None:
+        return 'Risk type not found'
+    tag_ids = data.get('strategy_tags') or []
+    if len(strategy_tag_names(user_id, tag_ids)) != len(tag_ids):
+        return 'Strategy tag not found'
+    return None
+
 @trades_bp.route('/accounts/<int:account_id>/trades', methods=['GET'])
+@read_only
 @require_auth
 def get_trades(account_id):
     """Get all trades for a specific account"""
@@ -20,20 +39,24 @@ def get_trades(account_id):
         instrument = request.args.get('instrument')
         trade_type = request.args.get('trade_type')
         
-        # Build query
-        query = Trade.query.filter_by(account_id=account_id)
+        # Build query criteria
+        criteria = [Trade.account_id == account_id]
         
         if status:
-            query = query.filter_by(status=status)
+            criteria.append(Trade.status == status)
         if instrument:
-            query = query.filter(Trade.instrument.ilike(f'%{instrument}%'))
+            criteria.append(Trade.instrument.ilike(f'%{instrument}%'))
         if trade_type:
-            query = query.filter_by(trade_type=trade_type)
+            criteria.append(Trade.trade_type == trade_type)
         
-        trades = query.order_by(Trade.created_at.desc()).all()
+        # Load slotted DTOs straight from rows, children included, with one query per table
+        trades = TradeDTO.load(*criteria, order_by=Trade.created_at.desc())
         
-        return jsonify({
-            'trades': [trade.to_dict() for trade in trades]
+        if wants_columns():
+            return render(serialize_trades_columnar(trades)), 200
+        
+        return render({
+            'trades': serialize_trades(trades)
         }), 200
         
     except Exception as e:
@@ -54,6 +77,10 @@ def create_trade(account_id):
         if not data or not data.get('instrument') or not data.get('trade_type'):
             return jsonify({'error': 'Instrument and trade type are required'}), 400
         
+        error = unknown_reference(request.user_id, data)
+        if error:
+            return jsonify({'error': error}), 400
+        
         # Create trade
         trade = Trade(
             account_id=account_id,
@@ -80,6 +107,7 @@ def create_trade(account_id):
                 commission=float(data.get('commission', 0))
             )
             db.session.add(entry)
+            record_entry(trade.id, entry.quantity)
         
         # Add strategy tags if provided
         if data.get('strategy_tags'):
@@ -98,7 +126,9 @@ def create_trade(account_id):
                 )
                 db.session.add(cost)
         
+        record_change(request.user_id, 'trade', trade.id)
         db.session.commit()
+        publish_trade_change(request.user_id, account_id, 'trade.created', trade=trade)
         
         return jsonify({
             'message': 'Trade created successfully',
@@ -110,6 +140,7 @@ def create_trade(account_id):
         return jsonify({'error': str(e)}), 500
 
 @trades_bp.route('/trades/<int:trade_id>', methods=['GET'])
+@read_only
 @require_auth
 def get_trade(trade_id):
     """Get specific trade details"""
@@ -127,6 +158,29 @@ def get_trade(trade_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@trades_bp.route('/trades/<int:trade_id>/lots', methods=['GET'])
+@read_only
+@require_auth
+def get_trade_lots(trade_id):
+    """Get exits matched to entry lots, by the account's lot method or ?method=fifo|lifo|average"""
+    try:
+        trade = Trade.query.join(Account).filter(
+            Trade.id == trade_id,
+            Account.user_id == request.user_id
+        ).first()
+        
+        if not trade:
+            return jsonify({'error': 'Trade not found'}), 404
+        
+        method = request.args.get('method')
+        if method is not None and method not in METHODS:
+            return jsonify({'error': f'method must be one of: {", ".join(METHODS)}'}), 400
+        
+        return jsonify(trade_lot_report(trade, method)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @trades_bp.route('/trades/<int:trade_id>', methods=['PUT'])
 @require_auth
 def update_trade(trade_id):
@@ -144,6 +198,21 @@ def update_trade(trade_id):
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
+        error = unknown_reference(request.user_id, data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        was_closed = trade.status == 'Closed'
+        if data.get('status') == 'Closed':
+            try:
+                check_close(trade)
+            except OpenPosition as e:
+                return jsonify({'error': str(e)}), 400
+        
+        # The frozen summary of an archived trade would go stale
+        if any(field in data for field in SUMMARY_FIELDS):
+            restore_trade(trade)
+        
         # Update trade fields
         if 'trade_name' in data:
             trade.trade_name = data['trade_name']
@@ -151,6 +220,8 @@ def update_trade(trade_id):
             trade.instrument = data['instrument']
         if 'trade_type' in data:
             trade.trade_type = data['trade_type']
+            # Flipping the direction flips every lot's P&L
+            rebuild_lots([trade.id])
         if 'status' in data:
             trade.status = data['status']
         if 'stop_loss_price' in data:
@@ -163,13 +234,23 @@ def update_trade(trade_id):
             trade.notes = data['notes']
         
         trade.updated_at = datetime.utcnow()
+        record_change(request.user_id, 'trade', trade.id)
+        # Closing or editing a trade outside of an exit reseeds the alert state
+        alerts = refresh_alerts(trade.account_id)
         db.session.commit()
         
+        event_type = 'trade.closed' if trade.status == 'Closed' and not was_closed else 'trade.updated'
+        publish_trade_change(request.user_id, trade.account_id, event_type, trade=trade)
+        publish_alerts(request.user_id, alerts)
+        
         return jsonify({
             'message': 'Trade updated successfully',
             'trade': trade.to_dict()
         }), 200
         
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Trade was changed by another request; reload it and try again'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -187,8 +268,13 @@ def delete_trade(trade_id):
         if not trade:
             return jsonify({'error': 'Trade not found'}), 404
         
+        account_id = trade.account_id
         db.session.delete(trade)
+        record_change(request.user_id, 'trade', trade_id, 'delete')
+        alerts = refresh_alerts(account_id)
         db.session.commit()
+        publish_trade_change(request.user_id, account_id, 'trade.deleted', trade_id=trade_id)
+        publish_alerts(request.user_id, alerts)
         
         return jsonify({'message': 'Trade deleted successfully'}), 200
         
@@ -214,6 +300,8 @@ def add_trade_entry(trade_id):
         if not data or not data.get('entry_price') or not data.get('quantity'):
             return jsonify({'error': 'Entry price and quantity are required'}), 400
         
+        restore_trade(trade)
+        
         entry = TradeEntry(
             trade_id=trade_id,
             entry_date=datetime.fromisoformat(data['entry_date']) if data.get('entry_date') else datetime.utcnow(),
@@ -223,7 +311,12 @@ def add_trade_entry(trade_id):
         )
         
         db.session.add(entry)
+        db.session.flush()
+        record_entry(trade_id, entry.quantity)
+        match_entry(trade, entry)
+        record_change(request.user_id, 'trade', trade_id)
         db.session.commit()
+        publish_trade_change(request.user_id, trade.account_id, 'trade.entry_added', trade=trade)
         
         return jsonify({
             'message': 'Entry added successfully',
@@ -252,12 +345,20 @@ def add_trade_exit(trade_id):
         if not data or not data.get('exit_price') or not data.get('quantity'):
             return jsonify({'error': 'Exit price and quantity are required'}), 400
         
-        # Check if we have enough open quantity
-        open_quantity = trade.calculate_open_quantity()
-        exit_quantity = float(data['quantity'])
+        restore_trade(trade)
+        realized_before = realized_pnl_cents(trade)
         
-        if exit_quantity > open_quantity:
-            return jsonify({'error': f'Cannot exit {exit_quantity} units. Only {open_quantity} units are open.'}), 400
+        # Take the quantity off the ledger first; it refuses exits larger than the open quantity,
+        # even when several arrive at once, and closes the trade when nothing is left
+        exit_quantity = float(data['quantity'])
+        try:
+            closed = apply_exit(trade_id, exit_quantity) == 0
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except LedgerConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
         
         exit_trade = TradeExit(
             trade_id=trade_id,
@@ -269,12 +370,14 @@ def add_trade_exit(trade_id):
         )
         
         db.session.add(exit_trade)
+        db.session.flush()
+        match_exit(trade, exit_trade)
+        alerts = record_realized_change(trade, realized_before)
         
-        # Update trade status if fully closed
-        if trade.calculate_open_quantity() - exit_quantity <= 0:
-            trade.status = 'Closed'
-        
+        record_change(request.user_id, 'trade', trade_id)
         db.session.commit()
+        publish_trade_change(request.user_id, trade.account_id, 'trade.closed' if closed else 'trade.exit_added', trade=trade)
+        publish_alerts(request.user_id, alerts)
         
         return jsonify({
             'message': 'Exit added successfully',
@@ -303,6 +406,9 @@ def add_trade_cost(trade_id):
         if not data or not data.get('cost_type') or not data.get('amount'):
             return jsonify({'error': 'Cost type and amount are required'}), 400
         
+        restore_trade(trade)
+        realized_before = realized_pnl_cents(trade)
+        
         cost = TradeCost(
             trade_id=trade_id,
             cost_type=data['cost_type'],
@@ -311,7 +417,12 @@ def add_trade_cost(trade_id):
         )
         
         db.session.add(cost)
+        db.session.flush()
+        alerts = record_realized_change(trade, realized_before)
+        record_change(request.user_id, 'trade', trade_id)
         db.session.commit()
+        publish_trade_change(request.user_id, trade.account_id, 'trade.cost_added', trade=trade)
+        publish_alerts(request.user_id, alerts)
         
         return jsonify({
             'message': 'Cost added successfully',
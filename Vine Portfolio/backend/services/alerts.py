@@ -0,0 +1,300 @@
+"""Max drawdown and profit target alerts, evaluated as exits and costs are recorded
+
+Each account keeps a running balance and peak (AccountAlertState). An exit or
+cost moves the balance by the change in its trade's realized P&L in one UPDATE,
+so evaluating the rules never rescans the account's trades. A rule that is
+crossed writes an AccountAlert in the same transaction as the change and is then
+quiet until the account is back on the safe side of it.
+
+Edits the running state cannot follow as a delta (closing or reopening a trade by
+hand, changing its direction or account, deletes, entries on closed trades, new
+capital or limits) mark the state stale, and the next evaluation replays the
+closed trades' P&L to reseed it. Only writes evaluate: the state is seeded when
+the account is created and re-evaluated by the routes that edit it, which also
+keep the account's stored current balance in step, while reads report it without
+storing anything. Committed alerts go out as 'account.alert' events on the
+user's channel and to any registered listeners.
+"""
+import logging
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import select, insert, update, func, case, event, inspect
+from sqlalchemy.orm import Session
+from src.models.user import db
+from src.models.account import Account
+from src.models.alert import AccountAlert, AccountAlertState
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.services.event_bus import get_event_bus, user_channel
+from src.services.trade_metrics import trade_metrics_subquery
+from src.services.money import to_cents, cents_to_decimal, percent_of
+
+logger = logging.getLogger(__name__)
+
+# Alert type -> state flag remembering that it has fired
+ALERT_FLAGS = {
+    'max_drawdown_breached': 'drawdown_alerted',
+    'profit_target_reached': 'target_alerted',
+}
+
+# Fill attributes that move a closed trade's net P&L
+FILL_FIELDS = {
+    TradeEntry: ('entry_price', 'quantity', 'trade_id'),
+    TradeExit: ('exit_price', 'quantity', 'trade_id'),
+    TradeCost: ('amount', 'trade_id'),
+}
+
+# Callbacks run with (user_id, alert dict) for every committed alert
+_listeners = []
+
+
+def add_alert_listener(callback):
+    """Call callback(user_id, alert) for each alert once it is committed, e.g. to send an email or a webhook"""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def remove_alert_listener(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def realized_pnl_cents(trade):
+    """What a trade adds to its account's balance: its net P&L once closed, nothing while open"""
+    return trade.calculate_net_pnl_cents() if trade.status == 'Closed' else 0
+
+
+def _seed(account_id):
+    """Balance and running peak of an account in cents, replayed from its closed trades in the order they closed"""
+    metrics = trade_metrics_subquery(select(Trade.id).where(Trade.account_id == account_id))
+    # As in the snapshots, a trade closed without exits counts from when it was created
+    closed_at = func.coalesce(metrics.c.closed_at, metrics.c.created_at)
+    initial_capital = db.session.execute(select(Account.initial_capital).where(Account.id == account_id)).scalar()
+    balance = peak = to_cents(initial_capital)
+    for net_pnl, in db.session.execute(
+        select(metrics.c.net_pnl).where(metrics.c.status == 'Closed').order_by(closed_at, metrics.c.trade_id)
+    ):
+        balance += to_cents(net_pnl or 0)
+        peak = max(peak, balance)
+    return balance, peak
+
+
+def _ensure_state(account_id):
+    """Create or reseed the account's running state when needed; returns True if it was (re)seeded"""
+    stale = db.session.execute(
+        select(AccountAlertState.stale).where(AccountAlertState.account_id == account_id)
+    ).scalar()
+    if stale is False:
+        return False
+    balance, peak = _seed(account_id)
+    if stale is None:
+        db.session.execute(insert(AccountAlertState.__table__).values(
+            account_id=account_id, balance_cents=balance, peak_cents=peak,
+            drawdown_alerted=False, target_alerted=False, stale=False, updated_at=datetime.utcnow()
+        ))
+    else:
+        # The flags survive a reseed so an ongoing breach is not reported again
+        db.session.execute(update(AccountAlertState.__table__).where(
+            AccountAlertState.account_id == account_id
+        ).values(balance_cents=balance, peak_cents=peak, stale=False, updated_at=datetime.utcnow()))
+    return True
+
+
+def _figures(balance, peak, initial_capital):
+    return {
+        'balance': cents_to_decimal(balance),
+        'peak_balance': cents_to_decimal(peak),
+        'drawdown': round((peak - balance) / peak * 100, 2) if peak > 0 else 0,
+        'pnl_percentage': round((balance - initial_capital) / initial_capital * 100, 2) if initial_capital else 0
+    }
+
+
+def _breaches(balance, peak, initial_capital, max_drawdown, profit_target):
+    """Which rules a balance and peak (cents) are past, by alert type"""
+    return {
+        'max_drawdown_breached': bool(max_drawdown) and balance <= peak - percent_of(peak, max_drawdown),
+        'profit_target_reached': bool(profit_target) and balance - initial_capital >= percent_of(initial_capital, profit_target)
+    }
+
+
+def _store_balance(account_id, balance):
+    """Keep the account's stored current balance in step with its running balance (cents)"""
+    db.session.execute(update(Account.__table__).where(Account.id == account_id).values(
+        current_balance=cents_to_decimal(balance)
+    ))
+    account = db.session.identity_map.get(db.session.identity_key(Account, account_id))
+    if account is not None:
+        db.session.expire(account, ['current_balance'])
+
+
+def _evaluate(account_id, trade_id=None):
+    """Check the account's rules against its running state; adds and returns the alerts for rules just crossed"""
+    state = db.session.execute(
+        select(AccountAlertState.balance_cents, AccountAlertState.peak_cents, AccountAlertState.drawdown_alerted,
+               AccountAlertState.target_alerted, Account.initial_capital, Account.current_balance, Account.max_drawdown,
+               Account.profit_target)
+        .join(Account, Account.id == AccountAlertState.account_id).where(AccountAlertState.account_id == account_id)
+    ).one()
+    balance, peak = state.balance_cents, state.peak_cents
+    if to_cents(state.current_balance) != balance:
+        _store_balance(account_id, balance)
+    initial_capital = to_cents(state.initial_capital)
+    breached = _breaches(balance, peak, initial_capital, state.max_drawdown, state.profit_target)
+    thresholds = {'max_drawdown_breached': state.max_drawdown, 'profit_target_reached': state.profit_target}
+
+    alerts = []
+    for alert_type, flag in ALERT_FLAGS.items():
+        hit = breached[alert_type]
+        if hit == getattr(state, flag):
+            continue
+        # Only the writer that flips the flag reports the crossing, however many evaluate it at once
+        column = getattr(AccountAlertState, flag)
+        flipped = db.session.execute(update(AccountAlertState.__table__).where(
+            AccountAlertState.account_id == account_id, column == (not hit)
+        ).values({flag: hit})).rowcount
+        if flipped and hit:
+            alert = AccountAlert(account_id=account_id, alert_type=alert_type, threshold=thresholds[alert_type],
+                                 trade_id=trade_id, **_figures(balance, peak, initial_capital))
+            db.session.add(alert)
+            alerts.append(alert)
+    return alerts
+
+
+def apply_balance_change(account_id, delta_cents, trade_id=None):
+    """Move the account's running balance by delta_cents (already flushed) and evaluate its rules; returns new alerts"""
+    if not _ensure_state(account_id):
+        if not delta_cents:
+            return []
+        balance = AccountAlertState.balance_cents + delta_cents
+        db.session.execute(update(AccountAlertState.__table__).where(
+            AccountAlertState.account_id == account_id
+        ).values(
+            balance_cents=balance,
+            peak_cents=case((balance > AccountAlertState.peak_cents, balance), else_=AccountAlertState.peak_cents),
+            updated_at=datetime.utcnow()
+        ))
+    # A reseed already counted the change
+    return _evaluate(account_id, trade_id)
+
+
+def record_realized_change(trade, realized_before):
+    """Evaluate the trade's account after an exit or cost; realized_before is realized_pnl_cents(trade) before it
+
+    Partial exits of an open trade leave the balance alone and cost nothing here.
+    """
+    if trade.status != 'Closed' and not realized_before:
+        return []
+    # The exit or cost was added by trade_id, so a collection loaded earlier would miss it
+    db.session.expire(trade, ['exits', 'costs'])
+    return apply_balance_change(trade.account_id, realized_pnl_cents(trade) - realized_before, trade.id)
+
+
+def refresh_alerts(account_id):
+    """Reseed the account's running state if an edit made it stale, then evaluate its rules; returns new alerts"""
+    return apply_balance_change(account_id, 0)
+
+
+def running_balances(account_ids):
+    """{account_id: (balance, peak)} in cents from the accounts' running states; writes nothing"""
+    account_ids = list(account_ids)
+    balances = {
+        row.account_id: (row.balance_cents, row.peak_cents) for row in db.session.execute(
+            select(AccountAlertState.account_id, AccountAlertState.balance_cents, AccountAlertState.peak_cents)
+            .where(AccountAlertState.account_id.in_(account_ids), AccountAlertState.stale.is_(False))
+        )
+    }
+    for account_id in account_ids:
+        if account_id not in balances:
+            # Not seeded yet or waiting to be reseeded: replay the figures, leaving the stored state to the next write
+            balances[account_id] = _seed(account_id)
+    return balances
+
+
+def account_alert_state(account_id):
+    """The account's running balance, peak and drawdown and the rules they are past; writes nothing"""
+    account = db.session.get(Account, account_id)
+    balance, peak = running_balances([account_id])[account_id]
+    initial_capital = to_cents(account.initial_capital)
+    figures = _figures(balance, peak, initial_capital)
+    breached = _breaches(balance, peak, initial_capital, account.max_drawdown, account.profit_target)
+    return {
+        'balance': float(figures['balance']),
+        'peak_balance': float(figures['peak_balance']),
+        'drawdown': figures['drawdown'],
+        'pnl_percentage': figures['pnl_percentage'],
+        'max_drawdown_breached': breached['max_drawdown_breached'],
+        'profit_target_reached': breached['profit_target_reached']
+    }
+
+
+def publish_alerts(user_id, alerts):
+    """Send committed alerts to the user's event channel and the registered listeners"""
+    if not alerts:
+        return
+    try:
+        bus = get_event_bus()
+        channel = user_channel(user_id)
+        for alert in alerts:
+            payload = alert.to_dict()
+            bus.publish(channel, 'account.alert', payload)
+            for listener in list(_listeners):
+                try:
+                    listener(user_id, payload)
+                except Exception:
+                    logger.exception('Alert listener %r failed', listener)
+    except Exception:
+        # Alerts are stored with the change; delivery is best effort
+        logger.exception('Failed to publish alerts for user %s', user_id)
+
+
+def _changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in fields)
+
+
+def _closed_changed(trade):
+    """Whether an edit moved the trade into or out of Closed, which adds or removes its P&L"""
+    history = inspect(trade).attrs.status.history
+    return history.has_changes() and ('Closed' in history.added) != ('Closed' in history.deleted)
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_alert_state_stale(session, flush_context):
+    """Flag running states that an edit moved in a way record_realized_change did not account for"""
+    stale = set()
+    trade_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Account):
+            if obj in session.dirty and _changed(obj, ('initial_capital', 'max_drawdown', 'profit_target')):
+                stale.add(obj.id)
+        elif isinstance(obj, Trade):
+            if obj in session.dirty:
+                # Exits close trades in the ledger's own UPDATE and record the P&L as a delta, so only
+                # a hand-made close or reopen, which moves a trade that may have closed long ago, is left
+                if _closed_changed(obj) or _changed(obj, ('trade_type', 'account_id')):
+                    history = inspect(obj).attrs.account_id.history
+                    stale.update(chain(history.sum(), history.deleted))
+            elif obj.status == 'Closed':
+                stale.add(obj.account_id)
+        elif type(obj) in FILL_FIELDS:
+            # New exits and costs are recorded as deltas by the routes that add them
+            if obj in session.new and not isinstance(obj, TradeEntry):
+                continue
+            if obj in session.dirty and not _changed(obj, FILL_FIELDS[type(obj)]):
+                continue
+            history = inspect(obj).attrs.trade_id.history
+            trade_ids.update(chain(history.sum(), history.deleted) if obj in session.dirty else [obj.trade_id])
+    stale.discard(None)
+    trade_ids.discard(None)
+    if not stale and not trade_ids:
+        return
+
+    connection = session.connection()
+    if trade_ids:
+        # Fills of open trades do not move the balance
+        stale.update(connection.execute(
+            select(Trade.account_id).where(Trade.id.in_(trade_ids), Trade.status == 'Closed')
+        ).scalars())
+    if stale:
+        connection.execute(update(AccountAlertState.__table__).where(
+            AccountAlertState.account_id.in_(stale)
+        ).values(stale=True))
@@ -0,0 +1,223 @@
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+from sqlalchemy import select, func, bindparam
+from src.models.user import db
+from src.models.account import Account
+from src.models.trade import Trade
+from src.models.risk_type import TradeStrategyTag
+from src.services.trade_metrics import trade_metrics_subquery, archived_within
+from src.services.money import to_cents, from_cents
+
+LIST_FILTERS = ('account_ids', 'instruments', 'strategy_tag_ids', 'risk_type_ids')
+VALUE_FILTERS = ('start_date', 'end_date', 'trade_type', 'status')
+DATE_FIELDS = ('opened_at', 'closed_at')
+TRADE_TYPES = ('long', 'short')  # Compared case-insensitively
+STATUSES = ('Open', 'Closed', 'Pending', 'Canceled')
+
+# Statements keyed by filter shape; reusing the same statement object keeps
+# SQLAlchemy's compiled cache warm, so each shape is compiled only once
+_plan_cache = {}
+_plan_lock = Lock()
+
+
+def _is_bare_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_filters(data):
+    """Validate raw request filters and normalise them into bind parameter values"""
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError('Filters must be a JSON object')
+    filters = {}
+
+    for key in LIST_FILTERS:
+        values = data.get(key)
+        if values in (None, '', []):
+            continue
+        if isinstance(values, str):
+            values = [v for v in values.split(',') if v]
+        if not isinstance(values, list):
+            raise ValueError(f'{key} must be a list')
+        if key == 'instruments':
+            filters[key] = [str(v).upper() for v in values]
+        else:
+            try:
+                filters[key] = [int(v) for v in values]
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must contain integer ids')
+
+    for key in ('start_date', 'end_date'):
+        if data.get(key):
+            try:
+                filters[key] = datetime.fromisoformat(data[key])
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be an ISO date')
+    if 'end_date' in filters:
+        # end_date is bound as an exclusive limit: a bare date covers the whole day, a time includes that instant
+        if _is_bare_date(data['end_date']):
+            filters['end_date'] = datetime.combine(filters['end_date'].date() + timedelta(days=1), time.min)
+        else:
+            filters['end_date'] += timedelta(microseconds=1)
+
+    if data.get('trade_type'):
+        filters['trade_type'] = str(data['trade_type']).lower()
+        if filters['trade_type'] not in TRADE_TYPES:
+            raise ValueError('trade_type must be Long or Short')
+    if data.get('status'):
+        if data['status'] not in STATUSES:
+            raise ValueError(f'status must be one of {", ".join(STATUSES)}')
+        filters['status'] = data['status']
+
+    date_field = data.get('date_field', 'opened_at')
+    if date_field not in DATE_FIELDS:
+        raise ValueError(f'date_field must be one of {", ".join(DATE_FIELDS)}')
+    filters['date_field'] = date_field
+
+    return filters
+
+
+def filter_shape(filters):
+    """Which filters are present; list lengths are not part of the shape thanks to expanding parameters"""
+    present = tuple(key for key in LIST_FILTERS + VALUE_FILTERS if key in filters)
+    return present + (filters.get('date_field', 'opened_at'),)
+
+
+def _build_plan(shape):
+    """Build the filtered per-trade metrics statement for one filter shape"""
+    scope = select(Trade.id).join(Account, Account.id == Trade.account_id).where(
+        Account.user_id == bindparam('user_id')
+    )
+    if 'account_ids' in shape:
+        scope = scope.where(Trade.account_id.in_(bindparam('account_ids', expanding=True)))
+    if 'instruments' in shape:
+        scope = scope.where(func.upper(Trade.instrument).in_(bindparam('instruments', expanding=True)))
+    if 'risk_type_ids' in shape:
+        scope = scope.where(Trade.risk_type_id.in_(bindparam('risk_type_ids', expanding=True)))
+    if 'trade_type' in shape:
+        scope = scope.where(func.lower(Trade.trade_type) == bindparam('trade_type'))
+    if 'status' in shape:
+        scope = scope.where(Trade.status == bindparam('status'))
+    if 'strategy_tag_ids' in shape:
+        tagged = select(TradeStrategyTag.trade_id).where(
+            TradeStrategyTag.strategy_tag_id.in_(bindparam('strategy_tag_ids', expanding=True))
+        )
+        scope = scope.where(Trade.id.in_(tagged))
+    if 'start_date' in shape or 'end_date' in shape:
+        scope = scope.where(archived_within(
+            shape[-1],
+            bindparam('start_date') if 'start_date' in shape else None,
+            bindparam('end_date') if 'end_date' in shape else None
+        ))
+
+    metrics = trade_metrics_subquery(scope)
+    date_column = metrics.c[shape[-1]]
+
+    query = select(metrics)
+    if 'start_date' in shape:
+        query = query.where(date_column >= bindparam('start_date'))
+    if 'end_date' in shape:
+        query = query.where(date_column < bindparam('end_date'))
+    return query.order_by(metrics.c.closed_at, metrics.c.trade_id)
+
+
+def get_plan(filters):
+    """Return the cached statement for the shape of these filters, building it on first use"""
+    shape = filter_shape(filters)
+    plan = _plan_cache.get(shape)
+    if plan is None:
+        with _plan_lock:
+            plan = _plan_cache.get(shape)
+            if plan is None:
+                plan = _build_plan(shape)
+                _plan_cache[shape] = plan
+    return plan
+
+
+def run_query(user_id, filters):
+    """Execute the filtered metrics query and return one row per matching trade"""
+    params = {key: value for key, value in filters.items() if key != 'date_field'}
+    params['user_id'] = user_id
+    return db.session.execute(get_plan(filters), params).all()
+
+
+def _breakdown(rows, key):
+    """Trades, P&L and win rate of closed trades grouped by one column"""
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(getattr(row, key), {'trades': 0, 'pnl': 0, 'wins': 0})
+        net_pnl = to_cents(row.net_pnl)
+        group['trades'] += 1
+        group['pnl'] += net_pnl
+        if net_pnl > 0:
+            group['wins'] += 1
+
+    return [{
+        key: value,
+        'trades': data['trades'],
+        'pnl': from_cents(data['pnl']),
+        'win_rate': round(data['wins'] / data['trades'] * 100, 2) if data['trades'] else 0
+    } for value, data in groups.items()]
+
+
+def summarize(rows):
+    """Compute the account analytics metrics from per-trade metric rows"""
+    closed = [row for row in rows if row.status == 'Closed']
+    # Per-trade P&L in cents, so the totals below are exact
+    net_pnl = {row.trade_id: to_cents(row.net_pnl) for row in closed}
+    wins = [row for row in closed if net_pnl[row.trade_id] > 0]
+    losses = [row for row in closed if net_pnl[row.trade_id] <= 0]
+
+    win_rate = (len(wins) / len(closed) * 100) if closed else 0
+    total_wins = from_cents(sum(net_pnl[row.trade_id] for row in wins))
+    total_losses = abs(from_cents(sum(net_pnl[row.trade_id] for row in losses)))
+    profit_factor = total_wins / total_losses if total_losses > 0 else 0
+
+    r_multiples = [row.r_multiple for row in closed if row.r_multiple != 0]
+    avg_r_multiple = sum(r_multiples) / len(r_multiples) if r_multiples else 0
+
+    avg_win = total_wins / len(wins) if wins else 0
+    avg_loss = total_losses / len(losses) if losses else 0
+    expectancy = (win_rate / 100 * avg_win) - ((100 - win_rate) / 100 * avg_loss)
+
+    # Rows are ordered by close date, so streaks follow the order trades were closed
+    max_consecutive_wins = max_consecutive_losses = current_wins = current_losses = 0
+    for row in closed:
+        if net_pnl[row.trade_id] > 0:
+            current_wins += 1
+            current_losses = 0
+            max_consecutive_wins = max(max_consecutive_wins, current_wins)
+        else:
+            current_losses += 1
+            current_wins = 0
+            max_consecutive_losses = max(max_consecutive_losses, current_losses)
+
+    best = max(closed, key=lambda row: net_pnl[row.trade_id]) if closed else None
+    worst = min(closed, key=lambda row: net_pnl[row.trade_id]) if closed else None
+
+    return {
+        'analytics': {
+            'total_trades': len(rows),
+            'closed_trades': len(closed),
+            'open_trades': len([row for row in rows if row.status == 'Open']),
+            'total_pnl': from_cents(sum(net_pnl.values())),
+            'total_gross_pnl': from_cents(sum(to_cents(row.gross_pnl) for row in closed)),
+            'total_costs': from_cents(sum(to_cents(row.total_costs) for row in rows)),
+            'win_rate': round(win_rate, 2),
+            'profit_factor': round(profit_factor, 2),
+            'avg_r_multiple': round(avg_r_multiple, 2),
+            'expectancy': round(expectancy, 2),
+            'max_consecutive_wins': max_consecutive_wins,
+            'max_consecutive_losses': max_consecutive_losses,
+            'best_trade_id': best.trade_id if best else None,
+            'worst_trade_id': worst.trade_id if worst else None
+        },
+        'performance_by_account': _breakdown(closed, 'account_id'),
+        'performance_by_instrument': _breakdown(closed, 'instrument'),
+        'performance_by_risk_type': _breakdown(closed, 'risk_type_id')
+    }
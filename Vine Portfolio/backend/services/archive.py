@@ -0,0 +1,166 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, exists
+from src.models.user import db
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.archive import TradeSummary, TradeArchive
+from src.services.serialization import load_trade_children
+from src.services.lot_matching import rebuild_lots
+from src.services.sharding import in_each_shard
+from src.services.search_index import reindex_trades
+from src.services.trade_metrics import trade_metrics_subquery
+from src.services.money import PRICE_DIGITS, QUANTITY_DIGITS, trade_figures, fixed_to_decimal, cents_to_decimal
+
+DATE_FIELDS = ('entry_date', 'exit_date', 'created_at')
+
+# Trade fields whose change makes the frozen summary wrong
+SUMMARY_FIELDS = ('trade_type', 'status', 'stop_loss_price')
+
+
+def archive_cutoff(horizon_days):
+    return datetime.utcnow() - timedelta(days=horizon_days)
+
+
+def archivable_trades(cutoff, account_ids=None, limit=None):
+    """Ids of closed, not yet archived trades whose last exit happened before cutoff"""
+    last_exits = select(
+        TradeExit.trade_id.label('trade_id'),
+        func.max(TradeExit.exit_date).label('closed_at')
+    ).group_by(TradeExit.trade_id).subquery()
+
+    query = select(Trade.id).join(last_exits, last_exits.c.trade_id == Trade.id).where(
+        Trade.status == 'Closed',
+        last_exits.c.closed_at < cutoff,
+        ~exists().where(TradeSummary.trade_id == Trade.id)
+    ).order_by(Trade.id)
+    if account_ids:
+        query = query.where(Trade.account_id.in_(account_ids))
+    if limit:
+        query = query.limit(limit)
+    return list(db.session.execute(query).scalars())
+
+
+def archive_trades(trade_ids):
+    """Freeze the metrics of these trades into summary rows and move their children into archive rows"""
+    if not trade_ids:
+        return 0
+    metrics = trade_metrics_subquery(select(Trade.id).where(Trade.id.in_(trade_ids)))
+    rows = db.session.execute(select(metrics)).all()
+    entries, exits, costs, _ = load_trade_children(trade_ids)
+
+    summaries, archives = [], []
+    for row in rows:
+        trade_entries, trade_exits = entries.get(row.trade_id, ()), exits.get(row.trade_id, ())
+        # Frozen figures come from the exact fixed-point kernel, like the live Trade calculations
+        figures = trade_figures(
+            row.trade_type.lower() == 'long', row.stop_loss_price,
+            [entry.entry_price for entry in trade_entries], [entry.quantity for entry in trade_entries],
+            [exit.exit_price for exit in trade_exits], [exit.quantity for exit in trade_exits],
+            [cost.amount for cost in costs.get(row.trade_id, ())]
+        )
+        summaries.append({
+            'trade_id': row.trade_id,
+            'account_id': row.account_id,
+            'opened_at': row.opened_at,
+            'closed_at': row.closed_at,
+            'entry_qty': fixed_to_decimal(figures['entry_qty'], QUANTITY_DIGITS),
+            'avg_entry': fixed_to_decimal(figures['avg_entry'], PRICE_DIGITS),
+            'exit_qty': fixed_to_decimal(figures['exit_qty'], QUANTITY_DIGITS),
+            'avg_exit': fixed_to_decimal(figures['avg_exit'], PRICE_DIGITS),
+            'total_costs': cents_to_decimal(figures['total_costs']),
+            'gross_pnl': cents_to_decimal(figures['gross_pnl']),
+            'net_pnl': cents_to_decimal(figures['net_pnl']),
+            'risk_amount': cents_to_decimal(figures['risk_amount']),
+            'r_multiple': figures['r_multiple']
+        })
+        archives.append({
+            'trade_id': row.trade_id,
+            'account_id': row.account_id,
+            'closed_at': row.closed_at,
+            'payload': TradeArchive.pack(
+                [dto.as_dict() for dto in entries.get(row.trade_id, ())],
+                [dto.as_dict() for dto in exits.get(row.trade_id, ())],
+                [dto.as_dict() for dto in costs.get(row.trade_id, ())]
+            )
+        })
+
+    db.session.execute(insert(TradeSummary), summaries)
+    db.session.execute(insert(TradeArchive), archives)
+    for model in (TradeEntry, TradeExit, TradeCost):
+        db.session.execute(delete(model).where(model.trade_id.in_(trade_ids)), execution_options={'synchronize_session': False})
+    # Bulk statements skip the session's index sync; the exit reasons now come from the archive rows
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        reindex_trades(connection, trade_ids)
+    return len(rows)
+
+
+def archive_closed_trades(horizon_days=None, account_ids=None, batch_size=500):
+    """Archive every closed trade older than the horizon, committing one batch at a time"""
+    if horizon_days is None:
+        horizon_days = int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365'))
+    cutoff = archive_cutoff(horizon_days)
+    archived = 0
+    while True:
+        trade_ids = archivable_trades(cutoff, account_ids, batch_size)
+        if not trade_ids:
+            break
+        archived += archive_trades(trade_ids)
+        db.session.commit()
+    return archived
+
+
+def _unpack(row, keep_id=True):
+    """Insert values for a child row stored in its to_dict form"""
+    values = {key: value for key, value in row.items() if keep_id or key != 'id'}
+    for key in DATE_FIELDS:
+        if values.get(key):
+            values[key] = datetime.fromisoformat(values[key])
+    return values
+
+
+def _restore_rows(model, rows):
+    """Insert archived child rows under their old ids; False if one of them was handed out again meanwhile"""
+    # SQLite reuses the highest freed rowid, so a fill added after archiving can hold one of these ids
+    taken = set(db.session.execute(select(model.id).where(model.id.in_([row['id'] for row in rows]))).scalars())
+    kept = [_unpack(row) for row in rows if row['id'] not in taken]
+    moved = [_unpack(row, keep_id=False) for row in rows if row['id'] in taken]
+    for values in (kept, moved):
+        if values:
+            db.session.execute(insert(model), values)
+    return not moved
+
+
+def restore_trade(trade):
+    """Move an archived trade's entries, exits and costs back into the hot tables so it can be changed"""
+    if not trade.summary:
+        return False
+    children = trade.archive.load()
+    same_ids = True
+    for model, key in ((TradeEntry, 'entries'), (TradeExit, 'exits'), (TradeCost, 'costs')):
+        if children[key]:
+            same_ids = _restore_rows(model, children[key]) and same_ids
+
+    db.session.delete(trade.summary)
+    db.session.delete(trade.archive)
+    db.session.flush()
+    db.session.expire(trade, ['entries', 'exits', 'costs', 'summary', 'archive'])
+    # Stored lots point at fill ids; only fills that had to take new ids need them matched again
+    if not same_ids:
+        rebuild_lots([trade.id])
+    return True
+
+
+def init_archival(app):
+    """Archive old closed trades as part of the daily maintenance run; ARCHIVE_HORIZON_DAYS=0 turns it off"""
+    app.config.setdefault('ARCHIVE_HORIZON_DAYS', int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365')))
+    horizon_days = app.config['ARCHIVE_HORIZON_DAYS']
+
+    @app.cli.command('archive-trades')
+    def archive_trades_command():
+        """Archive closed trades older than ARCHIVE_HORIZON_DAYS"""
+        print(f'Archived {in_each_shard(lambda: archive_closed_trades(horizon_days))} trades')
+
+    scheduler = app.extensions.get('snapshot_scheduler')
+    if horizon_days > 0 and scheduler is not None:
+        scheduler.add_task('trade archival', lambda: archive_closed_trades(horizon_days))
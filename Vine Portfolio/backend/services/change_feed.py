@@ -0,0 +1,75 @@
+from sqlalchemy.orm import selectinload
+from src.models.user import db
+from src.models.account import Account
+from src.models.trade import Trade
+from src.models.risk_type import RiskType, StrategyTag
+from src.models.change_log import ChangeLog
+
+# Entities clients can replicate, with the options that load each payload in bulk
+SYNCED_ENTITIES = {
+    'account': (Account, ()),
+    'trade': (Trade, (
+        selectinload(Trade.entries),
+        selectinload(Trade.exits),
+        selectinload(Trade.costs),
+        selectinload(Trade.trade_tags)
+    )),
+    'risk_type': (RiskType, ()),
+    'strategy_tag': (StrategyTag, ())
+}
+
+
+def record_change(user_id, entity, entity_id, operation='upsert'):
+    """Add a change-log row to the current session so it commits with the mutation"""
+    db.session.add(ChangeLog(user_id=user_id, entity=entity, entity_id=entity_id, operation=operation))
+
+
+def record_account_deleted(user_id, account):
+    """Tombstone an account and every trade removed with it by the cascade"""
+    for trade_id, in db.session.query(Trade.id).filter_by(account_id=account.id):
+        record_change(user_id, 'trade', trade_id, 'delete')
+    record_change(user_id, 'account', account.id, 'delete')
+
+
+def changes_since(user_id, cursor=0, limit=500):
+    """Compacted changes after a cursor: the latest operation per entity, in cursor order"""
+    rows = ChangeLog.query.filter(
+        ChangeLog.user_id == user_id,
+        ChangeLog.id > cursor
+    ).order_by(ChangeLog.id).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Keep only the last change per entity; dict order then follows the latest cursor
+    latest = {}
+    for row in rows:
+        key = (row.entity, row.entity_id)
+        latest.pop(key, None)
+        latest[key] = row
+
+    # Load the payloads of all upserted entities with one query per entity type
+    payloads = {}
+    for entity, (model, options) in SYNCED_ENTITIES.items():
+        ids = [entity_id for (kind, entity_id), row in latest.items() if kind == entity and row.operation == 'upsert']
+        if ids:
+            for obj in model.query.options(*options).filter(model.id.in_(ids)):
+                payloads[(entity, obj.id)] = obj.to_dict()
+
+    changes = []
+    for key, row in latest.items():
+        change = {'cursor': row.id, 'entity': row.entity, 'id': row.entity_id}
+        data = payloads.get(key)
+        if row.operation == 'upsert' and data is not None:
+            change['op'] = 'upsert'
+            change['data'] = data
+        else:
+            # Entities deleted after this change was logged come back as tombstones too
+            change['op'] = 'delete'
+        changes.append(change)
+
+    return {
+        'changes': changes,
+        'cursor': rows[-1].id if rows else cursor,
+        'has_more': has_more
+    }
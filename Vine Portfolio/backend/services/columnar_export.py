@@ -0,0 +1,181 @@
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from flask import send_file
+from sqlalchemy import select, Boolean, Date, DateTime, Float, Integer, Numeric
+from src.models.user import db
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.archive import TradeArchive
+
+# Optional; columnar exports are unavailable without it
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}  # format name -> file extension
+BATCH_SIZE = 10000  # Rows per cursor fetch, record batch and Parquet row group
+
+# Low-cardinality text columns written dictionary-encoded
+DICTIONARY_COLUMNS = {'instrument', 'trade_type', 'status', 'cost_type', 'exit_reason'}
+
+# Table name in the bundle, model, and the key of its rows inside an archive payload
+TABLES = (
+    ('trades', Trade, None),
+    ('entries', TradeEntry, 'entries'),
+    ('exits', TradeExit, 'exits'),
+    ('costs', TradeCost, 'costs'),
+)
+
+
+def columnar_available():
+    return pa is not None
+
+
+def _arrow_type(column):
+    column_type = column.type
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, Numeric):
+        return pa.decimal128(column_type.precision, column_type.scale)
+    if isinstance(column_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, Date):
+        return pa.date32()
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if column.name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def table_schema(model):
+    """Arrow schema mirroring a model's columns: Numeric as decimal128, DateTime as timestamp[us]"""
+    return pa.schema([
+        pa.field(column.name, _arrow_type(column), nullable=column.nullable)
+        for column in model.__table__.columns
+    ])
+
+
+class _DictionaryEncoder:
+    """Keeps one growing dictionary per column, so later batches only append to it"""
+
+    def __init__(self):
+        self.values = []
+        self.indices = {}
+
+    def encode(self, values):
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(None)
+                continue
+            code = self.indices.get(value)
+            if code is None:
+                code = self.indices[value] = len(self.values)
+                self.values.append(value)
+            codes.append(code)
+        return pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()), pa.array(self.values, pa.string()))
+
+
+def _to_batch(rows, schema, encoders):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(encoders.setdefault(field.name, _DictionaryEncoder()).encode(values))
+        elif pa.types.is_decimal(field.type):
+            # Numerics load as floats; the cast rounds them back to the column scale
+            arrays.append(pa.array(values, pa.float64()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _from_archive(row, schema):
+    """A child row stored in its to_dict form, converted back to column values"""
+    values = []
+    for field in schema:
+        value = row.get(field.name)
+        if value is not None and pa.types.is_timestamp(field.type):
+            value = datetime.fromisoformat(value)
+        values.append(value)
+    return tuple(values)
+
+
+def _record_batches(model, archive_key, account_ids, schema):
+    """Record batches fetched straight from a server-side cursor, followed by archived rows"""
+    encoders = {}
+    table = model.__table__
+    trade_ids = select(Trade.id).where(Trade.account_id.in_(account_ids))
+    scope = table.c.account_id.in_(account_ids) if model is Trade else table.c.trade_id.in_(trade_ids)
+    query = select(*table.columns).where(scope).order_by(table.c.id).execution_options(yield_per=BATCH_SIZE)
+    for rows in db.session.execute(query).partitions():
+        yield _to_batch(rows, schema, encoders)
+
+    if archive_key is None:
+        return
+    archived = select(TradeArchive.payload).where(TradeArchive.account_id.in_(account_ids)).order_by(
+        TradeArchive.trade_id
+    ).execution_options(yield_per=BATCH_SIZE)
+    pending = []
+    for payload, in db.session.execute(archived):
+        pending.extend(_from_archive(row, schema) for row in TradeArchive(payload=payload).load()[archive_key])
+        if len(pending) >= BATCH_SIZE:
+            yield _to_batch(pending, schema, encoders)
+            pending = []
+    if pending:
+        yield _to_batch(pending, schema, encoders)
+
+
+def _write_table(path, file_format, schema, batches):
+    if file_format == 'parquet':
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for batch in batches:
+                # Each batch becomes one row group
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+    else:
+        options = ipc.IpcWriteOptions(compression='zstd', emit_dictionary_deltas=True)
+        with pa.OSFile(path, 'wb') as sink, ipc.new_file(sink, schema, options=options) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+
+def write_columnar_export(output, account_ids, file_format='parquet'):
+    """Write trades, entries, exits and costs of the accounts as one zip of columnar files
+
+    output is a path or a writable binary file object. Returns row counts per table.
+    """
+    if pa is None:
+        raise RuntimeError('Columnar export requires pyarrow')
+    extension = FORMATS[file_format]
+    counts = {}
+    with tempfile.TemporaryDirectory() as directory, zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as bundle:
+        for name, model, archive_key in TABLES:
+            schema = table_schema(model)
+            counts[name] = 0
+
+            def counted(batches):
+                for batch in batches:
+                    counts[name] += batch.num_rows
+                    yield batch
+
+            path = os.path.join(directory, f'{name}.{extension}')
+            _write_table(path, file_format, schema, counted(_record_batches(model, archive_key, account_ids, schema)))
+            bundle.write(path, f'{name}.{extension}')
+    return counts
+
+
+def columnar_export_response(accounts, file_format):
+    """Download response with the accounts' columnar export bundle"""
+    output = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+    write_columnar_export(output, [account.id for account in accounts], file_format)
+    output.seek(0)
+    name = accounts[0].name if len(accounts) == 1 else 'portfolio'
+    return send_file(output, mimetype='application/zip', as_attachment=True,
+                     download_name=f'{name}_trades_{file_format}.zip')
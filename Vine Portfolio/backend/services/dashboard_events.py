@@ -0,0 +1,93 @@
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from sqlalchemy import select, func, case
+from src.models.user import db
+from src.models.account import Account
+from src.services.event_bus import get_event_bus, user_channel
+from src.services.trade_metrics import user_trade_scope, trade_metrics_subquery
+
+logger = logging.getLogger(__name__)
+
+# Last balance published per (user, account), so unchanged balances are not re-sent. Account ids
+# are only unique within a shard, hence the user in the key; the least recently published go first
+PUBLISHED_BALANCES_LIMIT = int(os.environ.get('PUBLISHED_BALANCES_LIMIT', '10000'))
+_published_balances = OrderedDict()
+_published_lock = Lock()
+
+
+def _balance_changed(user_id, account_id, balance):
+    """Remember balance as the last one published for the account; False if it already was"""
+    key = (user_id, account_id)
+    with _published_lock:
+        if _published_balances.get(key) == balance:
+            _published_balances.move_to_end(key)
+            return False
+        _published_balances[key] = balance
+        _published_balances.move_to_end(key)
+        while len(_published_balances) > PUBLISHED_BALANCES_LIMIT:
+            _published_balances.popitem(last=False)
+    return True
+
+
+def account_stats(user_id, account_id):
+    """Balance and headline stats for one account from a single aggregate query"""
+    metrics = trade_metrics_subquery(user_trade_scope(user_id, [account_id]))
+    is_closed = metrics.c.status == 'Closed'
+    row = db.session.execute(select(
+        func.count(metrics.c.trade_id).label('total_trades'),
+        func.sum(case((is_closed, 1), else_=0)).label('closed_trades'),
+        func.sum(case((metrics.c.status == 'Open', 1), else_=0)).label('open_trades'),
+        func.sum(case((is_closed & (metrics.c.net_pnl > 0), 1), else_=0)).label('wins'),
+        func.sum(case((is_closed, metrics.c.net_pnl), else_=0.0)).label('total_pnl')
+    )).one()
+
+    account = db.session.get(Account, account_id)
+    initial_capital = float(account.initial_capital)
+    total_pnl = row.total_pnl or 0
+    closed_trades = row.closed_trades or 0
+
+    return {
+        'account_id': account_id,
+        'current_balance': round(initial_capital + total_pnl, 2),
+        'pnl': round(total_pnl, 2),
+        'pnl_percentage': round(total_pnl / initial_capital * 100, 2) if initial_capital else 0,
+        'total_trades': row.total_trades,
+        'closed_trades': closed_trades,
+        'open_trades': row.open_trades or 0,
+        'win_rate': round((row.wins or 0) / closed_trades * 100, 2) if closed_trades else 0
+    }
+
+
+def trade_summary(trade):
+    """The few trade fields a dashboard needs to patch its state"""
+    return {
+        'trade_id': trade.id,
+        'account_id': trade.account_id,
+        'instrument': trade.instrument,
+        'status': trade.status,
+        'open_quantity': trade.calculate_open_quantity(),
+        'net_pnl': round(trade.calculate_net_pnl(), 2)
+    }
+
+
+def publish_trade_change(user_id, account_id, event_type, trade=None, trade_id=None):
+    """Publish a trade delta followed by the account balance and stats it affects"""
+    try:
+        bus = get_event_bus()
+        channel = user_channel(user_id)
+        bus.publish(channel, event_type, trade_summary(trade) if trade else {'trade_id': trade_id, 'account_id': account_id})
+
+        stats = account_stats(user_id, account_id)
+        if _balance_changed(user_id, account_id, stats['current_balance']):
+            bus.publish(channel, 'account.balance_changed', {
+                'account_id': account_id,
+                'current_balance': stats['current_balance'],
+                'pnl': stats['pnl'],
+                'pnl_percentage': stats['pnl_percentage']
+            })
+        bus.publish(channel, 'stats.updated', stats)
+    except Exception:
+        # Events are best effort; the write they describe has already been committed
+        logger.exception('Failed to publish %s for account %s', event_type, account_id)
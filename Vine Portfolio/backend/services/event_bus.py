@@ -0,0 +1,105 @@
+import itertools
+import queue
+from collections import deque, namedtuple
+from threading import Lock
+
+Event = namedtuple('Event', ['id', 'channel', 'type', 'data'])
+
+
+class Subscription:
+    """A subscriber's view of one channel; events are buffered until read"""
+
+    def __init__(self, bus, channel, max_pending=256):
+        self.bus = bus
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def deliver(self, event):
+        """Queue an event, dropping the oldest one if the subscriber has fallen behind"""
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Wait for the next event, returning None if the timeout expires"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Publish/subscribe interface; replace the local bus with a cross-process one via set_event_bus"""
+
+    def publish(self, channel, event_type, data):
+        raise NotImplementedError
+
+    def subscribe(self, channel, last_event_id=None):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class LocalEventBus(EventBus):
+    """In-process event bus keeping a short replay history per channel for reconnecting clients"""
+
+    def __init__(self, history_size=100):
+        self.history_size = history_size
+        self._ids = itertools.count(1)
+        self._subscribers = {}
+        self._history = {}
+        self._lock = Lock()
+
+    def publish(self, channel, event_type, data):
+        with self._lock:
+            event = Event(next(self._ids), channel, event_type, data)
+            self._history.setdefault(channel, deque(maxlen=self.history_size)).append(event)
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, channel, last_event_id=None):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            if last_event_id is not None:
+                for event in self._history.get(channel, ()):
+                    if event.id > last_event_id:
+                        subscription.deliver(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+_event_bus = LocalEventBus()
+
+
+def get_event_bus():
+    return _event_bus
+
+
+def set_event_bus(bus):
+    """Swap the process-wide event bus, e.g. for one backed by a message broker"""
+    global _event_bus
+    _event_bus = bus
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
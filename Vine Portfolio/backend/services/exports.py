@@ -0,0 +1,76 @@
+from src.models.account import Account
+from src.models.trade import Trade
+from src.services.jobs import register_job, JobError
+from src.services.reference_cache import owns_accounts
+
+EXPORT_HEADER = [
+    'Trade ID', 'Trade Name', 'Instrument', 'Type', 'Status',
+    'Entry Date', 'Entry Price', 'Exit Date', 'Exit Price',
+    'Quantity', 'Stop Loss', 'Take Profit', 'Gross P&L',
+    'Net P&L', 'Total Costs', 'R-Multiple', 'Notes'
+]
+
+
+def _first_entry_and_exit(trade):
+    """First entry and exit in their to_dict form, read from the archive row for archived trades"""
+    if trade.summary:
+        children = trade.archive.load()
+        entries, exits = children['entries'], children['exits']
+    else:
+        entries = [trade.entries[0].to_dict()] if trade.entries else []
+        exits = [trade.exits[0].to_dict()] if trade.exits else []
+    return (entries[0] if entries else None), (exits[0] if exits else None)
+
+
+def account_export(account, progress=None):
+    """CSV rows for every trade of an account; progress(done, total) is called as trades are processed"""
+    trades = Trade.query.filter_by(account_id=account.id).all()
+    
+    # Prepare CSV data
+    csv_data = [list(EXPORT_HEADER)]
+    
+    for number, trade in enumerate(trades):
+        # Get first entry and exit for simplicity
+        first_entry, first_exit = _first_entry_and_exit(trade)
+        
+        csv_data.append([
+            trade.id,
+            trade.trade_name or '',
+            trade.instrument,
+            trade.trade_type,
+            trade.status,
+            first_entry['entry_date'] if first_entry else '',
+            first_entry['entry_price'] if first_entry else '',
+            first_exit['exit_date'] if first_exit else '',
+            first_exit['exit_price'] if first_exit else '',
+            first_entry['quantity'] if first_entry else '',
+            float(trade.stop_loss_price) if trade.stop_loss_price else '',
+            float(trade.take_profit_price) if trade.take_profit_price else '',
+            round(trade.calculate_gross_pnl(), 2),
+            round(trade.calculate_net_pnl(), 2),
+            round(trade.calculate_total_costs(), 2),
+            round(trade.calculate_r_multiple(), 2),
+            trade.notes or ''
+        ])
+        if progress:
+            progress(number + 1, len(trades))
+    
+    return {
+        'csv_data': csv_data,
+        'filename': f'{account.name}_trades_export.csv'
+    }
+
+
+def _validate_export(user_id, params):
+    account_id = params.get('account_id')
+    if not isinstance(account_id, int) or not owns_accounts(user_id, [account_id]):
+        raise ValueError('Account not found')
+
+
+@register_job('export_account_data', validate=_validate_export)
+def export_account_data_job(context):
+    """Background version of the account CSV export"""
+    account = Account.query.filter_by(id=context.params['account_id'], user_id=context.user_id).first()
+    if not account:
+        raise JobError('Account not found')
+    return account_export(account, progress=context.progress)
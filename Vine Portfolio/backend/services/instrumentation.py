@@ -0,0 +1,241 @@
+import hmac
+import logging
+import os
+import re
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+from flask import g, request, has_request_context, jsonify, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _labels(self.label_names, label_values, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+                bucket_labels = _labels(self.label_names, label_values, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {count}')
+        return lines
+
+
+class CounterMetric:
+    """Monotonic counter keyed by label values"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+ROUTE_LABELS = ('method', 'route', 'status')
+
+request_duration = Histogram('http_request_duration_seconds', 'Request latency', ROUTE_LABELS, LATENCY_BUCKETS)
+request_sql_statements = Histogram('http_request_sql_statements', 'SQL statements executed per request', ROUTE_LABELS, COUNT_BUCKETS)
+request_sql_duration = Histogram('http_request_sql_duration_seconds', 'Cumulative SQL time per request', ROUTE_LABELS, LATENCY_BUCKETS)
+response_size = Histogram('http_response_size_bytes', 'Response body size', ROUTE_LABELS, SIZE_BUCKETS)
+slow_queries = CounterMetric('sql_slow_queries_total', 'SQL statements slower than the slow-query threshold', ('route',))
+n_plus_one = CounterMetric('sql_n_plus_one_total', 'Requests repeating one statement past the N+1 threshold', ('route', 'origin'))
+
+METRICS = (request_duration, request_sql_statements, request_sql_duration, response_size, slow_queries, n_plus_one)
+
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _query_origin():
+    """The innermost app frame (outside this module) that issued the current statement"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(BACKEND_DIR) and filename != os.path.abspath(__file__):
+            return f'{os.path.relpath(filename, BACKEND_DIR)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+
+    stats['count'] += 1
+    stats['seconds'] += elapsed
+
+    if elapsed >= stats['slow_threshold']:
+        slow_queries.inc((_route_label(),))
+        logger.warning('Slow query (%.1f ms) on %s: %s params=%r', elapsed * 1000, _route_label(), statement, parameters)
+
+    statements = stats.get('statements')
+    if statements is not None:
+        # The same SQL text repeated with different parameters is the N+1 signature
+        statements[statement] += 1
+        if statements[statement] == 2:
+            stats['origins'][statement] = _query_origin()
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time so the stack stays balanced
+    conn = context.connection
+    if conn is not None and context.execution_context is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
+_listeners_installed = False
+
+
+def _install_engine_listeners():
+    """Listen on every engine, including ones created after startup"""
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listeners_installed = True
+
+
+def init_instrumentation(app):
+    """Record per-route latency, SQL and size metrics, add Server-Timing and serve /metrics"""
+    app.config.setdefault('SLOW_QUERY_SECONDS', 0.1)
+    # None follows app.debug per request, so `flask run --debug` and app.run(debug=True) turn it on
+    detect = os.environ.get('DETECT_N_PLUS_ONE')
+    app.config.setdefault('DETECT_N_PLUS_ONE', None if detect is None else detect not in ('0', 'false', 'off'))
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    # /metrics names every route and its traffic: METRICS_TOKEN makes scrapers send it as a bearer token,
+    # and without one only clients on this host, not forwarded by a proxy, may read it
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '1') not in ('0', 'false', 'off'))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    _install_engine_listeners()
+
+    @app.before_request
+    def start_request_metrics():
+        detect_n_plus_one = app.config['DETECT_N_PLUS_ONE']
+        if detect_n_plus_one is None:
+            detect_n_plus_one = app.debug
+        g.request_started = time.perf_counter()
+        g.sql_stats = {
+            'count': 0,
+            'seconds': 0.0,
+            'slow_threshold': app.config['SLOW_QUERY_SECONDS'],
+            'statements': Counter() if detect_n_plus_one else None,
+            'origins': {}
+        }
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('request_started')
+        stats = g.get('sql_stats')
+        if started is None or stats is None:
+            return response
+
+        elapsed = time.perf_counter() - started
+        route = _route_label()
+        labels = (request.method, route, str(response.status_code))
+        request_duration.observe(labels, elapsed)
+        request_sql_statements.observe(labels, stats['count'])
+        request_sql_duration.observe(labels, stats['seconds'])
+        if not response.is_streamed:
+            response_size.observe(labels, response.calculate_content_length() or 0)
+
+        if stats['statements']:
+            for statement, count in stats['statements'].items():
+                if count >= app.config['N_PLUS_ONE_THRESHOLD']:
+                    origin = stats['origins'].get(statement, 'unknown')
+                    n_plus_one.inc((route, origin))
+                    logger.warning('Possible N+1 on %s: %d x %s (from %s)', route, count,
+                                   re.sub(r'\s+', ' ', statement)[:200], origin)
+
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'sql;dur={stats["seconds"] * 1000:.1f};desc="{stats["count"]} queries"'
+        )
+        return response
+
+    def metrics_allowed():
+        token = app.config['METRICS_TOKEN']
+        if token:
+            auth_header = request.headers.get('Authorization', '')
+            return auth_header.startswith('Bearer ') and hmac.compare_digest(auth_header[7:], token)
+        return request.remote_addr in LOOPBACK_ADDRESSES and 'X-Forwarded-For' not in request.headers
+
+    def metrics():
+        if not metrics_allowed():
+            return jsonify({'error': 'Metrics access denied'}), 403
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.expose())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    if app.config['METRICS_ENABLED']:
+        app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,261 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from sqlalchemy import select, update, func, or_, and_
+from src.models.user import db
+from src.models.job import Job
+from src.services.sharding import locate_user, use_shard
+
+logger = logging.getLogger(__name__)
+
+JobType = namedtuple('JobType', 'name handler executor max_attempts validate')
+
+# Registered job types by name; see register_job
+JOB_TYPES = {}
+
+PROGRESS_INTERVAL = 0.5  # Seconds between progress writes
+RETRY_BACKOFF = 5  # Seconds, doubled after every failed attempt
+
+_wakeup = Event()
+_process_app = None
+
+
+def register_job(name, executor='thread', max_attempts=3, validate=None):
+    """Register a job handler; handler(context) returns a JSON-serializable result
+
+    executor='process' runs the handler in the process pool when one is available.
+    validate(user_id, params), if given, raises ValueError for bad submissions.
+    """
+    def decorator(handler):
+        JOB_TYPES[name] = JobType(name, handler, executor, max_attempts, validate)
+        return handler
+    return decorator
+
+
+class JobError(Exception):
+    """A failure that retrying cannot fix; the job fails right away"""
+
+
+class JobContext:
+    """What a running handler sees: its parameters and a way to report progress"""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.params = job.get_params()
+        self.attempt = job.attempts
+        self._last_write = 0.0
+
+    def progress(self, done, total=100, message=None, force=False):
+        """Record progress (also keeps the job's lease alive); writes are throttled"""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        percent = min(max(done / total * 100, 0), 100) if total else 100
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(Job.__table__).where(Job.id == self.job_id).values(
+                    progress=percent, progress_message=message, locked_at=datetime.utcnow()
+                )
+            )
+
+
+def enqueue(job_type, user_id=None, params=None, run_after=None):
+    """Add a job to the queue; it runs once the caller commits"""
+    spec = JOB_TYPES.get(job_type)
+    if spec is None:
+        raise ValueError(f'Unknown job type: {job_type}')
+    params = params or {}
+    if spec.validate:
+        spec.validate(user_id, params)
+    job = Job(
+        user_id=user_id,
+        job_type=job_type,
+        params=json.dumps(params),
+        max_attempts=spec.max_attempts,
+        run_after=run_after or datetime.utcnow()
+    )
+    db.session.add(job)
+    _wakeup.set()
+    return job
+
+
+def _claimable(now, lease_seconds):
+    # Running jobs whose lease expired belong to a worker that died
+    return or_(
+        and_(Job.status == 'queued', Job.run_after <= now),
+        and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=lease_seconds))
+    )
+
+
+def claim_job(lease_seconds=600):
+    """Atomically take the oldest runnable job; returns its id or None"""
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claimable = _claimable(now, lease_seconds)
+    candidate = select(Job.id).where(claimable).order_by(Job.id).limit(1).scalar_subquery()
+    with db.engine.begin() as connection:
+        claimed = connection.execute(
+            update(Job.__table__).where(Job.id == candidate, claimable).values(
+                status='running', locked_by=token, locked_at=now, attempts=Job.attempts + 1,
+                started_at=func.coalesce(Job.started_at, now)
+            )
+        ).rowcount
+        if not claimed:
+            return None
+        return connection.execute(select(Job.id).where(Job.locked_by == token)).scalar()
+
+
+def _finish(job_id, **values):
+    values.update(locked_by=None, locked_at=None)
+    with db.engine.begin() as connection:
+        connection.execute(update(Job.__table__).where(Job.id == job_id).values(**values))
+
+
+def record_failure(job_id, error):
+    """Requeue with exponential backoff, or mark the job failed once its attempts are used up"""
+    attempts, max_attempts = db.session.execute(
+        select(Job.attempts, Job.max_attempts).where(Job.id == job_id)
+    ).one()
+    if attempts < max_attempts:
+        delay = RETRY_BACKOFF * 2 ** (attempts - 1)
+        _finish(job_id, status='queued', error=error, run_after=datetime.utcnow() + timedelta(seconds=delay))
+    else:
+        _finish(job_id, status='failed', error=error, finished_at=datetime.utcnow())
+
+
+def execute_job(job_id):
+    """Run a claimed job's handler and store its outcome; needs an app context"""
+    try:
+        job = db.session.get(Job, job_id)
+        spec = JOB_TYPES.get(job.job_type)
+        if spec is None:
+            raise JobError(f'Unknown job type: {job.job_type}')
+        context = JobContext(job)
+        shard, moving = locate_user(job.user_id) if job.user_id else (None, False)
+        if moving:
+            raise RuntimeError('User data is being moved to another shard')
+        db.session.commit()
+        with use_shard(shard):
+            result = spec.handler(context)
+            db.session.commit()
+        _finish(job_id, status='succeeded', result=json.dumps(result), error=None, progress=100,
+                finished_at=datetime.utcnow())
+    except JobError as e:
+        db.session.rollback()
+        _finish(job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %s failed', job_id)
+        record_failure(job_id, str(e))
+    finally:
+        db.session.remove()
+
+
+def _init_process():
+    # Connections inherited from the parent must not be shared with it
+    with _process_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def _execute_in_process(job_id):
+    with _process_app.app_context():
+        execute_job(job_id)
+
+
+class JobWorkerPool:
+    """Worker threads that poll the job table; process-type jobs are handed to a process pool"""
+
+    def __init__(self, app, threads=2, processes=0, poll_interval=1.0, lease_seconds=600):
+        self.app = app
+        self.threads = threads
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stopped = Event()
+        self._workers = []
+        self._process_pool = None
+
+    def start(self):
+        global _process_app
+        if self.processes:
+            # Forked workers inherit the app, so they can open their own connections to the database
+            _process_app = self.app
+            # Close the connections left from startup so no SQLite handle is open across the fork
+            with self.app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose()
+            self._process_pool = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context('fork'), initializer=_init_process
+            )
+            # Fork every worker now, before any thread can be inside a transaction: a child forked
+            # mid-transaction inherits SQLite lock state it can never release
+            self._process_pool.submit(int).result()
+        for number in range(self.threads):
+            worker = Thread(target=self._run, name=f'job-worker-{number}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        self._stopped.set()
+        _wakeup.set()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def run_job(self, job_id):
+        spec = JOB_TYPES.get(db.session.get(Job, job_id).job_type)
+        db.session.remove()
+        if spec is not None and spec.executor == 'process' and self._process_pool is not None:
+            try:
+                self._process_pool.submit(_execute_in_process, job_id).result()
+            except Exception as e:
+                # The worker process died before it could record the outcome
+                record_failure(job_id, f'Worker process failed: {e}')
+        else:
+            execute_job(job_id)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    job_id = claim_job(self.lease_seconds)
+                    if job_id is not None:
+                        self.run_job(job_id)
+                        continue
+                except Exception:
+                    logger.exception('Job worker error')
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+
+def _process_workers_supported(app):
+    database_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    in_memory = database_uri in ('sqlite://', 'sqlite:///:memory:')
+    return 'fork' in multiprocessing.get_all_start_methods() and not in_memory
+
+
+def init_jobs(app):
+    """Start the background job workers unless JOBS_ENABLED is turned off"""
+    app.config.setdefault('JOBS_ENABLED', os.environ.get('JOBS_ENABLED', '1') not in ('0', 'false', 'off'))
+    app.config.setdefault('JOBS_THREADS', int(os.environ.get('JOBS_THREADS', '2')))
+    app.config.setdefault('JOBS_PROCESSES', int(os.environ.get('JOBS_PROCESSES', '2')))
+    app.config.setdefault('JOBS_POLL_INTERVAL', float(os.environ.get('JOBS_POLL_INTERVAL', '1.0')))
+    app.config.setdefault('JOBS_LEASE_SECONDS', int(os.environ.get('JOBS_LEASE_SECONDS', '600')))
+    if not app.config['JOBS_ENABLED']:
+        return None
+
+    processes = app.config['JOBS_PROCESSES'] if _process_workers_supported(app) else 0
+    pool = JobWorkerPool(app, app.config['JOBS_THREADS'], processes,
+                         app.config['JOBS_POLL_INTERVAL'], app.config['JOBS_LEASE_SECONDS'])
+    app.extensions['job_pool'] = pool
+    pool.start()
+    return pool
@@ -0,0 +1,406 @@
+"""Match exits to entry lots under FIFO, LIFO or average cost
+
+Every exit is split into lots: slices matched against the entries it closes,
+each with its own realized P&L and holding time. The slices are stored as
+TradeLot rows under the account's lot_method. A new exit is matched against
+the open lots left by the stored rows, so its cost does not grow with the
+trade's history; fills that land before already matched exits, archive
+restores and method changes replay the trade from its fills instead.
+
+All arithmetic is on the fixed-point units of services/money.py.
+"""
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, cast, type_coerce, inspect, text, BigInteger, DateTime
+from src.models.user import db
+from src.models.account import Account
+from src.models.trade import Trade, TradeEntry, TradeExit
+from src.models.lot import TradeLot
+from src.services.serialization import load_trade_children
+from src.services.money import (
+    PRICE_DIGITS, QUANTITY_DIGITS, QUANTITY_SCALE, round_div, to_fixed, from_fixed, from_cents,
+    fixed_to_decimal, cents_to_decimal, value_to_cents
+)
+
+METHODS = ('fifo', 'lifo', 'average')
+REBUILD_BATCH = 500  # Trades replayed per query batch
+LOT_FETCH = 64  # Open lots read per round trip when matching a new exit
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# A matched slice; times are epoch microseconds, prices and quantities fixed units, pnl cents
+Match = namedtuple('Match', 'entry_id exit_id quantity entry_price exit_price pnl opened closed')
+
+
+def _micros(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _datetime(micros):
+    return _EPOCH + micros * _MICROSECOND
+
+
+def _units(column):
+    return cast(func.round(column * QUANTITY_SCALE), BigInteger)
+
+
+class Lot:
+    """Quantity still open from one entry, or from the pooled entries under average cost"""
+    __slots__ = ('entry_id', 'opened', 'price', 'quantity')
+
+    def __init__(self, entry_id, opened, price, quantity):
+        self.entry_id = entry_id
+        self.opened = opened
+        self.price = price
+        self.quantity = quantity
+
+    def to_dict(self):
+        return {
+            'entry_id': self.entry_id,
+            'opened_at': _datetime(self.opened).isoformat(),
+            'price': from_fixed(self.price, PRICE_DIGITS),
+            'quantity': from_fixed(self.quantity, QUANTITY_DIGITS)
+        }
+
+
+class LotBook:
+    """Open lots of one trade, consumed by its exits
+
+    Entries are added in the order they happened. FIFO and LIFO keep one lot per
+    entry in a deque and take from its left or right end; average cost pools the
+    entries into a single lot whose price only entries change. An exit larger
+    than what is open waits for the next entries.
+    """
+
+    def __init__(self, method, is_long):
+        if method not in METHODS:
+            raise ValueError(f'Unknown lot method: {method}')
+        self.method = method
+        self.is_long = is_long
+        self.lots = deque()
+        self.pending = deque()  # [exit_id, closed, price, quantity] still to match
+
+    def add(self, entry_id, opened, price, quantity):
+        """Open a lot; returns the matches of pending exits it fills"""
+        if self.method == 'average' and self.lots:
+            pool = self.lots[0]
+            total = pool.quantity + quantity
+            pool.price = round_div(pool.price * pool.quantity + price * quantity, total)
+            pool.opened = round_div(pool.opened * pool.quantity + opened * quantity, total)
+            pool.quantity = total
+        else:
+            self.lots.append(Lot(None if self.method == 'average' else entry_id, opened, price, quantity))
+
+        matches = []
+        while self.pending and self.lots:
+            waiting = self.pending[0]
+            taken, waiting[3] = self._take(*waiting)
+            matches.extend(taken)
+            if waiting[3]:
+                break
+            self.pending.popleft()
+        return matches
+
+    def close(self, exit_id, closed, price, quantity):
+        """Match an exit against the open lots"""
+        if self.pending:
+            self.pending.append([exit_id, closed, price, quantity])
+            return []
+        matches, unmatched = self._take(exit_id, closed, price, quantity)
+        if unmatched:
+            self.pending.append([exit_id, closed, price, unmatched])
+        return matches
+
+    def _take(self, exit_id, closed, price, quantity):
+        lots = self.lots
+        lifo = self.method == 'lifo'
+        matches = []
+        while quantity and lots:
+            lot = lots[-1] if lifo else lots[0]
+            used = min(lot.quantity, quantity)
+            pnl = value_to_cents((price - lot.price) * used)
+            matches.append(Match(lot.entry_id, exit_id, used, lot.price, price,
+                                 pnl if self.is_long else -pnl, lot.opened, closed))
+            lot.quantity -= used
+            quantity -= used
+            if not lot.quantity:
+                if lifo:
+                    lots.pop()
+                else:
+                    lots.popleft()
+        return matches, quantity
+
+    @property
+    def unmatched(self):
+        return sum(waiting[3] for waiting in self.pending)
+
+
+def replay(method, is_long, entries, exits):
+    """Book and matches of a whole fill history; fills are (id, time, price, quantity) tuples"""
+    # Entries before exits at the same moment, then in the order they were recorded
+    fills = sorted([(moment, 0, fill_id, price, quantity) for fill_id, moment, price, quantity in entries] +
+                   [(moment, 1, fill_id, price, quantity) for fill_id, moment, price, quantity in exits])
+    book = LotBook(method, is_long)
+    matches = []
+    for moment, kind, fill_id, price, quantity in fills:
+        if kind == 0:
+            matches.extend(book.add(fill_id, moment, price, quantity))
+        else:
+            matches.extend(book.close(fill_id, moment, price, quantity))
+    return book, matches
+
+
+def _fill(fill_id, moment, price, quantity):
+    return (fill_id, _micros(moment), to_fixed(price, PRICE_DIGITS), to_fixed(quantity, QUANTITY_DIGITS))
+
+
+def _replay_children(method, is_long, entries, exits):
+    return replay(
+        method, is_long,
+        [_fill(entry.id, entry.entry_date, entry.entry_price, entry.quantity) for entry in entries],
+        [_fill(exit.id, exit.exit_date, exit.exit_price, exit.quantity) for exit in exits]
+    )
+
+
+def _lot_row(trade_id, account_id, method, match):
+    return {
+        'trade_id': trade_id,
+        'account_id': account_id,
+        'method': method,
+        'entry_id': match.entry_id,
+        'exit_id': match.exit_id,
+        'quantity': fixed_to_decimal(match.quantity, QUANTITY_DIGITS),
+        'entry_price': fixed_to_decimal(match.entry_price, PRICE_DIGITS),
+        'exit_price': fixed_to_decimal(match.exit_price, PRICE_DIGITS),
+        'realized_pnl': cents_to_decimal(match.pnl),
+        'opened_at': _datetime(match.opened),
+        'closed_at': _datetime(match.closed),
+        'holding_seconds': max(match.closed - match.opened, 0) // 1000000
+    }
+
+
+def _expire_lots(trade_ids):
+    for trade_id in trade_ids:
+        trade = db.session.identity_map.get(db.session.identity_key(Trade, trade_id))
+        if trade is not None:
+            db.session.expire(trade, ['lots'])
+
+
+def rebuild_lots(trade_ids):
+    """Replace the stored lots of these trades with a replay of their fills; returns the lot count"""
+    trade_ids = list(trade_ids)
+    if not trade_ids:
+        return 0
+    trades = db.session.execute(
+        select(Trade.id, Trade.account_id, Trade.trade_type, Account.lot_method)
+        .join(Account, Account.id == Trade.account_id).where(Trade.id.in_(trade_ids))
+    ).all()
+    entries, exits, _, _ = load_trade_children(trade_ids)
+    rows = []
+    for trade in trades:
+        _, matches = _replay_children(trade.lot_method, trade.trade_type.lower() == 'long',
+                                      entries.get(trade.id, ()), exits.get(trade.id, ()))
+        rows.extend(_lot_row(trade.id, trade.account_id, trade.lot_method, match) for match in matches)
+
+    db.session.execute(delete(TradeLot).where(TradeLot.trade_id.in_(trade_ids)),
+                       execution_options={'synchronize_session': False})
+    if rows:
+        db.session.execute(insert(TradeLot), rows)
+    _expire_lots(trade_ids)
+    return len(rows)
+
+
+def rebuild_account_lots(account_ids):
+    """Replay every trade of the accounts, a batch at a time"""
+    trade_ids = db.session.execute(
+        select(Trade.id).where(Trade.account_id.in_(account_ids)).order_by(Trade.id)
+    ).scalars().all()
+    return sum(rebuild_lots(trade_ids[start:start + REBUILD_BATCH])
+               for start in range(0, len(trade_ids), REBUILD_BATCH))
+
+
+def ensure_lot_matching(engine):
+    """Add the lot_method column to an existing account table and match every trade's lots once"""
+    existing = {column['name'] for column in inspect(engine).get_columns('account')}
+    if 'lot_method' in existing:
+        return
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE account ADD COLUMN lot_method VARCHAR(10) NOT NULL DEFAULT 'fifo'"))
+    account_ids = db.session.execute(select(Account.id)).scalars().all()
+    rebuild_account_lots(account_ids)
+    db.session.commit()
+
+
+def _open_book(trade, method, is_long, quantity):
+    """LotBook of the lots left open by the stored matches, as far as an exit of quantity units reaches"""
+    book = LotBook(method, is_long)
+    if method != 'average':
+        matched = select(
+            TradeLot.entry_id.label('entry_id'), func.sum(_units(TradeLot.quantity)).label('units')
+        ).where(TradeLot.trade_id == trade.id).group_by(TradeLot.entry_id).subquery()
+        remaining = _units(TradeEntry.quantity) - func.coalesce(matched.c.units, 0)
+        order = (TradeEntry.entry_date.desc(), TradeEntry.id.desc()) if method == 'lifo' else (TradeEntry.entry_date, TradeEntry.id)
+        rows = db.session.execute(
+            select(TradeEntry.id, TradeEntry.entry_date, TradeEntry.entry_price, remaining)
+            .outerjoin(matched, matched.c.entry_id == TradeEntry.id)
+            .where(TradeEntry.trade_id == trade.id, remaining > 0).order_by(*order)
+            .execution_options(yield_per=LOT_FETCH)
+        )
+        # Only the lots the exit will take are read; a long-lived position can have thousands open
+        needed = []
+        for row in rows:
+            needed.append(row)
+            quantity -= row[3]
+            if quantity <= 0:
+                break
+        rows.close()
+        if method == 'lifo':
+            needed.reverse()
+        for entry_id, entry_date, entry_price, units in needed:
+            book.add(entry_id, _micros(entry_date), to_fixed(entry_price, PRICE_DIGITS), units)
+        return book
+
+    # The pool as the last match left it, plus the entries made since
+    last = db.session.execute(
+        select(TradeLot.entry_price, TradeLot.opened_at, TradeLot.closed_at)
+        .where(TradeLot.trade_id == trade.id).order_by(TradeLot.closed_at.desc(), TradeLot.id.desc()).limit(1)
+    ).first()
+    since = TradeEntry.trade_id == trade.id
+    if last is not None:
+        pooled = db.session.execute(
+            select(func.coalesce(func.sum(_units(TradeEntry.quantity)), 0))
+            .where(TradeEntry.trade_id == trade.id, TradeEntry.entry_date <= last.closed_at)
+        ).scalar() - db.session.execute(
+            select(func.coalesce(func.sum(_units(TradeLot.quantity)), 0)).where(TradeLot.trade_id == trade.id)
+        ).scalar()
+        if pooled > 0:
+            book.add(None, _micros(last.opened_at), to_fixed(last.entry_price, PRICE_DIGITS), pooled)
+        since = (TradeEntry.trade_id == trade.id) & (TradeEntry.entry_date > last.closed_at)
+    rows = db.session.execute(
+        select(TradeEntry.id, TradeEntry.entry_date, TradeEntry.entry_price, TradeEntry.quantity)
+        .where(since).order_by(TradeEntry.entry_date, TradeEntry.id)
+    )
+    for row in rows:
+        book.add(*_fill(*row))
+    return book
+
+
+def _can_match_incrementally(trade, exit, method):
+    """Whether the stored lots are current and the exit comes after every other fill"""
+    lots = TradeLot.trade_id == trade.id
+    exits = (TradeExit.trade_id == trade.id) & (TradeExit.id != exit.id)
+    # One round trip for all the checks
+    state = db.session.execute(select(
+        select(func.coalesce(func.sum(_units(TradeLot.quantity)), 0)).where(lots).scalar_subquery().label('lot_units'),
+        select(func.count()).where(lots, TradeLot.method != method).scalar_subquery().label('foreign'),
+        select(func.coalesce(func.sum(_units(TradeExit.quantity)), 0)).where(exits).scalar_subquery().label('exited_units'),
+        type_coerce(select(func.max(TradeExit.exit_date)).where(exits).scalar_subquery(), DateTime).label('last_exit'),
+        type_coerce(select(func.max(TradeEntry.entry_date)).where(TradeEntry.trade_id == trade.id).scalar_subquery(),
+                    DateTime).label('last_entry')
+    )).one()
+    if state.foreign or state.lot_units != state.exited_units:
+        return False
+    return all(moment is None or moment <= exit.exit_date for moment in (state.last_exit, state.last_entry))
+
+
+def match_exit(trade, exit):
+    """Store the lots of an exit that was just added to the trade (and flushed)"""
+    method = trade.account.lot_method
+    if not _can_match_incrementally(trade, exit, method):
+        return rebuild_lots([trade.id])
+    fill = _fill(exit.id, exit.exit_date, exit.exit_price, exit.quantity)
+    book = _open_book(trade, method, trade.trade_type.lower() == 'long', fill[3])
+    matches = book.close(*fill)
+    if book.unmatched:
+        # More exited than the stored lots leave open; let the replay sort it out
+        return rebuild_lots([trade.id])
+    if matches:
+        db.session.execute(insert(TradeLot), [
+            _lot_row(trade.id, trade.account_id, method, match) for match in matches
+        ])
+        _expire_lots([trade.id])
+    return len(matches)
+
+
+def match_entry(trade, entry):
+    """Keep the stored lots right after an entry was added; only back-dated entries change them"""
+    last_close = db.session.execute(
+        select(func.max(TradeLot.closed_at)).where(TradeLot.trade_id == trade.id)
+    ).scalar()
+    if last_close is not None and entry.entry_date <= last_close:
+        return rebuild_lots([trade.id])
+    return 0
+
+
+def _match_dict(match, method):
+    return {
+        'method': method,
+        'entry_id': match.entry_id,
+        'exit_id': match.exit_id,
+        'quantity': from_fixed(match.quantity, QUANTITY_DIGITS),
+        'entry_price': from_fixed(match.entry_price, PRICE_DIGITS),
+        'exit_price': from_fixed(match.exit_price, PRICE_DIGITS),
+        'realized_pnl': from_cents(match.pnl),
+        'opened_at': _datetime(match.opened).isoformat(),
+        'closed_at': _datetime(match.closed).isoformat(),
+        'holding_seconds': max(match.closed - match.opened, 0) // 1000000
+    }
+
+
+def trade_lot_report(trade, method=None):
+    """Realized and open lots of a trade; methods other than the account's are matched on the fly"""
+    stored_method = trade.account.lot_method
+    method = method or stored_method
+    if trade.summary:
+        entries, exits, _, _ = load_trade_children([trade.id])
+        entries, exits = entries.get(trade.id, ()), exits.get(trade.id, ())
+    else:
+        entries, exits = trade.entries, trade.exits
+    book, matches = _replay_children(method, trade.trade_type.lower() == 'long', entries, exits)
+
+    if method == stored_method:
+        stored = TradeLot.query.filter_by(trade_id=trade.id).order_by(TradeLot.closed_at, TradeLot.id).all()
+        lots = [lot.to_dict() for lot in stored]
+    else:
+        lots = [_match_dict(match, method) for match in matches]
+    matched = sum(match.quantity for match in matches)
+    held = sum(match.quantity * max(match.closed - match.opened, 0) for match in matches)
+    return {
+        'trade_id': trade.id,
+        'method': method,
+        'stored': method == stored_method,
+        'lots': lots,
+        'open_lots': [lot.to_dict() for lot in book.lots],
+        'realized_pnl': from_cents(sum(match.pnl for match in matches)),
+        'matched_quantity': from_fixed(matched, QUANTITY_DIGITS),
+        'unmatched_exit_quantity': from_fixed(book.unmatched, QUANTITY_DIGITS),
+        # Quantity-weighted
+        'avg_holding_seconds': held // matched // 1000000 if matched else None
+    }
+
+
+def account_lot_summary(account):
+    """Realized lot P&L, quantity and quantity-weighted holding time of an account, per instrument"""
+    cents = cast(func.round(TradeLot.realized_pnl * 100), BigInteger)
+    rows = db.session.execute(
+        select(Trade.instrument, func.count(TradeLot.id), func.sum(cents), func.sum(TradeLot.quantity),
+               func.sum(TradeLot.quantity * TradeLot.holding_seconds))
+        .join(Trade, Trade.id == TradeLot.trade_id)
+        .where(TradeLot.account_id == account.id, TradeLot.method == account.lot_method)
+        .group_by(Trade.instrument).order_by(Trade.instrument)
+    ).all()
+
+    def figures(lots, pnl, quantity, held):
+        return {
+            'lots': lots,
+            'realized_pnl': from_cents(pnl or 0),
+            'quantity': round(quantity or 0, QUANTITY_DIGITS),
+            'avg_holding_seconds': round(held / quantity) if quantity else None
+        }
+
+    instruments = [{'instrument': row[0], **figures(*row[1:])} for row in rows]
+    totals = figures(*(sum(row[i] or 0 for row in rows) for i in range(1, 5)))
+    return {'account_id': account.id, 'method': account.lot_method, 'instruments': instruments, 'totals': totals}
@@ -0,0 +1,162 @@
+"""Unrealized P&L and distance to stop of open trades, marked at the local price store's latest prices
+
+All open trades in scope are valued in one pass: one query for the trades with
+their ledger open quantity, one for their entries and one for the latest price
+of each instrument. Entry columns are converted to fixed-point units together
+and the figures come from the same kernel as realized P&L, so marking a
+position at its exit price gives exactly the gross P&L the exit would realize.
+"""
+from sqlalchemy import select
+from src.models.user import db
+from src.models.trade import Trade, TradeEntry
+from src.services.trade_metrics import user_trade_scope
+from src.services.price_store import latest_prices, normalize_instrument
+from src.services.money import (
+    PRICE_DIGITS, QUANTITY_DIGITS, to_fixed, to_fixed_many, from_fixed, from_cents,
+    average_price, gross_pnl, value_to_cents
+)
+
+
+def _percentage(part, whole):
+    return round(part / whole * 100, 2) if whole else None
+
+
+def open_positions(user_id, account_ids=None):
+    """Open trades in scope with their open quantity and entry totals as fixed-point integers"""
+    scope = user_trade_scope(user_id, account_ids).where(Trade.status == 'Open', Trade.open_quantity_units > 0)
+    positions = {
+        row.id: {
+            'trade_id': row.id,
+            'account_id': row.account_id,
+            'instrument': row.instrument,
+            'is_long': row.trade_type.lower() == 'long',
+            'trade_type': row.trade_type,
+            'risk_type_id': row.risk_type_id,
+            'stop_loss_price': to_fixed(row.stop_loss_price, PRICE_DIGITS),
+            'open_qty': row.open_quantity_units,
+            'entry_qty': 0,
+            'entry_value': 0
+        }
+        for row in db.session.execute(
+            select(Trade.id, Trade.account_id, Trade.instrument, Trade.trade_type, Trade.risk_type_id,
+                   Trade.stop_loss_price, Trade.open_quantity_units).where(Trade.id.in_(scope)).order_by(Trade.id)
+        )
+    }
+    if not positions:
+        return []
+
+    trade_ids, prices, quantities = [], [], []
+    for trade_id, price, quantity in db.session.execute(
+        select(TradeEntry.trade_id, TradeEntry.entry_price, TradeEntry.quantity).where(TradeEntry.trade_id.in_(scope))
+    ):
+        trade_ids.append(trade_id)
+        prices.append(price)
+        quantities.append(quantity)
+    for trade_id, price, quantity in zip(trade_ids, to_fixed_many(prices, PRICE_DIGITS),
+                                         to_fixed_many(quantities, QUANTITY_DIGITS)):
+        position = positions[trade_id]
+        position['entry_qty'] += quantity
+        position['entry_value'] += price * quantity
+    return list(positions.values())
+
+
+def _value_position(position, mark):
+    """Figures of one position in fixed-point units; None where the position has no price"""
+    open_qty, entry_qty, entry_value = position['open_qty'], position['entry_qty'], position['entry_value']
+    avg_entry = average_price(entry_value, entry_qty)
+    stop = position['stop_loss_price']
+    figures = {
+        'avg_entry': avg_entry,
+        'cost_basis': value_to_cents(avg_entry * open_qty),
+        'market_value': None,
+        'unrealized_pnl': None,
+        'distance_to_stop': None,
+        'risk_to_stop': None
+    }
+    if mark is None:
+        return figures
+    # The open quantity priced at the mark, as if it were exited there
+    figures['market_value'] = value_to_cents(mark * open_qty)
+    figures['unrealized_pnl'] = gross_pnl(position['is_long'], entry_qty, entry_value, open_qty, mark * open_qty)
+    if stop:
+        distance = mark - stop if position['is_long'] else stop - mark
+        figures['distance_to_stop'] = distance
+        # What a stop-out would give back from the current mark; negative once the stop is breached
+        figures['risk_to_stop'] = value_to_cents(distance * open_qty)
+    return figures
+
+
+def _totals():
+    return {'positions': 0, 'priced_positions': 0, 'cost_basis': 0, 'market_value': 0,
+            'unrealized_pnl': 0, 'risk_to_stop': 0}
+
+
+def _add(totals, figures):
+    totals['positions'] += 1
+    totals['cost_basis'] += figures['cost_basis']
+    if figures['market_value'] is not None:
+        totals['priced_positions'] += 1
+        totals['market_value'] += figures['market_value']
+        totals['unrealized_pnl'] += figures['unrealized_pnl']
+        totals['risk_to_stop'] += figures['risk_to_stop'] or 0
+
+
+def _totals_dict(totals):
+    return {
+        'positions': totals['positions'],
+        'priced_positions': totals['priced_positions'],
+        'cost_basis': from_cents(totals['cost_basis']),
+        'market_value': from_cents(totals['market_value']),
+        'unrealized_pnl': from_cents(totals['unrealized_pnl']),
+        'unrealized_pnl_percentage': _percentage(totals['unrealized_pnl'], totals['cost_basis']),
+        'risk_to_stop': from_cents(totals['risk_to_stop'])
+    }
+
+
+def mark_to_market(user_id, account_ids=None, as_of=None):
+    """Every open position of the user valued at the latest price at or before as_of, with totals
+
+    Positions whose instrument has no price yet are listed with null figures
+    and left out of the market value, unrealized P&L and risk totals.
+    """
+    positions = open_positions(user_id, account_ids)
+    marks = latest_prices([position['instrument'] for position in positions], as_of)
+
+    portfolio = _totals()
+    by_account = {}
+    payload = []
+    for position in positions:
+        price, marked_at = marks.get(normalize_instrument(position['instrument']), (None, None))
+        mark = to_fixed(price, PRICE_DIGITS) if price is not None else None
+        figures = _value_position(position, mark)
+        _add(portfolio, figures)
+        _add(by_account.setdefault(position['account_id'], _totals()), figures)
+
+        distance = figures['distance_to_stop']
+        payload.append({
+            'trade_id': position['trade_id'],
+            'account_id': position['account_id'],
+            'instrument': position['instrument'],
+            'trade_type': position['trade_type'],
+            'open_quantity': from_fixed(position['open_qty'], QUANTITY_DIGITS),
+            'avg_entry': from_fixed(figures['avg_entry'], PRICE_DIGITS),
+            'stop_loss_price': from_fixed(position['stop_loss_price'], PRICE_DIGITS) if position['stop_loss_price'] else None,
+            'mark_price': from_fixed(mark, PRICE_DIGITS) if mark is not None else None,
+            'marked_at': marked_at.isoformat() if marked_at else None,
+            'cost_basis': from_cents(figures['cost_basis']),
+            'market_value': from_cents(figures['market_value']) if mark is not None else None,
+            'unrealized_pnl': from_cents(figures['unrealized_pnl']) if mark is not None else None,
+            'unrealized_pnl_percentage': _percentage(figures['unrealized_pnl'], figures['cost_basis']) if mark is not None else None,
+            'distance_to_stop': from_fixed(distance, PRICE_DIGITS) if distance is not None else None,
+            'distance_to_stop_percentage': _percentage(distance, mark) if distance is not None else None,
+            'risk_to_stop': from_cents(figures['risk_to_stop']) if figures['risk_to_stop'] is not None else None
+        })
+
+    return {
+        'as_of': as_of.isoformat() if as_of else None,
+        'positions': payload,
+        'accounts': [dict(_totals_dict(totals), account_id=account_id) for account_id, totals in by_account.items()],
+        'portfolio': dict(_totals_dict(portfolio), unpriced_instruments=sorted({
+            position['instrument'] for position in payload if position['mark_price'] is None
+        }))
+    }
@@ -0,0 +1,199 @@
+"""Exact fixed-point arithmetic for prices, quantities and cash
+
+Prices and quantities are held as integers of 1e-8 units and cash as integer
+cents, matching the scale of the Numeric columns they come from. Sums and
+products of these integers are exact; values are rounded (half to even) only
+where a result is turned back into a price or into cents.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from operator import mul
+
+PRICE_DIGITS = 8
+QUANTITY_DIGITS = 8
+CASH_DIGITS = 2
+RATIO_DIGITS = 8  # Percentages and other rates given as plain numbers
+
+PRICE_SCALE = 10 ** PRICE_DIGITS
+QUANTITY_SCALE = 10 ** QUANTITY_DIGITS
+CASH_SCALE = 10 ** CASH_DIGITS
+
+# A price times a quantity is cash in units of 1 / VALUE_SCALE
+VALUE_SCALE = PRICE_SCALE * QUANTITY_SCALE
+_VALUE_PER_CENT = VALUE_SCALE // CASH_SCALE
+
+# Floats are rounded as the decimal they print as (1.015 is 1.015, not 1.01499999999999990230):
+# scaling a float errs by at most this fraction of the result, so round() agrees with that decimal
+# except within this distance of a tie, and past _FLOAT_EXACT_LIMIT the decimal is always used
+_FLOAT_TIE_TOLERANCE = 2.0 ** -48
+_FLOAT_EXACT_LIMIT = 2 ** 50
+
+
+def round_div(numerator, denominator):
+    """Integer division rounded half to even"""
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    twice = remainder * 2
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def _near_tie(scaled, units):
+    """Whether a scaled float is too close to halfway between two units for round() to be trusted"""
+    return abs(abs(scaled - units) - 0.5) <= abs(scaled) * _FLOAT_TIE_TOLERANCE
+
+
+def to_fixed(value, digits):
+    """Integer count of 10**-digits units in a Decimal, float, int or numeric string; None is 0"""
+    if value.__class__ is Decimal:
+        if not value.is_finite():
+            raise ValueError(f'Not a finite number: {value}')
+        return int(value.scaleb(digits).to_integral_value(ROUND_HALF_EVEN))
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value * 10 ** digits
+    if isinstance(value, float):
+        scaled = value * 10 ** digits
+        if -_FLOAT_EXACT_LIMIT < scaled < _FLOAT_EXACT_LIMIT:
+            units = round(scaled)
+            if not _near_tie(scaled, units):
+                return units
+        value = Decimal(repr(value))
+    else:
+        try:
+            value = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError(f'Not a number: {value!r}')
+    return to_fixed(value, digits)
+
+
+def to_fixed_many(values, digits):
+    """to_fixed over a whole column of values, in a single pass when they are all floats or Decimals"""
+    scale = 10 ** digits
+    try:
+        scaled = [value * scale for value in values]
+        units = [round(value) for value in scaled]
+    except (TypeError, ValueError, OverflowError):
+        units = None
+    if units is None or (units and max(map(abs, units)) >= _FLOAT_EXACT_LIMIT):
+        return [to_fixed(value, digits) for value in values]
+    for index, value in enumerate(scaled):
+        if value.__class__ is float and _near_tie(value, units[index]):
+            units[index] = to_fixed(values[index], digits)
+    return units
+
+
+def from_fixed(units, digits):
+    """Float nearest to a fixed-point amount"""
+    return units / 10 ** digits
+
+
+def fixed_to_decimal(units, digits):
+    """Exact Decimal of a fixed-point amount, for writing back to Numeric columns"""
+    return Decimal(units).scaleb(-digits)
+
+
+def to_cents(value):
+    return to_fixed(value, CASH_DIGITS)
+
+
+def from_cents(cents):
+    return from_fixed(cents, CASH_DIGITS)
+
+
+def cents_to_decimal(cents):
+    return fixed_to_decimal(cents, CASH_DIGITS)
+
+
+def value_to_cents(value):
+    """Cash in price x quantity units, rounded to cents"""
+    return round_div(value, _VALUE_PER_CENT)
+
+
+def percent_of(cents, percentage):
+    """percentage % of an amount of cents, rounded to cents"""
+    return round_div(cents * to_fixed(percentage, RATIO_DIGITS), 100 * 10 ** RATIO_DIGITS)
+
+
+def position_size(risk_cents, price_distance):
+    """Quantity units that lose risk_cents over a move of price_distance price units"""
+    return round_div(risk_cents * _VALUE_PER_CENT, price_distance)
+
+
+def whole_units_for_risk(risk_cents, price_distance):
+    """Largest whole number of units (shares, contracts) that loses at most risk_cents over price_distance"""
+    return risk_cents * _VALUE_PER_CENT // (price_distance * QUANTITY_SCALE)
+
+
+def fill_totals(prices, quantities):
+    """Total quantity and total value of fills given as price and quantity units
+
+    The value is in price x quantity units, so no rounding happens here.
+    """
+    return sum(quantities), sum(map(mul, prices, quantities))
+
+
+def average_price(value, quantity):
+    """Quantity-weighted average price in price units"""
+    return round_div(value, quantity) if quantity else 0
+
+
+def gross_pnl(is_long, entry_qty, entry_value, exit_qty, exit_value):
+    """Realized P&L in cents of the exited quantity against the average entry price"""
+    if not exit_qty:
+        return 0
+    if entry_qty:
+        # Exit value minus the cost basis of the exited quantity, rounded to cents once
+        pnl = round_div(exit_value * entry_qty - entry_value * exit_qty, entry_qty * _VALUE_PER_CENT)
+    else:
+        pnl = value_to_cents(exit_value)
+    return pnl if is_long else -pnl
+
+
+def risk_amount(is_long, stop_price, entry_qty, entry_value):
+    """Cents lost if the whole entered quantity is stopped out at stop_price"""
+    if not stop_price or not entry_qty:
+        return 0
+    risk = entry_value - stop_price * entry_qty
+    return value_to_cents(risk if is_long else -risk)
+
+
+def open_risk(is_long, stop_price, open_qty, entry_qty, entry_value):
+    """Cents lost if the open quantity is stopped out at stop_price, against the average entry
+
+    A stop past the average entry locks in profit and counts as no risk.
+    """
+    if not stop_price or not open_qty or not entry_qty:
+        return 0
+    # Cost basis of the open quantity minus its value at the stop, rounded to cents once
+    risk = entry_value * open_qty - stop_price * open_qty * entry_qty
+    return max(round_div(risk if is_long else -risk, entry_qty * _VALUE_PER_CENT), 0)
+
+
+def r_multiple(net_pnl_cents, risk_cents):
+    return net_pnl_cents / risk_cents if risk_cents > 0 else 0
+
+
+def trade_figures(is_long, stop_loss_price, entry_prices, entry_quantities,
+                  exit_prices, exit_quantities, cost_amounts):
+    """All per-trade metrics from the raw fill columns, as exact fixed-point integers"""
+    entry_qty, entry_value = fill_totals(to_fixed_many(entry_prices, PRICE_DIGITS),
+                                         to_fixed_many(entry_quantities, QUANTITY_DIGITS))
+    exit_qty, exit_value = fill_totals(to_fixed_many(exit_prices, PRICE_DIGITS),
+                                       to_fixed_many(exit_quantities, QUANTITY_DIGITS))
+    total_costs = sum(to_fixed_many(cost_amounts, CASH_DIGITS))
+    gross = gross_pnl(is_long, entry_qty, entry_value, exit_qty, exit_value)
+    risk = risk_amount(is_long, to_fixed(stop_loss_price, PRICE_DIGITS), entry_qty, entry_value)
+    return {
+        'entry_qty': entry_qty,
+        'avg_entry': average_price(entry_value, entry_qty),
+        'exit_qty': exit_qty,
+        'avg_exit': average_price(exit_value, exit_qty),
+        'total_costs': total_costs,
+        'gross_pnl': gross,
+        'net_pnl': gross - total_costs,
+        'risk_amount': risk,
+        'r_multiple': r_multiple(gross - total_costs, risk)
+    }
@@ -0,0 +1,154 @@
+"""Per-trade open-quantity counter that partial exits update atomically
+
+Each trade row carries its open quantity in 1e-8 units and a version number.
+Entries add to the counter with a single UPDATE. An exit reads the counter,
+then writes the remainder with an UPDATE that only matches while the version
+and the open quantity are still what it read; when another writer got there
+first nothing matches and the exit retries against the fresh row. Two
+concurrent exits therefore can never close more than was opened.
+"""
+import time
+from sqlalchemy import select, update, func, cast, inspect, text, BigInteger
+from src.models.user import db
+from src.models.trade import Trade, TradeEntry, TradeExit
+from src.models.archive import TradeSummary
+from src.services.money import QUANTITY_DIGITS, QUANTITY_SCALE, to_fixed, from_fixed
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 0.005  # Seconds, doubled after every lost race
+
+# Ledger columns added to trade tables created before they existed
+LEDGER_COLUMNS = {
+    'open_quantity_units': 'BIGINT NOT NULL DEFAULT 0',
+    'version': 'INTEGER NOT NULL DEFAULT 1',
+}
+
+
+class InsufficientQuantity(ValueError):
+    """The exit is larger than the trade's open quantity"""
+
+    def __init__(self, requested_units, open_units):
+        self.requested_units = requested_units
+        self.open_units = open_units
+        super().__init__(f'Cannot exit {from_fixed(requested_units, QUANTITY_DIGITS)} units. '
+                         f'Only {from_fixed(open_units, QUANTITY_DIGITS)} units are open.')
+
+
+class OpenPosition(ValueError):
+    """A trade cannot be marked Closed while its ledger still has quantity open"""
+
+    def __init__(self, open_units):
+        self.open_units = open_units
+        super().__init__(f'Cannot close a trade with {from_fixed(open_units, QUANTITY_DIGITS)} units open. '
+                         f'Add an exit for them instead.')
+
+
+class LedgerConflict(Exception):
+    """Concurrent writers kept changing the trade faster than the exit could be applied"""
+
+
+def _units(column):
+    return cast(func.round(column * QUANTITY_SCALE), BigInteger)
+
+
+def open_quantity_expression():
+    """Open quantity units of Trade rows recomputed from their entries, exits and archive summary"""
+    entered = select(func.coalesce(func.sum(_units(TradeEntry.quantity)), 0)).where(
+        TradeEntry.trade_id == Trade.id
+    ).scalar_subquery()
+    exited = select(func.coalesce(func.sum(_units(TradeExit.quantity)), 0)).where(
+        TradeExit.trade_id == Trade.id
+    ).scalar_subquery()
+    # Archived trades have no hot children; their summary holds the totals
+    archived = select(func.coalesce(func.sum(_units(TradeSummary.entry_qty) - _units(TradeSummary.exit_qty)), 0)).where(
+        TradeSummary.trade_id == Trade.id
+    ).scalar_subquery()
+    return entered - exited + archived
+
+
+def rebuild_open_quantities(connection, account_ids=None):
+    """Reset counters that drifted from the trades' fills; returns how many were fixed"""
+    recomputed = open_quantity_expression()
+    statement = update(Trade.__table__).where(Trade.open_quantity_units != recomputed).values(
+        open_quantity_units=recomputed, version=Trade.version + 1
+    )
+    if account_ids is not None:
+        statement = statement.where(Trade.account_id.in_(account_ids))
+    return connection.execute(statement).rowcount
+
+
+def ensure_position_ledger(engine):
+    """Add the ledger columns to an existing trade table and fill the counters on first run"""
+    existing = {column['name'] for column in inspect(engine).get_columns('trade')}
+    missing = [name for name in LEDGER_COLUMNS if name not in existing]
+    if not missing:
+        return
+    with engine.begin() as connection:
+        for name in missing:
+            connection.execute(text(f'ALTER TABLE trade ADD COLUMN {name} {LEDGER_COLUMNS[name]}'))
+        rebuild_open_quantities(connection)
+
+
+def _expire(trade_id):
+    # The row changed behind the session's back; reload the ledger columns on next access
+    trade = db.session.identity_map.get(db.session.identity_key(Trade, trade_id))
+    if trade is not None:
+        db.session.expire(trade, ['open_quantity_units', 'version', 'status'])
+
+
+def record_entry(trade_id, quantity):
+    """Add an entry's quantity to the trade's open quantity"""
+    units = to_fixed(quantity, QUANTITY_DIGITS)
+    db.session.execute(
+        update(Trade.__table__).where(Trade.id == trade_id).values(
+            open_quantity_units=Trade.open_quantity_units + units, version=Trade.version + 1
+        )
+    )
+    _expire(trade_id)
+
+
+def check_close(trade):
+    """Refuse to mark a trade Closed by hand while quantity is still open
+
+    Only exits take quantity off the ledger, so a manual close must find it at
+    zero. The counter is read from the trade as loaded; the flush that saves the
+    new status only matches that same version, so an entry or exit committed in
+    between makes it fail with StaleDataError rather than close an open position.
+    """
+    if trade.status != 'Closed' and trade.open_quantity_units > 0:
+        raise OpenPosition(trade.open_quantity_units)
+
+
+def apply_exit(trade_id, quantity):
+    """Take an exit's quantity off the trade's open quantity; returns the units still open
+
+    A trade whose open quantity reaches zero is marked Closed in the same UPDATE.
+    Raises InsufficientQuantity when the exit is larger than what is open and
+    LedgerConflict when it loses the race MAX_ATTEMPTS times in a row.
+    """
+    units = to_fixed(quantity, QUANTITY_DIGITS)
+    if units <= 0:
+        raise ValueError('Exit quantity must be positive')
+    delay = RETRY_DELAY
+    for _ in range(MAX_ATTEMPTS):
+        version, open_units = db.session.execute(
+            select(Trade.version, Trade.open_quantity_units).where(Trade.id == trade_id)
+        ).one()
+        if units > open_units:
+            raise InsufficientQuantity(units, open_units)
+
+        remaining = open_units - units
+        values = {'open_quantity_units': remaining, 'version': version + 1}
+        if remaining == 0:
+            values['status'] = 'Closed'
+        applied = db.session.execute(
+            update(Trade.__table__).where(
+                Trade.id == trade_id, Trade.version == version, Trade.open_quantity_units == open_units
+            ).values(**values)
+        ).rowcount
+        if applied:
+            _expire(trade_id)
+            return remaining
+        time.sleep(delay)
+        delay *= 2
+    raise LedgerConflict(f'Trade {trade_id} is being changed concurrently; try again')
@@ -0,0 +1,159 @@
+"""Local store of market prices imported from files, used to mark open trades to market
+
+Files are CSV with a header row (Parquet too when pyarrow is installed). The
+columns recognised are an instrument (instrument, symbol or ticker), a time
+(bar_time, time, timestamp, datetime or date; ISO 8601 or epoch seconds or
+milliseconds) and either open/high/low/close bars or a single price for ticks.
+Rows are upserted on (instrument, time), so re-importing a file is harmless.
+"""
+import csv
+import os
+from datetime import datetime, timezone
+import click
+from sqlalchemy import select, func, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.user import db
+from src.models.price import PriceBar
+
+# Optional; only needed to import Parquet files
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+IMPORT_BATCH = 1000
+
+# Accepted header names for each field, lower-cased
+COLUMN_ALIASES = {
+    'instrument': ('instrument', 'symbol', 'ticker'),
+    'bar_time': ('bar_time', 'time', 'timestamp', 'datetime', 'date'),
+    'open_price': ('open', 'open_price'),
+    'high_price': ('high', 'high_price'),
+    'low_price': ('low', 'low_price'),
+    'close_price': ('close', 'close_price'),
+    'price': ('price', 'last'),
+    'volume': ('volume', 'size'),
+}
+
+EPOCH_MILLISECONDS = 10 ** 11  # Epoch numbers above this are taken as milliseconds
+
+
+def normalize_instrument(instrument):
+    return instrument.strip().upper()
+
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+        seconds = float(value)
+        if seconds > EPOCH_MILLISECONDS:
+            seconds /= 1000
+        return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+    else:
+        moment = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _field(record, name):
+    for alias in COLUMN_ALIASES[name]:
+        value = record.get(alias)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def parse_bar(record, instrument=None):
+    """price_bar values from one file record whose keys are lower-cased headers"""
+    instrument = instrument or _field(record, 'instrument')
+    moment = _field(record, 'bar_time')
+    if not instrument or moment is None:
+        raise ValueError('Each row needs an instrument and a time')
+    close = _field(record, 'close_price') or _field(record, 'price')
+    if close is None:
+        raise ValueError('Each row needs a close or a price')
+    close = float(close)
+    volume = _field(record, 'volume')
+    return {
+        'instrument': normalize_instrument(instrument),
+        'bar_time': _parse_time(moment),
+        'open_price': float(_field(record, 'open_price') or close),
+        'high_price': float(_field(record, 'high_price') or close),
+        'low_price': float(_field(record, 'low_price') or close),
+        'close_price': close,
+        'volume': float(volume) if volume is not None else None
+    }
+
+
+def _upsert(bars):
+    statement = sqlite_insert(PriceBar.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['instrument', 'bar_time'],
+        set_={name: statement.excluded[name] for name in ('open_price', 'high_price', 'low_price', 'close_price', 'volume')}
+    )
+    db.session.execute(statement, bars)
+
+
+def import_bars(records, instrument=None):
+    """Upsert bars from an iterable of records keyed by header name; returns how many were stored"""
+    stored = 0
+    batch = []
+    for number, record in enumerate(records, start=1):
+        record = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+        try:
+            batch.append(parse_bar(record, instrument))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Row {number}: {e}')
+        if len(batch) == IMPORT_BATCH:
+            _upsert(batch)
+            stored += len(batch)
+            batch = []
+    if batch:
+        _upsert(batch)
+        stored += len(batch)
+    return stored
+
+
+def import_price_file(path, instrument=None):
+    """Import a CSV or Parquet file of bars or ticks; the caller commits"""
+    if os.path.splitext(path)[1].lower() == '.parquet':
+        if pq is None:
+            raise ValueError('Importing Parquet files needs pyarrow')
+        return import_bars(pq.read_table(path).to_pylist(), instrument)
+    with open(path, newline='', encoding='utf-8') as handle:
+        return import_bars(csv.DictReader(handle), instrument)
+
+
+def latest_prices(instruments, as_of=None):
+    """{instrument: (close price, bar time)} of the last bar at or before as_of for each instrument found"""
+    instruments = sorted({normalize_instrument(instrument) for instrument in instruments})
+    if not instruments:
+        return {}
+    latest = select(PriceBar.instrument, func.max(PriceBar.bar_time).label('bar_time')).where(
+        PriceBar.instrument.in_(instruments)
+    )
+    if as_of is not None:
+        latest = latest.where(PriceBar.bar_time <= as_of)
+    latest = latest.group_by(PriceBar.instrument).subquery()
+    rows = db.session.execute(
+        select(PriceBar.instrument, PriceBar.bar_time, PriceBar.close_price).join(
+            latest, and_(PriceBar.instrument == latest.c.instrument, PriceBar.bar_time == latest.c.bar_time)
+        )
+    )
+    return {row.instrument: (row.close_price, row.bar_time) for row in rows}
+
+
+def init_price_store(app):
+    """Register the import-prices command"""
+
+    @app.cli.command('import-prices')
+    @click.argument('paths', nargs=-1, required=True)
+    @click.option('--instrument', help='Instrument of every row, for files without an instrument column')
+    def import_prices_command(paths, instrument):
+        """Import bars or ticks from CSV or Parquet files into the local price store"""
+        for path in paths:
+            count = import_price_file(path, instrument)
+            db.session.commit()
+            print(f'{path}: {count} bars')
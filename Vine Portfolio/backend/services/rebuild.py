@@ -0,0 +1,49 @@
+from sqlalchemy import select, delete
+from src.models.user import db
+from src.models.account import Account
+from src.models.snapshot import AccountSnapshot
+from src.models.trade import Trade
+from src.services.jobs import register_job, JobError
+from src.services.search_index import reindex_trades
+from src.services.position_ledger import rebuild_open_quantities
+from src.services.lot_matching import rebuild_account_lots
+from src.services.snapshots import sync_account_snapshots
+from src.services.reference_cache import owns_accounts
+
+
+def _validate_rebuild(user_id, params):
+    account_ids = params.get('account_ids')
+    if account_ids is None:
+        return
+    if not isinstance(account_ids, list) or not all(isinstance(account_id, int) for account_id in account_ids):
+        raise ValueError('account_ids must be a list of integer ids')
+    if not owns_accounts(user_id, account_ids):
+        raise ValueError('Account not found')
+
+
+@register_job('rebuild_analytics', executor='process', validate=_validate_rebuild)
+def rebuild_analytics(context):
+    """Recompute equity snapshots, the search index, open-quantity counters and lots of a user's accounts"""
+    query = Account.query.filter_by(user_id=context.user_id)
+    if context.params.get('account_ids'):
+        query = query.filter(Account.id.in_(context.params['account_ids']))
+    accounts = query.order_by(Account.id).all()
+    if not accounts:
+        raise JobError('No accounts to rebuild')
+
+    snapshots = reindexed = ledgers_fixed = lots = 0
+    for number, account in enumerate(accounts):
+        context.progress(number, len(accounts), f'Rebuilding {account.name}', force=True)
+        db.session.execute(delete(AccountSnapshot).where(AccountSnapshot.account_id == account.id))
+        snapshots += sync_account_snapshots(account)
+
+        # Archived trades are reindexed too; their exit reasons come from the archive rows
+        trade_ids = db.session.execute(select(Trade.id).where(Trade.account_id == account.id)).scalars().all()
+        reindex_trades(db.session.connection(), trade_ids)
+        reindexed += len(trade_ids)
+        ledgers_fixed += rebuild_open_quantities(db.session.connection(), [account.id])
+        lots += rebuild_account_lots([account.id])
+        db.session.commit()
+
+    return {'accounts': len(accounts), 'snapshots': snapshots, 'trades_reindexed': reindexed,
+            'ledgers_fixed': ledgers_fixed, 'lots': lots}
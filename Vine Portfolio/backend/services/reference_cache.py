@@ -0,0 +1,162 @@
+"""Per-user, in-process cache of reference data: risk types, strategy tags and accounts
+
+Trade forms fetch these lists constantly and every serialized trade needs the
+names behind its strategy_tag_id and risk_type_id values. A user's reference
+data is loaded with one query per table and kept for REFERENCE_CACHE_TTL
+seconds; beyond REFERENCE_CACHE_USERS users the least recently used entry is
+evicted. A commit that creates, changes or deletes a risk type, a strategy tag
+or an account's descriptive fields drops its owner's entry. Other processes
+pick up such changes when their entry expires, or at once for ids they have
+never seen: an unknown id reloads the user's entry once, and ids still unknown
+after that are remembered as missing until the entry expires.
+"""
+import os
+import time
+from collections import OrderedDict
+from itertools import chain
+from threading import Lock
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from src.models.user import db
+from src.models.account import Account
+from src.models.risk_type import RiskType, StrategyTag
+
+# The account fields worth caching; balances change with every exit, so they are always read fresh
+ACCOUNT_FIELDS = ('id', 'name', 'broker', 'base_currency', 'trading_model', 'lot_method')
+
+
+class ReferenceData:
+    """One user's risk types, strategy tags and accounts, each keyed by id in creation order"""
+
+    __slots__ = ('risk_types', 'strategy_tags', 'accounts', 'loaded_at', 'missing')
+
+    def __init__(self, risk_types, strategy_tags, accounts):
+        self.risk_types = risk_types
+        self.strategy_tags = strategy_tags
+        self.accounts = accounts
+        self.loaded_at = time.monotonic()
+        self.missing = set()  # (kind, id) looked up and not found since loading
+
+    @classmethod
+    def load(cls, user_id):
+        risk_types = {risk_type.id: risk_type.to_dict()
+                      for risk_type in RiskType.query.filter_by(user_id=user_id).order_by(RiskType.id)}
+        strategy_tags = {tag.id: tag.to_dict()
+                         for tag in StrategyTag.query.filter_by(user_id=user_id).order_by(StrategyTag.id)}
+        columns = [getattr(Account, field) for field in ACCOUNT_FIELDS]
+        accounts = {row.id: dict(row._mapping) for row in db.session.execute(
+            select(*columns).where(Account.user_id == user_id).order_by(Account.id)
+        )}
+        return cls(risk_types, strategy_tags, accounts)
+
+
+class ReferenceCache:
+    """Bounded LRU of ReferenceData per user with a time-to-live"""
+
+    def __init__(self, max_users=1024, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = 0  # Bumped by every invalidation
+        self._lock = Lock()
+
+    def get(self, user_id, reload=False):
+        now = time.monotonic()
+        with self._lock:
+            data = self._entries.get(user_id)
+            if data is not None and not reload and now - data.loaded_at < self.ttl:
+                self._entries.move_to_end(user_id)
+                return data
+            generation = self._generation
+
+        data = ReferenceData.load(user_id)
+        with self._lock:
+            # An invalidation while loading means the rows read may already be stale
+            if self._generation == generation:
+                self._entries[user_id] = data
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+        return data
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+reference_cache = ReferenceCache(
+    int(os.environ.get('REFERENCE_CACHE_USERS', '1024')),
+    float(os.environ.get('REFERENCE_CACHE_TTL', '300'))
+)
+
+
+def reference_data(user_id):
+    """The user's cached risk types, strategy tags and accounts"""
+    return reference_cache.get(user_id)
+
+
+def invalidate_reference_data(user_id):
+    reference_cache.invalidate(user_id)
+
+
+def _lookup(user_id, kind, ids):
+    data = reference_cache.get(user_id)
+    if any(key not in getattr(data, kind) and (kind, key) not in data.missing for key in ids):
+        # Possibly created by another process since this one loaded the user's data; reloading
+        # replaces only this user's entry, and ids still unknown are not looked for again until it expires
+        data = reference_cache.get(user_id, reload=True)
+        data.missing.update((kind, key) for key in ids if key not in getattr(data, kind))
+    return getattr(data, kind)
+
+
+def strategy_tag_names(user_id, tag_ids):
+    """Names of the user's strategy tags in the order given; unknown ids are skipped"""
+    tags = _lookup(user_id, 'strategy_tags', tag_ids)
+    return [tags[tag_id]['name'] for tag_id in tag_ids if tag_id in tags]
+
+
+def risk_type_name(user_id, risk_type_id):
+    """Name of one of the user's risk types, or None"""
+    if risk_type_id is None:
+        return None
+    risk_type = _lookup(user_id, 'risk_types', (risk_type_id,)).get(risk_type_id)
+    return risk_type['name'] if risk_type else None
+
+
+def owns_accounts(user_id, account_ids):
+    """Whether every one of the account ids belongs to the user"""
+    accounts = _lookup(user_id, 'accounts', account_ids)
+    return all(account_id in accounts for account_id in account_ids)
+
+
+def _changes_reference_data(obj, session):
+    if isinstance(obj, (RiskType, StrategyTag)):
+        return True
+    if isinstance(obj, Account):
+        if obj in session.new or obj in session.deleted:
+            return True
+        state = inspect(obj)
+        return any(state.attrs[field].history.has_changes() for field in ACCOUNT_FIELDS)
+    return False
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_reference_changes(session, flush_context):
+    """Remember whose reference data this transaction touched"""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if _changes_reference_data(obj, session) and obj.user_id is not None:
+            session.info.setdefault('reference_users', set()).add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_reference_data(session):
+    # Rolled-back changes may have been cached by a read inside the transaction too
+    for user_id in session.info.pop('reference_users', ()):
+        reference_cache.invalidate(user_id)
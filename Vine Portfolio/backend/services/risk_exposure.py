@@ -0,0 +1,140 @@
+"""Open risk-to-stop across a user's portfolio, grouped by account, instrument, currency and risk type
+
+The risk of an open trade is what stopping out its open quantity would lose
+from the average entry; a stop already past the entry locks in profit and
+counts as no risk. Open trades without a stop loss carry unbounded risk and are
+counted as unprotected instead. Positions are loaded in one pass as fixed-point
+units, their risk is summed in integer cents at the finest grain, and the
+coarser groupings are rolled up from those rows. Balances and peaks are the
+accounts' running figures from closed-trade P&L, as the drawdown alerts see them.
+"""
+from sqlalchemy import select
+from src.models.user import db
+from src.models.account import Account
+from src.services.alerts import running_balances
+from src.services.mark_to_market import open_positions
+from src.services.money import from_cents, percent_of, open_risk
+from src.services.reference_cache import risk_type_name
+
+
+def _percentage(part, whole):
+    return round(part / whole * 100, 2) if whole > 0 else None
+
+
+def open_risk_groups(user_id, account_ids=None):
+    """(account_id, instrument, risk_type_id, positions, unprotected, open_risk) rows of the user's open trades
+
+    open_risk is in cents.
+    """
+    groups = {}
+    for position in open_positions(user_id, account_ids):
+        stop = position['stop_loss_price']
+        key = (position['account_id'], position['instrument'], position['risk_type_id'])
+        group = groups.setdefault(key, [0, 0, 0])
+        group[0] += 1
+        if not stop:
+            group[1] += 1
+            continue
+        group[2] += open_risk(position['is_long'], stop, position['open_qty'],
+                              position['entry_qty'], position['entry_value'])
+    return [key + tuple(group) for key, group in groups.items()]
+
+
+def _account_limits(user_id, account_ids=None):
+    """Balance and room left above the drawdown limit of each of the user's accounts, in cents"""
+    query = select(
+        Account.id, Account.name, Account.base_currency, Account.max_drawdown
+    ).where(Account.user_id == user_id).order_by(Account.id)
+    if account_ids:
+        query = query.where(Account.id.in_(account_ids))
+    rows = db.session.execute(query).all()
+    balances = running_balances(row.id for row in rows)
+
+    limits = {}
+    for row in rows:
+        balance, peak_balance = balances[row.id]
+        room = None
+        if row.max_drawdown:
+            # The same line the max drawdown alert is raised at
+            room = balance - (peak_balance - percent_of(peak_balance, row.max_drawdown))
+        limits[row.id] = {
+            'name': row.name,
+            'currency': row.base_currency,
+            'balance': balance,
+            'max_drawdown': float(row.max_drawdown) if row.max_drawdown else None,
+            'drawdown_room': room
+        }
+    return limits
+
+
+def _group():
+    return {'positions': 0, 'unprotected_positions': 0, 'open_risk': 0, 'accounts': set()}
+
+
+def _group_dict(group, limits):
+    balance = sum(limits[account_id]['balance'] for account_id in group['accounts'])
+    return {
+        'positions': group['positions'],
+        'unprotected_positions': group['unprotected_positions'],
+        'accounts': len(group['accounts']),
+        'open_risk': from_cents(group['open_risk']),
+        'open_risk_percentage': _percentage(group['open_risk'], balance)
+    }
+
+
+def risk_exposure(user_id, account_ids=None):
+    """Open risk of the user's accounts with rollups by instrument, currency and risk type
+
+    Rollup percentages are of the combined balance of the accounts holding the
+    exposure; groupings other than by account are kept per currency so amounts
+    in different currencies are never added together.
+    """
+    limits = _account_limits(user_id, account_ids)
+    by_account = {account_id: dict(_group(), accounts={account_id}) for account_id in limits}
+    by_instrument, by_currency, by_risk_type = {}, {}, {}
+
+    for account_id, instrument, risk_type_id, positions, unprotected, risk in open_risk_groups(user_id, account_ids):
+        currency = limits[account_id]['currency']
+        for group in (by_account[account_id],
+                      by_instrument.setdefault((instrument, currency), _group()),
+                      by_currency.setdefault(currency, _group()),
+                      by_risk_type.setdefault((risk_type_id, currency), _group())):
+            group['positions'] += positions
+            group['unprotected_positions'] += unprotected
+            group['open_risk'] += risk
+            group['accounts'].add(account_id)
+
+    accounts = []
+    for account_id, group in by_account.items():
+        limit = limits[account_id]
+        room = limit['drawdown_room']
+        figures = _group_dict(group, limits)
+        del figures['accounts']
+        accounts.append(dict(
+            figures,
+            account_id=account_id,
+            name=limit['name'],
+            currency=limit['currency'],
+            balance=from_cents(limit['balance']),
+            max_drawdown=limit['max_drawdown'],
+            drawdown_room=from_cents(room) if room is not None else None,
+            # A stop-out of everything open would take the account through its drawdown limit
+            exceeds_drawdown_limit=room is not None and group['open_risk'] > room
+        ))
+    # Flagged accounts first, then by share of the balance at risk
+    accounts.sort(key=lambda item: (not item['exceeds_drawdown_limit'], -(item['open_risk_percentage'] or 0)))
+
+    def ranked(groups):
+        return sorted(groups, key=lambda item: item['open_risk'], reverse=True)
+
+    return {
+        'accounts': accounts,
+        'by_instrument': ranked(dict(_group_dict(group, limits), instrument=instrument, currency=currency)
+                                for (instrument, currency), group in by_instrument.items()),
+        'by_currency': ranked(dict(_group_dict(group, limits), currency=currency)
+                              for currency, group in by_currency.items()),
+        'by_risk_type': ranked(dict(_group_dict(group, limits), risk_type_id=risk_type_id,
+                                    risk_type=risk_type_name(user_id, risk_type_id), currency=currency)
+                               for (risk_type_id, currency), group in by_risk_type.items()),
+        'flagged_account_ids': [item['account_id'] for item in accounts if item['exceeds_drawdown_limit']]
+    }
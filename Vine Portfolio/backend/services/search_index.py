@@ -0,0 +1,141 @@
+import html
+import re
+from collections import namedtuple
+from sqlalchemy import event, select, text, bindparam
+from sqlalchemy.orm import Session
+from src.models.trade import Trade, TradeExit
+from src.models.archive import TradeArchive
+
+SEARCH_TABLE = 'trade_search'
+
+# bm25 weights follow the column order below; unindexed columns get zero
+SEARCH_WEIGHTS = '3.0, 5.0, 1.0, 2.0, 0.0, 0.0'
+
+CREATE_INDEX_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    trade_name, instrument, notes, exit_reasons,
+    account_id UNINDEXED, user_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+DELETE_SQL = text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN :trade_ids').bindparams(
+    bindparam('trade_ids', expanding=True)
+)
+
+INSERT_SQL = f"""
+INSERT INTO {SEARCH_TABLE} (rowid, trade_name, instrument, notes, exit_reasons, account_id, user_id)
+SELECT t.id, coalesce(t.trade_name, ''), t.instrument, coalesce(t.notes, ''),
+       coalesce(group_concat(x.exit_reason, ' '), ''), t.account_id, a.user_id
+FROM trade t
+JOIN account a ON a.id = t.account_id
+LEFT JOIN trade_exit x ON x.trade_id = t.id
+"""
+
+REINDEX_SQL = text(INSERT_SQL + ' WHERE t.id IN :trade_ids GROUP BY t.id').bindparams(
+    bindparam('trade_ids', expanding=True)
+)
+
+REBUILD_SQL = text(INSERT_SQL + ' GROUP BY t.id')
+
+UPDATE_EXIT_REASONS_SQL = text(f'UPDATE {SEARCH_TABLE} SET exit_reasons = :exit_reasons WHERE rowid = :trade_id')
+
+# snippet() wraps matches in these; the text around them is escaped before they become <mark> tags
+MATCH_START, MATCH_END = '\ue000', '\ue001'
+
+SearchMatch = namedtuple('SearchMatch', ['trade_id', 'score', 'snippet'])
+
+
+def _is_sqlite(bind):
+    return bind.dialect.name == 'sqlite'
+
+
+def ensure_search_index(engine):
+    """Create the FTS5 table if needed and fill it from existing trades on first run"""
+    if not _is_sqlite(engine):
+        return
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_INDEX_SQL))
+        indexed = connection.execute(text(f'SELECT count(*) FROM {SEARCH_TABLE}')).scalar()
+        if not indexed:
+            connection.execute(REBUILD_SQL)
+            _index_archived_exit_reasons(connection)
+
+
+def _index_archived_exit_reasons(connection, trade_ids=None):
+    """Fill in the exit reasons of archived trades, whose exits live in the archive payload"""
+    query = select(TradeArchive.trade_id, TradeArchive.payload)
+    if trade_ids is not None:
+        query = query.where(TradeArchive.trade_id.in_(trade_ids))
+    updates = []
+    for trade_id, payload in connection.execute(query):
+        reasons = [row['exit_reason'] for row in TradeArchive.unpack(payload)['exits'] if row.get('exit_reason')]
+        if reasons:
+            updates.append({'trade_id': trade_id, 'exit_reasons': ' '.join(reasons)})
+    if updates:
+        connection.execute(UPDATE_EXIT_REASONS_SQL, updates)
+
+
+def reindex_trades(connection, trade_ids):
+    """Replace the index rows of the given trades with their current contents"""
+    trade_ids = sorted(trade_ids)
+    if not trade_ids:
+        return
+    connection.execute(DELETE_SQL, {'trade_ids': trade_ids})
+    connection.execute(REINDEX_SQL, {'trade_ids': trade_ids})
+    _index_archived_exit_reasons(connection, trade_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Reindex every trade whose searchable fields or exits were touched by this flush"""
+    trade_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Trade) and obj.id is not None:
+            trade_ids.add(obj.id)
+        elif isinstance(obj, TradeExit) and obj.trade_id is not None:
+            trade_ids.add(obj.trade_id)
+
+    if trade_ids:
+        connection = session.connection()
+        if _is_sqlite(connection):
+            reindex_trades(connection, trade_ids)
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r'\w+', query or '', re.UNICODE)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _highlight(snippet):
+    """Escape the indexed text, then turn the match markers into <mark> tags"""
+    return html.escape(snippet or '').replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search_trades(connection, user_id, query, account_id=None, limit=20, offset=0):
+    """Return (total, matches) of ranked matches with an HTML-safe highlighted snippet"""
+    match = build_match_query(query)
+    if not match:
+        return 0, []
+
+    conditions = f'{SEARCH_TABLE} MATCH :match AND user_id = :user_id'
+    params = {'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset,
+              'match_start': MATCH_START, 'match_end': MATCH_END}
+    if account_id is not None:
+        conditions += ' AND account_id = :account_id'
+        params['account_id'] = account_id
+
+    total = connection.execute(
+        text(f'SELECT count(*) FROM {SEARCH_TABLE} WHERE {conditions}'), params
+    ).scalar()
+    rows = connection.execute(text(f"""
+        SELECT rowid AS trade_id, bm25({SEARCH_TABLE}, {SEARCH_WEIGHTS}) AS score,
+               snippet({SEARCH_TABLE}, -1, :match_start, :match_end, '...', 12) AS snippet
+        FROM {SEARCH_TABLE}
+        WHERE {conditions}
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), params).all()
+    return total, [SearchMatch(row.trade_id, row.score, _highlight(row.snippet)) for row in rows]
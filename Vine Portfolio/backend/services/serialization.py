@@ -0,0 +1,266 @@
+import json
+from flask import Response, request
+from sqlalchemy import select, type_coerce, Float, String, Numeric, Date, DateTime
+from src.models.user import db, User
+from src.models.account import Account
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.risk_type import RiskType, StrategyTag, TradeStrategyTag
+from src.models.change_log import ChangeLog
+from src.models.snapshot import AccountSnapshot
+from src.models.archive import TradeArchive
+
+# Optional fast encoders; the stdlib json module is used when they are not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def _float_converter(scale):
+    """Floats rounded to the column scale, as the ORM's Decimal conversion would"""
+    if scale is None:
+        return float
+    return lambda value: round(float(value), scale)
+
+
+def _to_iso(value):
+    """ISO 8601 text from either a datetime or SQLite's stored 'YYYY-MM-DD HH:MM:SS' text"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # datetime.isoformat leaves out a zero microsecond part
+        if value.endswith('.000000'):
+            value = value[:-7]
+        return value.replace(' ', 'T', 1)
+    return value.isoformat()
+
+
+class DTO:
+    """Slotted, JSON-ready snapshot of a model row; the slots name the columns to load"""
+    __slots__ = ()
+    model = None
+    _plan = None
+
+    @classmethod
+    def plan(cls):
+        """Column expressions and converters, built once per DTO class"""
+        if cls._plan is None:
+            columns, converters = [], []
+            for name in cls.__slots__:
+                column = getattr(cls.model, name)
+                column_type = cls.model.__table__.c[name].type
+                if isinstance(column_type, Numeric):
+                    # Read numerics as floats directly, skipping the Decimal round trip
+                    columns.append(type_coerce(column, Float))
+                    converters.append(_float_converter(column_type.scale))
+                elif isinstance(column_type, (DateTime, Date)):
+                    # Read timestamps as stored text instead of parsing them into datetimes
+                    columns.append(type_coerce(column, String))
+                    converters.append(_to_iso)
+                else:
+                    columns.append(column)
+                    converters.append(None)
+            cls._plan = (columns, tuple(converters))
+        return cls._plan
+
+    @classmethod
+    def select(cls):
+        return select(*cls.plan()[0])
+
+    @classmethod
+    def from_row(cls, row):
+        obj = object.__new__(cls)
+        for name, converter, value in zip(cls.__slots__, cls.plan()[1], row):
+            setattr(obj, name, converter(value) if converter and value is not None else value)
+        return obj
+
+    @classmethod
+    def from_dict(cls, data):
+        obj = object.__new__(cls)
+        for name in cls.__slots__:
+            setattr(obj, name, data[name])
+        return obj
+
+    @classmethod
+    def load(cls, *criteria, order_by=None):
+        """Load DTOs straight from the database without building ORM objects"""
+        query = cls.select().where(*criteria)
+        if order_by is not None:
+            query = query.order_by(order_by)
+        return [cls.from_row(row) for row in db.session.execute(query)]
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UserDTO(DTO):
+    __slots__ = ('id', 'email', 'primary_currency', 'created_at', 'updated_at')
+    model = User
+
+
+class AccountDTO(DTO):
+    __slots__ = ('id', 'user_id', 'name', 'broker', 'base_currency', 'initial_capital', 'current_balance',
+                 'profit_target', 'max_drawdown', 'trading_model', 'lot_method', 'created_at', 'updated_at')
+    model = Account
+
+
+class TradeEntryDTO(DTO):
+    __slots__ = ('id', 'trade_id', 'entry_date', 'entry_price', 'quantity', 'commission', 'created_at')
+    model = TradeEntry
+
+
+class TradeExitDTO(DTO):
+    __slots__ = ('id', 'trade_id', 'exit_date', 'exit_price', 'quantity', 'commission', 'exit_reason', 'created_at')
+    model = TradeExit
+
+
+class TradeCostDTO(DTO):
+    __slots__ = ('id', 'trade_id', 'cost_type', 'amount', 'description', 'created_at')
+    model = TradeCost
+
+
+class RiskTypeDTO(DTO):
+    __slots__ = ('id', 'user_id', 'name', 'description', 'default_risk_percentage', 'created_at', 'updated_at')
+    model = RiskType
+
+
+class StrategyTagDTO(DTO):
+    __slots__ = ('id', 'user_id', 'name', 'description', 'created_at', 'updated_at')
+    model = StrategyTag
+
+
+class TradeStrategyTagDTO(DTO):
+    __slots__ = ('id', 'trade_id', 'strategy_tag_id', 'created_at')
+    model = TradeStrategyTag
+
+
+class ChangeLogDTO(DTO):
+    __slots__ = ('id', 'user_id', 'entity', 'entity_id', 'operation', 'created_at')
+    model = ChangeLog
+
+
+class AccountSnapshotDTO(DTO):
+    __slots__ = ('account_id', 'snapshot_date', 'balance', 'realized_pnl', 'open_risk', 'peak_balance',
+                 'drawdown', 'open_trades')
+    model = AccountSnapshot
+
+
+class TradeDTO(DTO):
+    __slots__ = ('id', 'account_id', 'trade_name', 'instrument', 'trade_type', 'status', 'stop_loss_price',
+                 'take_profit_price', 'risk_type_id', 'notes', 'created_at', 'updated_at', 'version')
+    model = Trade
+
+
+def _group_by_trade(dtos):
+    grouped = {}
+    for dto in dtos:
+        grouped.setdefault(dto.trade_id, []).append(dto)
+    return grouped
+
+
+def load_trade_children(trade_ids):
+    """Entries, exits, costs and tag names for many trades with one query per table"""
+    if not trade_ids:
+        return {}, {}, {}, {}
+    entries = _group_by_trade(TradeEntryDTO.load(TradeEntry.trade_id.in_(trade_ids), order_by=TradeEntry.id))
+    exits = _group_by_trade(TradeExitDTO.load(TradeExit.trade_id.in_(trade_ids), order_by=TradeExit.id))
+    costs = _group_by_trade(TradeCostDTO.load(TradeCost.trade_id.in_(trade_ids), order_by=TradeCost.id))
+
+    # Archived trades have no child rows left; read them from their archive row instead
+    missing = [trade_id for trade_id in trade_ids if trade_id not in entries]
+    if missing:
+        archived = db.session.execute(
+            select(TradeArchive.trade_id, TradeArchive.payload).where(TradeArchive.trade_id.in_(missing))
+        )
+        for trade_id, payload in archived:
+            children = TradeArchive(payload=payload).load()
+            entries[trade_id] = [TradeEntryDTO.from_dict(row) for row in children['entries']]
+            exits[trade_id] = [TradeExitDTO.from_dict(row) for row in children['exits']]
+            costs[trade_id] = [TradeCostDTO.from_dict(row) for row in children['costs']]
+
+    tags = {}
+    tag_rows = db.session.execute(
+        select(TradeStrategyTag.trade_id, StrategyTag.name).join(
+            StrategyTag, StrategyTag.id == TradeStrategyTag.strategy_tag_id
+        ).where(TradeStrategyTag.trade_id.in_(trade_ids)).order_by(TradeStrategyTag.id)
+    )
+    for trade_id, name in tag_rows:
+        tags.setdefault(trade_id, []).append(name)
+    return entries, exits, costs, tags
+
+
+def serialize_trades(trades):
+    """Row-oriented trade payloads matching Trade.to_dict"""
+    entries, exits, costs, tags = load_trade_children([trade.id for trade in trades])
+    payload = []
+    for trade in trades:
+        data = trade.as_dict()
+        data['entries'] = [dto.as_dict() for dto in entries.get(trade.id, ())]
+        data['exits'] = [dto.as_dict() for dto in exits.get(trade.id, ())]
+        data['costs'] = [dto.as_dict() for dto in costs.get(trade.id, ())]
+        data['strategy_tags'] = tags.get(trade.id, [])
+        payload.append(data)
+    return payload
+
+
+def to_columns(dtos, dto_class):
+    """Column-oriented block: field names plus one value array per field"""
+    return {
+        'fields': list(dto_class.__slots__),
+        'columns': [list(column) for column in zip(*(dto.as_tuple() for dto in dtos))] or [[] for _ in dto_class.__slots__],
+        'count': len(dtos)
+    }
+
+
+def serialize_trades_columnar(trades):
+    """Trades and their children as column blocks linked by trade_id"""
+    entries, exits, costs, tags = load_trade_children([trade.id for trade in trades])
+
+    def flatten(grouped):
+        return [dto for trade in trades for dto in grouped.get(trade.id, ())]
+
+    return {
+        'trades': to_columns(trades, TradeDTO),
+        'entries': to_columns(flatten(entries), TradeEntryDTO),
+        'exits': to_columns(flatten(exits), TradeExitDTO),
+        'costs': to_columns(flatten(costs), TradeCostDTO),
+        'strategy_tags': {
+            'fields': ['trade_id', 'name'],
+            'columns': [
+                [trade.id for trade in trades for _ in tags.get(trade.id, ())],
+                [name for trade in trades for name in tags.get(trade.id, ())]
+            ]
+        }
+    }
+
+
+def wants_columns():
+    return request.args.get('format') == 'columns'
+
+
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def render(payload):
+    """Encode a payload as MessagePack when the client prefers it, otherwise as JSON"""
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES, default='application/json')
+    if msgpack is not None and best in MSGPACK_MIMETYPES:
+        response = Response(msgpack.packb(payload, use_bin_type=True), mimetype='application/msgpack')
+    else:
+        response = Response(encode_json(payload), mimetype='application/json')
+    # The body depends on Accept, so shared caches must not hand one encoding to clients asking for the other
+    response.vary.add('Accept')
+    return response
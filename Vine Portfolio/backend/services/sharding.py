@@ -0,0 +1,343 @@
+"""Per-user sharding of account and trade data across several SQLite databases
+
+The main database becomes a directory: it keeps users, jobs and the user_shard
+table saying where each user's data lives. With DATABASE_SHARDS=N above one,
+every user is assigned one of N shard files (shard_0.db, ...) by rendezvous
+hashing of the user id, and each authenticated request runs with that shard
+as current_shard so the session sends every query on user data there. Users
+without a directory entry keep their data in the directory database until
+`flask rebalance-shards` moves them.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.engine import make_url
+from src.models.user import db, User, current_shard, DIRECTORY_TABLES
+from src.models.shard import UserShard
+from src.models.account import Account
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.risk_type import RiskType, StrategyTag, TradeStrategyTag
+from src.models.archive import TradeSummary, TradeArchive
+from src.models.lot import TradeLot
+from src.models.snapshot import AccountSnapshot
+from src.models.alert import AccountAlert, AccountAlertState
+from src.models.change_log import ChangeLog
+from src.services.search_index import ensure_search_index, reindex_trades, DELETE_SQL
+from src.services.position_ledger import ensure_position_ledger
+from src.services.lot_matching import ensure_lot_matching
+from src.services.reference_cache import invalidate_reference_data
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH = 500
+
+# A user's tables in copy order, parents first: (model, owner column, foreign keys as column -> table)
+USER_TABLES = (
+    (Account, 'user', {}),
+    (RiskType, 'user', {}),
+    (StrategyTag, 'user', {}),
+    (Trade, 'account', {'account_id': 'account', 'risk_type_id': 'risk_type'}),
+    (TradeEntry, 'trade', {'trade_id': 'trade'}),
+    (TradeExit, 'trade', {'trade_id': 'trade'}),
+    (TradeCost, 'trade', {'trade_id': 'trade'}),
+    (TradeStrategyTag, 'trade', {'trade_id': 'trade', 'strategy_tag_id': 'strategy_tag'}),
+    (TradeSummary, 'trade', {'trade_id': 'trade', 'account_id': 'account'}),
+    (TradeArchive, 'trade', {'trade_id': 'trade', 'account_id': 'account'}),
+    (TradeLot, 'trade', {'trade_id': 'trade', 'account_id': 'account',
+                         'entry_id': 'trade_entry', 'exit_id': 'trade_exit'}),
+    (AccountSnapshot, 'account', {'account_id': 'account'}),
+    (AccountAlertState, 'account', {'account_id': 'account'}),
+    (AccountAlert, 'account', {'account_id': 'account', 'trade_id': 'trade'}),
+    (ChangeLog, 'user', {}),
+)
+
+# Change-log entities and the table their ids point into
+CHANGE_ENTITIES = {'account': 'account', 'trade': 'trade', 'risk_type': 'risk_type', 'strategy_tag': 'strategy_tag'}
+
+
+def shard_key(index):
+    """Bind key of a shard database; None stands for the directory database"""
+    return None if index is None else f'shard_{index}'
+
+
+def shard_for(user_id, shard_count):
+    """Shard index the hash assigns to a user, or None when sharding is off
+
+    Rendezvous hashing: growing from N to N+1 shards only moves the users whose
+    highest score is the new shard.
+    """
+    if shard_count <= 1:
+        return None
+    return max(range(shard_count), key=lambda index: hashlib.sha1(f'{user_id}:{index}'.encode()).digest())
+
+
+def shard_count():
+    return current_app.config.get('DATABASE_SHARDS', 1)
+
+
+def shard_keys():
+    """Bind keys of every database that can hold user data, the directory first"""
+    return [None] + [shard_key(index) for index in range(shard_count()) if shard_count() > 1]
+
+
+@contextmanager
+def use_shard(key):
+    """Route the session's queries on user data to one database for the duration of the block"""
+    token = current_shard.set(key)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def locate_user(user_id):
+    """(bind key, moving) of the database holding a user's data"""
+    if shard_count() <= 1:
+        return None, False
+    row = db.session.execute(
+        select(UserShard.shard, UserShard.moving).where(UserShard.user_id == user_id)
+    ).first()
+    if row is None:
+        return None, False
+    return shard_key(row.shard), row.moving
+
+
+def assign_shard(user_id):
+    """Record the hashed shard of a newly registered user; it commits with the user"""
+    index = shard_for(user_id, shard_count())
+    if index is not None:
+        db.session.add(UserShard(user_id=user_id, shard=index))
+
+
+def in_each_shard(task):
+    """Run task() against every database in turn, committing after each; returns the summed counts"""
+    total = 0
+    for key in shard_keys():
+        with use_shard(key):
+            try:
+                total += task() or 0
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                # Ids repeat across shards, so objects must not carry over in the identity map
+                db.session.remove()
+    return total
+
+
+def _owned(table, scope, user_id):
+    """Criteria matching a user's rows of a table"""
+    if scope == 'user':
+        return table.c.user_id == user_id
+    accounts = select(Account.id).where(Account.user_id == user_id)
+    if scope == 'account':
+        return table.c.account_id.in_(accounts)
+    return table.c.trade_id.in_(select(Trade.id).where(Trade.account_id.in_(accounts)))
+
+
+def _allocate_ids(source, target, table, criteria, renumber_all=False):
+    """Map the source ids that are already taken in the target to fresh ones above both maxima"""
+    source_ids = source.execute(select(table.c.id).where(criteria).order_by(table.c.id)).scalars().all()
+    if not source_ids:
+        return {}
+    taken = set()
+    for start in range(0, len(source_ids), COPY_BATCH):
+        batch = source_ids[start:start + COPY_BATCH]
+        taken.update(target.execute(select(table.c.id).where(table.c.id.in_(batch))).scalars())
+    if not taken:
+        return {}
+    next_id = max(target.execute(select(func.max(table.c.id))).scalar() or 0, source_ids[-1]) + 1
+    moved = source_ids if renumber_all else [old for old in source_ids if old in taken]
+    return {old: next_id + offset for offset, old in enumerate(moved)}
+
+
+def _repack(payload, trade_id):
+    children = json.loads(zlib.decompress(payload))
+    for rows in children.values():
+        for row in rows:
+            if 'trade_id' in row:
+                row['trade_id'] = trade_id
+    return TradeArchive.pack(children['entries'], children['exits'], children['costs'])
+
+
+def copy_user(source, target, user_id):
+    """Copy a user's rows between two connections, keeping ids unless the target already uses them
+
+    Returns {table name: {old id: new id}} for the ids that had to change.
+    """
+    remaps = {}
+    for model, scope, references in USER_TABLES:
+        table = model.__table__
+        criteria = _owned(table, scope, user_id)
+        remap = {}
+        if 'id' in table.c:
+            # Change-log ids are sync cursors, so they are renumbered as a block to keep their order
+            remap = _allocate_ids(source, target, table, criteria, renumber_all=model is ChangeLog)
+        remaps[table.name] = remap
+
+        rows = source.execute(
+            select(table).where(criteria).order_by(*table.primary_key.columns).execution_options(yield_per=COPY_BATCH)
+        ).mappings()
+        for batch in rows.partitions(COPY_BATCH):
+            values = []
+            for row in batch:
+                row = dict(row)
+                if remap:
+                    row['id'] = remap.get(row['id'], row['id'])
+                if model is TradeArchive and row['trade_id'] in remaps['trade']:
+                    row['payload'] = _repack(row['payload'], remaps['trade'][row['trade_id']])
+                for column, referenced in references.items():
+                    if row[column] is not None:
+                        row[column] = remaps[referenced].get(row[column], row[column])
+                if model is ChangeLog and row['entity'] in CHANGE_ENTITIES:
+                    row['entity_id'] = remaps[CHANGE_ENTITIES[row['entity']]].get(row['entity_id'], row['entity_id'])
+                values.append(row)
+            target.execute(insert(table), values)
+    return remaps
+
+
+def _record_renamed(target, user_id, remaps):
+    """Tell syncing clients about entities whose ids changed: the old id is gone, the new one is current"""
+    changes = []
+    for entity, table_name in CHANGE_ENTITIES.items():
+        for old, new in remaps[table_name].items():
+            changes.append({'user_id': user_id, 'entity': entity, 'entity_id': old, 'operation': 'delete'})
+            changes.append({'user_id': user_id, 'entity': entity, 'entity_id': new, 'operation': 'upsert'})
+    # Trades whose fills got new ids carry those ids in their payload
+    refreshed = set()
+    for model in (TradeEntry, TradeExit, TradeCost):
+        remap = remaps[model.__table__.name]
+        if remap:
+            refreshed.update(target.execute(
+                select(model.trade_id).where(model.id.in_(list(remap.values())))
+            ).scalars())
+    refreshed -= set(remaps['trade'].values())
+    changes.extend({'user_id': user_id, 'entity': 'trade', 'entity_id': trade_id, 'operation': 'upsert'}
+                   for trade_id in sorted(refreshed))
+    if changes:
+        now = datetime.utcnow()
+        target.execute(insert(ChangeLog.__table__), [dict(change, created_at=now) for change in changes])
+
+
+def delete_user_data(connection, user_id):
+    """Remove a user's rows from a database, children first"""
+    trade_ids = connection.execute(
+        select(Trade.id).where(_owned(Trade.__table__, 'account', user_id))
+    ).scalars().all()
+    for start in range(0, len(trade_ids), COPY_BATCH):
+        connection.execute(DELETE_SQL, {'trade_ids': trade_ids[start:start + COPY_BATCH]})
+    for model, scope, _ in reversed(USER_TABLES):
+        connection.execute(delete(model.__table__).where(_owned(model.__table__, scope, user_id)))
+
+
+def _mark_moving(user_id, shard, moving):
+    placement = db.session.get(UserShard, user_id)
+    if placement is None:
+        placement = UserShard(user_id=user_id, shard=shard)
+        db.session.add(placement)
+    placement.moving = moving
+    db.session.commit()
+    return placement
+
+
+def move_user(user_id, source_index, target_index, grace=None):
+    """Move one user's data to another database while their requests are turned away
+
+    The user is marked as moving first, so new requests get 503; after a grace
+    period for requests already running, the rows are copied in one target
+    transaction, the directory is switched and the source rows are deleted.
+    """
+    if grace is None:
+        grace = current_app.config['SHARD_MOVE_GRACE']
+    source_engine = db.engines[shard_key(source_index)]
+    target_engine = db.engines[shard_key(target_index)]
+    placement = _mark_moving(user_id, source_index, True)
+    try:
+        time.sleep(grace)
+        with source_engine.connect() as source, target_engine.begin() as target:
+            remaps = copy_user(source, target, user_id)
+            _record_renamed(target, user_id, remaps)
+            trade_ids = target.execute(
+                select(Trade.id).where(_owned(Trade.__table__, 'account', user_id))
+            ).scalars().all()
+            for start in range(0, len(trade_ids), COPY_BATCH):
+                reindex_trades(target, trade_ids[start:start + COPY_BATCH])
+    except Exception:
+        db.session.rollback()
+        _mark_moving(user_id, source_index, False)
+        raise
+
+    placement.shard = target_index
+    placement.moving = False
+    placement.moved_at = datetime.utcnow()
+    db.session.commit()
+    invalidate_reference_data(user_id)
+    # The directory already points at the copy; rows left behind by a crash here are unreachable
+    with source_engine.begin() as source:
+        delete_user_data(source, user_id)
+    return remaps
+
+
+def rebalance_shards(dry_run=False, grace=None):
+    """Move every user whose data is not where the hash puts it; returns the (user id, from, to) moves"""
+    count = shard_count()
+    placed = dict(db.session.execute(select(UserShard.user_id, UserShard.shard)).all())
+    moves = []
+    for user_id in db.session.execute(select(User.id).order_by(User.id)).scalars():
+        current, wanted = placed.get(user_id), shard_for(user_id, count)
+        if current != wanted:
+            moves.append((user_id, current, wanted))
+    if not dry_run:
+        for user_id, current, wanted in moves:
+            move_user(user_id, current, wanted, grace)
+            logger.info('Moved user %s from %s to %s', user_id, shard_key(current), shard_key(wanted))
+    return moves
+
+
+def prepare_shards():
+    """Create the user-data tables, indexes and search index in every shard database; needs an app context"""
+    tables = [table for table in db.metadata.sorted_tables if table.name not in DIRECTORY_TABLES]
+    for key in shard_keys()[1:]:
+        engine = db.engines[key]
+        db.metadata.create_all(engine, tables=tables)
+        for table in tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        ensure_search_index(engine)
+        ensure_position_ledger(engine)
+        with use_shard(key):
+            ensure_lot_matching(engine)
+
+
+def init_sharding(app):
+    """Attach the DATABASE_SHARDS shard databases next to the directory database; call before db.init_app"""
+    app.config.setdefault('DATABASE_SHARDS', int(os.environ.get('DATABASE_SHARDS', '1')))
+    app.config.setdefault('SHARD_MOVE_GRACE', float(os.environ.get('SHARD_MOVE_GRACE', '2')))
+    count = app.config['DATABASE_SHARDS']
+    if count > 1:
+        directory = make_url(app.config['SQLALCHEMY_DATABASE_URI']).database
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for index in range(count):
+            if directory in (None, '', ':memory:'):
+                uri = 'sqlite://'
+            else:
+                uri = f'sqlite:///{os.path.join(os.path.dirname(directory), f"shard_{index}.db")}'
+            binds.setdefault(shard_key(index), uri)
+
+    @app.cli.command('rebalance-shards')
+    @click.option('--dry-run', is_flag=True, help='Only list the users that would move')
+    def rebalance_shards_command(dry_run):
+        """Move users to the shard their id hashes to under DATABASE_SHARDS"""
+        moves = rebalance_shards(dry_run)
+        for user_id, current, wanted in moves:
+            print(f'User {user_id}: {shard_key(current) or "directory"} -> {shard_key(wanted) or "directory"}')
+        print(f'{"Would move" if dry_run else "Moved"} {len(moves)} users')
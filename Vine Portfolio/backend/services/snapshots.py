@@ -0,0 +1,433 @@
+import logging
+import os
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from threading import Event, Thread
+from sqlalchemy import select, insert, delete, func, case, event, inspect, type_coerce, Float, String
+from sqlalchemy.orm import Session
+from src.models.user import db
+from src.models.account import Account
+from src.models.snapshot import AccountSnapshot
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.archive import TradeSummary
+from src.services.serialization import AccountSnapshotDTO
+from src.services.trade_metrics import trade_metrics_subquery, archived_within
+from src.services.money import to_cents, cents_to_decimal
+from src.services.sharding import in_each_shard
+
+logger = logging.getLogger(__name__)
+
+# Trade attributes that move realized P&L or open risk; notes, names etc. leave snapshots valid
+TRADE_HISTORY_FIELDS = {
+    Trade: ('status', 'trade_type', 'stop_loss_price', 'account_id'),
+    TradeEntry: ('entry_date', 'entry_price', 'quantity'),
+    TradeExit: ('exit_date', 'exit_price', 'quantity'),
+    TradeCost: ('amount',)
+}
+
+
+def _as_date(value):
+    """Date part of a datetime, or of SQLite's stored 'YYYY-MM-DD HH:MM:SS' text"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date()
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min)
+
+
+def last_complete_day():
+    """The most recent UTC day that has fully ended"""
+    return datetime.utcnow().date() - timedelta(days=1)
+
+
+def parse_date_range(args):
+    """Optional start/end query parameters (YYYY-MM-DD); raises ValueError for bad input"""
+    start = date.fromisoformat(args['start']) if args.get('start') else None
+    end = date.fromisoformat(args['end']) if args.get('end') else None
+    if start and end and start > end:
+        raise ValueError('start must not be after end')
+    return start, end
+
+
+def _date_criteria(start, end):
+    criteria = []
+    if start:
+        criteria.append(AccountSnapshot.snapshot_date >= start)
+    if end:
+        criteria.append(AccountSnapshot.snapshot_date <= end)
+    return criteria
+
+
+def _first_activity_day(account):
+    """Earliest day the account could have had a balance change"""
+    first_entry = db.session.execute(
+        select(func.min(TradeEntry.entry_date)).join(Trade, Trade.id == TradeEntry.trade_id)
+        .where(Trade.account_id == account.id)
+    ).scalar()
+    first_archived = db.session.execute(
+        select(func.min(TradeSummary.opened_at)).where(TradeSummary.account_id == account.id)
+    ).scalar()
+    days = [_as_date(account.created_at or datetime.utcnow())]
+    days.extend(_as_date(value) for value in (first_entry, first_archived) if value is not None)
+    return min(days)
+
+
+def _trade_history(account_id, start, end):
+    """(opened_at, closed_at, net_pnl, risk_amount) for the account's trades that touch start..end"""
+    # Archived trades are all closed, so only those closed from start on can touch the range
+    metrics = trade_metrics_subquery(select(Trade.id).where(
+        Trade.account_id == account_id, archived_within('closed_at', _day_start(start))
+    ))
+    # Balances only move when a trade is closed, as on the account dashboard
+    closed_at = case(
+        (metrics.c.status == 'Closed', func.coalesce(metrics.c.closed_at, metrics.c.created_at)),
+        else_=None
+    )
+    query = select(
+        metrics.c.opened_at, closed_at.label('closed_at'), metrics.c.net_pnl, metrics.c.risk_amount
+    ).where(
+        metrics.c.opened_at < _day_start(end + timedelta(days=1)),
+        (closed_at.is_(None)) | (closed_at >= _day_start(start))
+    )
+    return db.session.execute(query).all()
+
+
+def build_snapshots(account_id, start, end, balance, peak_balance):
+    """Snapshot rows for every day from start to end, continuing from the balance and peak at the close of the day before start"""
+    # Cash is summed in cents so balances do not drift over long histories
+    balance, peak_balance = to_cents(balance), to_cents(peak_balance)
+    realized = defaultdict(int)
+    risk_change = defaultdict(int)
+    count_change = defaultdict(int)
+    for opened_at, closed_at, net_pnl, risk_amount in _trade_history(account_id, start, end):
+        opened, closed = _as_date(opened_at), _as_date(closed_at)
+        if closed is not None and closed <= end:
+            realized[closed] += to_cents(net_pnl)
+        # A trade counts as open at the close of every day from its opening day until the day it closes
+        first_open = max(opened, start)
+        if closed is None or closed > first_open:
+            risk = max(to_cents(risk_amount), 0)
+            risk_change[first_open] += risk
+            count_change[first_open] += 1
+            if closed is not None and closed <= end:
+                risk_change[closed] -= risk
+                count_change[closed] -= 1
+
+    rows = []
+    open_risk, open_trades = 0, 0
+    day = start
+    while day <= end:
+        open_risk += risk_change.get(day, 0)
+        open_trades += count_change.get(day, 0)
+        balance += realized.get(day, 0)
+        peak_balance = max(peak_balance, balance)
+        rows.append({
+            'account_id': account_id,
+            'snapshot_date': day,
+            'balance': cents_to_decimal(balance),
+            'realized_pnl': cents_to_decimal(realized.get(day, 0)),
+            'open_risk': cents_to_decimal(open_risk),
+            'peak_balance': cents_to_decimal(peak_balance),
+            'drawdown': round((peak_balance - balance) / peak_balance * 100, 2) if peak_balance > 0 else 0,
+            'open_trades': open_trades
+        })
+        day += timedelta(days=1)
+    return rows
+
+
+def pending_account_snapshots(account, until=None):
+    """Snapshot rows the account is missing up to until, computed from trade history but not stored"""
+    until = until or last_complete_day()
+    latest = db.session.execute(
+        select(AccountSnapshot.snapshot_date, AccountSnapshot.balance, AccountSnapshot.peak_balance)
+        .where(AccountSnapshot.account_id == account.id)
+        .order_by(AccountSnapshot.snapshot_date.desc()).limit(1)
+    ).first()
+    if latest:
+        start = latest.snapshot_date + timedelta(days=1)
+        balance, peak_balance = latest.balance, latest.peak_balance
+    else:
+        start = _first_activity_day(account)
+        balance = peak_balance = account.initial_capital
+    if start > until:
+        return []
+    return build_snapshots(account.id, start, until, balance, peak_balance)
+
+
+def sync_account_snapshots(account, until=None):
+    """Append the account's missing snapshots up to until, backfilling from trade history on the first run"""
+    rows = pending_account_snapshots(account, until)
+    if rows:
+        db.session.execute(insert(AccountSnapshot), rows)
+    return len(rows)
+
+
+def _accounts_behind(account_ids, until):
+    """Every (or the given) account whose snapshots stop before until"""
+    latest = select(AccountSnapshot.account_id, func.max(AccountSnapshot.snapshot_date)).group_by(AccountSnapshot.account_id)
+    accounts = Account.query
+    if account_ids is not None:
+        latest = latest.where(AccountSnapshot.account_id.in_(account_ids))
+        accounts = accounts.filter(Account.id.in_(account_ids))
+    latest = dict(db.session.execute(latest).all())
+    return [account for account in accounts if latest.get(account.id) is None or latest[account.id] < until]
+
+
+def pending_snapshots(account_ids, until=None):
+    """Rows sync_snapshots would write for these accounts; read paths add them to the stored days"""
+    until = until or last_complete_day()
+    return [row for account in _accounts_behind(account_ids, until) for row in pending_account_snapshots(account, until)]
+
+
+def sync_snapshots(account_ids=None, until=None):
+    """Bring every (or the given) account's snapshots up to until; returns the number of rows written"""
+    until = until or last_complete_day()
+    return sum(sync_account_snapshots(account, until) for account in _accounts_behind(account_ids, until))
+
+
+def _in_range(day, start, end):
+    return (start is None or day >= start) and (end is None or day <= end)
+
+
+def account_equity_curve(account_id, start=None, end=None, pending=()):
+    """The account's snapshots between start and end, oldest first (one index range scan)
+
+    pending holds rows not stored yet (see pending_snapshots); they follow the stored days.
+    """
+    snapshots = AccountSnapshotDTO.load(
+        AccountSnapshot.account_id == account_id, *_date_criteria(start, end),
+        order_by=AccountSnapshot.snapshot_date
+    )
+    snapshots.extend(
+        AccountSnapshotDTO.from_row([row[name] for name in AccountSnapshotDTO.__slots__])
+        for row in pending if row['account_id'] == account_id and _in_range(row['snapshot_date'], start, end)
+    )
+    return snapshots
+
+
+def _daily_totals(account_ids):
+    return select(
+        type_coerce(AccountSnapshot.snapshot_date, String).label('snapshot_date'),
+        type_coerce(func.sum(AccountSnapshot.balance), Float).label('balance'),
+        type_coerce(func.sum(AccountSnapshot.realized_pnl), Float).label('realized_pnl'),
+        type_coerce(func.sum(AccountSnapshot.open_risk), Float).label('open_risk'),
+        func.sum(AccountSnapshot.open_trades).label('open_trades')
+    ).where(AccountSnapshot.account_id.in_(account_ids)).group_by(AccountSnapshot.snapshot_date)
+
+
+def portfolio_equity_curve(account_ids, start=None, end=None, pending=()):
+    """Summed daily balances of several accounts, with drawdown from the running portfolio peak
+
+    pending rows (see pending_snapshots) are added to the stored totals of their day.
+    """
+    if not account_ids:
+        return []
+    # Pending days before start still move the running peak, so the stored totals are read from there on
+    first_pending = min((row['snapshot_date'] for row in pending), default=None)
+    read_from = min(start, first_pending) if start and first_pending else start
+
+    totals = {}
+    for row in db.session.execute(_daily_totals(account_ids).where(*_date_criteria(read_from, end))):
+        totals[_as_date(row.snapshot_date)] = [row.balance, row.realized_pnl, row.open_risk, row.open_trades]
+    for row in pending:
+        if row['account_id'] in account_ids and _in_range(row['snapshot_date'], None, end):
+            total = totals.setdefault(row['snapshot_date'], [0.0, 0.0, 0.0, 0])
+            total[0] += float(row['balance'])
+            total[1] += float(row['realized_pnl'])
+            total[2] += float(row['open_risk'])
+            total[3] += row['open_trades']
+
+    peak_balance = 0.0
+    if read_from:
+        earlier = _daily_totals(account_ids).where(AccountSnapshot.snapshot_date < read_from).subquery()
+        peak_balance = db.session.execute(select(func.max(earlier.c.balance))).scalar() or 0.0
+
+    curve = []
+    for day in sorted(totals):
+        balance, realized_pnl, open_risk, open_trades = totals[day]
+        peak_balance = max(peak_balance, balance)
+        if not _in_range(day, start, end):
+            continue
+        curve.append({
+            'snapshot_date': day.isoformat(),
+            'balance': round(balance, 2),
+            'realized_pnl': round(realized_pnl, 2),
+            'open_risk': round(open_risk, 2),
+            'peak_balance': round(peak_balance, 2),
+            'drawdown': round((peak_balance - balance) / peak_balance * 100, 2) if peak_balance > 0 else 0,
+            'open_trades': open_trades
+        })
+    return curve
+
+
+AccountDrawdown = namedtuple('AccountDrawdown', ['max_drawdown', 'peak_balance'])
+
+
+def drawdown_by_account(account_ids, pending=()):
+    """Deepest end-of-day drawdown and running peak balance recorded for each account, in one grouped query
+
+    pending rows (see pending_snapshots) count as recorded too.
+    """
+    if not account_ids:
+        return {}
+    query = select(
+        AccountSnapshot.account_id,
+        type_coerce(func.max(AccountSnapshot.drawdown), Float).label('max_drawdown'),
+        func.max(AccountSnapshot.peak_balance).label('peak_balance')
+    ).where(AccountSnapshot.account_id.in_(account_ids)).group_by(AccountSnapshot.account_id)
+    drawdowns = {row.account_id: AccountDrawdown(row.max_drawdown, row.peak_balance) for row in db.session.execute(query)}
+    for row in pending:
+        if row['account_id'] in account_ids:
+            recorded = drawdowns.get(row['account_id'], AccountDrawdown(0, 0))
+            drawdowns[row['account_id']] = AccountDrawdown(
+                max(recorded.max_drawdown, row['drawdown']), max(recorded.peak_balance, row['peak_balance'])
+            )
+    return drawdowns
+
+
+def _history_changed(obj, fields, is_new):
+    if is_new:
+        return True
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in fields)
+
+
+def _touched_days(obj):
+    """Days a changed row refers to, including the values it had before the change"""
+    name = 'entry_date' if isinstance(obj, TradeEntry) else 'exit_date' if isinstance(obj, TradeExit) else None
+    if name is None:
+        return []
+    history = inspect(obj).attrs[name].history
+    return [_as_date(value) for value in chain(history.sum(), history.deleted) if value is not None]
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_snapshots(session, flush_context):
+    """Drop snapshots from the first day a trade change can affect; the next sync rebuilds them"""
+    stale = {}
+    trade_days = defaultdict(list)
+    trade_accounts = defaultdict(set)
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Account):
+            if obj in session.dirty and inspect(obj).attrs.initial_capital.history.has_changes():
+                stale[obj.id] = date.min
+            continue
+        fields = TRADE_HISTORY_FIELDS.get(type(obj))
+        if fields is None or not _history_changed(obj, fields, obj in session.new or obj in session.deleted):
+            continue
+        trade_id = obj.id if isinstance(obj, Trade) else obj.trade_id
+        trade_days[trade_id].extend(_touched_days(obj))
+        if isinstance(obj, Trade):
+            # Deleted trades are gone from the table, so keep what the object still knows
+            trade_accounts[trade_id].add(obj.account_id)
+            if obj.created_at:
+                trade_days[trade_id].append(_as_date(obj.created_at))
+    if not trade_days and not stale:
+        return
+
+    connection = session.connection()
+    if trade_days:
+        # A trade's snapshots are affected from the day it was opened
+        rows = connection.execute(
+            select(Trade.id, Trade.account_id, Trade.created_at, func.min(TradeEntry.entry_date))
+            .outerjoin(TradeEntry, TradeEntry.trade_id == Trade.id)
+            .where(Trade.id.in_(trade_days)).group_by(Trade.id)
+        )
+        for trade_id, account_id, created_at, first_entry in rows:
+            trade_accounts[trade_id].add(account_id)
+            trade_days[trade_id].extend(_as_date(value) for value in (created_at, first_entry) if value is not None)
+        for trade_id, days in trade_days.items():
+            if not days:
+                continue
+            for account_id in trade_accounts[trade_id] - {None}:
+                stale[account_id] = min(stale.get(account_id, date.max), min(days))
+
+    for account_id, day in stale.items():
+        connection.execute(
+            delete(AccountSnapshot).where(AccountSnapshot.account_id == account_id, AccountSnapshot.snapshot_date >= day)
+        )
+
+
+class SnapshotScheduler:
+    """Background thread that snapshots every account shortly after each UTC midnight, then runs any other daily tasks"""
+
+    def __init__(self, app, run_at=time(0, 5)):
+        self.app = app
+        self.run_at = run_at
+        self.tasks = [('account snapshots', sync_snapshots)]
+        self._stopped = Event()
+        self._thread = None
+
+    def add_task(self, name, task):
+        """Run task() in an app context after the snapshots; it returns the number of rows it touched"""
+        self.tasks.append((name, task))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.run_forever, name='account-snapshots', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def seconds_until_next_run(self, now=None):
+        now = now or datetime.utcnow()
+        next_run = datetime.combine(now.date(), self.run_at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def run_once(self):
+        with self.app.app_context():
+            for name, task in self.tasks:
+                try:
+                    count = in_each_shard(task)
+                    logger.info('Daily %s: %d rows', name, count)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Daily %s failed', name)
+
+    def run_forever(self):
+        # The first run backfills accounts that have no snapshots yet
+        self.run_once()
+        while not self._stopped.wait(self.seconds_until_next_run()):
+            self.run_once()
+
+
+def init_snapshots(app):
+    """Set up the daily snapshot scheduler and its CLI commands; nothing runs until it is started
+
+    Starting it at import would give every WSGI worker, and the debug reloader's watcher, a
+    scheduler of its own. Run `flask snapshot-scheduler` as one process next to the workers,
+    or call start_snapshot_scheduler from the process that serves the development server.
+    """
+    app.config.setdefault('SNAPSHOT_SCHEDULER', os.environ.get('SNAPSHOT_SCHEDULER', '1') not in ('0', 'false', 'off'))
+    app.config.setdefault('SNAPSHOT_RUN_AT', os.environ.get('SNAPSHOT_RUN_AT', '00:05'))
+    scheduler = SnapshotScheduler(app, time.fromisoformat(app.config['SNAPSHOT_RUN_AT']))
+    app.extensions['snapshot_scheduler'] = scheduler
+
+    @app.cli.command('snapshot-scheduler')
+    def snapshot_scheduler_command():
+        """Run the daily snapshot and maintenance tasks in the foreground"""
+        scheduler.run_forever()
+
+    @app.cli.command('sync-snapshots')
+    def sync_snapshots_command():
+        """Write every account's missing snapshots up to the last complete day"""
+        print(f'Wrote {in_each_shard(sync_snapshots)} snapshots')
+
+    return scheduler
+
+
+def start_snapshot_scheduler(app):
+    """Start the scheduler thread unless SNAPSHOT_SCHEDULER is turned off"""
+    scheduler = app.extensions.get('snapshot_scheduler')
+    if scheduler is None or not app.config['SNAPSHOT_SCHEDULER']:
+        return None
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,79 @@
+from sqlalchemy import select, func, case
+from src.models.user import db
+from src.models.risk_type import StrategyTag, TradeStrategyTag
+from src.services.trade_metrics import trade_metrics_subquery
+
+
+def _tag_group_columns(metrics):
+    """Aggregate columns shared by the per-tag and per-combination breakdowns"""
+    return (
+        func.count(metrics.c.trade_id).label('trades'),
+        func.sum(metrics.c.net_pnl).label('pnl'),
+        func.sum(case((metrics.c.net_pnl > 0, 1), else_=0)).label('wins'),
+        func.avg(case((metrics.c.r_multiple != 0, metrics.c.r_multiple))).label('avg_r_multiple'),
+        func.sum(metrics.c.total_costs).label('total_costs')
+    )
+
+
+def _format_group(row, key, value):
+    """Turn an aggregated row into the response shape used by the analytics routes"""
+    return {
+        key: value,
+        'trades': row.trades,
+        'pnl': round(row.pnl or 0, 2),
+        'win_rate': round(row.wins / row.trades * 100, 2) if row.trades else 0,
+        'avg_r_multiple': round(row.avg_r_multiple or 0, 2),
+        'total_costs': round(row.total_costs or 0, 2)
+    }
+
+
+def performance_by_strategy_tag(scope):
+    """Closed-trade performance per strategy tag for the trades in scope, in one grouped query"""
+    metrics = trade_metrics_subquery(scope)
+    query = select(
+        StrategyTag.id, StrategyTag.name, *_tag_group_columns(metrics)
+    ).select_from(TradeStrategyTag).join(
+        StrategyTag, StrategyTag.id == TradeStrategyTag.strategy_tag_id
+    ).join(
+        metrics, metrics.c.trade_id == TradeStrategyTag.trade_id
+    ).where(
+        metrics.c.status == 'Closed'
+    ).group_by(StrategyTag.id, StrategyTag.name).order_by(func.sum(metrics.c.net_pnl).desc())
+
+    results = []
+    for row in db.session.execute(query):
+        performance = _format_group(row, 'strategy_tag', row.name)
+        performance['strategy_tag_id'] = row.id
+        results.append(performance)
+    return results
+
+
+def performance_by_tag_combination(scope):
+    """Closed-trade performance per combination of two or more tags on the same trade"""
+    metrics = trade_metrics_subquery(scope)
+
+    # Sorting the tag names before group_concat gives every combination a stable key
+    tagged = select(
+        TradeStrategyTag.trade_id, StrategyTag.name
+    ).join(
+        StrategyTag, StrategyTag.id == TradeStrategyTag.strategy_tag_id
+    ).where(
+        TradeStrategyTag.trade_id.in_(scope)
+    ).distinct().order_by(TradeStrategyTag.trade_id, StrategyTag.name).subquery()
+
+    combinations = select(
+        tagged.c.trade_id,
+        func.group_concat(tagged.c.name, ' + ').label('combination'),
+        func.count().label('tag_count')
+    ).group_by(tagged.c.trade_id).subquery()
+
+    query = select(
+        combinations.c.combination, *_tag_group_columns(metrics)
+    ).select_from(combinations).join(
+        metrics, metrics.c.trade_id == combinations.c.trade_id
+    ).where(
+        metrics.c.status == 'Closed',
+        combinations.c.tag_count > 1
+    ).group_by(combinations.c.combination).order_by(func.sum(metrics.c.net_pnl).desc())
+
+    return [_format_group(row, 'strategy_tags', row.combination.split(' + ')) for row in db.session.execute(query)]
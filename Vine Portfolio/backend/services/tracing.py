@@ -0,0 +1,452 @@
+import atexit
+import contextvars
+import json
+import os
+import random
+import re
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+STATEMENT_LIMIT = 1000
+TRACEPARENT = re.compile(r'(?P<version>[0-9a-f]{2})-(?P<trace_id>[0-9a-f]{32})-(?P<parent_id>[0-9a-f]{16})-(?P<flags>[0-9a-f]{2})')
+
+
+class Span:
+    """A timed operation within a trace"""
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'kind',
+                 'start_ns', 'end_ns', 'attributes', 'status', 'status_message', '_token')
+
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, kind='internal', attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = 'unset'
+        self.status_message = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = 'error'
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.processor.on_end(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.set_error(f'{exc_type.__name__}: {exc}')
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end()
+        return False
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            'attributes': self.attributes,
+            'status': self.status,
+            'status_message': self.status_message
+        }
+
+
+class NonRecordingSpan:
+    """Stands in for spans of unsampled traces so instrumented code pays almost nothing"""
+    recording = False
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+
+class _NoopContext:
+    """Returned for children of unsampled spans; leaves the current span untouched"""
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopContext()
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+    def shutdown(self):
+        pass
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(spans, service_name):
+    """Encode spans as an OTLP/HTTP JSON trace export request"""
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+            'scopeSpans': [{
+                'scope': {'name': 'vine-portfolio'},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': SPAN_KINDS.get(span.kind, 1),
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items()],
+                    'status': {'code': 2 if span.status == 'error' else 0, 'message': span.status_message or ''}
+                } for span in spans]
+            }]
+        }]
+    }
+
+
+class OTLPJsonExporter:
+    """Posts spans as OTLP/HTTP JSON to a collector, e.g. the local one started by run_local_collector"""
+
+    def __init__(self, endpoint='http://localhost:4318/v1/traces', service_name='vine-portfolio', timeout=2.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        body = json.dumps(to_otlp(spans, self.service_name)).encode('utf-8')
+        req = urllib.request.Request(self.endpoint, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(req, timeout=self.timeout).close()
+        except OSError:
+            # Tracing must never take the app down; drop the batch if the collector is away
+            pass
+
+    def shutdown(self):
+        pass
+
+
+class BatchSpanProcessor:
+    """Buffers finished spans and exports them from a background thread"""
+
+    def __init__(self, exporter, max_batch=512, interval=2.0, max_queue=10000):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval = interval
+        self._queue = deque(maxlen=max_queue)
+        self._wake = Event()
+        self._stopped = False
+        self._thread = None
+        self._lock = Lock()
+
+    def on_end(self, span):
+        self._queue.append(span)
+        if self._thread is None:
+            self._start()
+        if len(self._queue) >= self.max_batch:
+            self._wake.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='span-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                batch.append(self._queue.popleft())
+            self.exporter.export(batch)
+
+    def shutdown(self):
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+        self.exporter.shutdown()
+
+
+class _DroppingProcessor:
+    def on_end(self, span):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Tracer:
+    """Creates spans; root spans are sampled at sample_rate and children follow their parent"""
+
+    def __init__(self, processor=None, sample_rate=0.0):
+        self.processor = processor or _DroppingProcessor()
+        self.sample_rate = sample_rate
+
+    def configure(self, processor, sample_rate):
+        self.processor = processor
+        self.sample_rate = sample_rate
+
+    def start_root_span(self, name, kind='server', attributes=None, trace_id=None, parent_id=None, sampled=None):
+        """Start a trace, or continue a remote one when trace_id/parent_id come from a traceparent header"""
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return NonRecordingSpan()
+        return Span(self, name, trace_id or f'{random.getrandbits(128):032x}', parent_id, kind, attributes)
+
+    def start_span(self, name, attributes=None, kind='internal'):
+        """Start a child of the current span; outside any trace this starts a sampled-or-not root"""
+        parent = _current_span.get()
+        if parent is None:
+            return self.start_root_span(name, kind, attributes)
+        if not parent.recording:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, kind, attributes)
+
+
+tracer = Tracer()
+
+
+def trace_span(name, **attributes):
+    """Internal span under the current one; use it as a context manager, or call end() when the phase is done"""
+    return tracer.start_span(name, attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _parse_traceparent(header):
+    """(trace_id, parent_id, sampled) from a W3C traceparent header, or None"""
+    match = TRACEPARENT.fullmatch((header or '').strip())
+    if not match or match['version'] == 'ff' or not int(match['trace_id'], 16) or not int(match['parent_id'], 16):
+        return None
+    # Only the sampled bit of the trace flags is defined
+    return match['trace_id'], match['parent_id'], bool(int(match['flags'], 16) & 0x01)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    span = None
+    if parent is not None and parent.recording:
+        span = tracer.start_span('db.query', {
+            'db.system': conn.dialect.name,
+            'db.statement': statement[:STATEMENT_LIMIT],
+            'db.executemany': executemany
+        }, kind='client')
+    conn.info.setdefault('trace_spans', []).append(span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    span = spans.pop() if spans else None
+    if span is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute('db.rowcount', cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context):
+    spans = exception_context.connection.info.get('trace_spans') if exception_context.connection else None
+    span = spans.pop() if spans else None
+    if span is not None:
+        span.set_error(str(exception_context.original_exception))
+        span.end()
+
+
+def _before_commit(session):
+    parent = _current_span.get()
+    if parent is not None and parent.recording:
+        session.info['commit_span'] = tracer.start_span('db.commit')
+
+
+def _end_commit_span(session, error=None):
+    span = session.info.pop('commit_span', None)
+    if span is not None:
+        if error:
+            span.set_error(error)
+        span.end()
+
+
+_listeners_installed = False
+
+
+def _install_listeners():
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        event.listen(Session, 'before_commit', _before_commit)
+        event.listen(Session, 'after_commit', _end_commit_span)
+        event.listen(Session, 'after_soft_rollback', lambda session, previous: _end_commit_span(session, 'rollback'))
+        _listeners_installed = True
+
+
+def build_exporter(app):
+    kind = app.config['TRACE_EXPORTER']
+    if kind == 'otlp':
+        return OTLPJsonExporter(app.config['TRACE_OTLP_ENDPOINT'])
+    if kind == 'jsonl':
+        return JsonLinesExporter(app.config['TRACE_FILE'])
+    return None
+
+
+def init_tracing(app):
+    """Open spans for every request, SQL statement and commit, exported by a pluggable exporter"""
+    app.config.setdefault('TRACE_SAMPLE_RATE', float(os.environ.get('TRACE_SAMPLE_RATE', '0.01')))
+    app.config.setdefault('TRACE_EXPORTER', os.environ.get('TRACE_EXPORTER', 'jsonl'))
+    app.config.setdefault('TRACE_FILE', os.environ.get('TRACE_FILE', os.path.join(app.root_path, 'traces.jsonl')))
+    app.config.setdefault('TRACE_OTLP_ENDPOINT', os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'))
+
+    exporter = build_exporter(app)
+    if exporter is None or app.config['TRACE_SAMPLE_RATE'] <= 0:
+        return
+    tracer.configure(BatchSpanProcessor(exporter), app.config['TRACE_SAMPLE_RATE'])
+    _install_listeners()
+
+    @app.before_request
+    def start_request_span():
+        remote = _parse_traceparent(request.headers.get('traceparent'))
+        trace_id, parent_id, sampled = remote if remote else (None, None, None)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        span = tracer.start_root_span(f'{request.method} {route}', attributes={
+            'http.method': request.method,
+            'http.route': route,
+            'http.target': request.full_path
+        }, trace_id=trace_id, parent_id=parent_id, sampled=sampled)
+        # Kept on the request rather than g, which batch sub-requests share with their batch
+        request.environ['vine.trace_span'] = span.__enter__()
+
+    @app.after_request
+    def tag_request_span(response):
+        span = request.environ.get('vine.trace_span')
+        if span is not None and span.recording:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f'HTTP {response.status_code}')
+            response.headers['X-Trace-Id'] = span.trace_id
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = request.environ.pop('vine.trace_span', None)
+        if span is not None:
+            span.__exit__(type(exc) if exc else None, exc, None)
+
+
+def run_local_collector(port=4318, output='collected_spans.jsonl'):
+    """Stand-in OTLP/HTTP JSON collector that writes received spans as JSON lines"""
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/traces':
+                self.send_error(404)
+                return
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with open(output, 'a') as f:
+                for resource_spans in payload.get('resourceSpans', []):
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for span in scope_spans.get('spans', []):
+                            f.write(json.dumps(span) + '\n')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), CollectorHandler)
+    print(f'Collecting OTLP spans on http://127.0.0.1:{port}/v1/traces into {output}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local OTLP/HTTP JSON collector stand-in')
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--output', default='collected_spans.jsonl')
+    args = parser.parse_args()
+    run_local_collector(args.port, args.output)
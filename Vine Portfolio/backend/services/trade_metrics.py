@@ -0,0 +1,115 @@
+from sqlalchemy import select, func, case, cast, exists, Float
+from src.models.account import Account
+from src.models.trade import Trade, TradeEntry, TradeExit, TradeCost
+from src.models.archive import TradeSummary
+
+
+def user_trade_scope(user_id, account_ids=None):
+    """Select the ids of trades owned by a user, optionally limited to some accounts"""
+    scope = select(Trade.id).join(Account, Account.id == Trade.account_id).where(Account.user_id == user_id)
+    if account_ids:
+        scope = scope.where(Trade.account_id.in_(account_ids))
+    return scope
+
+
+def archived_within(date_field, start=None, end=None):
+    """Condition on Trade: live, or archived with its frozen opened_at/closed_at in start..end (end exclusive)
+
+    Date-filtered reads add it to their scope so summaries of archived trades outside the range are never joined.
+    """
+    column = getattr(TradeSummary, date_field)
+    in_range = [TradeSummary.trade_id == Trade.id]
+    if start is not None:
+        in_range.append(column >= start)
+    if end is not None:
+        in_range.append(column < end)
+    return ~exists().where(TradeSummary.trade_id == Trade.id) | exists().where(*in_range)
+
+
+def _has_no_risk_basis(stop_loss_price, entry_qty):
+    """SQL condition for trades that have no stop loss or no entries"""
+    return (stop_loss_price.is_(None)) | (stop_loss_price == 0) | (entry_qty == 0)
+
+
+def trade_metrics_subquery(scope):
+    """Per-trade quantities, average prices, P&L and risk computed in SQL for the trades in scope"""
+    # Aggregate the children once per trade; Float casts keep SQLite from doing integer division
+    entries = select(
+        TradeEntry.trade_id.label('trade_id'),
+        cast(func.sum(TradeEntry.quantity), Float).label('qty'),
+        cast(func.sum(TradeEntry.entry_price * TradeEntry.quantity), Float).label('value'),
+        func.min(TradeEntry.entry_date).label('opened_at')
+    ).where(TradeEntry.trade_id.in_(scope)).group_by(TradeEntry.trade_id).subquery()
+
+    exits = select(
+        TradeExit.trade_id.label('trade_id'),
+        cast(func.sum(TradeExit.quantity), Float).label('qty'),
+        cast(func.sum(TradeExit.exit_price * TradeExit.quantity), Float).label('value'),
+        func.max(TradeExit.exit_date).label('closed_at')
+    ).where(TradeExit.trade_id.in_(scope)).group_by(TradeExit.trade_id).subquery()
+
+    costs = select(
+        TradeCost.trade_id.label('trade_id'),
+        cast(func.sum(TradeCost.amount), Float).label('amount')
+    ).where(TradeCost.trade_id.in_(scope)).group_by(TradeCost.trade_id).subquery()
+
+    entry_qty = func.coalesce(entries.c.qty, 0.0)
+    exit_qty = func.coalesce(exits.c.qty, 0.0)
+    total_costs = func.coalesce(costs.c.amount, 0.0)
+    avg_entry = func.coalesce(entries.c.value / func.nullif(entries.c.qty, 0), 0.0)
+    avg_exit = func.coalesce(exits.c.value / func.nullif(exits.c.qty, 0), 0.0)
+    is_long = func.lower(Trade.trade_type) == 'long'
+    stop_loss = cast(Trade.stop_loss_price, Float)
+
+    gross_pnl = case(
+        (exit_qty == 0, 0.0),
+        (is_long, (avg_exit - avg_entry) * exit_qty),
+        else_=(avg_entry - avg_exit) * exit_qty
+    )
+    net_pnl = gross_pnl - total_costs
+    risk_amount = case(
+        (_has_no_risk_basis(Trade.stop_loss_price, entry_qty), 0.0),
+        (is_long, (avg_entry - stop_loss) * entry_qty),
+        else_=(stop_loss - avg_entry) * entry_qty
+    )
+    r_multiple = case(
+        (risk_amount > 0, net_pnl / risk_amount),
+        else_=0.0
+    )
+
+    def frozen(column, live):
+        """Archived trades have no child rows left, so take their value from the summary row"""
+        if isinstance(live.type, Float):
+            column = cast(column, Float)
+        return func.coalesce(column, live)
+
+    return select(
+        Trade.id.label('trade_id'),
+        Trade.account_id.label('account_id'),
+        Trade.instrument.label('instrument'),
+        Trade.trade_type.label('trade_type'),
+        Trade.status.label('status'),
+        Trade.risk_type_id.label('risk_type_id'),
+        stop_loss.label('stop_loss_price'),
+        Trade.created_at.label('created_at'),
+        frozen(TradeSummary.opened_at, func.coalesce(entries.c.opened_at, Trade.created_at)).label('opened_at'),
+        frozen(TradeSummary.closed_at, exits.c.closed_at).label('closed_at'),
+        frozen(TradeSummary.entry_qty, entry_qty).label('entry_qty'),
+        frozen(TradeSummary.avg_entry, avg_entry).label('avg_entry'),
+        frozen(TradeSummary.exit_qty, exit_qty).label('exit_qty'),
+        frozen(TradeSummary.avg_exit, avg_exit).label('avg_exit'),
+        (frozen(TradeSummary.entry_qty, entry_qty) - frozen(TradeSummary.exit_qty, exit_qty)).label('open_qty'),
+        frozen(TradeSummary.total_costs, total_costs).label('total_costs'),
+        frozen(TradeSummary.gross_pnl, gross_pnl).label('gross_pnl'),
+        frozen(TradeSummary.net_pnl, net_pnl).label('net_pnl'),
+        frozen(TradeSummary.risk_amount, risk_amount).label('risk_amount'),
+        frozen(TradeSummary.r_multiple, r_multiple).label('r_multiple')
+    ).select_from(Trade).outerjoin(
+        entries, entries.c.trade_id == Trade.id
+    ).outerjoin(
+        exits, exits.c.trade_id == Trade.id
+    ).outerjoin(
+        costs, costs.c.trade_id == Trade.id
+    ).outerjoin(
+        TradeSummary, TradeSummary.trade_id == Trade.id
+    ).where(Trade.id.in_(scope)).subquery('trade_metrics')
@@ -0,0 +1,273 @@
+"""Replay an account's closed trades under alternative sizing, stop and drawdown rules
+
+The account's closed trades are loaded once as columns: close time, gross
+R-multiple (gross P&L over the risk to the original stop), costs in R and the
+actual net P&L. Each scenario re-sizes every trade so that it risks a
+percentage of the scenario's equity (or of the starting capital), optionally
+caps losses at a number of R (a stop that is always honoured), cuts risk while
+in drawdown and stops trading for good once a drawdown limit is hit.
+
+The journal holds fills, not price paths, so a tighter stop can only be
+modelled as a cap on the loss in R; how many winners it would have stopped out
+is not knowable. Trades without a stop have no R and are left out.
+
+All scenarios are stepped through the trades together, one trade at a time,
+with each scenario's state held in flat per-field lists.
+"""
+from datetime import datetime, time, timedelta
+from itertools import product
+from sqlalchemy import select
+from src.models.user import db
+from src.models.trade import Trade
+from src.services.trade_metrics import trade_metrics_subquery, archived_within
+from src.services.money import to_cents, from_cents
+
+MAX_SCENARIOS = 1000
+
+# Risk per trade (percent of equity) that each trading model stands for, as suggested by the risk suggestions
+TRADING_MODEL_RISK = {'Risk-Free': 0.25, 'Medium Risk': 1.0, 'High Risk': 2.5}
+
+SCENARIO_FIELDS = ('risk_percentage', 'trading_model', 'compounding', 'max_loss_r',
+                   'reduce_risk_at_drawdown', 'reduced_risk_percentage', 'max_drawdown')
+
+
+class TradeColumns:
+    """Closed trades of an account as parallel columns, in the order they closed"""
+
+    __slots__ = ('closed_at', 'gross_r', 'cost_r', 'net_pnl', 'unsized')
+
+    def __init__(self, closed_at, gross_r, cost_r, net_pnl, unsized):
+        self.closed_at = closed_at
+        self.gross_r = gross_r
+        self.cost_r = cost_r
+        self.net_pnl = net_pnl
+        self.unsized = unsized  # Closed trades left out for having no risk to a stop
+
+    @classmethod
+    def load(cls, account_id, start=None, end=None):
+        start = datetime.combine(start, time.min) if start else None
+        end = datetime.combine(end + timedelta(days=1), time.min) if end else None
+        scope = select(Trade.id).where(Trade.account_id == account_id)
+        if start or end:
+            scope = scope.where(archived_within('closed_at', start, end))
+        metrics = trade_metrics_subquery(scope)
+        closed_at = metrics.c.closed_at
+        query = select(
+            closed_at, metrics.c.gross_pnl, metrics.c.total_costs, metrics.c.net_pnl, metrics.c.risk_amount
+        ).where(metrics.c.status == 'Closed', closed_at.is_not(None)).order_by(closed_at, metrics.c.trade_id)
+        if start:
+            query = query.where(closed_at >= start)
+        if end:
+            query = query.where(closed_at < end)
+
+        columns = cls([], [], [], [], 0)
+        for closed, gross_pnl, total_costs, net_pnl, risk_amount in db.session.execute(query):
+            if not risk_amount or risk_amount <= 0:
+                columns.unsized += 1
+                continue
+            columns.closed_at.append(closed)
+            columns.gross_r.append(gross_pnl / risk_amount)
+            columns.cost_r.append(total_costs / risk_amount)
+            columns.net_pnl.append(net_pnl)
+        return columns
+
+
+def _number(scenario, name, maximum=None):
+    """A positive number from the scenario, or None when not given"""
+    value = scenario.get(name)
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if value <= 0 or maximum is not None and value > maximum:
+        raise ValueError(f'{name} must be above 0' + (f' and at most {maximum}' if maximum is not None else ''))
+    return value
+
+
+def _flag(scenario, name, default):
+    """A JSON true/false from the scenario, or default when not given"""
+    value = scenario.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, bool):
+        raise ValueError(f'{name} must be true or false')
+    return value
+
+
+def normalize_scenario(scenario, default_model):
+    """A scenario with every rule filled in; raises ValueError"""
+    if not isinstance(scenario, dict):
+        raise ValueError('Each scenario must be an object')
+    unknown = set(scenario) - set(SCENARIO_FIELDS) - {'name'}
+    if unknown:
+        raise ValueError(f'Unknown scenario fields: {", ".join(sorted(unknown))}')
+
+    model = scenario.get('trading_model')
+    if model is not None and model not in TRADING_MODEL_RISK:
+        raise ValueError(f'trading_model must be one of {", ".join(TRADING_MODEL_RISK)}')
+    risk = _number(scenario, 'risk_percentage', 100)
+    if risk is None:
+        # The scenario's trading model, else the account's own
+        risk = TRADING_MODEL_RISK.get(model or default_model, TRADING_MODEL_RISK['Medium Risk'])
+    reduce_at = _number(scenario, 'reduce_risk_at_drawdown', 100)
+    reduced = _number(scenario, 'reduced_risk_percentage', 100)
+    return {
+        'name': scenario.get('name'),
+        'risk_percentage': risk,
+        'trading_model': model,
+        'compounding': _flag(scenario, 'compounding', True),
+        'max_loss_r': _number(scenario, 'max_loss_r'),
+        'reduce_risk_at_drawdown': reduce_at,
+        'reduced_risk_percentage': reduced if reduced is not None else (risk / 2 if reduce_at is not None else None),
+        'max_drawdown': _number(scenario, 'max_drawdown', 100)
+    }
+
+
+def expand_sweep(sweep):
+    """Scenarios for every combination of the listed values, e.g. {'risk_percentage': [0.5, 1], 'max_drawdown': [None, 10]}"""
+    if not isinstance(sweep, dict) or not sweep:
+        raise ValueError('sweep must map scenario fields to lists of values')
+    names = sorted(sweep)
+    values = [(sweep[name] or [None]) if isinstance(sweep[name], list) else [sweep[name]] for name in names]
+    count = 1
+    for options in values:
+        count *= len(options)
+    if count > MAX_SCENARIOS:
+        raise ValueError(f'The sweep has {count} combinations; at most {MAX_SCENARIOS} can run at once')
+    return [dict(zip(names, combination)) for combination in product(*values)]
+
+
+def _summary(start, equity, peak, max_drawdown, taken, wins, gross_win, gross_loss):
+    return {
+        'final_balance': from_cents(to_cents(equity)),
+        'net_pnl': from_cents(to_cents(equity) - to_cents(start)),
+        'return_percentage': round((equity - start) / start * 100, 2) if start else None,
+        'max_drawdown': round(max_drawdown, 2),
+        'peak_balance': from_cents(to_cents(peak)),
+        'trades_taken': taken,
+        'win_rate': round(wins / taken * 100, 2) if taken else 0,
+        'profit_factor': round(gross_win / gross_loss, 2) if gross_loss else None
+    }
+
+
+def _actual(columns, start):
+    """The account as it was actually traded, over the same trades"""
+    equity = peak = start
+    max_drawdown = gross_win = gross_loss = 0.0
+    wins = 0
+    for pnl in columns.net_pnl:
+        equity += pnl
+        if pnl > 0:
+            wins += 1
+            gross_win += pnl
+        else:
+            gross_loss -= pnl
+        peak = max(peak, equity)
+        if peak > 0:
+            max_drawdown = max(max_drawdown, (peak - equity) / peak * 100)
+    return _summary(start, equity, peak, max_drawdown, len(columns.net_pnl), wins, gross_win, gross_loss)
+
+
+def replay(columns, scenarios, starting_balance, include_curves=False):
+    """Run every scenario over the trade columns; returns one result per scenario in the same order"""
+    count = len(scenarios)
+    start = float(starting_balance)
+
+    # Per-scenario rules and state as flat lists, indexed by scenario
+    risk = [scenario['risk_percentage'] / 100 for scenario in scenarios]
+    compounding = [scenario['compounding'] for scenario in scenarios]
+    loss_cap = [-scenario['max_loss_r'] if scenario['max_loss_r'] is not None else None for scenario in scenarios]
+    reduce_at = [scenario['reduce_risk_at_drawdown'] for scenario in scenarios]
+    reduced = [(scenario['reduced_risk_percentage'] or 0) / 100 for scenario in scenarios]
+    halt_at = [scenario['max_drawdown'] for scenario in scenarios]
+
+    equity = [start] * count
+    peak = [start] * count
+    max_drawdown = [0.0] * count
+    drawdown = [0.0] * count
+    taken = [0] * count
+    wins = [0] * count
+    gross_win = [0.0] * count
+    gross_loss = [0.0] * count
+    halted = [None] * count
+    curves = [[] for _ in range(count)] if include_curves else None
+    active = list(range(count))
+
+    for index, (gross_r, cost_r) in enumerate(zip(columns.gross_r, columns.cost_r)):
+        if not active:
+            break
+        stopped = False
+        for s in active:
+            balance = equity[s]
+            fraction = reduced[s] if reduce_at[s] is not None and drawdown[s] >= reduce_at[s] else risk[s]
+            at_risk = (balance if compounding[s] else start) * fraction
+            outcome = gross_r if loss_cap[s] is None or gross_r >= loss_cap[s] else loss_cap[s]
+            pnl = at_risk * (outcome - cost_r)
+            balance += pnl
+            equity[s] = balance
+            taken[s] += 1
+            if pnl > 0:
+                wins[s] += 1
+                gross_win[s] += pnl
+            else:
+                gross_loss[s] -= pnl
+            if balance > peak[s]:
+                peak[s] = balance
+            drawdown[s] = (peak[s] - balance) / peak[s] * 100 if peak[s] > 0 else 100.0
+            if drawdown[s] > max_drawdown[s]:
+                max_drawdown[s] = drawdown[s]
+            if curves is not None:
+                curves[s].append(balance)
+            # A blown account cannot keep trading, whatever the drawdown limit
+            if balance <= 0 or halt_at[s] is not None and drawdown[s] >= halt_at[s]:
+                halted[s] = index
+                stopped = True
+        if stopped:
+            active = [s for s in active if halted[s] is None]
+
+    results = []
+    for s, scenario in enumerate(scenarios):
+        result = {
+            'scenario': scenario,
+            'stats': dict(
+                _summary(start, equity[s], peak[s], max_drawdown[s], taken[s], wins[s], gross_win[s], gross_loss[s]),
+                halted=halted[s] is not None,
+                halted_at=columns.closed_at[halted[s]].isoformat() if halted[s] is not None else None
+            )
+        }
+        if curves is not None:
+            # Flat from the trade that stopped the scenario onwards
+            curve = curves[s] + [equity[s]] * (len(columns.gross_r) - len(curves[s]))
+            result['equity_curve'] = [round(value, 2) for value in curve]
+        results.append(result)
+    return results
+
+
+def what_if(account, scenarios=None, sweep=None, include_curves=False, start=None, end=None, starting_balance=None):
+    """Replay the account's closed trades under each scenario, plus the actual outcome for comparison"""
+    scenarios = list(scenarios or [])
+    if sweep is not None:
+        scenarios.extend(expand_sweep(sweep))
+    if not scenarios:
+        raise ValueError('Give scenarios or a sweep')
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f'At most {MAX_SCENARIOS} scenarios can run at once')
+    scenarios = [normalize_scenario(scenario, account.trading_model) for scenario in scenarios]
+
+    balance = float(starting_balance if starting_balance is not None else account.initial_capital)
+    if balance <= 0:
+        raise ValueError('starting_balance must be above 0')
+
+    columns = TradeColumns.load(account.id, start, end)
+    payload = {
+        'starting_balance': from_cents(to_cents(balance)),
+        'trades': len(columns.gross_r),
+        'unsized_trades': columns.unsized,
+        'actual': _actual(columns, balance),
+        'results': replay(columns, scenarios, balance, include_curves)
+    }
+    if include_curves:
+        payload['dates'] = [closed.isoformat() for closed in columns.closed_at]
+    return payload
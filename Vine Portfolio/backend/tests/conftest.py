@@ -0,0 +1,121 @@
+"""Shared fixtures: an app with every blueprint on a throwaway SQLite file, and an API client per user
+
+Run from the backend directory with `python -m pytest tests`.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_backend_as_src():
+    """The code imports itself as the src package (the backend directory is deployed as src/)"""
+    if 'src' not in sys.modules:
+        sys.path.insert(0, os.path.dirname(BACKEND))
+        spec = importlib.util.spec_from_file_location(
+            'src', os.path.join(BACKEND, '__init__.py'), submodule_search_locations=[BACKEND]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['src'] = module
+        spec.loader.exec_module(module)
+    src = sys.modules['src']
+    import src.models
+    # The routes import the models from src.models, and auth from models as main.py sees them
+    for name in src.__all__:
+        setattr(src.models, name, getattr(src, name))
+    sys.modules.setdefault('models', src.models)
+
+
+_import_backend_as_src()
+
+from src.benchmarks.common import create_app  # noqa: E402
+from src.models import db  # noqa: E402
+from src.services.reference_cache import reference_cache  # noqa: E402
+from src.services import dashboard_events  # noqa: E402
+
+
+class Api:
+    """Test client calls made as one registered user"""
+
+    def __init__(self, client, email):
+        self.client = client
+        response = client.post('/api/auth/register', json={'email': email, 'password': 'secret'})
+        assert response.status_code == 201, response.get_json()
+        self.user_id = response.get_json()['user']['id']
+        self.headers = {'Authorization': 'Bearer ' + response.get_json()['token']}
+
+    def get(self, path, **kwargs):
+        return self.client.get(path, headers={**self.headers, **kwargs.pop('headers', {})}, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.client.post(path, headers={**self.headers, **kwargs.pop('headers', {})}, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.client.put(path, headers={**self.headers, **kwargs.pop('headers', {})}, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.client.delete(path, headers={**self.headers, **kwargs.pop('headers', {})}, **kwargs)
+
+    def account(self, **fields):
+        data = {'name': 'Main', 'initial_capital': 10000, **fields}
+        response = self.post('/api/accounts/', json=data)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['account']['id']
+
+    def strategy_tag(self, name):
+        response = self.post('/api/risk/strategy-tags', json={'name': name})
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['strategy_tag']['id']
+
+    def risk_type(self, name):
+        response = self.post('/api/risk/risk-types', json={'name': name})
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['risk_type']['id']
+
+    def trade(self, account_id, entry_price=100, quantity=10, **fields):
+        data = {'instrument': 'EURUSD', 'trade_type': 'Long', 'entry_price': entry_price, 'quantity': quantity, **fields}
+        response = self.post(f'/api/accounts/{account_id}/trades', json=data)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['trade']
+
+    def exit(self, trade_id, exit_price, quantity, **fields):
+        return self.post(f'/api/trades/{trade_id}/exits',
+                         json={'exit_price': exit_price, 'quantity': quantity, **fields})
+
+    def closed_trade(self, account_id, entry_price, exit_price, quantity=10, **fields):
+        trade = self.trade(account_id, entry_price, quantity, **fields)
+        response = self.exit(trade['id'], exit_price, quantity)
+        assert response.status_code == 201, response.get_json()
+        return trade['id']
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app('sqlite:///' + str(tmp_path / 'app.db'), with_routes=True)
+    app.config['TESTING'] = True
+    # Ids restart with every database, so in-process caches must not outlive it
+    reference_cache.clear()
+    dashboard_events._published_balances.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def api(client):
+    return Api(client, 'trader@example.com')
+
+
+@pytest.fixture
+def other_api(client):
+    return Api(client, 'other@example.com')
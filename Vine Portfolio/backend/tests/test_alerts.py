@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.models import db
+from src.models.alert import AccountAlertState
+from src.services import alerts
+from src.services.alerts import add_alert_listener, remove_alert_listener
+
+
+@pytest.fixture
+def seeds(monkeypatch):
+    """Account ids the running state was replayed for"""
+    seeded = []
+    seed = alerts._seed
+    monkeypatch.setattr(alerts, '_seed', lambda account_id: seeded.append(account_id) or seed(account_id))
+    return seeded
+
+
+@pytest.fixture
+def published():
+    received = []
+    callback = lambda user_id, alert: received.append(alert['alert_type'])
+    add_alert_listener(callback)
+    yield received
+    remove_alert_listener(callback)
+
+
+def _state(app, account_id):
+    with app.app_context():
+        state = db.session.get(AccountAlertState, account_id)
+        return state.balance_cents, state.peak_cents, state.stale
+
+
+def _alerts(api, account_id):
+    response = api.get('/api/risk/alerts', query_string={'account_id': account_id})
+    assert response.status_code == 200, response.get_json()
+    return [alert['alert_type'] for alert in response.get_json()['alerts']]
+
+
+def test_exits_and_costs_move_the_balance_without_a_reseed(app, api, seeds):
+    account_id = api.account()
+    trade_id = api.trade(account_id, 100, 10)['id']
+    seeds.clear()  # Creating the account seeds its state
+    assert api.exit(trade_id, 110, 4).status_code == 201
+    assert _state(app, account_id) == (1000000, 1000000, False)
+
+    # The last exit closes the trade in the ledger; its P&L goes in as a delta
+    assert api.exit(trade_id, 120, 6).status_code == 201
+    assert _state(app, account_id) == (1016000, 1016000, False)
+    assert api.post(f'/api/trades/{trade_id}/costs', json={'cost_type': 'Commission', 'amount': 10}).status_code == 201
+    assert _state(app, account_id) == (1015000, 1016000, False)
+    assert seeds == []
+
+
+def test_hand_made_closes_and_reopens_reseed(app, api, seeds):
+    account_id = api.account()
+    trade_id = api.closed_trade(account_id, 100, 110)
+    open_id = api.trade(account_id)['id']
+    seeds.clear()
+
+    assert api.put(f'/api/trades/{open_id}', json={'status': 'Cancelled', 'notes': 'Never filled'}).status_code == 200
+    assert seeds == []
+
+    assert api.put(f'/api/trades/{trade_id}', json={'status': 'Open'}).status_code == 200
+    assert seeds == [account_id]
+    assert _state(app, account_id) == (1000000, 1000000, False)
+    assert api.put(f'/api/trades/{trade_id}', json={'status': 'Closed'}).status_code == 200
+    assert seeds == [account_id] * 2
+    assert _state(app, account_id) == (1010000, 1010000, False)
+
+
+def test_each_crossing_alerts_once(api, published):
+    account_id = api.account(max_drawdown=5, profit_target=10)
+    api.closed_trade(account_id, 100, 150)  # 10500
+    api.closed_trade(account_id, 100, 40)  # 9900, more than 5% below the peak
+    api.closed_trade(account_id, 100, 90)  # 9800, still past it
+    assert _alerts(api, account_id) == ['max_drawdown_breached']
+
+    api.closed_trade(account_id, 100, 230)  # 11100: a new peak, 11% up
+    api.closed_trade(account_id, 100, 40)  # 10500: past the drawdown again
+    assert _alerts(api, account_id) == ['max_drawdown_breached', 'profit_target_reached', 'max_drawdown_breached']
+    assert published == ['max_drawdown_breached', 'profit_target_reached', 'max_drawdown_breached']
+
+
+def test_concurrent_exits_report_the_crossing_once(app, api, published):
+    account_id = api.account(max_drawdown=5)
+    trade_ids = [api.trade(account_id)['id'] for _ in range(8)]
+
+    with ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(lambda trade_id: api.exit(trade_id, 90, 10).status_code, trade_ids))
+    assert statuses == [201] * 8
+    assert _state(app, account_id) == (920000, 1000000, False)
+    assert _alerts(api, account_id) == ['max_drawdown_breached']
+    assert published == ['max_drawdown_breached']
+
+
+def test_limit_changes_reevaluate_and_reads_do_not_write(app, api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 40)
+    assert _alerts(api, account_id) == []
+
+    assert api.put(f'/api/accounts/{account_id}', json={'max_drawdown': 5}).status_code == 200
+    assert _alerts(api, account_id) == ['max_drawdown_breached']
+
+    with app.app_context():
+        db.session.get(AccountAlertState, account_id).stale = True
+        db.session.commit()
+    suggestions = api.get(f'/api/risk/accounts/{account_id}/risk-suggestions').get_json()
+    assert suggestions['alert_state']['max_drawdown_breached'] is True
+    assert _state(app, account_id)[2] is True
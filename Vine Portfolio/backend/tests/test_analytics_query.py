@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+
+
+def _query(api, **filters):
+    response = api.post('/api/analytics/query', json=filters)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['analytics']
+
+
+def test_query_filters_by_account_instrument_and_direction(api):
+    first, second = api.account(name='First'), api.account(name='Second')
+    api.closed_trade(first, 100, 110)
+    api.closed_trade(first, 100, 90, trade_type='Short')
+    api.closed_trade(second, 50, 40, instrument='XAUUSD')
+
+    assert _query(api)['closed_trades'] == 3
+    assert _query(api, account_ids=[first])['total_pnl'] == 200
+    assert _query(api, instruments='xauusd')['total_pnl'] == -100
+    assert _query(api, trade_type='short')['closed_trades'] == 1
+
+
+def test_bare_end_date_covers_the_whole_day(api):
+    account_id = api.account()
+    api.trade(account_id)
+    today = datetime.utcnow().date().isoformat()
+
+    assert _query(api, end_date=today)['total_trades'] == 1
+    assert _query(api, end_date=today + 'T00:00:00')['total_trades'] == 0
+
+
+def test_query_does_not_see_other_users_trades(api, other_api):
+    api.closed_trade(api.account(), 100, 110)
+    assert _query(other_api)['total_trades'] == 0
+
+
+@pytest.mark.parametrize('body, message', [
+    ([], 'JSON object'),
+    ('filters', 'JSON object'),
+    ({'account_ids': 'a,b'}, 'integer ids'),
+    ({'instruments': 5}, 'must be a list'),
+    ({'start_date': '19/10/2026'}, 'ISO date'),
+    ({'trade_type': 'sideways'}, 'trade_type'),
+    ({'status': 'Gone'}, 'status'),
+    ({'date_field': 'created_at'}, 'date_field'),
+])
+def test_bad_filters_are_rejected(api, body, message):
+    response = api.post('/api/analytics/query', json=body)
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
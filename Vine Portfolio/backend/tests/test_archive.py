@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+from src.models import db, Trade, TradeExit
+from src.services.analytics_query import get_plan, parse_filters
+from src.services.archive import archive_closed_trades, archive_trades
+
+
+def _at(days_ago):
+    return (datetime.utcnow() - timedelta(days=days_ago)).replace(microsecond=0).isoformat()
+
+
+def _old_trade(api, account_id, entry_price, exit_price, days_ago, **fields):
+    trade = api.trade(account_id, entry_price, 10, entry_date=_at(days_ago + 1), stop_loss_price=entry_price - 5, **fields)
+    assert api.exit(trade['id'], exit_price, 4, exit_date=_at(days_ago)).status_code == 201
+    assert api.exit(trade['id'], exit_price, 6, exit_date=_at(days_ago), exit_reason='Target').status_code == 201
+    return trade['id']
+
+
+def _archive(app, trade_ids):
+    with app.app_context():
+        assert archive_trades(trade_ids) == len(trade_ids)
+        db.session.commit()
+
+
+def _fills(api, trade_id):
+    trade = api.get(f'/api/trades/{trade_id}').get_json()['trade']
+    return [entry['id'] for entry in trade['entries']], [exit['id'] for exit in trade['exits']]
+
+
+def _lots(api, trade_id):
+    return [(lot['entry_id'], lot['exit_id'], lot['quantity']) for lot in api.get(f'/api/trades/{trade_id}/lots').get_json()['lots']]
+
+
+def test_archived_trades_keep_their_figures(app, api):
+    account_id = api.account()
+    trade_id = _old_trade(api, account_id, 100, 110, days_ago=400)
+    before = api.get(f'/api/trades/{trade_id}').get_json()['trade']
+    analytics = api.get(f'/api/analytics/accounts/{account_id}/analytics').get_json()
+
+    with app.app_context():
+        assert archive_closed_trades(horizon_days=365) == 1
+        assert db.session.query(TradeExit).count() == 0
+
+    after = api.get(f'/api/trades/{trade_id}').get_json()['trade']
+    assert after['exits'] == before['exits']
+    assert api.post('/api/analytics/query', json={}).get_json()['analytics']['total_pnl'] == 100
+    assert api.get(f'/api/analytics/accounts/{account_id}/analytics').get_json() == analytics
+
+
+def test_restore_puts_the_fills_back_under_their_ids(app, api):
+    account_id = api.account()
+    trade_id = _old_trade(api, account_id, 100, 110, days_ago=400)
+    fills, lots = _fills(api, trade_id), _lots(api, trade_id)
+    _archive(app, [trade_id])
+
+    # Changing a summarised field brings the trade back into the hot tables
+    assert api.put(f'/api/trades/{trade_id}', json={'stop_loss_price': 90}).status_code == 200
+    assert _fills(api, trade_id) == fills
+    assert _lots(api, trade_id) == lots
+    with app.app_context():
+        assert db.session.get(Trade, trade_id).summary is None
+
+
+def test_restore_gives_new_ids_only_to_fills_whose_id_was_reused(app, api):
+    account_id = api.account()
+    first = _old_trade(api, account_id, 100, 110, days_ago=400)
+    last = _old_trade(api, account_id, 100, 120, days_ago=300)
+    last_exits = _fills(api, last)[1]
+    _archive(app, [last])
+
+    # SQLite hands the highest freed rowid out again
+    open_trade = api.trade(account_id)
+    assert api.exit(open_trade['id'], 105, 1).status_code == 201
+    assert _fills(api, open_trade['id'])[1] == last_exits[:1]
+
+    assert api.post(f'/api/trades/{last}/costs', json={'cost_type': 'Swap', 'amount': 2}).status_code == 201
+    restored = _fills(api, last)[1]
+    assert last_exits[1] in restored and len(set(restored) - set(last_exits)) == 1
+    assert {exit_id for _, exit_id, _ in _lots(api, last)} == set(restored)
+    assert _fills(api, first)[1] == [1, 2]
+
+
+def test_date_filtered_reads_leave_out_archived_trades_outside_the_range(app, api):
+    account_id = api.account()
+    old = _old_trade(api, account_id, 100, 110, days_ago=400)
+    recent = _old_trade(api, account_id, 100, 90, days_ago=380)
+    _old_trade(api, account_id, 100, 105, days_ago=10)
+    _archive(app, [old, recent])
+
+    def query(**filters):
+        return api.post('/api/analytics/query', json=filters).get_json()['analytics']
+
+    start = (datetime.utcnow() - timedelta(days=390)).date().isoformat()
+    end = (datetime.utcnow() - timedelta(days=370)).date().isoformat()
+    assert query(date_field='closed_at', start_date=start, end_date=end)['total_pnl'] == -100
+    assert query(date_field='closed_at', start_date=start)['total_pnl'] == -50
+    assert query(date_field='closed_at', end_date=end)['total_pnl'] == 0
+    assert query(date_field='opened_at', end_date=end)['closed_trades'] == 2
+
+    what_if = api.post(f'/api/analytics/accounts/{account_id}/what-if',
+                       json={'scenarios': [{'risk_percentage': 1}], 'start': start}).get_json()
+    assert what_if['actual']['trades_taken'] == 2
+
+
+def test_date_filters_reach_the_summary_lookup():
+    sql = str(get_plan(parse_filters({'date_field': 'closed_at', 'start_date': '2025-01-01'})))
+    assert 'trade_summary.closed_at >= :start_date' in sql
@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+import pytest
+
+from src.models import db, Account, Job
+from src.routes import batch as batch_module
+
+
+def _batch(api, *requests):
+    response = api.post('/api/batch', json={'requests': [dict(zip(('method', 'path', 'body'), sub)) for sub in requests]})
+    assert response.status_code == 200, response.get_json()
+    return [(sub['status'], sub['body']) for sub in response.get_json()['responses']]
+
+
+def _stored_balance(app, account_id):
+    with app.app_context():
+        return db.session.get(Account, account_id).current_balance
+
+
+def _snapshot_runs(monkeypatch):
+    """Record each sub-request's path and whether it ran inside a read snapshot"""
+    runs, inside = [], []
+    read_snapshot, run_sub_request = batch_module.read_snapshot, batch_module.run_sub_request
+
+    def tracked_snapshot():
+        inside.append(True)
+        try:
+            with read_snapshot():
+                yield
+        finally:
+            inside.pop()
+
+    def tracked_run(method, path, body):
+        runs.append((path, bool(inside)))
+        return run_sub_request(method, path, body)
+
+    monkeypatch.setattr(batch_module, 'read_snapshot', batch_module.contextmanager(tracked_snapshot))
+    monkeypatch.setattr(batch_module, 'run_sub_request', tracked_run)
+    return runs
+
+
+def test_exits_keep_the_stored_balance_in_step(app, api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110)
+    assert _stored_balance(app, account_id) == Decimal('10100.00')
+    trade_id = api.closed_trade(account_id, 100, 95)
+    assert _stored_balance(app, account_id) == Decimal('10050.00')
+    assert api.delete(f'/api/trades/{trade_id}').status_code == 200
+    assert api.get('/api/accounts/').get_json()['accounts'][0]['current_balance'] == 10100
+
+
+def test_dashboards_derive_the_balance_without_storing_it(app, api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110)
+    with app.app_context():
+        db.session.get(Account, account_id).current_balance = 123
+        db.session.commit()
+
+    account = api.get(f'/api/accounts/{account_id}/dashboard').get_json()['account']
+    assert account['current_balance'] == 10100
+    portfolio = api.get('/api/analytics/portfolio/dashboard').get_json()
+    assert portfolio['portfolio']['total_balance'] == 10100
+    assert portfolio['accounts'][0]['account']['current_balance'] == 10100
+    assert portfolio['accounts'][0]['pnl_percentage'] == 1
+    assert _stored_balance(app, account_id) == 123
+
+
+def test_only_read_only_views_share_a_snapshot(app, api, monkeypatch):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110)
+    runs = _snapshot_runs(monkeypatch)
+
+    responses = _batch(api,
+                       ('GET', f'/api/accounts/{account_id}/dashboard'),
+                       ('GET', '/api/analytics/portfolio/dashboard'),
+                       ('GET', f'/api/analytics/accounts/{account_id}/export?async=1'),
+                       ('GET', f'/api/accounts/{account_id}/trades'),
+                       ('GET', '/api/nowhere'))
+    assert [status for status, _ in responses] == [200, 200, 202, 200, 404]
+    assert runs == [(f'/api/accounts/{account_id}/dashboard', True), ('/api/analytics/portfolio/dashboard', True),
+                    (f'/api/analytics/accounts/{account_id}/export?async=1', False),
+                    (f'/api/accounts/{account_id}/trades', True), ('/api/nowhere', False)]
+    with app.app_context():
+        assert db.session.get(Job, responses[2][1]['job']['id']).job_type == 'export_account_data'
+
+
+def test_writes_are_seen_by_the_reads_after_them(api):
+    account_id = api.account()
+    trade = {'instrument': 'EURUSD', 'trade_type': 'Long', 'entry_price': 1, 'quantity': 1}
+    responses = _batch(api,
+                       ('GET', f'/api/accounts/{account_id}/trades'),
+                       ('POST', f'/api/accounts/{account_id}/trades', trade),
+                       ('GET', f'/api/accounts/{account_id}/trades'))
+    assert [status for status, _ in responses] == [200, 201, 200]
+    assert [len(body['trades']) for _, body in responses[::2]] == [0, 1]
+
+
+def test_streamed_responses_are_refused(api):
+    assert _batch(api, ('GET', '/api/events/stream'))[0][0] == 400
+
+
+@pytest.mark.parametrize('body', [
+    [],
+    {'requests': []},
+    {'requests': [{'path': '/api/accounts/'}] * 21},
+    {'requests': ['GET /api/accounts/']},
+    {'requests': [{'method': 'TRACE', 'path': '/api/accounts/'}]},
+    {'requests': [{'path': '/health'}]},
+    {'requests': [{'method': 'POST', 'path': '/api/batch'}]},
+])
+def test_bad_batches_are_rejected(api, body):
+    assert api.post('/api/batch', json=body).status_code == 400
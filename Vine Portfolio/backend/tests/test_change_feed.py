@@ -0,0 +1,57 @@
+def _changes(api, since=0, **params):
+    response = api.get('/api/changes', query_string={'since': since, **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_changes_are_compacted_to_the_latest_operation(api):
+    account_id = api.account()
+    trade = api.trade(account_id)
+    api.put(f"/api/trades/{trade['id']}", json={'notes': 'edited'})
+    api.delete(f"/api/trades/{api.trade(account_id)['id']}")
+
+    feed = _changes(api)
+    changes = {(change['entity'], change['id']): change for change in feed['changes']}
+    assert changes[('trade', trade['id'])]['op'] == 'upsert'
+    assert changes[('trade', trade['id'])]['data']['notes'] == 'edited'
+    assert [change['op'] for (entity, _), change in changes.items() if entity == 'trade'].count('delete') == 1
+    assert [change['cursor'] for change in feed['changes']] == sorted(change['cursor'] for change in feed['changes'])
+    assert feed['cursor'] == feed['changes'][-1]['cursor']
+    assert not feed['has_more']
+
+
+def test_cursor_resumes_after_the_last_change(api):
+    account_id = api.account()
+    cursor = _changes(api)['cursor']
+    trade = api.trade(account_id)
+
+    feed = _changes(api, cursor)
+    assert [(change['entity'], change['id']) for change in feed['changes']] == [('trade', trade['id'])]
+    assert _changes(api, feed['cursor']) == {'changes': [], 'cursor': feed['cursor'], 'has_more': False}
+
+
+def test_limit_pages_through_the_log(api):
+    account_id = api.account()
+    for _ in range(3):
+        api.trade(account_id)
+
+    first = _changes(api, limit=2)
+    assert first['has_more'] and len(first['changes']) == 2
+    second = _changes(api, first['cursor'], limit=2)
+    assert not second['has_more']
+    assert len(first['changes']) + len(second['changes']) == 4
+
+
+def test_deleting_an_account_tombstones_its_trades(api):
+    account_id = api.account()
+    trade = api.trade(account_id)
+    cursor = _changes(api)['cursor']
+    assert api.delete(f'/api/accounts/{account_id}').status_code == 200
+
+    ops = {(change['entity'], change['id']): change['op'] for change in _changes(api, cursor)['changes']}
+    assert ops == {('trade', trade['id']): 'delete', ('account', account_id): 'delete'}
+
+
+def test_feed_is_scoped_to_the_user(api, other_api):
+    api.trade(api.account())
+    assert _changes(other_api)['changes'] == []
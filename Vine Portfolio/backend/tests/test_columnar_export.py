@@ -0,0 +1,80 @@
+import io
+import zipfile
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.ipc as ipc  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.services import columnar_export  # noqa: E402
+from src.services.archive import archive_trades  # noqa: E402
+
+
+def _tables(response, file_format='parquet'):
+    assert response.status_code == 200, response.get_json()
+    bundle = zipfile.ZipFile(io.BytesIO(response.data))
+    tables = {}
+    for name in bundle.namelist():
+        data = pa.BufferReader(bundle.read(name))
+        table = pq.read_table(data) if file_format == 'parquet' else ipc.open_file(data).read_all()
+        tables[name.split('.')[0]] = table
+    return tables
+
+
+def test_account_export_writes_typed_tables(api):
+    account_id = api.account()
+    trade_id = api.closed_trade(account_id, 100.5, 110.25)
+    api.post(f'/api/trades/{trade_id}/costs', json={'cost_type': 'Commission', 'amount': 1.5})
+
+    tables = _tables(api.get(f'/api/analytics/accounts/{account_id}/export', query_string={'format': 'parquet'}))
+    assert set(tables) == {'trades', 'entries', 'exits', 'costs'}
+    trades = tables['trades']
+    assert pa.types.is_dictionary(trades.schema.field('instrument').type)
+    assert pa.types.is_decimal(tables['entries'].schema.field('entry_price').type)
+    assert trades.column('instrument').to_pylist() == ['EURUSD']
+    assert [float(price) for price in tables['exits'].column('exit_price').to_pylist()] == [110.25]
+    assert tables['costs'].column('cost_type').to_pylist() == ['Commission']
+
+
+def test_dictionaries_grow_across_batches_and_include_archived_rows(app, api, monkeypatch):
+    monkeypatch.setattr(columnar_export, 'BATCH_SIZE', 1)
+    account_id = api.account()
+    archived = api.closed_trade(account_id, 100, 110, instrument='GBPUSD')
+    api.closed_trade(account_id, 100, 90)
+    api.closed_trade(account_id, 100, 95, instrument='USDJPY')
+    with app.app_context():
+        archive_trades([archived])
+        db.session.commit()
+
+    tables = _tables(api.get('/api/analytics/export/columnar', query_string={'format': 'arrow'}), 'arrow')
+    assert tables['trades'].column('instrument').to_pylist() == ['GBPUSD', 'EURUSD', 'USDJPY']
+    # Live exits first, then the archived trade's exits
+    assert [float(price) for price in tables['exits'].column('exit_price').to_pylist()] == [90, 95, 110]
+
+
+def test_portfolio_export_is_scoped_to_the_users_accounts(api, other_api):
+    first, second = api.account(name='First'), api.account(name='Second')
+    api.closed_trade(first, 100, 110)
+    api.closed_trade(second, 100, 120)
+    foreign = other_api.account()
+
+    tables = _tables(api.get('/api/analytics/export/columnar', query_string={'account_ids': str(second)}))
+    assert tables['trades'].column('account_id').to_pylist() == [second]
+    assert api.get('/api/analytics/export/columnar', query_string={'account_ids': f'{first},{foreign}'}).status_code == 404
+    assert other_api.get(f'/api/analytics/accounts/{first}/export', query_string={'format': 'parquet'}).status_code == 404
+
+
+def test_bad_export_parameters_are_rejected(api):
+    api.account()
+    assert api.get('/api/analytics/export/columnar', query_string={'format': 'csv'}).status_code == 400
+    assert api.get('/api/analytics/export/columnar', query_string={'account_ids': 'one'}).status_code == 400
+
+
+def test_export_reports_missing_pyarrow(api, monkeypatch):
+    monkeypatch.setattr(columnar_export, 'pa', None)
+    account_id = api.account()
+    assert api.get('/api/analytics/export/columnar').status_code == 501
+    with pytest.raises(RuntimeError):
+        columnar_export.write_columnar_export(io.BytesIO(), [account_id])
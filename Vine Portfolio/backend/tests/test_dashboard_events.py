@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from src.routes import events
+from src.services.event_bus import LocalEventBus, Subscription, get_event_bus, set_event_bus, user_channel
+
+
+@pytest.fixture
+def bus():
+    previous = get_event_bus()
+    set_event_bus(LocalEventBus())
+    yield get_event_bus()
+    set_event_bus(previous)
+
+
+def _drain(subscription):
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append(event)
+    return events
+
+
+def test_reconnecting_subscriber_gets_only_missed_events():
+    bus = LocalEventBus(history_size=2)
+    first = bus.publish('user:1', 'a', {})
+    bus.publish('user:2', 'other', {})
+    bus.publish('user:1', 'b', {})
+    bus.publish('user:1', 'c', {})
+
+    assert [event.type for event in _drain(bus.subscribe('user:1', last_event_id=first.id))] == ['b', 'c']
+    assert _drain(bus.subscribe('user:1')) == []
+
+
+def test_slow_subscriber_drops_the_oldest_events():
+    bus = LocalEventBus()
+    subscription = Subscription(bus, 'user:1', max_pending=2)
+    for event_type in 'abc':
+        subscription.deliver(bus.publish('user:2', event_type, {}))
+
+    assert [event.type for event in _drain(subscription)] == ['b', 'c']
+
+
+def test_trade_writes_publish_deltas_and_only_changed_balances(bus, api):
+    account_id = api.account()
+    subscription = bus.subscribe(user_channel(api.user_id))
+
+    trade = api.trade(account_id)
+    assert [event.type for event in _drain(subscription)] == ['trade.created', 'account.balance_changed', 'stats.updated']
+    api.trade(account_id)  # An open trade leaves the balance where it was
+    assert [event.type for event in _drain(subscription)] == ['trade.created', 'stats.updated']
+
+    api.exit(trade['id'], 110, 10)
+    published = _drain(subscription)
+    assert [event.type for event in published] == ['trade.closed', 'account.balance_changed', 'stats.updated']
+    assert published[1].data['current_balance'] == 10100
+    assert published[2].data['win_rate'] == 100
+
+
+def test_stream_replays_from_last_event_id(bus, api, monkeypatch):
+    monkeypatch.setattr(events, 'HEARTBEAT_SECONDS', 0.01)
+    account_id = api.account()
+    bus.publish(user_channel(api.user_id), 'before', {})
+    api.trade(account_id)
+
+    response = api.get('/api/events/stream', headers={'Last-Event-ID': '1'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.response
+    assert next(chunks) == b'retry: 5000\n\n'
+    first = next(chunks).decode()
+    assert first.startswith('id: 2\nevent: trade.created\n')
+    assert json.loads(first.split('data: ', 1)[1])['account_id'] == account_id
+    assert next(chunks).decode().startswith('id: 3\nevent: account.balance_changed\n')
+    assert next(chunks).decode().startswith('id: 4\nevent: stats.updated\n')
+    assert next(chunks) == b': keep-alive\n\n'
+    response.close()
+
+
+def test_stream_requires_a_valid_token(client):
+    assert client.get('/api/events/stream').status_code == 401
+    assert client.get('/api/events/stream', query_string={'token': 'nope'}).status_code == 401
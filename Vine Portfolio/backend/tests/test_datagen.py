@@ -0,0 +1,45 @@
+from sqlalchemy import select
+
+from src.benchmarks.common import create_app
+from src.benchmarks.datagen import generate
+from src.models import db, Trade, TradeEntry, TradeExit
+from src.services.search_index import search_trades
+
+
+def _generated(tmp_path, name, seed):
+    app = create_app('sqlite:///' + str(tmp_path / name))
+    with app.app_context():
+        user_ids = generate(users=2, accounts_per_user=2, trades_per_account=15, seed=seed)
+        trades = db.session.execute(
+            select(Trade.id, Trade.account_id, Trade.instrument, Trade.trade_type, Trade.status).order_by(Trade.id)
+        ).all()
+        entries = db.session.execute(select(TradeEntry.trade_id, TradeEntry.entry_price, TradeEntry.quantity).order_by(TradeEntry.id)).all()
+        exits = db.session.execute(select(TradeExit.trade_id, TradeExit.quantity).order_by(TradeExit.id)).all()
+        hits, _ = search_trades(db.session.connection(), user_ids[0], trades[0].instrument)
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    return user_ids, trades, entries, exits, hits
+
+
+def test_same_seed_generates_the_same_data(tmp_path):
+    first = _generated(tmp_path, 'first.db', seed=7)
+    assert _generated(tmp_path, 'second.db', seed=7) == first
+    assert _generated(tmp_path, 'third.db', seed=8)[1:4] != first[1:4]
+
+
+def test_closed_trades_exit_their_whole_position(tmp_path):
+    _, trades, entries, exits, hits = _generated(tmp_path, 'data.db', seed=42)
+    assert len(trades) == 2 * 2 * 15
+    assert hits > 0  # Bulk-inserted trades are indexed for search
+
+    entered, exited = {}, {}
+    for trade_id, _, quantity in entries:
+        entered[trade_id] = entered.get(trade_id, 0) + quantity
+    for trade_id, quantity in exits:
+        exited[trade_id] = exited.get(trade_id, 0) + quantity
+    for trade in trades:
+        if trade.status == 'Closed':
+            assert exited[trade.id] == entered[trade.id]
+        else:
+            assert exited.get(trade.id, 0) < entered[trade.id]
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import text
+
+from src.benchmarks.common import create_app
+from src.models import db
+from src.services.instrumentation import init_instrumentation, n_plus_one
+
+REMOTE = {'REMOTE_ADDR': '203.0.113.9'}
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    apps = []
+
+    def make(**config):
+        app = create_app('sqlite:///' + str(tmp_path / f'metrics{len(apps)}.db'), with_routes=True)
+        app.config.update(config)
+        init_instrumentation(app)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def test_metrics_are_local_only_without_a_token(make_app):
+    client = make_app(METRICS_TOKEN=None).test_client()
+    client.post('/api/auth/login', json={})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/auth/login"' in response.text
+    assert client.get('/metrics', environ_base=REMOTE).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'}).status_code == 403
+
+
+def test_metrics_token_is_required_when_configured(make_app):
+    client = make_app(METRICS_TOKEN='scrape-secret').test_client()
+
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', environ_base=REMOTE, headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+
+
+def test_metrics_can_be_turned_off(make_app):
+    assert make_app(METRICS_ENABLED=False).test_client().get('/metrics').status_code == 404
+
+
+def test_server_timing_counts_the_request_queries(make_app):
+    client = make_app().test_client()
+    response = client.post('/api/auth/register', json={'email': 'timing@example.com', 'password': 'secret'})
+    assert response.status_code == 201
+    assert 'queries"' in response.headers['Server-Timing']
+    assert not response.headers['Server-Timing'].endswith('desc="0 queries"')
+
+
+def test_n_plus_one_detection_follows_debug_per_request(make_app):
+    app = make_app(DETECT_N_PLUS_ONE=None, N_PLUS_ONE_THRESHOLD=3)
+
+    @app.route('/repeat')
+    def repeat():
+        for value in range(3):
+            db.session.execute(text('SELECT :value'), {'value': value})
+        return 'ok'
+
+    def detected():
+        return sum(count for (route, _), count in n_plus_one._values.items() if route == '/repeat')
+
+    before = detected()
+    app.test_client().get('/repeat')
+    assert detected() == before
+    app.debug = True
+    app.test_client().get('/repeat')
+    assert detected() == before + 1
+
+
+def test_failed_statements_keep_the_timer_balanced(make_app):
+    app = make_app()
+
+    @app.route('/fails')
+    def fails():
+        connection = db.session.connection()
+        with pytest.raises(Exception):
+            connection.execute(text('SELECT * FROM missing_table'))
+        return str(len(connection.info['query_started']))
+
+    assert app.test_client().get('/fails').text == '0'
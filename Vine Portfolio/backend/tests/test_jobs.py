@@ -0,0 +1,136 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from src.models import db, Job
+from src.services.jobs import JobError, JobWorkerPool, claim_job, enqueue, execute_job, register_job
+
+calls = []
+
+
+@register_job('test_flaky', max_attempts=2)
+def flaky_job(context):
+    calls.append(context.attempt)
+    if context.params.get('fail') == 'always' or context.attempt == 1:
+        raise RuntimeError(f'attempt {context.attempt} failed')
+    return {'attempt': context.attempt}
+
+
+@register_job('test_rejected')
+def rejected_job(context):
+    raise JobError('cannot be retried')
+
+
+def _job(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        db.session.expunge(job)
+        return job
+
+
+def _enqueue(app, job_type, params=None):
+    with app.app_context():
+        job = enqueue(job_type, params=params)
+        db.session.commit()
+        return job.id
+
+
+def _make_runnable(app, job_id):
+    with app.app_context():
+        db.session.get(Job, job_id).run_after = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+
+def test_bad_submissions_are_rejected(api, other_api):
+    account_id = api.account()
+    assert api.post('/api/jobs/', json={'job_type': 'nope'}).status_code == 400
+    assert api.post('/api/jobs/', json=[]).status_code == 400
+    response = other_api.post('/api/jobs/', json={'job_type': 'export_account_data', 'params': {'account_id': account_id}})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Account not found'
+
+
+def test_export_job_runs_and_serves_its_result(app, api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110)
+    response = api.post('/api/jobs/', json={'job_type': 'export_account_data', 'params': {'account_id': account_id}})
+    assert response.status_code == 202
+    job_path = response.headers['Location']
+    assert api.get(job_path + '/result').status_code == 409
+
+    with app.app_context():
+        job_id = claim_job()
+        execute_job(job_id)
+
+    assert api.get(job_path).get_json()['job']['status'] == 'succeeded'
+    rows = api.get(job_path + '/result').get_json()['csv_data']
+    assert rows[0][:3] == ['Trade ID', 'Trade Name', 'Instrument']
+    assert [row[2] for row in rows[1:]] == ['EURUSD']
+
+
+def test_only_one_worker_claims_a_job(app):
+    job_id = _enqueue(app, 'test_flaky')
+
+    def claim(_):
+        with app.app_context():
+            return claim_job()
+
+    with ThreadPoolExecutor(8) as pool:
+        claimed = list(pool.map(claim, range(8)))
+    assert [value for value in claimed if value is not None] == [job_id]
+    assert _job(app, job_id).attempts == 1
+
+
+def test_expired_leases_are_claimed_again(app):
+    job_id = _enqueue(app, 'test_flaky')
+    with app.app_context():
+        assert claim_job(lease_seconds=60) == job_id
+        assert claim_job(lease_seconds=60) is None
+        db.session.get(Job, job_id).locked_at = datetime.utcnow() - timedelta(seconds=120)
+        db.session.commit()
+        assert claim_job(lease_seconds=60) == job_id
+    assert _job(app, job_id).attempts == 2
+
+
+def test_failures_retry_with_backoff_until_attempts_run_out(app):
+    calls.clear()
+    job_id = _enqueue(app, 'test_flaky', {'fail': 'always'})
+    with app.app_context():
+        execute_job(claim_job())
+    job = _job(app, job_id)
+    assert (job.status, job.error) == ('queued', 'attempt 1 failed')
+    assert job.run_after > datetime.utcnow()
+
+    with app.app_context():
+        assert claim_job() is None  # Still backing off
+    _make_runnable(app, job_id)
+    with app.app_context():
+        execute_job(claim_job())
+    assert _job(app, job_id).status == 'failed'
+    assert calls == [1, 2]
+
+
+def test_job_errors_fail_without_retrying(app):
+    job_id = _enqueue(app, 'test_rejected')
+    with app.app_context():
+        execute_job(claim_job())
+    job = _job(app, job_id)
+    assert (job.status, job.attempts, job.error) == ('failed', 1, 'cannot be retried')
+
+
+def test_worker_pool_runs_queued_jobs(app):
+    calls.clear()
+    pool = JobWorkerPool(app, threads=2, poll_interval=0.05)
+    pool.start()
+    try:
+        job_id = _enqueue(app, 'test_flaky')
+        deadline = time.monotonic() + 5
+        while _job(app, job_id).error is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # Skip the backoff once the first failure has been recorded
+        _make_runnable(app, job_id)
+        while _job(app, job_id).status != 'succeeded' and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    assert _job(app, job_id).get_result() == {'attempt': 2}
@@ -0,0 +1,62 @@
+import argparse
+import json
+
+import pytest
+
+from src.benchmarks.loadtest import DEFAULT_MIX, Recorder, compare, parse_mix, percentile, run_load, serve
+
+
+def test_percentiles_use_the_nearest_rank():
+    samples = list(range(1, 101))
+    assert [percentile(samples, q) for q in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([1, 2, 3], 0) == 1
+    assert percentile([], 50) is None
+
+
+def test_mixes_override_the_default_weights():
+    mix = parse_mix('trades.create=10, risk.suggestions=0,trades.list')
+    assert mix['trades.create'] == 10 and mix['trades.list'] == 1
+    assert 'risk.suggestions' not in mix
+    assert parse_mix('') == DEFAULT_MIX
+    with pytest.raises(argparse.ArgumentTypeError, match='Unknown action'):
+        parse_mix('trades.delete=1')
+    with pytest.raises(argparse.ArgumentTypeError, match='no actions left'):
+        parse_mix(','.join(f'{name}=0' for name in DEFAULT_MIX))
+
+
+def test_reports_summarize_each_action_and_the_total():
+    recorder = Recorder()
+    for millis in range(1, 21):
+        recorder.record('trades.list', millis / 1000, None)
+    recorder.record('trades.create', 0.5, 'HTTP 500')
+    recorder.record('trades.create', 0.1, None)
+
+    report = recorder.report(elapsed=2)
+    listed = report['actions']['trades.list']
+    assert (listed['requests'], listed['throughput_rps'], listed['p50_ms'], listed['p95_ms'], listed['max_ms']) == \
+        (20, 10, 10, 19, 20)
+    assert report['actions']['trades.create']['error_rate'] == 0.5
+    assert report['total'] == dict(report['total'], requests=22, errors={'HTTP 500': 1}, max_ms=500)
+
+
+def test_compare_flags_slower_and_failing_actions(tmp_path, capsys):
+    stats = {'requests': 10, 'throughput_rps': 10, 'error_rate': 0, 'p95_ms': 10}
+    previous = tmp_path / 'before.json'
+    previous.write_text(json.dumps({'label': 'before', 'actions': {'fast': stats, 'slow': stats, 'broken': stats}}))
+    current = {'actions': {'fast': dict(stats, p95_ms=11), 'slow': dict(stats, p95_ms=20),
+                           'broken': dict(stats, error_rate=0.1), 'new': stats}}
+    assert compare(current, str(previous), 0.2) == 2
+    output = capsys.readouterr().out
+    assert 'REGRESSION slow' in output and 'REGRESSION broken' in output and 'fast' not in output
+
+
+def test_a_short_run_against_the_in_process_server(tmp_path):
+    server, base_url = serve(str(tmp_path / 'load.db'), 0)
+    try:
+        report = run_load(base_url, users=3, duration=1, mix=parse_mix(''), seed_trades=2)
+    finally:
+        server.shutdown()
+    assert report['setup']['requests'] > 0 and report['setup']['error_rate'] == 0
+    assert report['total']['requests'] > 0 and report['total']['errors'] == {}
+    assert set(report['actions']) <= set(DEFAULT_MIX)
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models import db
+from src.services import lot_matching
+from src.services.lot_matching import LotBook, rebuild_lots, replay
+from src.services.money import to_fixed, PRICE_DIGITS, QUANTITY_DIGITS
+
+START = datetime(2026, 1, 5, 9)
+
+
+def _fills(*fills):
+    """(id, minutes after START, price, quantity) tuples in fixed units"""
+    return [(fill_id, minute * 60 * 1000000, to_fixed(price, PRICE_DIGITS), to_fixed(quantity, QUANTITY_DIGITS))
+            for fill_id, minute, price, quantity in fills]
+
+
+ENTRIES = _fills((1, 0, 100, 10), (2, 10, 110, 10))
+EXITS = _fills((1, 20, 120, 15))
+
+
+@pytest.mark.parametrize('method, pnl', [('fifo', 20000 + 5000), ('lifo', 10000 + 10000), ('average', 15 * 1500)])
+def test_methods_split_an_exit_differently(method, pnl):
+    book, matches = replay(method, True, ENTRIES, EXITS)
+    assert sum(match.pnl for match in matches) == pnl
+    assert sum(match.quantity for match in matches) == to_fixed(15, QUANTITY_DIGITS)
+    assert sum(lot.quantity for lot in book.lots) == to_fixed(5, QUANTITY_DIGITS)
+
+
+def test_short_lots_gain_when_the_price_falls():
+    _, matches = replay('fifo', False, _fills((1, 0, 100, 1)), _fills((1, 5, 90, 1)))
+    assert [match.pnl for match in matches] == [1000]
+
+
+def test_exits_larger_than_the_book_wait_for_entries():
+    book = LotBook('fifo', True)
+    assert book.close(1, 0, to_fixed(10, PRICE_DIGITS), to_fixed(5, QUANTITY_DIGITS)) == []
+    assert book.unmatched == to_fixed(5, QUANTITY_DIGITS)
+    matches = book.add(1, 1, to_fixed(8, PRICE_DIGITS), to_fixed(3, QUANTITY_DIGITS))
+    assert [match.quantity for match in matches] == [to_fixed(3, QUANTITY_DIGITS)]
+    assert book.unmatched == to_fixed(2, QUANTITY_DIGITS)
+    with pytest.raises(ValueError):
+        LotBook('hifo', True)
+
+
+def _at(minutes):
+    return (START + timedelta(minutes=minutes)).isoformat()
+
+
+def _lots(api, trade_id, **params):
+    response = api.get(f'/api/trades/{trade_id}/lots', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.mark.parametrize('method', ['fifo', 'lifo', 'average'])
+def test_incremental_matching_agrees_with_a_replay(app, api, monkeypatch, method):
+    trade_id = api.trade(api.account(lot_method=method), 100, 5, entry_date=_at(0))['id']
+    rebuilds = []
+    monkeypatch.setattr(lot_matching, 'rebuild_lots', lambda ids: rebuilds.append(ids) or rebuild_lots(ids))
+
+    for step in range(1, 8):
+        assert api.post(f'/api/trades/{trade_id}/entries',
+                        json={'entry_price': 100 + step, 'quantity': 2, 'entry_date': _at(step * 10)}).status_code == 201
+        assert api.exit(trade_id, 103 + step, 2 + step % 2, exit_date=_at(step * 10 + 5)).status_code == 201
+    assert rebuilds == []
+
+    incremental = _lots(api, trade_id)
+    with app.app_context():
+        rebuild_lots([trade_id])
+        db.session.commit()
+    replayed = _lots(api, trade_id)
+    key = ['entry_id', 'exit_id', 'quantity', 'entry_price', 'realized_pnl', 'holding_seconds']
+    assert [[lot[name] for name in key] for lot in incremental['lots']] == \
+        [[lot[name] for name in key] for lot in replayed['lots']]
+    assert incremental['realized_pnl'] == replayed['realized_pnl']
+
+
+def test_back_dated_fills_replay_the_trade(api):
+    trade_id = api.trade(api.account(), 100, 5, entry_date=_at(0))['id']
+    assert api.exit(trade_id, 110, 5, exit_date=_at(30)).status_code == 201
+    entry = api.post(f'/api/trades/{trade_id}/entries', json={'entry_price': 90, 'quantity': 5, 'entry_date': _at(10)})
+    assert entry.status_code == 201
+    assert api.exit(trade_id, 120, 5, exit_date=_at(40)).status_code == 201
+
+    report = _lots(api, trade_id)
+    assert [(lot['entry_price'], lot['exit_price']) for lot in report['lots']] == [(100, 110), (90, 120)]
+    assert _lots(api, trade_id, method='lifo')['lots'][0]['entry_price'] == 90
+    assert _lots(api, trade_id, method='lifo')['stored'] is False
+
+
+def test_method_changes_rebuild_the_stored_lots(api):
+    account_id = api.account()
+    trade_id = api.trade(account_id, 100, 5, entry_date=_at(0))['id']
+    api.post(f'/api/trades/{trade_id}/entries', json={'entry_price': 110, 'quantity': 5, 'entry_date': _at(5)})
+    api.exit(trade_id, 120, 5, exit_date=_at(10))
+
+    assert api.put(f'/api/accounts/{account_id}', json={'lot_method': 'lifo'}).status_code == 200
+    report = _lots(api, trade_id)
+    assert (report['method'], report['stored'], report['realized_pnl']) == ('lifo', True, 50)
+    summary = api.get(f'/api/analytics/accounts/{account_id}/lots').get_json()
+    assert summary['totals']['realized_pnl'] == 50
+
+
+def test_bad_lot_methods_are_rejected(api):
+    account_id = api.account()
+    trade_id = api.trade(account_id)['id']
+    assert api.get(f'/api/trades/{trade_id}/lots', query_string={'method': 'hifo'}).status_code == 400
+    assert api.put(f'/api/accounts/{account_id}', json={'lot_method': 'hifo'}).status_code == 400
+    assert api.post('/api/accounts/', json={'name': 'Bad', 'initial_capital': 1, 'lot_method': 'hifo'}).status_code == 400
+
+
+def test_concurrent_exits_store_each_lot_once(api):
+    trade_id = api.trade(api.account(), 100, 12, entry_date=_at(0))['id']
+
+    with ThreadPoolExecutor(6) as pool:
+        statuses = list(pool.map(lambda step: api.exit(trade_id, 110, 2, exit_date=_at(step + 1)).status_code, range(6)))
+    assert statuses == [201] * 6
+
+    report = _lots(api, trade_id)
+    assert sorted(lot['exit_id'] for lot in report['lots']) == sorted({lot['exit_id'] for lot in report['lots']})
+    assert (report['matched_quantity'], report['realized_pnl']) == (12, 120)
+    assert sum(lot['quantity'] for lot in report['lots']) == 12
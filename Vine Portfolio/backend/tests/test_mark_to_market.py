@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+
+from src.models import db
+from src.services.price_store import import_bars, import_price_file, latest_prices, parse_bar
+
+
+def _prices(app, *rows):
+    with app.app_context():
+        import_bars([{'symbol': instrument, 'time': moment, 'close': close} for instrument, moment, close in rows])
+        db.session.commit()
+
+
+def _marked(api, **params):
+    response = api.get('/api/analytics/portfolio/mark-to-market', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_open_positions_are_marked_at_the_latest_price(app, api):
+    account_id = api.account()
+    long_id = api.trade(account_id, 100, 10, stop_loss_price=95)['id']
+    assert api.exit(long_id, 104, 4).status_code == 201
+    short_id = api.trade(account_id, 50, 2, trade_type='Short', instrument='gbpusd', stop_loss_price=55)['id']
+    api.closed_trade(account_id, 100, 110)
+    _prices(app, ('EURUSD', '2026-01-01T00:00:00', 101), ('EURUSD', '2026-01-02T00:00:00', 103),
+            ('GBPUSD', '2026-01-02T00:00:00', 48))
+
+    data = _marked(api)
+    positions = {position['trade_id']: position for position in data['positions']}
+    assert set(positions) == {long_id, short_id}
+    assert positions[long_id] == dict(positions[long_id], open_quantity=6, mark_price=103, cost_basis=600,
+                                      market_value=618, unrealized_pnl=18, distance_to_stop=8, risk_to_stop=48)
+    assert positions[short_id] == dict(positions[short_id], mark_price=48, unrealized_pnl=4, distance_to_stop=7,
+                                       risk_to_stop=14)
+    assert data['portfolio'] == dict(data['portfolio'], positions=2, priced_positions=2, unrealized_pnl=22,
+                                     cost_basis=700, unpriced_instruments=[])
+
+
+def test_marks_follow_as_of_and_unpriced_positions_stay_out_of_the_totals(app, api):
+    account_id = api.account()
+    api.trade(account_id, 100, 1)
+    api.trade(account_id, 10, 1, instrument='XAUUSD')
+    _prices(app, ('EURUSD', '2026-01-01T00:00:00', 90), ('EURUSD', '2026-01-05T00:00:00', 120))
+
+    data = _marked(api, as_of='2026-01-03')
+    assert [position['mark_price'] for position in data['positions']] == [90, None]
+    assert data['portfolio'] == dict(data['portfolio'], positions=2, priced_positions=1, unrealized_pnl=-10,
+                                     unpriced_instruments=['XAUUSD'])
+    assert _marked(api)['portfolio']['unrealized_pnl'] == 20
+
+
+def test_marking_at_the_exit_price_matches_the_realized_pnl(app, api):
+    account_id = api.account()
+    trade_id = api.trade(account_id, 1.10001, 0.3)['id']
+    api.post(f'/api/trades/{trade_id}/entries', json={'entry_price': 1.20003, 'quantity': 0.7})
+    _prices(app, ('EURUSD', '2026-01-01T00:00:00', 1.31))
+    unrealized = _marked(api)['portfolio']['unrealized_pnl']
+
+    assert api.exit(trade_id, 1.31, 1).status_code == 201
+    realized = api.post('/api/analytics/query', json={}).get_json()['analytics']['total_pnl']
+    assert unrealized == realized
+
+
+def test_scope_and_bad_parameters(api, other_api):
+    account_id, other_id = api.account(), api.account(name='Other')
+    api.trade(other_id)
+    assert _marked(api, account_ids=str(account_id))['positions'] == []
+    assert api.get('/api/analytics/portfolio/mark-to-market', query_string={'account_ids': 'x'}).status_code == 400
+    assert api.get('/api/analytics/portfolio/mark-to-market', query_string={'as_of': 'soon'}).status_code == 400
+    foreign = other_api.account()
+    assert api.get('/api/analytics/portfolio/mark-to-market', query_string={'account_ids': str(foreign)}).status_code == 404
+
+
+def test_imports_parse_ticks_bars_and_epoch_times_and_upsert(app, tmp_path):
+    assert parse_bar({'ticker': ' eurusd ', 'timestamp': '1767225600000', 'price': '1.1'}) == {
+        'instrument': 'EURUSD', 'bar_time': datetime(2026, 1, 1), 'open_price': 1.1, 'high_price': 1.1,
+        'low_price': 1.1, 'close_price': 1.1, 'volume': None
+    }
+    assert parse_bar({'symbol': 'X', 'date': '2026-01-01T01:00:00+01:00', 'close': 2})['bar_time'] == datetime(2026, 1, 1)
+
+    path = tmp_path / 'bars.csv'
+    path.write_text('Time,Open,High,Low,Close,Volume\n2026-01-01,1,2,0.5,1.5,10\n2026-01-02,1.5,2,1,1.8,\n')
+    with app.app_context():
+        assert import_price_file(str(path), instrument='eurusd') == 2
+        path.write_text('Time,Close\n2026-01-02,1.9\n')
+        assert import_price_file(str(path), instrument='EURUSD') == 1
+        db.session.commit()
+        assert latest_prices(['eurusd']) == {'EURUSD': (1.9, datetime(2026, 1, 2))}
+
+        path.write_text('Time,Close\n2026-01-03,\n')
+        with pytest.raises(ValueError, match='Row 1'):
+            import_price_file(str(path), instrument='EURUSD')
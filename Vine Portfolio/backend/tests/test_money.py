@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+import pytest
+
+from src.services.money import (
+    CASH_DIGITS, PRICE_DIGITS, QUANTITY_DIGITS, fixed_to_decimal, percent_of, position_size,
+    round_div, to_cents, to_fixed, to_fixed_many, trade_figures, whole_units_for_risk
+)
+
+
+@pytest.mark.parametrize('numerator, denominator, expected', [
+    (5, 2, 2), (7, 2, 4), (-5, 2, -2), (-7, 2, -4), (5, -2, -2), (10, 3, 3), (11, 3, 4)
+])
+def test_round_div_rounds_half_to_even(numerator, denominator, expected):
+    assert round_div(numerator, denominator) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1.015, 102), (1.025, 102), (0.125, 12), (Decimal('2.675'), 268), ('19.99', 1999), (None, 0), (3, 300)
+])
+def test_to_cents_rounds_the_printed_decimal(value, expected):
+    assert to_cents(value) == expected
+
+
+def test_to_fixed_rejects_non_numbers():
+    for value in ('abc', Decimal('NaN'), Decimal('Infinity')):
+        with pytest.raises(ValueError):
+            to_fixed(value, PRICE_DIGITS)
+
+
+def test_batch_conversion_matches_single_values():
+    values = [1.015, 0.1, 2.5e-9, Decimal('1.23456789'), 1e20, -0.000000005]
+    assert to_fixed_many(values, PRICE_DIGITS) == [to_fixed(value, PRICE_DIGITS) for value in values]
+    assert to_fixed_many([1, None, '2.5'], CASH_DIGITS) == [100, 0, 250]
+
+
+def test_cash_sums_do_not_drift():
+    cents = sum(to_fixed_many([0.1] * 1000, CASH_DIGITS))
+    assert fixed_to_decimal(cents, CASH_DIGITS) == Decimal('100.00')
+
+
+def test_trade_figures_are_exact():
+    figures = trade_figures(
+        True, 0.9,
+        entry_prices=[1.1, 1.2], entry_quantities=[0.1, 0.2],
+        exit_prices=[1.3], exit_quantities=[0.3],
+        cost_amounts=[0.01, 0.02]
+    )
+    assert figures['entry_qty'] == to_fixed('0.3', QUANTITY_DIGITS)
+    # Average entry 1.1666...: the P&L is taken against the cost basis, not the rounded average
+    assert figures['avg_entry'] == 116666667
+    assert figures['gross_pnl'] == 4  # (1.3 * 0.3) - (0.11 + 0.24) = 0.04
+    assert figures['net_pnl'] == 1
+    assert figures['risk_amount'] == 8  # 0.35 - 0.9 * 0.3 = 0.08
+    assert figures['r_multiple'] == pytest.approx(1 / 8)
+
+
+def test_short_trades_gain_when_the_price_falls():
+    figures = trade_figures(False, None, [100], [2], [90], [1], [])
+    assert (figures['gross_pnl'], figures['risk_amount'], figures['r_multiple']) == (1000, 0, 0)
+
+
+def test_sizing_helpers():
+    risk = to_cents(100)
+    distance = to_fixed(2, PRICE_DIGITS)
+    assert position_size(risk, distance) == to_fixed(50, QUANTITY_DIGITS)
+    assert whole_units_for_risk(risk, to_fixed(3, PRICE_DIGITS)) == 33
+    assert percent_of(to_cents(10000), 1.5) == to_cents(150)
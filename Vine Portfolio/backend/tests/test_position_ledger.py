@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from src.models import db, Trade
+from src.services.money import QUANTITY_SCALE
+from src.services.position_ledger import InsufficientQuantity, apply_exit, check_close, rebuild_open_quantities
+
+
+def _ledger(app, trade_id):
+    with app.app_context():
+        trade = db.session.get(Trade, trade_id)
+        return trade.open_quantity_units / QUANTITY_SCALE, trade.status
+
+
+def test_exits_count_down_and_close_the_trade(app, api):
+    trade_id = api.trade(api.account(), 100, 10)['id']
+    assert api.post(f'/api/trades/{trade_id}/entries', json={'entry_price': 102, 'quantity': 5}).status_code == 201
+    assert api.exit(trade_id, 110, 6).status_code == 201
+    assert _ledger(app, trade_id) == (9, 'Open')
+
+    response = api.exit(trade_id, 110, 9.5)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Cannot exit 9.5 units. Only 9.0 units are open.'
+    assert api.exit(trade_id, 110, 0).status_code == 400
+
+    assert api.exit(trade_id, 110, 9).status_code == 201
+    assert _ledger(app, trade_id) == (0, 'Closed')
+
+
+def test_closing_by_hand_needs_an_empty_ledger(app, api):
+    trade_id = api.trade(api.account(), 100, 10)['id']
+    response = api.put(f'/api/trades/{trade_id}', json={'status': 'Closed', 'notes': 'done'})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Cannot close a trade with 10.0 units open')
+    assert _ledger(app, trade_id) == (10, 'Open')
+    assert api.get(f'/api/trades/{trade_id}').get_json()['trade']['notes'] is None
+
+    assert api.exit(trade_id, 110, 10).status_code == 201
+    assert api.put(f'/api/trades/{trade_id}', json={'status': 'Open'}).status_code == 200
+    assert api.put(f'/api/trades/{trade_id}', json={'status': 'Closed'}).status_code == 200
+    assert _ledger(app, trade_id) == (0, 'Closed')
+
+
+def test_a_close_loses_to_an_entry_made_after_it_was_checked(app, api):
+    trade_id = api.trade(api.account(), 100, 10)['id']
+    assert api.exit(trade_id, 110, 10).status_code == 201
+    assert api.put(f'/api/trades/{trade_id}', json={'status': 'Open'}).status_code == 200
+
+    with app.app_context():
+        trade = db.session.get(Trade, trade_id)
+        check_close(trade)
+        trade.status = 'Closed'
+        # Committed by another request between the check and the flush; a thread of its own
+        # keeps it out of this app context and its session
+        with ThreadPoolExecutor(1) as pool:
+            entry = pool.submit(api.post, f'/api/trades/{trade_id}/entries', json={'entry_price': 100, 'quantity': 4})
+            assert entry.result().status_code == 201
+        with pytest.raises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
+    assert _ledger(app, trade_id) == (4, 'Open')
+
+
+def test_concurrent_exits_never_close_more_than_is_open(app, api):
+    trade_id = api.trade(api.account(), 100, 10)['id']
+
+    def exit_three(_):
+        with app.app_context():
+            try:
+                remaining = apply_exit(trade_id, 3)
+            except InsufficientQuantity:
+                db.session.rollback()
+                return None
+            db.session.commit()
+            return remaining
+
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(exit_three, range(6)))
+    applied = [value for value in results if value is not None]
+    assert sorted(applied, reverse=True) == [7 * QUANTITY_SCALE, 4 * QUANTITY_SCALE, QUANTITY_SCALE]
+    assert _ledger(app, trade_id) == (1, 'Open')
+
+
+def test_rebuild_fixes_only_drifted_counters(app, api):
+    account_id = api.account()
+    drifted = api.trade(account_id, 100, 10)['id']
+    api.exit(drifted, 110, 4)
+    api.trade(account_id, 100, 5)
+    with app.app_context():
+        db.session.get(Trade, drifted).open_quantity_units = 0
+        db.session.commit()
+        connection = db.session.connection()
+        assert rebuild_open_quantities(connection) == 1
+        assert rebuild_open_quantities(connection) == 0
+        db.session.commit()
+    assert _ledger(app, drifted) == (6, 'Open')
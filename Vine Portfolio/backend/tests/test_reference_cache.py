@@ -0,0 +1,105 @@
+from threading import Event, Thread
+
+from sqlalchemy import insert
+
+from src.models import db, RiskType, StrategyTag
+from src.services import reference_cache as cache_module
+from src.services.reference_cache import ReferenceCache, ReferenceData, reference_cache, reference_data, risk_type_name
+
+
+def _count_loads(monkeypatch):
+    loads = []
+    load = ReferenceData.load.__func__
+    monkeypatch.setattr(ReferenceData, 'load', classmethod(lambda cls, user_id: loads.append(user_id) or load(cls, user_id)))
+    return loads
+
+
+def test_reads_are_served_from_the_cache_until_a_commit_changes_them(app, api, monkeypatch):
+    loads = _count_loads(monkeypatch)
+    api.risk_type('Scalp')
+    assert [item['name'] for item in api.get('/api/risk/risk-types').get_json()['risk_types']] == ['Scalp']
+    api.get('/api/risk/risk-types')
+    api.get('/api/risk/strategy-tags')
+    assert loads == [api.user_id]
+
+    api.strategy_tag('Breakout')
+    assert [item['name'] for item in api.get('/api/risk/strategy-tags').get_json()['strategy_tags']] == ['Breakout']
+    assert loads == [api.user_id] * 2
+
+
+def test_renames_reach_serialized_trades(app, api):
+    account_id = api.account()
+    tag_id = api.strategy_tag('Breakout')
+    trade_id = api.trade(account_id, strategy_tags=[tag_id])['id']
+    assert api.get(f'/api/trades/{trade_id}').get_json()['trade']['strategy_tags'] == ['Breakout']
+
+    with app.app_context():
+        db.session.get(StrategyTag, tag_id).name = 'Range break'
+        db.session.commit()
+    assert api.get(f'/api/trades/{trade_id}').get_json()['trade']['strategy_tags'] == ['Range break']
+
+
+def test_rollbacks_drop_what_the_transaction_may_have_cached(app, api):
+    api.risk_type('Swing')
+    with app.app_context():
+        db.session.add(RiskType(user_id=api.user_id, name='Uncommitted'))
+        db.session.flush()
+        assert [item['name'] for item in reference_data(api.user_id).risk_types.values()] == ['Swing', 'Uncommitted']
+        db.session.rollback()
+        assert [item['name'] for item in reference_data(api.user_id).risk_types.values()] == ['Swing']
+
+
+def test_ids_written_elsewhere_reload_once_and_unknown_ids_are_remembered(app, api, monkeypatch):
+    with app.app_context():
+        reference_data(api.user_id)
+        # Another process inserts behind this one's back: no ORM events fire here
+        db.session.execute(insert(RiskType).values(id=7, user_id=api.user_id, name='Elsewhere'))
+        db.session.commit()
+
+        loads = _count_loads(monkeypatch)
+        assert risk_type_name(api.user_id, 7) == 'Elsewhere'
+        assert risk_type_name(api.user_id, 99) is None
+        assert risk_type_name(api.user_id, 99) is None
+        assert loads == [api.user_id] * 2
+    assert api.post(f'/api/accounts/{api.account()}/trades',
+                    json={'instrument': 'EURUSD', 'trade_type': 'Long', 'entry_price': 1, 'quantity': 1,
+                          'risk_type_id': 99}).status_code == 400
+
+
+def test_entries_expire_and_the_least_recent_user_is_evicted(app, api, other_api, monkeypatch):
+    cache = ReferenceCache(max_users=1, ttl=300)
+    monkeypatch.setattr(cache_module, 'reference_cache', cache)
+    with app.app_context():
+        first = reference_data(api.user_id)
+        assert reference_data(api.user_id) is first
+        reference_data(other_api.user_id)
+        assert list(cache._entries) == [other_api.user_id]
+        assert reference_data(api.user_id) is not first
+
+        cache.ttl = 0
+        assert reference_data(api.user_id) is not reference_data(api.user_id)
+
+
+def test_a_load_racing_an_invalidation_is_not_kept(app, api, monkeypatch):
+    loading, invalidated = Event(), Event()
+    load = ReferenceData.load.__func__
+
+    def slow_load(cls, user_id):
+        data = load(cls, user_id)
+        loading.set()
+        invalidated.wait(5)
+        return data
+
+    monkeypatch.setattr(ReferenceData, 'load', classmethod(slow_load))
+
+    def read():
+        with app.app_context():
+            reference_data(api.user_id)
+
+    reader = Thread(target=read)
+    reader.start()
+    assert loading.wait(5)
+    reference_cache.invalidate(api.user_id)
+    invalidated.set()
+    reader.join()
+    assert api.user_id not in reference_cache._entries
@@ -0,0 +1,90 @@
+from src.models import db, Account
+from src.models.alert import AccountAlertState
+from src.services.money import open_risk, to_fixed, PRICE_DIGITS, QUANTITY_DIGITS
+
+
+def _exposure(api, **params):
+    response = api.get('/api/analytics/portfolio/risk-exposure', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _account(data, account_id):
+    return next(account for account in data['accounts'] if account['account_id'] == account_id)
+
+
+def test_open_risk_is_summed_exactly_per_position(api):
+    account_id = api.account()
+    trade_id = api.trade(account_id, 1.10001, 0.3, stop_loss_price=1)['id']
+    api.post(f'/api/trades/{trade_id}/entries', json={'entry_price': 1.20003, 'quantity': 0.7})
+    for _ in range(3):
+        api.trade(account_id, 0.3, 1, stop_loss_price=0.2)
+    partial = api.trade(account_id, 100, 10, trade_type='Short', stop_loss_price=104)['id']
+    assert api.exit(partial, 98, 4).status_code == 201
+    # A stop past the entry locks in profit; no stop is unbounded
+    api.trade(account_id, 100, 1, stop_loss_price=101)
+    api.trade(account_id, 100, 1)
+
+    account = _account(_exposure(api), account_id)
+    # 0.170024 + 3 x 0.10 + 6 x 4
+    assert account['open_risk'] == 24.47
+    assert (account['positions'], account['unprotected_positions']) == (7, 1)
+
+
+def test_open_risk_rounds_once_against_the_cost_basis():
+    # Two of three units at an average entry of 1.1666...
+    entry_qty = to_fixed(3, QUANTITY_DIGITS)
+    entry_value = to_fixed(1.1, PRICE_DIGITS) * to_fixed(1, QUANTITY_DIGITS) + \
+        to_fixed(1.2, PRICE_DIGITS) * to_fixed(2, QUANTITY_DIGITS)
+    stop = to_fixed(1.14, PRICE_DIGITS)
+    assert open_risk(True, stop, to_fixed(2, QUANTITY_DIGITS), entry_qty, entry_value) == 5
+    assert open_risk(False, stop, to_fixed(2, QUANTITY_DIGITS), entry_qty, entry_value) == 0
+    assert open_risk(True, 0, entry_qty, entry_qty, entry_value) == 0
+
+
+def test_balances_come_from_closed_trade_pnl(app, api):
+    account_id = api.account(max_drawdown=10)
+    api.closed_trade(account_id, 100, 200)  # +1000, peak 11000
+    api.closed_trade(account_id, 100, 50)  # -500
+    api.trade(account_id, 100, 10, stop_loss_price=30)  # 700 at risk, 600 of room above 9900
+    with app.app_context():
+        db.session.get(Account, account_id).current_balance = 123
+        db.session.commit()
+
+    account = _account(_exposure(api), account_id)
+    assert (account['balance'], account['drawdown_room'], account['exceeds_drawdown_limit']) == (10500, 600, True)
+    assert account['open_risk_percentage'] == round(700 / 10500 * 100, 2)
+
+
+def test_stale_running_state_is_replayed_without_writing(app, api):
+    account_id = api.account()
+    trade_id = api.closed_trade(account_id, 100, 110)
+    with app.app_context():
+        state = db.session.get(AccountAlertState, account_id)
+        state.balance_cents, state.stale = 1, True
+        db.session.commit()
+
+    assert _account(_exposure(api), account_id)['balance'] == 10100
+    with app.app_context():
+        assert db.session.get(AccountAlertState, account_id).stale is True
+    assert api.get(f'/api/trades/{trade_id}').status_code == 200
+
+
+def test_rollups_keep_currencies_apart(api):
+    usd, eur = api.account(name='USD'), api.account(name='EUR', base_currency='EUR')
+    scalp = api.risk_type('Scalp')
+    api.trade(usd, 100, 1, stop_loss_price=90, risk_type_id=scalp)
+    api.trade(eur, 100, 1, stop_loss_price=95, risk_type_id=scalp)
+
+    data = _exposure(api)
+    assert [(group['currency'], group['open_risk']) for group in data['by_currency']] == [('USD', 10), ('EUR', 5)]
+    assert [(group['risk_type'], group['currency']) for group in data['by_risk_type']] == [('Scalp', 'USD'), ('Scalp', 'EUR')]
+    assert [group['accounts'] for group in data['by_instrument']] == [1, 1]
+    assert [account['account_id'] for account in _exposure(api, account_ids=str(eur))['accounts']] == [eur]
+
+
+def test_bad_account_ids_are_rejected(api, other_api):
+    api.account()
+    assert api.get('/api/analytics/portfolio/risk-exposure', query_string={'account_ids': 'x'}).status_code == 400
+    foreign = other_api.account()
+    assert api.get('/api/analytics/portfolio/risk-exposure', query_string={'account_ids': str(foreign)}).status_code == 404
@@ -0,0 +1,62 @@
+from src.models import db
+from src.services.archive import archive_trades
+
+
+def _search(api, q, **params):
+    response = api.get('/api/search/trades', query_string={'q': q, **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_search_matches_word_prefixes_across_fields(api):
+    account_id = api.account()
+    trade = api.trade(account_id, trade_name='Breakout long', notes='Waited for the retest')
+    api.exit(trade['id'], 110, 10, exit_reason='Target reached')
+
+    assert [hit['trade_id'] for hit in _search(api, 'retes')['results']] == [trade['id']]
+    assert _search(api, 'target')['total'] == 1
+    assert _search(api, 'retest missing')['total'] == 0
+
+
+def test_snippets_escape_the_indexed_text(api):
+    api.trade(api.account(), notes='<script>alert(1)</script> breakout')
+
+    snippet = _search(api, 'breakout')['results'][0]['snippet']
+    assert '<script>' not in snippet
+    assert '&lt;script&gt;' in snippet
+    assert '<mark>breakout</mark>' in snippet
+
+
+def test_edits_are_reindexed(api):
+    trade = api.trade(api.account(), notes='first idea')
+    assert api.put(f"/api/trades/{trade['id']}", json={'notes': 'second thought'}).status_code == 200
+
+    assert _search(api, 'first')['total'] == 0
+    assert _search(api, 'second')['total'] == 1
+
+
+def test_archived_trades_keep_their_exit_reasons_searchable(app, api):
+    trade = api.trade(api.account())
+    assert api.exit(trade['id'], 110, 10, exit_reason='Trailing stop').status_code == 201
+
+    with app.app_context():
+        # Archiving deletes the exit rows with a bulk statement, which the flush hook never sees
+        assert archive_trades([trade['id']]) == 1
+        db.session.commit()
+
+    assert [hit['trade_id'] for hit in _search(api, 'trailing')['results']] == [trade['id']]
+
+
+def test_search_is_scoped_to_the_user_and_account(api, other_api):
+    first, second = api.account(name='First'), api.account(name='Second')
+    api.trade(first, notes='shared word')
+    api.trade(second, notes='shared word')
+
+    assert _search(api, 'shared')['total'] == 2
+    assert _search(api, 'shared', account_id=first)['total'] == 1
+    assert _search(other_api, 'shared')['total'] == 0
+
+
+def test_search_requires_a_query(api):
+    assert api.get('/api/search/trades', query_string={'q': '  '}).status_code == 400
+    assert _search(api, '"*')['total'] == 0
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from src.services.serialization import _to_iso, msgpack
+
+
+def test_to_iso_matches_datetime_isoformat():
+    for value in (datetime(2026, 3, 1, 9, 30), datetime(2026, 3, 1, 9, 30, 0, 250)):
+        assert _to_iso(str(value)) == value.isoformat()
+    assert _to_iso('2026-03-01 09:30:00.000000') == '2026-03-01T09:30:00'
+    assert _to_iso('2026-03-01') == '2026-03-01'
+
+
+def test_trade_list_matches_the_orm_payload(api):
+    account_id = api.account()
+    trade = api.trade(account_id, notes='dto', costs=[{'cost_type': 'Swap', 'amount': 1.5}],
+                      strategy_tags=[api.strategy_tag('Breakout')])
+    api.exit(trade['id'], 110, 4, exit_reason='Partial')
+
+    listed = api.get(f'/api/accounts/{account_id}/trades').get_json()['trades'][0]
+    single = api.get(f"/api/trades/{trade['id']}").get_json()['trade']
+    for key, value in listed.items():
+        if key in ('entries', 'exits', 'costs'):
+            assert value == [{name: row[name] for name in value[0]} for row in single[key]]
+        else:
+            assert value == single[key], key
+
+
+def test_columns_format_returns_parallel_arrays(api):
+    account_id = api.account()
+    first = api.trade(account_id, trade_name='One')
+    api.trade(account_id, trade_name='Two')
+    api.exit(first['id'], 110, 10)
+
+    data = api.get(f'/api/accounts/{account_id}/trades', query_string={'format': 'columns'}).get_json()
+    trades = dict(zip(data['trades']['fields'], data['trades']['columns']))
+    assert data['trades']['count'] == 2
+    assert sorted(trades['trade_name']) == ['One', 'Two']
+    exits = dict(zip(data['exits']['fields'], data['exits']['columns']))
+    assert exits['trade_id'] == [first['id']]
+
+    accounts = api.get('/api/accounts/', query_string={'format': 'columns'}).get_json()['accounts']
+    assert dict(zip(accounts['fields'], accounts['columns']))['id'] == [account_id]
+
+
+def test_empty_columns_keep_one_array_per_field(api):
+    account_id = api.account()
+    data = api.get(f'/api/accounts/{account_id}/trades', query_string={'format': 'columns'}).get_json()
+    assert data['trades']['count'] == 0
+    assert len(data['trades']['columns']) == len(data['trades']['fields'])
+
+
+def test_responses_vary_on_accept(api):
+    response = api.get('/api/accounts/', headers={'Accept': 'application/msgpack'})
+    assert 'Accept' in response.headers['Vary']
+    assert response.mimetype == ('application/msgpack' if msgpack else 'application/json')
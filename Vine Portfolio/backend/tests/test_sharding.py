@@ -0,0 +1,156 @@
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+from sqlalchemy import select, func
+
+from conftest import Api
+from src.benchmarks.common import BLUEPRINTS
+from src.models import db, Account, Trade, UserShard
+from src.services import dashboard_events
+from src.services.reference_cache import reference_cache
+from src.services.search_index import ensure_search_index
+from src.services.sharding import init_sharding, prepare_shards, rebalance_shards, shard_for, shard_key
+
+SHARDS = 3
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    """The app as main.py sets it up with DATABASE_SHARDS=3, on files in tmp_path"""
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'app.db'), TESTING=True,
+                      DATABASE_SHARDS=SHARDS, SHARD_MOVE_GRACE=0)
+    for module_name, blueprint_name, url_prefix in BLUEPRINTS:
+        app.register_blueprint(getattr(importlib.import_module(module_name), blueprint_name), url_prefix=url_prefix)
+    init_sharding(app)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        ensure_search_index(db.engine)
+        prepare_shards()
+    reference_cache.clear()
+    dashboard_events._published_balances.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # init_app registered a metadata per bind key on the shared db; later apps have no such binds
+    for index in range(SHARDS):
+        db.metadatas.pop(shard_key(index), None)
+
+
+def _users(app, count):
+    client = app.test_client()
+    return [Api(client, f'user{number}@example.com') for number in range(count)]
+
+
+def _accounts_in(app, key):
+    with app.app_context():
+        return db.session.execute(select(func.count()).select_from(Account), bind_arguments={'bind': db.engines[key]}).scalar()
+
+
+def test_shard_assignment_is_stable_and_moves_few_users_when_growing():
+    assert shard_for(7, 1) is None
+    assert shard_for(7, SHARDS) == shard_for(7, SHARDS)
+    before = {user_id: shard_for(user_id, SHARDS) for user_id in range(1, 301)}
+    after = {user_id: shard_for(user_id, SHARDS + 1) for user_id in range(1, 301)}
+    moved = [user_id for user_id in before if before[user_id] != after[user_id]]
+    assert all(after[user_id] == SHARDS for user_id in moved)
+    assert 0 < len(moved) < 150
+    assert set(before.values()) == set(range(SHARDS))
+
+
+def test_each_user_writes_to_their_own_shard(sharded_app):
+    users = _users(sharded_app, 6)
+    for user in users:
+        user.closed_trade(user.account(), 100, 110)
+
+    with sharded_app.app_context():
+        placements = dict(db.session.execute(select(UserShard.user_id, UserShard.shard)).all())
+    assert placements == {user.user_id: shard_for(user.user_id, SHARDS) for user in users}
+    assert _accounts_in(sharded_app, None) == 0
+    for index in range(SHARDS):
+        assert _accounts_in(sharded_app, shard_key(index)) == list(placements.values()).count(index)
+
+    # Every shard numbers its own rows, yet each user only sees their own data
+    ids_by_shard = {}
+    for user in users:
+        accounts = user.get('/api/accounts/').get_json()['accounts']
+        assert len(accounts) == 1
+        ids_by_shard.setdefault(placements[user.user_id], []).append(accounts[0]['id'])
+        assert user.get('/api/analytics/portfolio/dashboard').get_json()['portfolio']['total_pnl'] == 100
+    assert all(ids == list(range(1, len(ids) + 1)) for ids in ids_by_shard.values())
+
+
+def test_users_on_different_shards_write_in_parallel(sharded_app):
+    users = _users(sharded_app, 4)
+    account_ids = [user.account() for user in users]
+
+    def trade(index):
+        user = users[index % len(users)]
+        return user.post(f'/api/accounts/{account_ids[index % len(users)]}/trades',
+                         json={'instrument': 'EURUSD', 'trade_type': 'Long', 'entry_price': 1, 'quantity': 1}).status_code
+
+    with ThreadPoolExecutor(8) as pool:
+        assert set(pool.map(trade, range(40))) == {201}
+    for user, account_id in zip(users, account_ids):
+        assert len(user.get(f'/api/accounts/{account_id}/trades').get_json()['trades']) == 10
+
+
+def _unplace(app, user):
+    """Make a user look like one registered before sharding: no directory entry, data in app.db"""
+    with app.app_context():
+        db.session.delete(db.session.get(UserShard, user.user_id))
+        db.session.commit()
+
+
+def test_rebalance_moves_legacy_users_and_renames_clashing_ids(sharded_app):
+    resident, legacy = _users(sharded_app, 2)
+    _unplace(sharded_app, legacy)
+    legacy_account = legacy.account()
+    trade_id = legacy.closed_trade(legacy_account, 100, 90)
+    assert _accounts_in(sharded_app, None) == 1
+
+    # Take the legacy user's account id in their target shard
+    with sharded_app.app_context():
+        target = shard_key(shard_for(legacy.user_id, SHARDS))
+        db.session.execute(db.insert(Account).values(id=legacy_account, user_id=resident.user_id, name='Taken',
+                                                     initial_capital=1, current_balance=1),
+                           bind_arguments={'bind': db.engines[target]})
+        db.session.commit()
+
+        assert rebalance_shards(dry_run=True) == [(legacy.user_id, None, shard_for(legacy.user_id, SHARDS))]
+        assert _accounts_in(sharded_app, None) == 1
+        assert rebalance_shards() == [(legacy.user_id, None, shard_for(legacy.user_id, SHARDS))]
+        assert rebalance_shards() == []
+
+    assert _accounts_in(sharded_app, None) == 0
+    accounts = legacy.get('/api/accounts/').get_json()['accounts']
+    assert len(accounts) == 1 and accounts[0]['id'] != legacy_account
+    assert legacy.get(f'/api/trades/{trade_id}').get_json()['trade']['account_id'] == accounts[0]['id']
+
+    changes = [(change['entity'], change['id'], change['op'])
+               for change in legacy.get('/api/changes', query_string={'since': 0}).get_json()['changes']]
+    assert ('account', legacy_account, 'delete') in changes
+    assert ('account', accounts[0]['id'], 'upsert') in changes
+
+
+def test_requests_wait_while_a_user_moves(sharded_app):
+    user, = _users(sharded_app, 1)
+    with sharded_app.app_context():
+        db.session.get(UserShard, user.user_id).moving = True
+        db.session.commit()
+    assert user.get('/api/accounts/').status_code == 503
+
+
+def test_shard_files_sit_next_to_the_directory(sharded_app, tmp_path):
+    binds = sharded_app.config['SQLALCHEMY_BINDS']
+    assert binds == {shard_key(index): f'sqlite:///{tmp_path / f"shard_{index}.db"}' for index in range(SHARDS)}
+    with sharded_app.app_context():
+        assert 'user' not in db.inspect(db.engines[shard_key(0)]).get_table_names()
+        assert 'trade' in db.inspect(db.engines[shard_key(0)]).get_table_names()
+        assert db.session.execute(select(func.count()).select_from(Trade),
+                                  bind_arguments={'bind': db.engines[shard_key(1)]}).scalar() == 0
@@ -0,0 +1,131 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from src.models import db, AccountSnapshot
+from src.services.snapshots import SnapshotScheduler, init_snapshots, last_complete_day, start_snapshot_scheduler, sync_snapshots
+
+
+def _day(days_ago):
+    return last_complete_day() - timedelta(days=days_ago)
+
+
+def _at(days_ago):
+    return datetime.combine(_day(days_ago), time(12)).isoformat()
+
+
+def _dated_trade(api, account_id, entry_price, exit_price, opened, closed):
+    trade = api.trade(account_id, entry_price, 10, entry_date=_at(opened))
+    assert api.exit(trade['id'], exit_price, 10, exit_date=_at(closed)).status_code == 201
+    return trade['id']
+
+
+def _curve(api, path, **params):
+    response = api.get(path, query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _stored(app):
+    with app.app_context():
+        return db.session.query(AccountSnapshot).count()
+
+
+def test_equity_curve_backfills_without_writing(app, api):
+    account_id = api.account()
+    _dated_trade(api, account_id, 100, 110, opened=5, closed=3)
+    _dated_trade(api, account_id, 100, 95, opened=2, closed=1)
+
+    data = _curve(api, f'/api/analytics/accounts/{account_id}/equity-curve')
+    assert _stored(app) == 0
+
+    by_day = {row['snapshot_date']: row for row in data['snapshots']}
+    assert by_day[_day(4).isoformat()]['balance'] == 10000
+    assert by_day[_day(4).isoformat()]['open_trades'] == 1
+    assert by_day[_day(3).isoformat()]['balance'] == 10100
+    assert by_day[_day(1).isoformat()]['balance'] == 10050
+    assert by_day[_day(0).isoformat()]['peak_balance'] == 10100
+    assert data['max_drawdown'] == pytest.approx(0.5)
+    assert data['snapshots'][-1]['snapshot_date'] == _day(0).isoformat()
+
+
+def test_stored_and_pending_days_read_the_same(app, api):
+    account_id = api.account()
+    _dated_trade(api, account_id, 100, 120, opened=6, closed=4)
+    path = f'/api/analytics/accounts/{account_id}/equity-curve'
+    pending = _curve(api, path, start=_day(5).isoformat(), end=_day(2).isoformat())
+
+    with app.app_context():
+        assert sync_snapshots() > 0
+        db.session.commit()
+    assert _curve(api, path, start=_day(5).isoformat(), end=_day(2).isoformat()) == pending
+    assert [row['snapshot_date'] for row in pending['snapshots']] == [_day(days).isoformat() for days in (5, 4, 3, 2)]
+
+
+def test_edits_drop_stored_days_and_reads_fill_them_in(app, api):
+    account_id = api.account()
+    _dated_trade(api, account_id, 100, 110, opened=5, closed=3)
+    with app.app_context():
+        sync_snapshots()
+        db.session.commit()
+    stored = _stored(app)
+
+    assert api.exit(api.trade(account_id, 100, 10, entry_date=_at(2))['id'], 90, 10, exit_date=_at(1)).status_code == 201
+    assert _stored(app) < stored
+
+    data = _curve(api, f'/api/analytics/accounts/{account_id}/equity-curve')
+    assert data['snapshots'][-1]['balance'] == 10000
+    assert data['current_drawdown'] == pytest.approx(100 / 10100 * 100, abs=0.01)
+
+
+def test_portfolio_curve_sums_stored_and_pending_accounts(app, api):
+    first, second = api.account(name='First'), api.account(name='Second', initial_capital=5000)
+    _dated_trade(api, first, 100, 110, opened=4, closed=3)
+    with app.app_context():
+        sync_snapshots([first])
+        db.session.commit()
+    _dated_trade(api, second, 100, 90, opened=3, closed=2)
+
+    data = _curve(api, '/api/analytics/portfolio/equity-curve', start=_day(2).isoformat())
+    assert data['snapshots'][0] == {
+        'snapshot_date': _day(2).isoformat(), 'balance': 15000.0, 'realized_pnl': -100.0, 'open_risk': 0.0,
+        'peak_balance': 15100.0, 'drawdown': round(100 / 15100 * 100, 2), 'open_trades': 0
+    }
+
+
+def test_dashboard_drawdown_counts_unstored_days(app, api):
+    account_id = api.account()
+    _dated_trade(api, account_id, 100, 150, opened=4, closed=3)
+    _dated_trade(api, account_id, 100, 80, opened=2, closed=1)
+
+    data = api.get('/api/analytics/portfolio/dashboard').get_json()
+    assert data['portfolio']['max_drawdown'] == pytest.approx(200 / 10500 * 100, abs=0.01)
+    assert data['accounts'][0]['current_drawdown'] == pytest.approx(200 / 10500 * 100, abs=0.01)
+    assert _stored(app) == 0
+
+
+def test_bad_date_range_is_rejected(api):
+    account_id = api.account()
+    path = f'/api/analytics/accounts/{account_id}/equity-curve'
+    assert api.get(path, query_string={'start': 'yesterday'}).status_code == 400
+    assert api.get(path, query_string={'start': _day(1).isoformat(), 'end': _day(2).isoformat()}).status_code == 400
+
+
+def test_scheduler_only_runs_when_started(app, api):
+    _dated_trade(api, api.account(), 100, 110, opened=3, closed=2)
+    scheduler = init_snapshots(app)
+    assert scheduler._thread is None
+
+    result = app.test_cli_runner().invoke(args=['sync-snapshots'])
+    assert result.exit_code == 0, result.output
+    assert _stored(app) > 0
+
+    app.config['SNAPSHOT_SCHEDULER'] = False
+    assert start_snapshot_scheduler(app) is None
+    assert scheduler._thread is None
+
+
+def test_next_run_is_the_coming_run_time():
+    scheduler = SnapshotScheduler(None, time(0, 5))
+    assert scheduler.seconds_until_next_run(datetime(2026, 1, 1, 0, 0)) == 300
+    assert scheduler.seconds_until_next_run(datetime(2026, 1, 1, 0, 5)) == 86400
@@ -0,0 +1,29 @@
+def test_performance_by_strategy_tag_groups_closed_trades(api):
+    account_id = api.account()
+    breakout, trend = api.strategy_tag('Breakout'), api.strategy_tag('Trend')
+    api.closed_trade(account_id, 100, 110, strategy_tags=[breakout])
+    api.closed_trade(account_id, 100, 95, strategy_tags=[breakout, trend])
+    api.trade(account_id, strategy_tags=[trend])  # Open trades are left out
+
+    response = api.get(f'/api/analytics/accounts/{account_id}/performance-by-tag')
+    assert response.status_code == 200
+    data = response.get_json()
+
+    by_tag = {row['strategy_tag']: row for row in data['performance_by_strategy_tag']}
+    assert by_tag['Breakout']['trades'] == 2
+    assert by_tag['Breakout']['pnl'] == 50
+    assert by_tag['Breakout']['win_rate'] == 50
+    assert by_tag['Trend']['trades'] == 1
+    assert by_tag['Trend']['pnl'] == -50
+
+    # Only trades carrying two or more tags form a combination
+    combinations = {tuple(row['strategy_tags']): row['trades'] for row in data['performance_by_tag_combination']}
+    assert combinations == {('Breakout', 'Trend'): 1}
+
+
+def test_performance_by_tag_is_scoped_to_the_user(api, other_api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110, strategy_tags=[api.strategy_tag('Breakout')])
+
+    assert other_api.get(f'/api/analytics/accounts/{account_id}/performance-by-tag').status_code == 404
+    assert other_api.get('/api/analytics/portfolio/performance-by-tag').get_json()['performance_by_strategy_tag'] == []
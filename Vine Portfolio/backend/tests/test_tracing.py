@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from src.services import tracing
+from src.services.tracing import Tracer, _parse_traceparent, init_tracing, to_otlp
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class Collecting:
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+    def flush(self):
+        pass
+
+
+@pytest.mark.parametrize('header, expected', [
+    (f'00-{TRACE_ID}-{PARENT_ID}-01', (TRACE_ID, PARENT_ID, True)),
+    (f'00-{TRACE_ID}-{PARENT_ID}-00', (TRACE_ID, PARENT_ID, False)),
+    # Flags are hex: 0x03 carries the sampled bit, 0x10 does not
+    (f'00-{TRACE_ID}-{PARENT_ID}-03', (TRACE_ID, PARENT_ID, True)),
+    (f'00-{TRACE_ID}-{PARENT_ID}-10', (TRACE_ID, PARENT_ID, False)),
+    (f'  00-{TRACE_ID}-{PARENT_ID}-01 ', (TRACE_ID, PARENT_ID, True)),
+    (f'ff-{TRACE_ID}-{PARENT_ID}-01', None),
+    (f'00-{"0" * 32}-{PARENT_ID}-01', None),
+    (f'00-{TRACE_ID}-{"0" * 16}-01', None),
+    (f'00-{TRACE_ID.upper()}-{PARENT_ID}-01', None),
+    (f'00-{TRACE_ID}-{PARENT_ID}', None),
+    (None, None),
+])
+def test_parse_traceparent(header, expected):
+    assert _parse_traceparent(header) == expected
+
+
+def test_children_follow_the_sampling_of_their_root():
+    processor = Collecting()
+    tracer = Tracer(processor, sample_rate=0.0)
+
+    with tracer.start_root_span('unsampled'):
+        with tracer.start_span('child') as child:
+            assert not child.recording
+    with tracer.start_root_span('remote', trace_id=TRACE_ID, parent_id=PARENT_ID, sampled=True) as root:
+        with tracer.start_span('child'):
+            pass
+    assert [(span.name, span.trace_id, span.parent_id) for span in processor.spans] == [
+        ('child', TRACE_ID, root.span_id), ('remote', TRACE_ID, PARENT_ID)
+    ]
+
+
+def test_errors_mark_the_span_and_reach_otlp():
+    processor = Collecting()
+    tracer = Tracer(processor, sample_rate=1.0)
+    with pytest.raises(ValueError):
+        with tracer.start_root_span('failing'):
+            raise ValueError('boom')
+
+    span = to_otlp(processor.spans, 'tests')['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert span['status'] == {'code': 2, 'message': 'ValueError: boom'}
+
+
+@pytest.fixture
+def traced_app(app, tmp_path):
+    app.config.update(TRACE_SAMPLE_RATE=1.0, TRACE_EXPORTER='jsonl', TRACE_FILE=str(tmp_path / 'traces.jsonl'))
+    init_tracing(app)
+    yield app
+    tracing.tracer.configure(tracing._DroppingProcessor(), 0.0)
+
+
+def _exported(app):
+    # Stop the exporter thread so no batch is still being written while the file is read
+    processor = tracing.tracer.processor
+    processor.shutdown()
+    processor._thread.join()
+    with open(app.config['TRACE_FILE']) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_requests_continue_the_callers_trace(traced_app, api):
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 110)
+    response = api.get(f'/api/analytics/accounts/{account_id}/analytics',
+                       headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+    assert response.headers['X-Trace-Id'] == TRACE_ID
+
+    spans = [span for span in _exported(traced_app) if span['trace_id'] == TRACE_ID]
+    root = next(span for span in spans if span['kind'] == 'server')
+    assert root['parent_id'] == PARENT_ID
+    assert root['attributes']['http.route'] == '/api/analytics/accounts/<int:account_id>/analytics'
+    assert {'analytics.load_trades', 'db.query'} <= {span['name'] for span in spans}
+    assert all(span['parent_id'] for span in spans)
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from src.models import db, Trade, TradeCost, TradeExit
+
+
+@pytest.fixture
+def trade_ids(api):
+    account_id = api.account()
+    first = api.trade(account_id, 100, 10, stop_loss_price=95)['id']
+    second = api.trade(account_id, 200, 10)['id']
+    assert api.exit(first, 110, 4).status_code == 201
+    return first, second
+
+
+def test_figures_are_computed_once(app, trade_ids, monkeypatch):
+    with app.app_context():
+        trade = db.session.get(Trade, trade_ids[0])
+        computed = []
+        compute = Trade._compute_figures
+        monkeypatch.setattr(Trade, '_compute_figures', lambda self: computed.append(self.id) or compute(self))
+
+        assert trade.calculate_net_pnl() == 40
+        trade.calculate_r_multiple()
+        trade.calculate_open_quantity()
+        assert computed == [trade.id]
+
+
+def test_child_changes_drop_the_cache(app, trade_ids):
+    with app.app_context():
+        trade = db.session.get(Trade, trade_ids[0])
+        assert trade.calculate_gross_pnl() == 40
+
+        trade.exits.append(TradeExit(exit_price=120, quantity=6, exit_date=datetime.utcnow()))
+        assert trade.calculate_gross_pnl() == 160
+
+        trade.exits[0].exit_price = 100
+        assert trade.calculate_gross_pnl() == 120
+
+        trade.costs.append(TradeCost(cost_type='Commission', amount=5))
+        assert trade.calculate_net_pnl() == 115
+        trade.costs[0].amount = 10
+        assert trade.calculate_net_pnl() == 110
+
+        trade.stop_loss_price = 90
+        assert trade.calculate_risk_amount() == 100
+
+
+def test_moving_a_child_updates_both_trades(app, trade_ids):
+    first_id, second_id = trade_ids
+    with app.app_context():
+        first, second = db.session.get(Trade, first_id), db.session.get(Trade, second_id)
+        assert (first.calculate_total_quantity_exited(), second.calculate_total_quantity_exited()) == (4, 0)
+
+        db.session.query(TradeExit).filter_by(trade_id=first_id).one().trade_id = second_id
+        assert first._figures is None and second._figures is None
+        db.session.commit()
+        assert (first.calculate_total_quantity_exited(), second.calculate_total_quantity_exited()) == (0, 4)
+
+
+def test_commit_and_rollback_recompute_from_the_database(app, trade_ids):
+    with app.app_context():
+        trade = db.session.get(Trade, trade_ids[0])
+        assert trade.calculate_total_costs() == 0
+        db.session.add(TradeCost(trade_id=trade.id, cost_type='Swap', amount=3))
+        db.session.commit()
+        assert trade.calculate_total_costs() == 3
+
+        trade.exits[0].quantity = 10
+        assert trade.calculate_open_quantity() == 0
+        db.session.rollback()
+        assert trade.calculate_open_quantity() == 6
@@ -0,0 +1,70 @@
+import pytest
+
+from src.services.what_if import MAX_SCENARIOS
+
+
+def _what_if(api, account_id, **body):
+    response = api.post(f'/api/analytics/accounts/{account_id}/what-if', json=body)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.fixture
+def account_id(api):
+    """A +2R winner and a -2R loser, each risking 100, and a trade without a stop"""
+    account_id = api.account()
+    api.closed_trade(account_id, 100, 120, stop_loss_price=90)
+    api.closed_trade(account_id, 100, 80, stop_loss_price=90)
+    api.closed_trade(account_id, 100, 101)
+    return account_id
+
+
+def _stats(data):
+    return [(result['stats']['final_balance'], result['stats']['halted']) for result in data['results']]
+
+
+def test_scenarios_resize_and_cap_the_actual_trades(api, account_id):
+    data = _what_if(api, account_id, scenarios=[
+        {'risk_percentage': 1, 'compounding': False},
+        {'risk_percentage': 1, 'compounding': False, 'max_loss_r': 1},
+        {'risk_percentage': 1},
+        {'risk_percentage': 1, 'max_drawdown': 1},
+    ])
+    assert (data['trades'], data['unsized_trades']) == (2, 1)
+    assert data['actual']['final_balance'] == 10000
+    assert _stats(data) == [(10000, False), (10100, False), (9996, False), (9996, True)]
+    assert data['results'][3]['stats']['max_drawdown'] == 2
+
+
+def test_sweeps_run_every_combination_with_curves(api, account_id):
+    data = _what_if(api, account_id, sweep={'risk_percentage': [0.5, 1], 'max_loss_r': [None, 1]},
+                    include_curves=True, starting_balance=20000)
+    assert [(result['scenario']['risk_percentage'], result['scenario']['max_loss_r']) for result in data['results']] == \
+        [(0.5, None), (1, None), (0.5, 1), (1, 1)]
+    assert len(data['dates']) == 2
+    assert data['results'][3]['equity_curve'] == [20400, 20196]
+
+
+def test_trading_models_stand_for_a_risk_percentage(api, account_id):
+    scenario = _what_if(api, account_id, scenarios=[{'trading_model': 'High Risk'}])['results'][0]['scenario']
+    assert scenario['risk_percentage'] == 2.5
+
+
+@pytest.mark.parametrize('body', [
+    ['not', 'an', 'object'],
+    'scenarios',
+    {},
+    {'scenarios': [{'stop': 1}]},
+    {'scenarios': [{'trading_model': 'Reckless'}]},
+    {'scenarios': [{'risk_percentage': 0}]},
+    {'scenarios': [{'risk_percentage': 1}], 'starting_balance': 0},
+    {'scenarios': [{'risk_percentage': 1}], 'start': '2026-02-01', 'end': '2026-01-01'},
+    {'sweep': {'risk_percentage': list(range(1, MAX_SCENARIOS + 2))}},
+])
+def test_bad_requests_are_rejected(api, account_id, body):
+    assert api.post(f'/api/analytics/accounts/{account_id}/what-if', json=body).status_code == 400
+
+
+def test_other_users_accounts_are_not_found(api, other_api):
+    foreign = other_api.account()
+    assert api.post(f'/api/analytics/accounts/{foreign}/what-if', json={'scenarios': [{}]}).status_code == 404